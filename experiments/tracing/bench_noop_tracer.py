@@ -0,0 +1,169 @@
+"""no-op トレーシングモードのオーバーヘッド計測スクリプト.
+
+LANGFUSE_TRACING_ENABLED=false のときにエージェントが1リクエストごとに実行する処理
+（NOOP_TRACER と record_request）のオーバーヘッドを、計装なしのループと比較します。
+差分が予算（--budget-ns）を超えた場合は終了コード1で終了します。
+Langfuse への接続は発生しません（認証情報なしで実行可能）。
+
+record_request は METRICS_ENABLED に従います（既定では有効で、メトリクスレジストリに記録する）。
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import timeit
+import tracemalloc
+from pathlib import Path
+
+# プロジェクトルートをパスに追加
+project_root = Path(__file__).parent.parent.parent
+sys.path.insert(0, str(project_root))
+
+os.environ["LANGFUSE_TRACING_ENABLED"] = "false"
+
+from src.langfuse_tracer import NOOP_TRACER, create_tracer  # noqa: E402
+from src.metrics_registry import is_metrics_enabled, record_request  # noqa: E402
+
+CHUNKS = ["量子コンピューティングは", "量子力学の原理を", "利用して計算を行う技術です。"]
+PROMPT = "量子コンピューティングとは何ですか？"
+MODEL = "global.anthropic.claude-sonnet-4-5-20250929-v1:0"
+REPEAT = 7
+NUMBER = 200_000
+
+# 1リクエストあたりの差分の予算（ns）。10 µs は 1 秒のリクエストの 0.001%
+DEFAULT_BUDGET_NS = 10_000
+
+
+def request_without_instrumentation() -> str:
+    """計装なしのリクエスト処理（レスポンス組み立てのみ）."""
+    full_response = ""
+    for chunk in CHUNKS:
+        full_response += chunk
+    return full_response
+
+
+def request_with_noop_tracer() -> str:
+    """NOOP_TRACER だけを使う（record_request なし）."""
+    tracer = create_tracer(session_id="bench", user_id="bench")
+    with tracer.trace_span(name="chat_streaming", input=PROMPT, tags=None) as span:
+        full_response = ""
+        for chunk in CHUNKS:
+            full_response += chunk
+        tracer.create_generation(
+            parent=span,
+            name="llm_response",
+            input=PROMPT,
+            output=full_response,
+            metrics=None,
+        )
+        span.set_output(full_response)
+    return full_response
+
+
+def request_noop_path() -> str:
+    """BedrockAgentSDK.chat_streaming と同じ呼び出しパターン（NOOP_TRACER + record_request）."""
+    tracer = create_tracer(session_id="bench", user_id="bench")
+    with tracer.trace_span(
+        name="chat_streaming",
+        input=PROMPT,
+        metadata={"streaming": "true"},
+        tags=["streaming"],
+    ) as span, record_request(MODEL, "development", None, "bench") as request:
+        full_response = ""
+        for chunk in CHUNKS:
+            request.first_token()
+            full_response += chunk
+        request.set_result(None)
+        tracer.create_generation(
+            parent=span,
+            name="llm_response",
+            input=PROMPT,
+            output=full_response,
+            metrics=None,
+        )
+        span.set_output(full_response)
+        span.update_metadata({"response_length": len(full_response)})
+    return full_response
+
+
+def measure_ns(func, number: int) -> list[float]:
+    """1回あたりの実行時間（ナノ秒）を REPEAT 回計測."""
+    timer = timeit.Timer(func)
+    return [t / number * 1e9 for t in timer.repeat(repeat=REPEAT, number=number)]
+
+
+def count_allocations(func, iterations: int = 10_000) -> float:
+    """1回あたりに残るメモリブロック数を計測."""
+    func()  # ウォームアップ
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for _ in range(iterations):
+        func()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    stats = after.compare_to(before, "filename")
+    return sum(stat.count_diff for stat in stats) / iterations
+
+
+def main():
+    """ベンチマークを実行（差分が予算を超えた場合は終了コード1）."""
+    parser = argparse.ArgumentParser(description="no-op トレーシングのオーバーヘッド計測")
+    parser.add_argument(
+        "--budget-ns",
+        type=float,
+        default=DEFAULT_BUDGET_NS,
+        help=f"1リクエストあたりの差分の予算（ns、既定 {DEFAULT_BUDGET_NS}）",
+    )
+    parser.add_argument("--number", type=int, default=NUMBER, help="1回の計測の反復回数")
+    args = parser.parse_args()
+
+    print("=" * 70)
+    print("no-op トレーシング オーバーヘッド計測")
+    print("=" * 70)
+    print(f"METRICS_ENABLED: {is_metrics_enabled()}")
+    print()
+
+    assert create_tracer() is NOOP_TRACER, "LANGFUSE_TRACING_ENABLED=false が効いていません"
+
+    baseline = measure_ns(request_without_instrumentation, args.number)
+    tracer_only = measure_ns(request_with_noop_tracer, args.number)
+    full = measure_ns(request_noop_path, args.number)
+
+    baseline_median = statistics.median(baseline)
+    tracer_median = statistics.median(tracer_only)
+    full_median = statistics.median(full)
+    diff = full_median - baseline_median
+    # 計測ノイズの目安（繰り返し間のばらつき）
+    noise = max(statistics.pstdev(baseline), statistics.pstdev(full))
+
+    print(f"計装なし                      : {baseline_median:8.1f} ns/request")
+    print(
+        f"NOOP_TRACER のみ              : {tracer_median:8.1f} ns/request "
+        f"(差分 {tracer_median - baseline_median:+.1f} ns)"
+    )
+    print(
+        f"NOOP_TRACER + record_request  : {full_median:8.1f} ns/request "
+        f"(差分 {diff:+.1f} ns, {full_median / baseline_median:.1f}x)"
+    )
+    print(f"計測ノイズ（繰り返し間の stdev）: {noise:8.1f} ns")
+    print()
+    print(f"残存ブロック数 (計装なし)   : {count_allocations(request_without_instrumentation):.3f} /request")
+    print(f"残存ブロック数 (no-op パス) : {count_allocations(request_noop_path):.3f} /request")
+    print()
+
+    if diff <= 3 * noise:
+        print(f"💡 差分 {diff:.1f} ns は計測ノイズ（3σ = {3 * noise:.1f} ns）の範囲内です。")
+    else:
+        print(
+            f"💡 差分 {diff:.1f} ns は計測ノイズより大きく、1秒のリクエストの "
+            f"{diff / 1e9 * 100:.5f}% に相当します。"
+        )
+    if diff > args.budget_ns:
+        print(f"❌ 差分 {diff:.1f} ns が予算 {args.budget_ns:.0f} ns を超えています。")
+        raise SystemExit(1)
+    print(f"✅ 差分 {diff:.1f} ns は予算 {args.budget_ns:.0f} ns 以内です。")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,354 @@
+"""多数の同時セッションでのスパン分離のストレステスト.
+
+1つのイベントループで数千のストリーミングセッションを交互に進め、
+エクスポートされたトレースツリーが正しいこと（スパンがリクエスト間で紐付かないこと）と、
+未終了スパンが残らないことを検証します。
+
+- tasks モード      : セッションごとに別タスク（asyncio.gather）。current_span() も検証
+- interleaved モード: 1つのタスクで複数のストリーミングジェネレーターを交互に進める
+- 一部のセッションは途中で放棄し、ルート終了時のリーク検出を確認
+
+それぞれのモードを2つのエクスポート方式で実行します。
+
+- async: 非同期エクスポートのエクスポーターをメモリ上の収集用に差し替え（RecordingClient）
+- sync : デフォルトの同期モード。Langfuse SDK のスパンを OpenTelemetry の
+         InMemorySpanExporter で収集し、SDK の送信先はローカルのダミーサーバーにする
+
+Langfuse への接続は発生しません（認証情報なしで実行可能）。
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from types import SimpleNamespace
+
+# プロジェクトルートをパスに追加
+project_root = Path(__file__).parent.parent.parent
+sys.path.insert(0, str(project_root))
+
+import src.langfuse_tracer as langfuse_tracer  # noqa: E402
+from src.langfuse_tracer import configure_export, create_tracer  # noqa: E402
+from src.metrics_registry import REGISTRY  # noqa: E402
+from src.span_context import current_span, open_span_count  # noqa: E402
+from src.trace_export import (  # noqa: E402
+    OVERFLOW_BLOCK,
+    ExportConfig,
+    SpanExporter,
+)
+from src.trace_sampling import SamplingConfig  # noqa: E402
+
+
+class CollectingExporter(SpanExporter):
+    """エクスポートされたスパンをメモリ上に集めるエクスポーター."""
+
+    def __init__(self):
+        self.records = []
+        self._lock = threading.Lock()
+
+    def export(self, records):
+        with self._lock:
+            self.records.extend(records)
+
+
+class _OtlpSink(BaseHTTPRequestHandler):
+    """Langfuse SDK の OTLP 送信を受け取って捨てるダミーサーバー."""
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def configure_sync_client() -> tuple[object, ThreadingHTTPServer]:
+    """同期モード用に、スパンをメモリ上に集める Langfuse クライアントを設定.
+
+    Returns:
+        (InMemorySpanExporter, ダミーサーバー)
+    """
+    from langfuse import Langfuse
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import (
+        InMemorySpanExporter,
+    )
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _OtlpSink)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    exporter = InMemorySpanExporter()
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    langfuse_tracer._langfuse = Langfuse(
+        public_key="pk-lf-stress",
+        secret_key="sk-lf-stress",
+        host=f"http://127.0.0.1:{server.server_address[1]}",
+        tracer_provider=provider,
+    )
+    configure_export(ExportConfig(mode="sync"), SamplingConfig(rate=1.0))
+    return exporter, server
+
+
+def otel_records(spans) -> list:
+    """OpenTelemetry のスパンを verify() が扱えるレコードに変換."""
+    records = []
+    for span in spans:
+        attributes = span.attributes or {}
+        raw_input = attributes.get("langfuse.observation.input")
+        try:
+            value = json.loads(raw_input) if raw_input is not None else None
+        except ValueError:
+            value = raw_input
+        is_root = attributes.get("langfuse.internal.as_root") or span.parent is None
+        records.append(
+            SimpleNamespace(
+                trace_id=format(span.context.trace_id, "032x"),
+                id=format(span.context.span_id, "016x"),
+                parent_id=None if is_root else format(span.parent.span_id, "016x"),
+                kind=attributes.get("langfuse.observation.type", "span"),
+                input=value,
+                end_time=span.end_time,
+            )
+        )
+    return records
+
+
+async def streaming_session(
+    index: int, expected: dict, check_context: bool, max_delay_s: float = 0.0
+):
+    """chat_with_client と同じ呼び出しパターンのストリーミングセッション.
+
+    tool_use_id はセッション間で重複させる（レジストリがリクエストごとであることの確認）。
+    """
+    rng = random.Random(index)
+    tracer = create_tracer(session_id=f"session-{index}", user_id="stress", enabled=True)
+    with tracer.trace_agent(name="stress_session", input=f"session-{index}") as span:
+        tool_call_count = 0
+        for turn in range(rng.randint(1, 4)):
+            await asyncio.sleep(rng.random() * max_delay_s)
+            if check_context:
+                assert current_span() is span, f"session {index}: current_span mismatch"
+
+            # 新しいメッセージ到着時に前のツールを終了
+            tracer.end_open_tool_spans()
+            for k in range(rng.randint(0, 3)):
+                tool_call_count += 1
+                tracer.start_tool_span(
+                    parent=span,
+                    tool_name="Read",
+                    tool_use_id=f"toolu_{turn}_{k}",
+                    tool_call_number=tool_call_count,
+                    input={"session": index},
+                )
+            yield f"chunk-{index}-{turn}"
+
+        tracer.end_open_tool_spans()
+        tracer.create_generation(
+            parent=span,
+            input=f"session-{index}",
+            output="done",
+            tool_call_count=tool_call_count,
+        )
+        span.set_output("done")
+        expected[f"session-{index}"] = tool_call_count
+
+
+async def run_tasks(sessions: int, concurrency: int, expected: dict):
+    """セッションごとに別タスクで実行."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def consume(index: int):
+        async with semaphore:
+            async for _ in streaming_session(
+                index, expected, check_context=True, max_delay_s=0.002
+            ):
+                pass
+
+    await asyncio.gather(*(consume(i) for i in range(sessions)))
+
+
+async def run_interleaved(
+    sessions: int, width: int, abandon_rate: float, expected: dict
+) -> int:
+    """1つのタスクで width 個のジェネレーターを交互に進める.
+
+    Returns:
+        途中で放棄したセッション数
+    """
+    rng = random.Random(0)
+    abandoned = 0
+    next_index = 0
+    active = []
+    while next_index < sessions or active:
+        while len(active) < width and next_index < sessions:
+            active.append(streaming_session(next_index, expected, check_context=False))
+            next_index += 1
+        generator = active.pop(rng.randrange(len(active)))
+        try:
+            await generator.__anext__()
+        except StopAsyncIteration:
+            continue
+        if rng.random() < abandon_rate:
+            # 閉じずに参照を捨てる（クライアント切断の再現）
+            abandoned += 1
+            del generator
+            continue
+        active.append(generator)
+    # 放棄したジェネレーターのファイナライズ（aclose）を実行させる
+    gc.collect()
+    for _ in range(10):
+        await asyncio.sleep(0)
+    return abandoned
+
+
+def verify(records: list, expected: dict) -> list[str]:
+    """トレースツリーを検証.
+
+    Returns:
+        検出した問題の一覧
+    """
+    problems = []
+    by_trace = defaultdict(list)
+    for record in records:
+        by_trace[record.trace_id].append(record)
+
+    traces_by_session = {}
+    for trace_id, trace_records in by_trace.items():
+        roots = [r for r in trace_records if r.kind == "span" and r.parent_id is None]
+        if len(roots) != 1:
+            problems.append(f"{trace_id}: {len(roots)} root spans")
+            continue
+        root = roots[0]
+        session = root.input
+        if session in traces_by_session:
+            problems.append(f"{session}: multiple traces")
+        traces_by_session[session] = trace_id
+
+        tools = [r for r in trace_records if r.kind == "tool"]
+        for tool in tools:
+            if tool.parent_id != root.id:
+                problems.append(f"{session}: tool span {tool.id} has wrong parent")
+            if tool.input != {"session": int(session.split("-")[1])}:
+                problems.append(f"{session}: tool span from {tool.input} cross-linked")
+            if tool.end_time is None:
+                problems.append(f"{session}: tool span {tool.id} not ended")
+        if session in expected and len(tools) != expected[session]:
+            problems.append(
+                f"{session}: expected {expected[session]} tool spans, got {len(tools)}"
+            )
+    return problems
+
+
+def leaked_spans(reason: str) -> float:
+    """langfuse_leaked_spans_total の値."""
+    for line in REGISTRY.render_prometheus().splitlines():
+        if line.startswith(f'langfuse_leaked_spans_total{{reason="{reason}"}}'):
+            return float(line.rsplit(" ", 1)[1])
+    return 0.0
+
+
+def main():
+    """ストレステストを実行."""
+    parser = argparse.ArgumentParser(description="Span isolation stress test")
+    parser.add_argument("--sessions", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=500)
+    parser.add_argument("--width", type=int, default=200, help="interleaved モードの同時ジェネレーター数")
+    parser.add_argument("--abandon-rate", type=float, default=0.01)
+    parser.add_argument(
+        "--sync-sessions",
+        type=int,
+        default=500,
+        help="sync 方式のセッション数（リクエストごとに flush するため少なめ）",
+    )
+    args = parser.parse_args()
+
+    print("=" * 70)
+    print("スパン分離ストレステスト")
+    print("=" * 70)
+
+    failed = False
+    server = None
+    for export_mode, mode in (
+        ("async", "tasks"),
+        ("async", "interleaved"),
+        ("sync", "tasks"),
+        ("sync", "interleaved"),
+    ):
+        if export_mode == "async":
+            sessions = args.sessions
+            exporter = CollectingExporter()
+            processor = configure_export(
+                ExportConfig(
+                    mode="async",
+                    max_queue_size=1_000_000,
+                    overflow_policy=OVERFLOW_BLOCK,
+                ),
+                SamplingConfig(rate=1.0),
+                exporters=[exporter],
+            )
+        else:
+            sessions = min(args.sessions, args.sync_sessions)
+            # Langfuse クライアントは公開キーごとに1つのため、作成は1回だけ
+            if server is None:
+                exporter, server = configure_sync_client()
+            exporter.clear()
+            processor = None
+        expected: dict = {}
+        leaked_before = leaked_spans("root_ended")
+
+        started = time.perf_counter()
+        if mode == "tasks":
+            asyncio.run(run_tasks(sessions, args.concurrency, expected))
+            abandoned = 0
+        else:
+            abandoned = asyncio.run(
+                run_interleaved(sessions, args.width, args.abandon_rate, expected)
+            )
+        elapsed = time.perf_counter() - started
+        if processor is not None:
+            processor.force_flush()
+            records = exporter.records
+            traces = sum(1 for r in records if r.kind == "trace")
+        else:
+            langfuse_tracer._langfuse.flush()
+            records = otel_records(exporter.get_finished_spans())
+            traces = sum(1 for r in records if r.parent_id is None)
+
+        problems = verify(records, expected)
+        leaked = leaked_spans("root_ended") - leaked_before
+
+        print()
+        print(f"[{export_mode}/{mode}] {sessions} sessions in {elapsed:.2f}s")
+        print(f"  traces exported : {traces}")
+        print(f"  spans exported  : {len(records)}")
+        print(f"  abandoned       : {abandoned} (leaked tool spans ended: {leaked:.0f})")
+        print(f"  open spans left : {open_span_count()}")
+        if traces != sessions:
+            problems.append(f"expected {sessions} traces, got {traces}")
+        if open_span_count() != 0:
+            problems.append(f"{open_span_count()} spans still open")
+        if problems:
+            failed = True
+            print(f"  ❌ {len(problems)} problem(s):")
+            for problem in problems[:20]:
+                print(f"     - {problem}")
+        else:
+            print("  ✅ trace trees are correct")
+
+    # ダミーサーバーはデーモンスレッドのため、終了時の SDK の flush まで応答する
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
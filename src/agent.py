@@ -24,8 +24,11 @@ try:
         AgentMetrics,
         extract_metrics_from_result,
         create_tracer,
+        is_tracing_enabled,
+        NOOP_TRACER,
         APP_VERSION,
     )
+    from src.metrics_registry import record_request
 except ImportError:
     # When running from src directory
     from langfuse_tracer import (  # type: ignore
@@ -34,8 +37,11 @@ except ImportError:
         AgentMetrics,
         extract_metrics_from_result,
         create_tracer,
+        is_tracing_enabled,
+        NOOP_TRACER,
         APP_VERSION,
     )
+    from metrics_registry import record_request  # type: ignore
 
 # Load environment variables
 load_dotenv()
@@ -94,6 +100,7 @@ class BedrockAgentSDK:
         system_prompt: Optional[str] = None,
         tags: Optional[list[str]] = None,
         environment: str = "development",
+        tracing_enabled: Optional[bool] = None,
     ):
         """Initialize the Bedrock Agent SDK.
 
@@ -106,6 +113,7 @@ class BedrockAgentSDK:
             system_prompt: System prompt for the agent (supports Prompt Caching)
             tags: Custom tags for tracing
             environment: Environment name (development, staging, production)
+            tracing_enabled: Enable Langfuse tracing (None: follow LANGFUSE_TRACING_ENABLED)
         """
         self.aws_region = aws_region or os.getenv("AWS_REGION", "us-east-1")
         self.cwd = cwd or os.getcwd()
@@ -117,6 +125,9 @@ class BedrockAgentSDK:
         self.system_prompt = system_prompt
         self.tags = tags or []
         self.environment = environment
+        self.tracing_enabled = (
+            is_tracing_enabled() if tracing_enabled is None else tracing_enabled
+        )
 
         # Setup Bedrock environment
         setup_bedrock_env()
@@ -126,7 +137,10 @@ class BedrockAgentSDK:
         session_id: Optional[str] = None,
         user_id: Optional[str] = None,
     ) -> LangfuseTracer:
-        """トレーサーを作成."""
+        """トレーサーを作成（トレーシング無効時は NOOP_TRACER）."""
+        if not self.tracing_enabled:
+            return NOOP_TRACER
+
         config = TracingConfig(
             session_id=session_id,
             user_id=user_id,
@@ -166,7 +180,9 @@ class BedrockAgentSDK:
             input=prompt,
             metadata={"streaming": "true"},
             tags=["streaming"],
-        ) as span:
+        ) as span, record_request(
+            self.model, self.environment, self.tags, user_id
+        ) as request:
             full_response = ""
             metrics: Optional[AgentMetrics] = None
 
@@ -184,9 +200,12 @@ class BedrockAgentSDK:
 
                 message_text = extract_message_text(message)
                 if message_text:
+                    request.first_token()
                     full_response += message_text
                     yield message_text
 
+            request.set_result(metrics)
+
             # Generation を作成
             tracer.create_generation(
                 parent=span,
@@ -223,7 +242,9 @@ class BedrockAgentSDK:
             name="chat",
             input=prompt,
             metadata={"streaming": "false"},
-        ) as span:
+        ) as span, record_request(
+            self.model, self.environment, self.tags, user_id
+        ) as request:
             full_response = ""
             message_count = 0
             metrics: Optional[AgentMetrics] = None
@@ -241,9 +262,12 @@ class BedrockAgentSDK:
 
                 message_text = extract_message_text(message)
                 if message_text:
+                    request.first_token()
                     message_count += 1
                     full_response += message_text + "\n"
 
+            request.set_result(metrics)
+
             # Generation を作成
             tracer.create_generation(
                 parent=span,
@@ -277,6 +301,7 @@ class BedrockAgentSDKWithClient:
         max_tokens: int = 4096,
         tags: Optional[list[str]] = None,
         environment: str = "development",
+        tracing_enabled: Optional[bool] = None,
     ):
         """Initialize the Bedrock Agent SDK with ClaudeSDKClient.
 
@@ -289,6 +314,7 @@ class BedrockAgentSDKWithClient:
             max_tokens: Maximum tokens to generate
             tags: Custom tags for tracing
             environment: Environment name (development, staging, production)
+            tracing_enabled: Enable Langfuse tracing (None: follow LANGFUSE_TRACING_ENABLED)
         """
         self.aws_region = aws_region or os.getenv("AWS_REGION", "us-east-1")
         self.cwd = cwd or os.getcwd()
@@ -300,18 +326,27 @@ class BedrockAgentSDKWithClient:
         self.max_tokens = max_tokens
         self.tags = tags or []
         self.environment = environment
+        self.tracing_enabled = (
+            is_tracing_enabled() if tracing_enabled is None else tracing_enabled
+        )
 
         # Setup Bedrock environment
         setup_bedrock_env()
 
         self.client: Optional[ClaudeSDKClient] = None
 
+        # 直近の chat_with_client() で検出したツール呼び出し（ToolUseBlock の id / name / input）
+        self.tool_calls: list[dict] = []
+
     def _create_tracer(
         self,
         session_id: Optional[str] = None,
         user_id: Optional[str] = None,
     ) -> LangfuseTracer:
-        """トレーサーを作成."""
+        """トレーサーを作成（トレーシング無効時は NOOP_TRACER）."""
+        if not self.tracing_enabled:
+            return NOOP_TRACER
+
         config = TracingConfig(
             session_id=session_id,
             user_id=user_id,
@@ -373,49 +408,40 @@ class BedrockAgentSDKWithClient:
                 "tools_count": str(len(self.tools)) if self.tools else "0",
             },
             tags=["with-tools"] if self.tools else [],
-        ) as span:
+        ) as span, record_request(
+            self.model, self.environment, self.tags, user_id
+        ) as request:
             full_response = ""
             metrics: Optional[AgentMetrics] = None
             tool_call_count = 0
+            self.tool_calls = []
 
             try:
                 # Send query to Claude
                 await self.client.query(prompt)
 
-                # 現在のツールを追跡（ToolResultBlockは受信ストリームに含まれないため）
-                current_tool_ids: list[str] = []
-
                 # Receive response messages
                 async for message in self.client.receive_response():
                     # ResultMessage からメトリクスを抽出
                     if isinstance(message, ResultMessage):
                         metrics = extract_metrics_from_result(message)
                         # 最終メッセージ時に未終了のツールを正常終了
-                        for tool_id in current_tool_ids:
-                            tracer.end_tool_span(
-                                tool_use_id=tool_id,
-                                output="(tool executed by SDK)",
-                                is_error=False,
-                            )
-                        current_tool_ids.clear()
+                        tracer.end_open_tool_spans()
                         continue
 
                     # AssistantMessage からツール使用を検出
                     if isinstance(message, AssistantMessage):
                         # 新しいAssistantMessage到着時、前のツールを終了
                         # （SDKが内部でツールを実行し、次のメッセージが来たということは実行完了）
-                        for tool_id in current_tool_ids:
-                            tracer.end_tool_span(
-                                tool_use_id=tool_id,
-                                output="(tool executed by SDK)",
-                                is_error=False,
-                            )
-                        current_tool_ids.clear()
+                        tracer.end_open_tool_spans()
 
                         for block in message.content:
                             # ツール使用の検出
                             if isinstance(block, ToolUseBlock):
                                 tool_call_count += 1
+                                self.tool_calls.append(
+                                    {"id": block.id, "name": block.name, "input": block.input}
+                                )
                                 tracer.start_tool_span(
                                     parent=span,
                                     tool_name=block.name,
@@ -423,25 +449,18 @@ class BedrockAgentSDKWithClient:
                                     tool_call_number=tool_call_count,
                                     input=block.input,
                                 )
-                                current_tool_ids.append(block.id)
 
                     # テキスト抽出
                     message_text = extract_message_text(message)
                     if message_text:
+                        request.first_token()
                         full_response += message_text
                         yield message_text
 
-                # 残った未終了のツール span を終了（正常終了として）
-                for tool_id in current_tool_ids:
-                    tracer.end_tool_span(
-                        tool_use_id=tool_id,
-                        output="(tool executed by SDK)",
-                        is_error=False,
-                    )
-                current_tool_ids.clear()
+                request.set_result(metrics, tool_calls=tool_call_count)
 
-                # 万が一の未終了スパンを終了
-                tracer.end_all_pending_spans("no result received")
+                # 残った未終了のツール span を終了（正常終了として）
+                tracer.end_open_tool_spans()
 
                 # Generation を作成
                 tracer.create_generation(
@@ -479,6 +498,7 @@ async def simple_query(
     max_tokens: int = 4096,
     tags: Optional[list[str]] = None,
     environment: str = "development",
+    tracing_enabled: Optional[bool] = None,
 ) -> str:
     """Simple query function using Claude Agent SDK with Bedrock.
 
@@ -493,6 +513,7 @@ async def simple_query(
         max_tokens: Maximum tokens to generate
         tags: Custom tags for tracing
         environment: Environment name (development, staging, production)
+        tracing_enabled: Enable Langfuse tracing (None: follow LANGFUSE_TRACING_ENABLED)
 
     Returns:
         Complete response
@@ -511,13 +532,14 @@ async def simple_query(
         environment=environment,
         aws_region=aws_region,
         model=model_id,
+        enabled=tracing_enabled,
     )
 
     with tracer.trace_span(
         name="simple_query",
         input=prompt,
         metadata={"streaming": "false"},
-    ) as span:
+    ) as span, record_request(model_id, environment, tags, user_id) as request:
         full_response = ""
         metrics: Optional[AgentMetrics] = None
 
@@ -529,8 +551,11 @@ async def simple_query(
 
             message_text = extract_message_text(message)
             if message_text:
+                request.first_token()
                 full_response += message_text + "\n"
 
+        request.set_result(metrics)
+
         # Generation を作成
         tracer.create_generation(
             parent=span,
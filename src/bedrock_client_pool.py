@@ -0,0 +1,391 @@
+"""評価用LLM（ジャッジ）が共有する Bedrock クライアントプール.
+
+DeepEval がメトリクスを非同期に評価すると、ジャッジの呼び出しが同時に数十件になる。
+ChatBedrock を既定の設定で作ると botocore の接続プール（max_pool_connections=10）が
+上限になり、超えた呼び出しは接続が空くまで見えないところで待たされる。
+このモジュールは接続数を明示した bedrock-runtime クライアントを1つ作って共有し、
+同時呼び出し数を接続数に合わせたスロットで制限して、スロットの待ち時間を計測する。
+ChatBedrock.ainvoke は同期の呼び出しをイベントループの既定のエグゼキューター
+（min(32, CPU数 + 4) スレッド）で実行するため、非同期の呼び出しは接続数と同じ
+スレッド数の専用エグゼキューターで実行する（スレッド数がスロット数より少ないと、
+スロットを取得した呼び出しがスレッドを待ち、その待ち時間がスロットの統計に現れない）。
+
+主な機能:
+1. 共有クライアント: max_pool_connections・接続/読み取りタイムアウト・
+   アダプティブリトライ（クライアント側のレート制御付き）を設定した bedrock-runtime
+2. ClientSlots: 接続数と同じ数のスロット（スレッドからも asyncio からも取得できるセマフォ）
+3. 専用エグゼキューター: スロットを取得して接続数と同じスレッド数のプールで呼び出す（run_async）
+4. 待ち時間のメトリクス: metrics_registry の bedrock_client_pool_wait_ms（ヒストグラム）と
+   使用中・待機中のスロット数（ゲージ）、および stats() による要約
+
+環境変数:
+    BEDROCK_POOL_CONNECTIONS=50: 接続数（= 同時に実行する呼び出し数）
+    BEDROCK_CONNECT_TIMEOUT=5: 接続タイムアウト（秒）
+    BEDROCK_READ_TIMEOUT=120: 読み取りタイムアウト（秒）
+    BEDROCK_MAX_ATTEMPTS=8: リトライを含む最大試行回数
+    BEDROCK_RETRY_MODE=adaptive: botocore のリトライモード（standard / adaptive）
+
+使用例:
+    pool = BedrockClientPool(BedrockClientConfig(max_pool_connections=32))
+    evaluator = BedrockEvaluator(client_pool=pool)
+    ...
+    pool.stats()  # {"size": 32, "acquired": 1400, "waited": 210, "wait_p95_ms": 850.0, ...}
+"""
+
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, Iterator, Optional
+
+try:
+    from src.metrics_registry import REGISTRY, is_metrics_enabled
+except ImportError:
+    from metrics_registry import REGISTRY, is_metrics_enabled  # type: ignore
+
+_POOL_LABELS = ("pool",)
+_WAIT_MS = REGISTRY.histogram(
+    "bedrock_client_pool_wait_ms", "Time spent waiting for a Bedrock client slot", _POOL_LABELS
+)
+_ACQUIRED = REGISTRY.counter(
+    "bedrock_client_pool_acquired_total", "Bedrock client slots acquired", _POOL_LABELS
+)
+_WAITED = REGISTRY.counter(
+    "bedrock_client_pool_waited_total",
+    "Bedrock client slot acquisitions that had to wait",
+    _POOL_LABELS,
+)
+
+
+@dataclass
+class BedrockClientConfig:
+    """Bedrock クライアントの設定."""
+
+    region_name: Optional[str] = None
+
+    # 接続数（スロット数も同じ。DeepEval の同時評価数以上にする）
+    max_pool_connections: int = 50
+
+    # タイムアウト（秒）。ジャッジの応答は長くなるため読み取りは長めにする
+    connect_timeout: float = 5.0
+    read_timeout: float = 120.0
+
+    # リトライ（adaptive はスロットリング時にクライアント側で送信レートを下げる）
+    max_attempts: int = 8
+    retry_mode: str = "adaptive"
+
+    # メトリクスのラベル
+    name: str = "evaluator"
+
+    @classmethod
+    def from_env(cls) -> "BedrockClientConfig":
+        """環境変数から設定を生成."""
+        return cls(
+            region_name=os.getenv("AWS_REGION", "us-east-1"),
+            max_pool_connections=int(os.getenv("BEDROCK_POOL_CONNECTIONS", "50")),
+            connect_timeout=float(os.getenv("BEDROCK_CONNECT_TIMEOUT", "5")),
+            read_timeout=float(os.getenv("BEDROCK_READ_TIMEOUT", "120")),
+            max_attempts=int(os.getenv("BEDROCK_MAX_ATTEMPTS", "8")),
+            retry_mode=os.getenv("BEDROCK_RETRY_MODE", "adaptive"),
+        )
+
+    def botocore_config(self):
+        """botocore.config.Config を生成."""
+        from botocore.config import Config
+
+        return Config(
+            max_pool_connections=self.max_pool_connections,
+            connect_timeout=self.connect_timeout,
+            read_timeout=self.read_timeout,
+            retries={"max_attempts": self.max_attempts, "mode": self.retry_mode},
+        )
+
+
+class ClientSlots:
+    """同時呼び出し数を制限するスロット（スレッドと asyncio で共有するセマフォ）.
+
+    threading.Semaphore はイベントループをブロックし、asyncio.Semaphore は
+    ループごと・スレッドセーフでないため、DeepEval の同期評価（スレッド）と
+    非同期評価（イベントループ）で同じ上限を共有できない。
+    このクラスは空きスロットをロックで管理し、解放時に待っている呼び出しへ
+    スロットを直接引き渡す（asyncio の待機者は call_soon_threadsafe で起こす）。
+    """
+
+    def __init__(self, size: int, name: str = "evaluator"):
+        """初期化.
+
+        Args:
+            size: スロット数
+            name: メトリクスのラベル
+        """
+        self.size = max(1, size)
+        self.name = name
+        self._labels = (name,)
+        self._lock = threading.Lock()
+        self._in_use = 0
+        # 待機者（到着順）: threading.Event または (ループ, Future)
+        self._waiters: deque = deque()
+        self.acquired = 0
+        self.waited = 0
+        self.wait_total_ms = 0.0
+        self.wait_max_ms = 0.0
+
+    @property
+    def in_use(self) -> int:
+        """使用中のスロット数."""
+        return self._in_use
+
+    @property
+    def waiting(self) -> int:
+        """スロットを待っている呼び出し数."""
+        return len(self._waiters)
+
+    def _record(self, wait_ms: Optional[float]):
+        """取得を記録（wait_ms が None の場合は待たずに取得）."""
+        with self._lock:
+            self.acquired += 1
+            if wait_ms is not None:
+                self.waited += 1
+                self.wait_total_ms += wait_ms
+                self.wait_max_ms = max(self.wait_max_ms, wait_ms)
+        if not is_metrics_enabled():
+            return
+        _ACQUIRED.inc(labels=self._labels)
+        _WAIT_MS.observe(wait_ms or 0.0, labels=self._labels)
+        if wait_ms is not None:
+            _WAITED.inc(labels=self._labels)
+
+    def acquire(self):
+        """スロットを取得（空くまでスレッドをブロック）."""
+        with self._lock:
+            if self._in_use < self.size and not self._waiters:
+                self._in_use += 1
+                event = None
+            else:
+                event = threading.Event()
+                self._waiters.append(event)
+        if event is None:
+            self._record(None)
+            return
+        started = time.perf_counter()
+        # スロットは release() から引き渡される（_in_use はそのまま）
+        event.wait()
+        self._record((time.perf_counter() - started) * 1000)
+
+    async def acquire_async(self):
+        """スロットを取得（空くまでタスクを待機）."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._in_use < self.size and not self._waiters:
+                self._in_use += 1
+                future = None
+            else:
+                future = loop.create_future()
+                waiter = (loop, future)
+                self._waiters.append(waiter)
+        if future is None:
+            self._record(None)
+            return
+        started = time.perf_counter()
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                handed_over = waiter not in self._waiters
+                if not handed_over:
+                    self._waiters.remove(waiter)
+            if handed_over and not future.cancelled():
+                # 引き渡し後にキャンセルされた場合は次の待機者に回す
+                # （引き渡し前にキャンセルされた場合は _wake() が回す）
+                self.release()
+            raise
+        self._record((time.perf_counter() - started) * 1000)
+
+    def release(self):
+        """スロットを解放（待機者がいれば引き渡す）."""
+        with self._lock:
+            if not self._waiters:
+                self._in_use -= 1
+                return
+            waiter = self._waiters.popleft()
+        if isinstance(waiter, threading.Event):
+            waiter.set()
+            return
+        loop, future = waiter
+        try:
+            loop.call_soon_threadsafe(self._wake, future)
+        except RuntimeError:
+            # ループが閉じている場合は次の待機者に回す
+            self.release()
+
+    def _wake(self, future: asyncio.Future):
+        """イベントループ上で待機者を起こす（キャンセル済みならスロットを回す）."""
+        if future.cancelled():
+            self.release()
+        else:
+            future.set_result(None)
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        """スロットを取得して実行するコンテキストマネージャー."""
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def slot_async(self) -> AsyncIterator[None]:
+        """スロットを取得して実行する非同期コンテキストマネージャー."""
+        await self.acquire_async()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        """取得数・待ち数・待ち時間の要約."""
+        summary = _WAIT_MS.summary(self._labels)
+        with self._lock:
+            return {
+                "size": self.size,
+                "in_use": self._in_use,
+                "waiting": len(self._waiters),
+                "acquired": self.acquired,
+                "waited": self.waited,
+                "wait_rate": self.waited / self.acquired if self.acquired else 0.0,
+                "wait_mean_ms": self.wait_total_ms / self.waited if self.waited else 0.0,
+                "wait_p95_ms": summary.get("p95", 0.0),
+                "wait_max_ms": self.wait_max_ms,
+            }
+
+
+class BedrockClientPool:
+    """共有する bedrock-runtime クライアントとスロット."""
+
+    def __init__(self, config: Optional[BedrockClientConfig] = None, client: Any = None):
+        """初期化.
+
+        Args:
+            config: クライアントの設定（Noneの場合は環境変数から生成）
+            client: 既存の bedrock-runtime クライアント（Noneの場合は初回の使用時に作成）
+        """
+        self.config = config or BedrockClientConfig.from_env()
+        self.slots = ClientSlots(self.config.max_pool_connections, self.config.name)
+        self._client = client
+        self._client_lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def region_name(self) -> str:
+        """クライアントのリージョン."""
+        return self.config.region_name or os.getenv("AWS_REGION", "us-east-1")
+
+    @property
+    def client(self):
+        """bedrock-runtime クライアント（boto3 のクライアントはスレッドセーフなので共有する）."""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    import boto3
+
+                    self._client = boto3.client(
+                        "bedrock-runtime",
+                        region_name=self.region_name,
+                        config=self.config.botocore_config(),
+                    )
+        return self._client
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        """非同期の呼び出しを実行するエグゼキューター（スレッド数 = スロット数）."""
+        if self._executor is None:
+            with self._client_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.slots.size,
+                        thread_name_prefix=f"bedrock-{self.config.name}",
+                    )
+        return self._executor
+
+    async def run_async(self, func: Callable[..., Any], *args: Any) -> Any:
+        """スロットを取得して同期の呼び出しを専用エグゼキューターで実行.
+
+        Args:
+            func: Bedrock を呼び出す同期関数（ChatBedrock.invoke など）
+            *args: func の引数
+
+        Returns:
+            func の戻り値
+        """
+        loop = asyncio.get_running_loop()
+        # LangChain のコールバックなどが使うコンテキスト変数を引き継ぐ
+        call = functools.partial(contextvars.copy_context().run, func, *args)
+        async with self.slots.slot_async():
+            return await loop.run_in_executor(self.executor, call)
+
+    def shutdown(self):
+        """エグゼキューターを停止（実行中の呼び出しの完了を待つ）."""
+        with self._client_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def stats(self) -> dict:
+        """スロットの統計."""
+        return self.slots.stats()
+
+
+_shared_pool: Optional[BedrockClientPool] = None
+_shared_pool_lock = threading.Lock()
+
+
+def _pool_gauge_lines() -> list[str]:
+    """共有プールの使用中・待機中のスロット数（Prometheus ゲージ）."""
+    pool = _shared_pool
+    if pool is None:
+        return []
+    label = f'{{pool="{pool.slots.name}"}}'
+    return [
+        "# HELP bedrock_client_pool_in_use Bedrock client slots in use",
+        "# TYPE bedrock_client_pool_in_use gauge",
+        f"bedrock_client_pool_in_use{label} {pool.slots.in_use}",
+        "# HELP bedrock_client_pool_waiting Calls waiting for a Bedrock client slot",
+        "# TYPE bedrock_client_pool_waiting gauge",
+        f"bedrock_client_pool_waiting{label} {pool.slots.waiting}",
+        "# HELP bedrock_client_pool_size Bedrock client slots",
+        "# TYPE bedrock_client_pool_size gauge",
+        f"bedrock_client_pool_size{label} {pool.slots.size}",
+    ]
+
+
+REGISTRY.register_collector(_pool_gauge_lines)
+
+
+def configure_client_pool(pool: Optional[BedrockClientPool] = None):
+    """共有のクライアントプールを設定.
+
+    以降に作成される BedrockEvaluator（client_pool 未指定）が使う。
+
+    Args:
+        pool: クライアントプール（Noneの場合は次の使用時に環境変数から作成）
+    """
+    global _shared_pool
+    with _shared_pool_lock:
+        _shared_pool = pool
+
+
+def get_shared_client_pool() -> BedrockClientPool:
+    """共有のクライアントプールを返す（未設定の場合は環境変数から作成）."""
+    global _shared_pool
+    if _shared_pool is None:
+        with _shared_pool_lock:
+            if _shared_pool is None:
+                _shared_pool = BedrockClientPool()
+    return _shared_pool
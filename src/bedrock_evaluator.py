@@ -2,10 +2,15 @@
 
 DeepEvalBaseLLM を継承して、LangChain の ChatBedrock を
 DeepEval で使用できるようにラップします。
+同じジャッジプロンプトの呼び出しは judge_cache（SQLite）から応答します。
+Bedrock の呼び出しは bedrock_client_pool の共有クライアント（接続数・タイムアウト・
+アダプティブリトライを設定）を使い、同時呼び出し数を接続数のスロットで制限します。
 """
 
 import os
-from typing import Optional
+import threading
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -26,6 +31,21 @@ try:
 except ImportError:
     LANGCHAIN_AWS_AVAILABLE = False
 
+try:
+    from src.bedrock_client_pool import BedrockClientPool, get_shared_client_pool
+    from src.judge_cache import JudgeCache, cache_key, get_default_judge_cache
+    from src.pricing import SOURCE_EVALUATOR, CostLedger
+except ImportError:
+    from bedrock_client_pool import BedrockClientPool, get_shared_client_pool  # type: ignore
+    from judge_cache import JudgeCache, cache_key, get_default_judge_cache  # type: ignore
+    from pricing import SOURCE_EVALUATOR, CostLedger  # type: ignore
+
+# judge_cache 引数の既定値（configure_judge_cache() の設定を使う）
+_DEFAULT_CACHE: Any = object()
+
+# client_pool 引数の既定値（configure_client_pool() の設定を使う）
+_DEFAULT_POOL: Any = object()
+
 
 class BedrockEvaluator(DeepEvalBaseLLM):
     """AWS Bedrock を DeepEval で使用するためのラッパークラス.
@@ -47,6 +67,9 @@ class BedrockEvaluator(DeepEvalBaseLLM):
         region_name: Optional[str] = None,
         temperature: float = 0.0,
         max_tokens: int = 4096,
+        cost_ledger: Optional[CostLedger] = None,
+        judge_cache: Optional[JudgeCache] = _DEFAULT_CACHE,
+        client_pool: Optional[BedrockClientPool] = _DEFAULT_POOL,
     ):
         """Initialize Bedrock Evaluator.
 
@@ -55,6 +78,10 @@ class BedrockEvaluator(DeepEvalBaseLLM):
             region_name: AWS リージョン
             temperature: サンプリング温度（評価は決定論的に0.0推奨）
             max_tokens: 最大トークン数
+            cost_ledger: 評価用LLMのトークン使用量を記録するコスト台帳
+            judge_cache: レスポンスキャッシュ（省略時は既定のキャッシュ、Noneで無効）
+            client_pool: Bedrock クライアントプール（省略時は共有のプール、
+                Noneの場合は ChatBedrock が既定の設定でクライアントを作成）
         """
         if not LANGCHAIN_AWS_AVAILABLE:
             raise ImportError(
@@ -65,8 +92,26 @@ class BedrockEvaluator(DeepEvalBaseLLM):
         self.region_name = region_name or os.getenv("AWS_REGION", "us-east-1")
         self.temperature = temperature
         self.max_tokens = max_tokens
+        self.cost_ledger = cost_ledger
+        self.judge_cache = (
+            get_default_judge_cache() if judge_cache is _DEFAULT_CACHE else judge_cache
+        )
+        self.client_pool = (
+            get_shared_client_pool() if client_pool is _DEFAULT_POOL else client_pool
+        )
+
+        # スキーマごとの structured output ラッパー（呼び出しごとに作り直さない）
+        self._structured_models: dict[type, Any] = {}
+        self._structured_lock = threading.Lock()
 
-        # ChatBedrock インスタンスを作成
+        # 評価用LLMのトークン使用量（全呼び出しの合計）
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+        # ChatBedrock インスタンスを作成（共有プールのクライアントを使う）
+        client_kwargs = {}
+        if self.client_pool is not None:
+            client_kwargs["client"] = self.client_pool.client
         self._model = ChatBedrock(
             model_id=model_id,
             region_name=self.region_name,
@@ -74,6 +119,7 @@ class BedrockEvaluator(DeepEvalBaseLLM):
                 "temperature": temperature,
                 "max_tokens": max_tokens,
             },
+            **client_kwargs,
         )
 
     def load_model(self) -> ChatBedrock:
@@ -84,6 +130,58 @@ class BedrockEvaluator(DeepEvalBaseLLM):
         """
         return self._model
 
+    def _structured_model(self, schema: type):
+        """スキーマの structured output ラッパーを返す（スキーマごとに1回だけ作成）.
+
+        include_raw=True でトークン使用量を含む元のメッセージも受け取る。
+        """
+        structured_model = self._structured_models.get(schema)
+        if structured_model is None:
+            with self._structured_lock:
+                structured_model = self._structured_models.get(schema)
+                if structured_model is None:
+                    structured_model = self.load_model().with_structured_output(
+                        schema, include_raw=True
+                    )
+                    self._structured_models[schema] = structured_model
+        return structured_model
+
+    @contextmanager
+    def _slot(self) -> Iterator[None]:
+        """クライアントプールのスロットを取得して Bedrock を呼び出す."""
+        if self.client_pool is None:
+            yield
+            return
+        with self.client_pool.slots.slot():
+            yield
+
+    async def _ainvoke(self, model: Any, prompt: str) -> Any:
+        """Bedrock を非同期に呼び出す.
+
+        ainvoke はイベントループの既定のエグゼキューターで実行されスロット数より先に
+        スレッド数が上限になるため、クライアントプールのスロットと専用エグゼキューターで実行する。
+        """
+        if self.client_pool is None:
+            return await model.ainvoke(prompt)
+        return await self.client_pool.run_async(model.invoke, prompt)
+
+    def _cache_lookup(self, prompt: str, schema: Optional[type]) -> tuple[Optional[str], bool, Any]:
+        """キャッシュを参照.
+
+        Returns:
+            (キャッシュキー, ヒットした場合True, レスポンス)
+        """
+        if self.judge_cache is None:
+            return None, False, None
+        key = cache_key(self.model_id, self.temperature, self.max_tokens, prompt, schema)
+        hit, value = self.judge_cache.get(key, schema)
+        return key, hit, value
+
+    def _cache_store(self, key: Optional[str], value: Any, schema: Optional[type], usage: tuple[int, int]):
+        """レスポンスをキャッシュに保存."""
+        if key is not None:
+            self.judge_cache.put(key, self.model_id, value, schema, *usage)
+
     def generate(self, prompt: str, schema: Optional[type] = None):
         """テキスト生成（DeepEvalBaseLLM 必須メソッド）.
 
@@ -95,18 +193,23 @@ class BedrockEvaluator(DeepEvalBaseLLM):
             生成されたテキスト（schema が None の場合）
             または Pydantic モデルインスタンス（schema が指定された場合）
         """
-        chat_model = self.load_model()
+        key, hit, cached = self._cache_lookup(prompt, schema)
+        if hit:
+            return cached
 
         # schema が指定されている場合は structured output を使用
         if schema is not None:
-            structured_model = chat_model.with_structured_output(schema)
-            response = structured_model.invoke(prompt)
+            with self._slot():
+                response = self._structured_model(schema).invoke(prompt)
             # Pydantic モデルインスタンスをそのまま返す
-            return response
-
-        # 通常の生成
-        response = chat_model.invoke(prompt)
-        return response.content
+            result, usage = self._parse_structured(response)
+        else:
+            # 通常の生成
+            with self._slot():
+                response = self.load_model().invoke(prompt)
+            result, usage = response.content, self._record_usage(response)
+        self._cache_store(key, result, schema, usage)
+        return result
 
     async def a_generate(self, prompt: str, schema: Optional[type] = None):
         """非同期テキスト生成（DeepEvalBaseLLM 必須メソッド）.
@@ -119,18 +222,57 @@ class BedrockEvaluator(DeepEvalBaseLLM):
             生成されたテキスト（schema が None の場合）
             または Pydantic モデルインスタンス（schema が指定された場合）
         """
-        chat_model = self.load_model()
+        key, hit, cached = self._cache_lookup(prompt, schema)
+        if hit:
+            return cached
 
         # schema が指定されている場合は structured output を使用
         if schema is not None:
-            structured_model = chat_model.with_structured_output(schema)
-            response = await structured_model.ainvoke(prompt)
+            response = await self._ainvoke(self._structured_model(schema), prompt)
             # Pydantic モデルインスタンスをそのまま返す
-            return response
+            result, usage = self._parse_structured(response)
+        else:
+            # 通常の生成
+            response = await self._ainvoke(self.load_model(), prompt)
+            result, usage = response.content, self._record_usage(response)
+        self._cache_store(key, result, schema, usage)
+        return result
+
+    def _parse_structured(self, response: dict) -> tuple[Any, tuple[int, int]]:
+        """include_raw=True の structured output からモデルインスタンスを取り出す.
 
-        # 通常の生成
-        response = await chat_model.ainvoke(prompt)
-        return response.content
+        Args:
+            response: {"raw": AIMessage, "parsed": ..., "parsing_error": ...}
+
+        Returns:
+            (Pydantic モデルインスタンス, (入力トークン, 出力トークン))
+        """
+        usage = self._record_usage(response.get("raw"))
+        if response.get("parsing_error") is not None:
+            raise response["parsing_error"]
+        return response["parsed"], usage
+
+    def _record_usage(self, message) -> tuple[int, int]:
+        """レスポンスのトークン使用量を記録.
+
+        Args:
+            message: LangChain の AIMessage（usage_metadata を持つ）
+
+        Returns:
+            (入力トークン, 出力トークン)
+        """
+        usage = getattr(message, "usage_metadata", None)
+        if not usage:
+            return 0, 0
+        input_tokens = usage.get("input_tokens", 0)
+        output_tokens = usage.get("output_tokens", 0)
+        self.input_tokens += input_tokens
+        self.output_tokens += output_tokens
+        if self.cost_ledger is not None:
+            self.cost_ledger.record_tokens(
+                SOURCE_EVALUATOR, self.model_id, input_tokens, output_tokens
+            )
+        return input_tokens, output_tokens
 
     def get_model_name(self) -> str:
         """モデル名を返す（DeepEvalBaseLLM 必須メソッド）.
@@ -144,12 +286,18 @@ class BedrockEvaluator(DeepEvalBaseLLM):
 def create_bedrock_evaluator(
     model_id: str = "anthropic.claude-3-haiku-20240307-v1:0",
     temperature: float = 0.0,
+    cost_ledger: Optional[CostLedger] = None,
+    judge_cache: Optional[JudgeCache] = _DEFAULT_CACHE,
+    client_pool: Optional[BedrockClientPool] = _DEFAULT_POOL,
 ) -> BedrockEvaluator:
     """DeepEval で使用する Bedrock 評価器を作成.
 
     Args:
         model_id: Bedrock モデルID
         temperature: サンプリング温度
+        cost_ledger: 評価用LLMのトークン使用量を記録するコスト台帳
+        judge_cache: レスポンスキャッシュ（省略時は既定のキャッシュ、Noneで無効）
+        client_pool: Bedrock クライアントプール（省略時は共有のプール）
 
     Returns:
         BedrockEvaluator インスタンス
@@ -162,6 +310,9 @@ def create_bedrock_evaluator(
     return BedrockEvaluator(
         model_id=model_id,
         temperature=temperature,
+        cost_ledger=cost_ledger,
+        judge_cache=judge_cache,
+        client_pool=client_pool,
     )
 
 
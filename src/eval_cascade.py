@@ -0,0 +1,446 @@
+"""ローカル指標によるジャッジのカスケード.
+
+すべてのテストケースを LLM ジャッジのメトリクス（AnswerRelevancy, Faithfulness,
+ContextualRelevancy, Hallucination, GEval x3）で評価すると、1ケースあたり7回以上の
+Bedrock 呼び出しになる。このモジュールは expected_output に対する安価なローカル指標を
+先に計算し、結論が出ない（閾値の間にある）ケースだけをジャッジに回す。
+省略するのは expected_output と比較できるメトリクス（評価パラメータに expected_output を
+含むものと EVAL_CASCADE_METRICS）だけで、Faithfulness や Hallucination などの参照を
+使わないメトリクスは判定に関係なく評価する。
+
+主な機能:
+1. ローカル指標（日本語向けに文字単位）
+   - 文字 n-gram F1（既定は bigram）
+   - ROUGE-L（文字単位の最長共通部分列の F1）
+   - 長さの比（短い方 / 長い方）
+2. 判定: 重み付き平均が high 以上なら pass、low 未満なら fail、その間はジャッジで評価
+   （expected_output がないケースは常にジャッジで評価。省略するのはカスケードの対象のメトリクスだけ）
+3. キャリブレーション: 判定が出たケースの一部（ケースのキーのハッシュで決定的に選ぶ）も
+   ジャッジで評価し、ローカル指標とジャッジの一致率・相関を集計
+4. 省略したジャッジの評価回数（メトリクス単位）の集計
+
+環境変数:
+    EVAL_CASCADE=false: カスケードを有効にする
+    EVAL_CASCADE_LOW=0.1: これ未満のローカルスコアは fail と判定
+    EVAL_CASCADE_HIGH=0.7: これ以上のローカルスコアは pass と判定
+    EVAL_CASCADE_CALIBRATION_RATE=0.1: 判定が出たケースのうちジャッジでも評価する割合
+    EVAL_CASCADE_METRICS=Answer Relevancy,Response Quality: 判定が出たケースで省略する
+        メトリクス（評価パラメータに expected_output を含むメトリクスは常に対象）
+"""
+
+import hashlib
+import math
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Optional
+
+# ROUGE-L の計算に使う最大文字数（O(n*m) のため長い出力は先頭で打ち切る）
+_ROUGE_MAX_CHARS = 1000
+
+# 正規化で取り除く文字（空白・句読点・記号）
+_STRIP_PATTERN = re.compile(r"[\s\W_]+", re.UNICODE)
+
+# カスケードの判定をスコアとして記録するときの名前
+LOCAL_SCORE_NAME = "Local Reference Match"
+
+# 判定が出たケースで省略するメトリクスの既定値（出力の正しさを評価するメトリクス）
+DEFAULT_GATED_METRICS = ("Answer Relevancy", "Response Quality")
+
+
+def normalize_text(text: str) -> str:
+    """比較用の正規化（NFKC、小文字化、空白・句読点の除去）."""
+    text = unicodedata.normalize("NFKC", text).lower()
+    return _STRIP_PATTERN.sub("", text)
+
+
+def char_ngram_f1(actual: str, expected: str, n: int = 2) -> float:
+    """文字 n-gram の F1（分かち書きが不要なため日本語でも使える）.
+
+    Args:
+        actual: エージェントの出力（正規化済み）
+        expected: 期待される出力（正規化済み）
+        n: n-gram の長さ
+
+    Returns:
+        0.0〜1.0
+    """
+    if len(actual) < n or len(expected) < n:
+        return 1.0 if actual == expected else 0.0
+    actual_grams = Counter(actual[i : i + n] for i in range(len(actual) - n + 1))
+    expected_grams = Counter(expected[i : i + n] for i in range(len(expected) - n + 1))
+    overlap = sum((actual_grams & expected_grams).values())
+    if overlap == 0:
+        return 0.0
+    precision = overlap / sum(actual_grams.values())
+    recall = overlap / sum(expected_grams.values())
+    return 2 * precision * recall / (precision + recall)
+
+
+def _lcs_length(a: str, b: str) -> int:
+    """最長共通部分列の長さ（1行分の DP テーブルで計算）."""
+    if len(a) < len(b):
+        a, b = b, a
+    previous = [0] * (len(b) + 1)
+    for char_a in a:
+        current = [0]
+        for j, char_b in enumerate(b, 1):
+            if char_a == char_b:
+                current.append(previous[j - 1] + 1)
+            else:
+                current.append(max(previous[j], current[j - 1]))
+        previous = current
+    return previous[-1]
+
+
+def rouge_l(actual: str, expected: str) -> float:
+    """文字単位の ROUGE-L F1.
+
+    Args:
+        actual: エージェントの出力（正規化済み）
+        expected: 期待される出力（正規化済み）
+
+    Returns:
+        0.0〜1.0
+    """
+    actual, expected = actual[:_ROUGE_MAX_CHARS], expected[:_ROUGE_MAX_CHARS]
+    if not actual or not expected:
+        return 1.0 if actual == expected else 0.0
+    lcs = _lcs_length(actual, expected)
+    if lcs == 0:
+        return 0.0
+    precision = lcs / len(actual)
+    recall = lcs / len(expected)
+    return 2 * precision * recall / (precision + recall)
+
+
+def length_ratio(actual: str, expected: str) -> float:
+    """長さの比（短い方 / 長い方）."""
+    longest = max(len(actual), len(expected))
+    return min(len(actual), len(expected)) / longest if longest else 1.0
+
+
+@dataclass
+class LocalScores:
+    """1ケースのローカル指標."""
+
+    ngram_f1: float
+    rouge_l: float
+    length_ratio: float
+    combined: float
+
+    def signals(self) -> dict[str, float]:
+        """キャリブレーションで相関を見る指標."""
+        return {
+            "ngram_f1": self.ngram_f1,
+            "rouge_l": self.rouge_l,
+            "length_ratio": self.length_ratio,
+            "combined": self.combined,
+        }
+
+
+@dataclass
+class CascadeConfig:
+    """カスケードの設定."""
+
+    enabled: bool = False
+
+    # 判定の閾値（combined が high 以上で pass、low 未満で fail）
+    low: float = 0.1
+    high: float = 0.7
+
+    # 判定が出たケースのうちジャッジでも評価する割合（キャリブレーション用）
+    calibration_rate: float = 0.1
+
+    # combined の重み（n-gram F1, ROUGE-L, 長さの比）
+    weights: tuple[float, float, float] = (0.4, 0.4, 0.2)
+
+    # n-gram の長さ
+    ngram: int = 2
+
+    # 判定が出たケースで省略するメトリクスの名前
+    # （評価パラメータに expected_output を含むメトリクスは常に対象）
+    metrics: list[str] = field(default_factory=lambda: list(DEFAULT_GATED_METRICS))
+
+    @classmethod
+    def from_env(cls) -> "CascadeConfig":
+        """環境変数から設定を生成."""
+        config = cls(
+            enabled=os.getenv("EVAL_CASCADE", "false").lower() in ("true", "1", "yes"),
+            low=float(os.getenv("EVAL_CASCADE_LOW", "0.1")),
+            high=float(os.getenv("EVAL_CASCADE_HIGH", "0.7")),
+            calibration_rate=float(os.getenv("EVAL_CASCADE_CALIBRATION_RATE", "0.1")),
+        )
+        metrics = os.getenv("EVAL_CASCADE_METRICS")
+        if metrics is not None:
+            config.metrics = [name.strip() for name in metrics.split(",") if name.strip()]
+        return config
+
+
+@dataclass
+class CascadeVerdict:
+    """1ケースのカスケードの判定."""
+
+    # None の場合は expected_output がない
+    local: Optional[LocalScores]
+    # "pass" / "fail" / "inconclusive"
+    decision: str
+    # 判定が出たがキャリブレーションのためにジャッジでも評価する
+    calibration: bool = False
+
+    @property
+    def run_judges(self) -> bool:
+        """ジャッジで評価するか."""
+        return self.decision == "inconclusive" or self.calibration
+
+
+class _Correlation:
+    """ピアソンの相関係数の逐次計算."""
+
+    __slots__ = ("n", "sx", "sy", "sxx", "syy", "sxy")
+
+    def __init__(self):
+        self.n = 0
+        self.sx = self.sy = self.sxx = self.syy = self.sxy = 0.0
+
+    def add(self, x: float, y: float):
+        self.n += 1
+        self.sx += x
+        self.sy += y
+        self.sxx += x * x
+        self.syy += y * y
+        self.sxy += x * y
+
+    def value(self) -> Optional[float]:
+        if self.n < 3:
+            return None
+        cov = self.n * self.sxy - self.sx * self.sy
+        var = (self.n * self.sxx - self.sx**2) * (self.n * self.syy - self.sy**2)
+        if var <= 0:
+            return None
+        return cov / math.sqrt(var)
+
+
+@dataclass
+class _MetricCalibration:
+    """1メトリクスのキャリブレーションの集計."""
+
+    correlations: dict[str, _Correlation] = field(default_factory=dict)
+    # 判定が出たケースでジャッジも評価したもの
+    decided: int = 0
+    agreed: int = 0
+    # ローカルは pass だがジャッジは fail（カスケードで見逃す不合格）
+    false_pass: int = 0
+    # ローカルは fail だがジャッジは pass
+    false_fail: int = 0
+
+
+class Cascade:
+    """ローカル指標によるジャッジの選別とキャリブレーションの集計（スレッドセーフ）."""
+
+    def __init__(self, config: Optional[CascadeConfig] = None):
+        """初期化.
+
+        Args:
+            config: カスケードの設定（Noneの場合は環境変数から生成）
+        """
+        self.config = config or CascadeConfig.from_env()
+        self._lock = threading.Lock()
+        self._decisions: Counter = Counter()
+        self._calibration_cases = 0
+        self._judge_evals_run = 0
+        self._judge_evals_skipped = 0
+        self._metrics: dict[str, _MetricCalibration] = {}
+
+    def local_scores(self, actual_output: str, expected_output: str) -> LocalScores:
+        """ローカル指標を計算."""
+        actual = normalize_text(actual_output)
+        expected = normalize_text(expected_output)
+        ngram = char_ngram_f1(actual, expected, self.config.ngram)
+        rouge = rouge_l(actual, expected)
+        ratio = length_ratio(actual, expected)
+        w_ngram, w_rouge, w_ratio = self.config.weights
+        combined = (w_ngram * ngram + w_rouge * rouge + w_ratio * ratio) / (
+            w_ngram + w_rouge + w_ratio
+        )
+        return LocalScores(ngram, rouge, ratio, combined)
+
+    def gates(self, metric) -> bool:
+        """判定が出たケースでこのメトリクスを省略するか.
+
+        expected_output と比較できるメトリクス（評価パラメータに expected_output を含むもの、
+        または config.metrics に名前があるもの）だけを省略する。
+        """
+        names = {getattr(metric, "name", None), getattr(metric, "__name__", None)}
+        if names & set(self.config.metrics):
+            return True
+        params = getattr(metric, "evaluation_params", None)
+        if not isinstance(params, (list, tuple)):
+            # 標準メトリクスは必要なパラメータをクラス属性に持つ
+            params = getattr(metric, "_required_params", None)
+        if not isinstance(params, (list, tuple)):
+            return False
+        return any(getattr(param, "value", param) == "expected_output" for param in params)
+
+    def _sampled(self, key: str) -> bool:
+        """キャリブレーションの対象か（ケースのキーのハッシュで決定的に選ぶ）."""
+        digest = hashlib.sha256(key.encode("utf-8")).digest()
+        return int.from_bytes(digest[:4], "big") / 2**32 < self.config.calibration_rate
+
+    def assess(
+        self, key: str, actual_output: Optional[str], expected_output: Optional[str]
+    ) -> CascadeVerdict:
+        """1ケースを判定.
+
+        Args:
+            key: ケースのキー（キャリブレーション対象の選択に使う）
+            actual_output: エージェントの出力
+            expected_output: 期待される出力
+
+        Returns:
+            CascadeVerdict
+        """
+        if not expected_output or actual_output is None:
+            verdict = CascadeVerdict(local=None, decision="inconclusive")
+            with self._lock:
+                self._decisions["no_reference"] += 1
+            return verdict
+
+        local = self.local_scores(actual_output, expected_output)
+        if local.combined >= self.config.high:
+            decision = "pass"
+        elif local.combined < self.config.low:
+            decision = "fail"
+        else:
+            decision = "inconclusive"
+        verdict = CascadeVerdict(
+            local=local,
+            decision=decision,
+            calibration=decision != "inconclusive" and self._sampled(key),
+        )
+        with self._lock:
+            self._decisions[decision] += 1
+            self._calibration_cases += verdict.calibration
+        return verdict
+
+    def score_entry_fields(self, verdict: CascadeVerdict) -> Optional[dict]:
+        """判定を記録するスコアの値（ScoreEntry の引数。expected_output がない場合None）."""
+        if verdict.local is None:
+            return None
+        local = verdict.local
+        return {
+            "name": LOCAL_SCORE_NAME,
+            "score": local.combined,
+            "success": None if verdict.decision == "inconclusive" else verdict.decision == "pass",
+            "threshold": self.config.high,
+            "reason": (
+                f"{verdict.decision}: char {self.config.ngram}-gram F1 {local.ngram_f1:.3f}, "
+                f"ROUGE-L {local.rouge_l:.3f}, length ratio {local.length_ratio:.3f}"
+            ),
+        }
+
+    def observe(self, verdict: CascadeVerdict, judge_results: list, skipped: int = 0):
+        """ジャッジの結果（または省略した回数）を集計.
+
+        Args:
+            verdict: assess() の戻り値
+            judge_results: カスケードの対象のメトリクスの eval_pipeline.MetricResult のリスト
+                （ジャッジを実行しなかった場合は空）
+            skipped: カスケードで省略したジャッジの評価回数
+        """
+        with self._lock:
+            self._judge_evals_skipped += skipped
+            self._judge_evals_run += len(judge_results)
+            if verdict.local is None:
+                return
+            for result in judge_results:
+                if result.score is None:
+                    continue
+                calibration = self._metrics.setdefault(result.name, _MetricCalibration())
+                for signal, value in verdict.local.signals().items():
+                    calibration.correlations.setdefault(signal, _Correlation()).add(
+                        value, result.score
+                    )
+                if verdict.decision == "inconclusive" or result.success is None:
+                    continue
+                calibration.decided += 1
+                local_pass = verdict.decision == "pass"
+                if local_pass == bool(result.success):
+                    calibration.agreed += 1
+                elif local_pass:
+                    calibration.false_pass += 1
+                else:
+                    calibration.false_fail += 1
+
+    def report(self) -> dict:
+        """キャリブレーションレポート.
+
+        Returns:
+            {"decisions", "judge_evals", "metrics": {名前: {相関, 一致率}}}
+        """
+        with self._lock:
+            run, skipped = self._judge_evals_run, self._judge_evals_skipped
+            metrics = {}
+            for name, calibration in self._metrics.items():
+                metrics[name] = {
+                    "correlation": {
+                        signal: (round(r, 3) if (r := c.value()) is not None else None)
+                        for signal, c in calibration.correlations.items()
+                    },
+                    "pairs": calibration.correlations["combined"].n
+                    if "combined" in calibration.correlations
+                    else 0,
+                    "decided": calibration.decided,
+                    "agreement": calibration.agreed / calibration.decided
+                    if calibration.decided
+                    else None,
+                    "false_pass": calibration.false_pass,
+                    "false_fail": calibration.false_fail,
+                }
+            return {
+                "thresholds": {"low": self.config.low, "high": self.config.high},
+                "decisions": dict(self._decisions),
+                "calibration_cases": self._calibration_cases,
+                "judge_evals": {
+                    "run": run,
+                    "skipped": skipped,
+                    "saved_rate": skipped / (run + skipped) if run + skipped else 0.0,
+                },
+                "metrics": metrics,
+            }
+
+
+def format_calibration(report: dict) -> list[str]:
+    """キャリブレーションレポートの表示行.
+
+    Args:
+        report: Cascade.report() の戻り値
+
+    Returns:
+        表示行のリスト
+    """
+    decisions = report["decisions"]
+    judge_evals = report["judge_evals"]
+    lines = [
+        f"  判定: pass {decisions.get('pass', 0)}, fail {decisions.get('fail', 0)}, "
+        f"inconclusive {decisions.get('inconclusive', 0)}, "
+        f"no reference {decisions.get('no_reference', 0)} "
+        f"(thresholds {report['thresholds']['low']}/{report['thresholds']['high']}, "
+        f"calibration {report['calibration_cases']} cases)",
+        f"  ジャッジ評価（対象のメトリクス）: {judge_evals['run']} 回実行, {judge_evals['skipped']} 回省略 "
+        f"({judge_evals['saved_rate']:.0%} saved)",
+    ]
+    for name, metric in report["metrics"].items():
+        r = metric["correlation"].get("combined")
+        line = f"  - {name}: r={r:+.2f}" if r is not None else f"  - {name}: r=n/a"
+        line += f" (n={metric['pairs']})"
+        if metric["agreement"] is not None:
+            line += (
+                f", agreement {metric['agreement']:.0%} on {metric['decided']} decided cases "
+                f"(false pass {metric['false_pass']}, false fail {metric['false_fail']})"
+            )
+        lines.append(line)
+    return lines
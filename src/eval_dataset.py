@@ -0,0 +1,471 @@
+"""評価データセットのストリーミング読み込み.
+
+json.load でデータセット全体を読み込むと、10万ケース規模の回帰テストセットでは
+メモリ使用量がデータセットのサイズに比例する。このモジュールはテストケースを
+1件ずつ読み出すイテレーターを提供する。
+
+主な機能:
+1. 形式: JSON（{"test_cases": [...]} または [...]）と JSONL（1行1ケース）
+2. 圧縮: .gz / .bz2 / .xz（拡張子で判定）
+3. ストリーミング: JSON もチャンク単位で読み、配列の要素を1件ずつデコード
+4. 決定的なシャーディング（--shard i/n）: ケースのキーのハッシュで割り当てるため、
+   ケースの追加・並べ替えで既存ケースのシャードは変わらない
+5. タグ式による絞り込み（--tags "knowledge and not git"、and / or / not / 括弧）
+6. タグごとの層化サンプリング（--sample-per-tag N --seed S）: タグごとに
+   (シード, ケースのキー) のハッシュが小さい N 件を候補にするため、同じシードなら
+   データセットの並び順に関係なく同じケースが選ばれる。候補からは各タグが N 件になる
+   少数のケースを選ぶ（複数のタグを持つケースは各タグの件数に数える）
+
+絞り込み・サンプリングはシャーディングの前に行う（分散実行でもタグごとに N 件）。
+
+環境変数:
+    EVAL_TAGS: タグ式（--tags の既定値）
+    EVAL_SAMPLE_PER_TAG: タグごとのサンプル数（--sample-per-tag の既定値）
+    EVAL_SAMPLE_SEED=0: サンプリングのシード
+
+使用例:
+    for index, item in iter_dataset("datasets/regression.jsonl.gz", shard=(0, 4)):
+        ...
+
+    # 2分程度のスモーク評価: slow タグのケースを除いてタグごとに2件
+    selection = DatasetSelection(tags="not slow", per_tag=2, seed=0)
+    for index, item in iter_dataset("datasets/evaluation_dataset.json", selection=selection):
+        ...
+"""
+
+import argparse
+import bz2
+import gzip
+import hashlib
+import heapq
+import io
+import json
+import lzma
+import os
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import IO, Any, Callable, Iterator, Optional
+
+try:
+    from src.eval_manifest import case_key
+except ImportError:
+    from eval_manifest import case_key  # type: ignore
+
+# JSON の値の直後に来る文字（値が途中で切れていないことの判定に使う）
+_DELIMITERS = " \t\r\n,:]}"
+
+# 圧縮形式の拡張子 -> open 関数
+_OPENERS = {
+    ".gz": gzip.open,
+    ".bz2": bz2.open,
+    ".xz": lzma.open,
+}
+
+# JSON をデコードするときに読み込むチャンクサイズ（文字数）
+_CHUNK_SIZE = 1 << 16
+
+
+def parse_shard(value: str) -> tuple[int, int]:
+    """シャード指定（"i/n"）を解析.
+
+    Args:
+        value: "0/4" のような文字列（i は 0 始まり）
+
+    Returns:
+        (i, n)
+    """
+    try:
+        index, count = (int(part) for part in value.split("/", 1))
+    except ValueError:
+        raise ValueError(f"Shard must be in the form i/n: {value}") from None
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Shard index must satisfy 0 <= i < n: {value}")
+    return index, count
+
+
+def shard_of(key: str, count: int) -> int:
+    """ケースのキーが割り当てられるシャード番号."""
+    digest = hashlib.sha256(key.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % count
+
+
+# タグ式のトークン（括弧、またはそれ以外の空白を含まない文字列）
+_TAG_TOKEN = re.compile(r"\s*(\(|\)|[^\s()]+)")
+
+
+def parse_tag_expression(expression: str) -> Callable[[set[str]], bool]:
+    """タグ式を解析して述語を返す.
+
+    文法（優先順位は not > and > or）:
+        expr := term ("or" term)*
+        term := factor ("and" factor)*
+        factor := "not" factor | "(" expr ")" | タグ
+
+    Args:
+        expression: "knowledge and (python or git) and not slow" のような式
+
+    Returns:
+        ケースのタグの集合を受け取り、式に一致するか返す関数
+    """
+    tokens = _TAG_TOKEN.findall(expression)
+    position = 0
+
+    def peek() -> Optional[str]:
+        return tokens[position] if position < len(tokens) else None
+
+    def take() -> str:
+        nonlocal position
+        token = peek()
+        if token is None:
+            raise ValueError(f"Unexpected end of tag expression: {expression}")
+        position += 1
+        return token
+
+    def parse_or() -> Callable[[set[str]], bool]:
+        operands = [parse_and()]
+        while (peek() or "").lower() == "or":
+            take()
+            operands.append(parse_and())
+        return operands[0] if len(operands) == 1 else lambda tags: any(f(tags) for f in operands)
+
+    def parse_and() -> Callable[[set[str]], bool]:
+        operands = [parse_not()]
+        while (peek() or "").lower() == "and":
+            take()
+            operands.append(parse_not())
+        return operands[0] if len(operands) == 1 else lambda tags: all(f(tags) for f in operands)
+
+    def parse_not() -> Callable[[set[str]], bool]:
+        token = take()
+        if token.lower() == "not":
+            operand = parse_not()
+            return lambda tags: not operand(tags)
+        if token == "(":
+            inner = parse_or()
+            if take() != ")":
+                raise ValueError(f'Expected ")" in tag expression: {expression}')
+            return inner
+        if token == ")" or token.lower() in ("and", "or"):
+            raise ValueError(f"Unexpected {token!r} in tag expression: {expression}")
+        return lambda tags: token in tags
+
+    predicate = parse_or()
+    if peek() is not None:
+        raise ValueError(f"Unexpected {peek()!r} in tag expression: {expression}")
+    return predicate
+
+
+@dataclass
+class DatasetSelection:
+    """テストケースの絞り込みとサンプリングの設定."""
+
+    # タグ式（Noneの場合は絞り込まない）
+    tags: Optional[str] = None
+
+    # タグごとのサンプル数（Noneの場合はサンプリングしない）
+    per_tag: Optional[int] = None
+
+    # サンプリングのシード
+    seed: int = 0
+
+    # 層にするタグ（Noneの場合はケースのすべてのタグ）
+    strata: Optional[list[str]] = None
+
+    @property
+    def active(self) -> bool:
+        """絞り込み・サンプリングを行うか."""
+        return bool(self.tags) or self.per_tag is not None
+
+    def describe(self) -> str:
+        """表示用の説明."""
+        parts = []
+        if self.tags:
+            parts.append(f"tags: {self.tags}")
+        if self.per_tag is not None:
+            strata = f" of {', '.join(self.strata)}" if self.strata else ""
+            parts.append(f"{self.per_tag} per tag{strata}, seed {self.seed}")
+        return "; ".join(parts)
+
+    def to_args(self) -> list[str]:
+        """コマンドライン引数（ワーカープロセスに渡す）."""
+        args = []
+        if self.tags:
+            args += ["--tags", self.tags]
+        if self.per_tag is not None:
+            args += ["--sample-per-tag", str(self.per_tag), "--seed", str(self.seed)]
+            if self.strata:
+                args += ["--strata", ",".join(self.strata)]
+        return args
+
+    @classmethod
+    def from_env(cls) -> "DatasetSelection":
+        """環境変数から設定を生成."""
+        per_tag = os.getenv("EVAL_SAMPLE_PER_TAG")
+        return cls(
+            tags=os.getenv("EVAL_TAGS") or None,
+            per_tag=int(per_tag) if per_tag else None,
+            seed=int(os.getenv("EVAL_SAMPLE_SEED", "0")),
+        )
+
+
+def add_selection_args(parser: argparse.ArgumentParser):
+    """絞り込み・サンプリングの引数を追加（--tags, --sample-per-tag, --strata, --seed）."""
+    defaults = DatasetSelection.from_env()
+    parser.add_argument(
+        "--tags",
+        default=defaults.tags,
+        help='タグ式で絞り込み（例: "knowledge and not git"、and / or / not / 括弧）',
+    )
+    parser.add_argument(
+        "--sample-per-tag",
+        type=int,
+        default=defaults.per_tag,
+        help="タグごとに N 件を層化サンプリング（スモーク評価用）",
+    )
+    parser.add_argument(
+        "--strata",
+        default=None,
+        help="サンプリングの層にするタグ（カンマ区切り、省略時はすべてのタグ）",
+    )
+    parser.add_argument("--seed", type=int, default=defaults.seed, help="サンプリングのシード")
+
+
+def selection_from_args(args: argparse.Namespace) -> DatasetSelection:
+    """add_selection_args() の引数から DatasetSelection を作成."""
+    if args.tags:
+        # 不正な式は評価を始める前にエラーにする
+        parse_tag_expression(args.tags)
+    return DatasetSelection(
+        tags=args.tags,
+        per_tag=args.sample_per_tag,
+        seed=args.seed,
+        strata=[tag.strip() for tag in args.strata.split(",")] if args.strata else None,
+    )
+
+
+def _sample_priority(seed: int, key: str) -> int:
+    """サンプリングの優先度（小さいほど選ばれる）."""
+    digest = hashlib.sha256(f"{seed}\0{key}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big")
+
+
+def _stratified_keys(
+    items: Iterator[dict], per_tag: int, seed: int, strata: Optional[list[str]]
+) -> set[str]:
+    """タグごとに per_tag 件を満たすケースのキーを選ぶ（タグ数 x per_tag 件だけ保持）.
+
+    タグごとに優先度の小さい per_tag 件を候補にし、候補の中から未充足のタグを多く含む
+    ケースから順に（同数なら優先度の小さい順に）選ぶ。複数のタグを持つケースはそれぞれの
+    タグの件数に数えるため、候補の和集合より少ない件数ですべてのタグが per_tag 件になる。
+    """
+    if per_tag <= 0:
+        return set()
+    # タグ -> (-優先度, キー, 層のタグ) の最大ヒープ（優先度の大きいものから追い出す）
+    heaps: dict[str, list[tuple[int, str, tuple[str, ...]]]] = {}
+    for item in items:
+        key = case_key(item)
+        priority = _sample_priority(seed, key)
+        tags = tuple(
+            tag
+            for tag in dict.fromkeys(item.get("tags") or ["(untagged)"])
+            if strata is None or tag in strata
+        )
+        for tag in tags:
+            heap = heaps.setdefault(tag, [])
+            if len(heap) < per_tag:
+                heapq.heappush(heap, (-priority, key, tags))
+            elif -heap[0][0] > priority:
+                heapq.heapreplace(heap, (-priority, key, tags))
+
+    candidates = {key: (-negated, tags) for heap in heaps.values() for negated, key, tags in heap}
+    counts = dict.fromkeys(heaps, 0)
+    selected: set[str] = set()
+    while candidates:
+        key, (_, tags) = min(
+            candidates.items(),
+            key=lambda entry: (-sum(counts[tag] < per_tag for tag in entry[1][1]), entry[1][0]),
+        )
+        del candidates[key]
+        if not any(counts[tag] < per_tag for tag in tags):
+            break
+        selected.add(key)
+        for tag in tags:
+            counts[tag] += 1
+    return selected
+
+
+def _open_text(path: Path) -> IO[str]:
+    """圧縮形式を判定してテキストモードで開く."""
+    opener = _OPENERS.get(path.suffix)
+    if opener is not None:
+        return io.TextIOWrapper(opener(path, "rb"), encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+def _dataset_format(path: Path) -> str:
+    """圧縮拡張子を除いた拡張子から形式を判定（json / jsonl）."""
+    suffixes = [s for s in path.suffixes if s not in _OPENERS]
+    return "jsonl" if suffixes and suffixes[-1] in (".jsonl", ".ndjson") else "json"
+
+
+def _iter_jsonl(f: IO[str]) -> Iterator[dict]:
+    """JSONL を1行ずつデコード（空行とコメント行 # は無視）."""
+    for line_number, line in enumerate(f, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON at line {line_number}: {e}") from None
+
+
+def _iter_json_array(f: IO[str], key: str = "test_cases") -> Iterator[dict]:
+    """JSON の配列（トップレベル、または key の値）を要素ごとにデコード.
+
+    ファイル全体を読み込まず、チャンク単位で読み進める。
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    eof = False
+
+    def fill() -> bool:
+        nonlocal buffer, position, eof
+        if eof:
+            return False
+        chunk = f.read(_CHUNK_SIZE)
+        if not chunk:
+            eof = True
+            return False
+        # デコード済みの部分を捨ててから追加する
+        buffer = buffer[position:] + chunk
+        position = 0
+        return True
+
+    def skip(chars: str) -> Optional[str]:
+        """chars に含まれる文字を読み飛ばし、次の文字を返す（終端の場合None）."""
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position] in chars:
+                position += 1
+            if position < len(buffer):
+                return buffer[position]
+            if not fill():
+                return None
+
+    def decode() -> Any:
+        """position から JSON の値を1つデコード（チャンクの境界にまたがる場合は読み足す）.
+
+        数値はバッファの末尾で切れていてもデコードできてしまう（"12" + "34" が 12、
+        "1." + "5" が 1 になる）ため、値の直後に区切り文字が読み込まれるまで読み足して
+        デコードし直す。
+        """
+        nonlocal position
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if not fill():
+                    raise
+                continue
+            if (end < len(buffer) and buffer[end] in _DELIMITERS) or not fill():
+                break
+        position = end
+        return value
+
+    # 配列の開始位置を探す（オブジェクトの場合はトップレベルのキーを順に読み、key 以外の値は読み飛ばす）
+    first = skip(" \t\r\n")
+    if first == "{":
+        position += 1
+        while True:
+            if skip(" \t\r\n,") != '"':
+                raise ValueError(f'Key "{key}" not found in dataset')
+            name = decode()
+            if skip(" \t\r\n") != ":":
+                raise ValueError(f'Expected ":" after "{name}"')
+            position += 1
+            if name == key:
+                break
+            skip(" \t\r\n")
+            decode()
+        first = skip(" \t\r\n")
+    if first != "[":
+        raise ValueError(f"Dataset must be a JSON array or an object with a {key} array")
+    position += 1
+
+    while True:
+        char = skip(" \t\r\n,")
+        if char is None:
+            raise ValueError("Unexpected end of dataset")
+        if char == "]":
+            return
+        yield decode()
+
+
+def _iter_raw(path: Path) -> Iterator[dict]:
+    """データセットのテストケースを順に返す."""
+    reader = _iter_jsonl if _dataset_format(path) == "jsonl" else _iter_json_array
+    with _open_text(path) as f:
+        yield from reader(f)
+
+
+def iter_dataset(
+    path: str,
+    shard: Optional[tuple[int, int]] = None,
+    selection: Optional[DatasetSelection] = None,
+) -> Iterator[tuple[int, dict]]:
+    """データセットのテストケースを1件ずつ返す.
+
+    サンプリングする場合は、選ぶケースを決めるためにデータセットを1回多く読む。
+
+    Args:
+        path: データセットファイル（.json / .jsonl、圧縮可）
+        shard: (i, n) を指定した場合、シャード i に割り当てられたケースのみ
+        selection: タグ式による絞り込みとタグごとのサンプリング
+
+    Yields:
+        (データセット内のインデックス, テストケースデータ)
+    """
+    dataset_path = Path(path)
+    predicate = parse_tag_expression(selection.tags) if selection and selection.tags else None
+
+    def matches(item: dict) -> bool:
+        return predicate is None or predicate(set(item.get("tags") or []))
+
+    sampled: Optional[set[str]] = None
+    if selection is not None and selection.per_tag is not None:
+        sampled = _stratified_keys(
+            (item for item in _iter_raw(dataset_path) if matches(item)),
+            selection.per_tag,
+            selection.seed,
+            selection.strata,
+        )
+
+    for index, item in enumerate(_iter_raw(dataset_path)):
+        if not matches(item):
+            continue
+        key = None
+        if sampled is not None:
+            key = case_key(item)
+            if key not in sampled:
+                continue
+        if shard is not None and shard_of(key or case_key(item), shard[1]) != shard[0]:
+            continue
+        yield index, item
+
+
+def iter_json_array(path: str, key: str) -> Iterator[Any]:
+    """JSON ファイルのトップレベルのキー key の配列を要素ごとに返す（評価レポートの cases など）."""
+    with _open_text(Path(path)) as f:
+        yield from _iter_json_array(f, key)
+
+
+def count_cases(
+    path: str,
+    shard: Optional[tuple[int, int]] = None,
+    selection: Optional[DatasetSelection] = None,
+) -> int:
+    """テストケース数を数える（ストリーミングで読むためメモリは一定）."""
+    return sum(1 for _ in iter_dataset(path, shard, selection))
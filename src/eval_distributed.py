@@ -0,0 +1,392 @@
+"""評価の分散実行（コーディネーター + ワーカープロセス）.
+
+1プロセスの run_evaluation_deepeval.py は、非同期で並行実行しても DeepEval の
+CPU 側の処理（GIL）とプロセスごとの接続数の上限で頭打ちになる。このモジュールは
+データセットをシャードに分け、シャードごとにワーカープロセス
+（run_evaluation_deepeval.py --shard i/n）を起動して結果を1つにまとめる。
+
+主な機能:
+1. シャードごとのワーカープロセス（それぞれ BedrockAgentSDK と BedrockEvaluator を持つ）
+2. 1つの Langfuse 実行: すべてのワーカーに同じ EVAL_RUN_ID を渡す（スコアIDは run_id ごと）
+3. 失敗したシャードのリトライ: 同じ run_id で --resume するため、完了済みのケースは再実行しない
+4. シャードごとのレポートのマージ（ケースは1件ずつ読み出すためメモリ使用量は一定）
+5. 全体の所要時間とシャードごとの所要時間・試行回数の表示
+
+ワーカーはマニフェスト（SQLite、WAL モード）とジャッジキャッシュを共有する。
+LANGFUSE_SPOOL_DIR を設定している場合は、シャードごとのサブディレクトリを使う。
+
+環境変数:
+    EVAL_PROCESSES=4: 同時に実行するワーカープロセス数
+    EVAL_SHARDS=0: シャード数（0 の場合は EVAL_PROCESSES と同じ）
+    EVAL_SHARD_RETRIES=1: 失敗したシャードのリトライ回数
+
+使用例:
+    uv run python src/eval_distributed.py --processes 4 --dataset datasets/regression.jsonl.gz \
+        --report evaluation_report.json
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+try:
+    from src.eval_dataset import (
+        DatasetSelection,
+        add_selection_args,
+        iter_json_array,
+        selection_from_args,
+    )
+    from src.eval_manifest import ReportBuilder
+except ImportError:
+    from eval_dataset import (
+        DatasetSelection,
+        add_selection_args,
+        iter_json_array,
+        selection_from_args,
+    )  # type: ignore
+    from eval_manifest import ReportBuilder  # type: ignore
+
+# ワーカーとして起動するスクリプト
+WORKER_SCRIPT = Path(__file__).with_name("run_evaluation_deepeval.py")
+
+
+@dataclass
+class DistributedConfig:
+    """分散実行の設定."""
+
+    # 同時に実行するワーカープロセス数
+    processes: int = 4
+
+    # シャード数（Noneの場合は processes と同じ。多くすると失敗時の再実行範囲が小さくなる）
+    shards: Optional[int] = None
+
+    # 失敗したシャードのリトライ回数
+    max_shard_retries: int = 1
+
+    # シャードごとのレポートの出力先（{run_id}/shard-{i}.json）
+    shard_report_dir: str = ".eval_cache/shards"
+
+    @property
+    def shard_count(self) -> int:
+        """シャード数."""
+        return max(1, self.shards or self.processes)
+
+    @classmethod
+    def from_env(cls) -> "DistributedConfig":
+        """環境変数から設定を生成."""
+        return cls(
+            processes=int(os.getenv("EVAL_PROCESSES", "4")),
+            shards=int(os.getenv("EVAL_SHARDS", "0")) or None,
+            max_shard_retries=int(os.getenv("EVAL_SHARD_RETRIES", "1")),
+        )
+
+
+@dataclass
+class ShardResult:
+    """1シャードの実行結果."""
+
+    index: int
+    count: int
+    report_path: str
+    attempts: int = 0
+    returncode: Optional[int] = None
+    # 最後の試行の所要時間と、全試行の合計
+    wall_s: float = 0.0
+    total_s: float = 0.0
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        """成功したか."""
+        return self.error is None
+
+    @property
+    def label(self) -> str:
+        """表示用のラベル（i/n）."""
+        return f"{self.index}/{self.count}"
+
+    def to_dict(self) -> dict:
+        """レポート用の辞書."""
+        return {
+            "shard": self.label,
+            "attempts": self.attempts,
+            "returncode": self.returncode,
+            "wall_s": round(self.wall_s, 3),
+            "total_s": round(self.total_s, 3),
+            "error": self.error,
+        }
+
+
+def worker_command(
+    dataset_path: str,
+    shard: ShardResult,
+    resume_run_id: Optional[str],
+    incremental: bool,
+    selection: Optional[DatasetSelection] = None,
+) -> list[str]:
+    """ワーカープロセスのコマンドライン."""
+    command = [
+        sys.executable,
+        str(WORKER_SCRIPT),
+        "--dataset",
+        dataset_path,
+        "--shard",
+        shard.label,
+        "--report",
+        shard.report_path,
+    ]
+    if resume_run_id:
+        command += ["--resume", resume_run_id]
+    if incremental:
+        command.append("--incremental")
+    if selection is not None:
+        # サンプリングはシャーディングの前に行うため、全ワーカーに同じ条件を渡す
+        command += selection.to_args()
+    return command
+
+
+def worker_env(run_id: str, shard_index: int) -> dict:
+    """ワーカープロセスの環境変数."""
+    env = {**os.environ, "EVAL_RUN_ID": run_id, "PYTHONUNBUFFERED": "1"}
+    # トレースのスプールはプロセスごとに分ける（セグメントファイルを共有できないため）
+    if env.get("LANGFUSE_SPOOL_DIR"):
+        env["LANGFUSE_SPOOL_DIR"] = str(Path(env["LANGFUSE_SPOOL_DIR"]) / f"shard-{shard_index}")
+    return env
+
+
+async def run_shard(
+    shard: ShardResult,
+    dataset_path: str,
+    run_id: str,
+    config: DistributedConfig,
+    resume: bool = False,
+    incremental: bool = False,
+    selection: Optional[DatasetSelection] = None,
+) -> ShardResult:
+    """1シャードのワーカープロセスを実行（失敗した場合は --resume でリトライ）.
+
+    Args:
+        shard: シャード（report_path を設定済み）
+        dataset_path: データセットのパス
+        run_id: 評価実行ID（すべてのシャードで共通）
+        config: 分散実行の設定
+        resume: 初回から --resume で実行するか（中断した分散実行の再開）
+        incremental: 変更のない (ケース, メトリクス) の結果を再利用するか
+        selection: タグ式による絞り込みとタグごとのサンプリング
+
+    Returns:
+        shard（結果を書き込んだもの）
+    """
+    for attempt in range(config.max_shard_retries + 1):
+        shard.attempts = attempt + 1
+        Path(shard.report_path).unlink(missing_ok=True)
+        # リトライでは同じ run_id で完了済みのケースを省略する
+        command = worker_command(
+            dataset_path, shard, run_id if resume or attempt else None, incremental, selection
+        )
+        started = time.perf_counter()
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            env=worker_env(run_id, shard.index),
+        )
+        assert process.stdout is not None
+        async for line in process.stdout:
+            print(f"[shard {shard.label}] {line.decode('utf-8', errors='replace').rstrip()}")
+        shard.returncode = await process.wait()
+        shard.wall_s = time.perf_counter() - started
+        shard.total_s += shard.wall_s
+
+        if shard.returncode != 0:
+            shard.error = f"exit code {shard.returncode}"
+        elif not Path(shard.report_path).exists():
+            # ワーカーはケースがすべて失敗した場合にレポートを書かずに終了する
+            # （割り当てられたケースがない場合は空のレポートを書く）
+            shard.error = "no report written"
+        else:
+            shard.error = None
+            return shard
+        retry = " (retrying with --resume)" if attempt < config.max_shard_retries else ""
+        print(f"❌ shard {shard.label} failed: {shard.error}{retry}")
+    return shard
+
+
+def merge_reports(shards: list[ShardResult]) -> ReportBuilder:
+    """成功したシャードのレポートを1つにまとめる.
+
+    Args:
+        shards: run_shard() の結果
+
+    Returns:
+        すべてのケースを追加した ReportBuilder（呼び出し側で close する）
+    """
+    builder = ReportBuilder()
+    for shard in shards:
+        if shard.ok:
+            for case in iter_json_array(shard.report_path, "cases"):
+                builder.add_case(case)
+    return builder
+
+
+async def run_distributed(
+    dataset_path: str,
+    config: Optional[DistributedConfig] = None,
+    report_path: Optional[str] = None,
+    resume_run_id: Optional[str] = None,
+    incremental: bool = False,
+    selection: Optional[DatasetSelection] = None,
+) -> bool:
+    """データセットをシャードに分けてワーカープロセスで評価.
+
+    Args:
+        dataset_path: データセットのパス
+        config: 分散実行の設定（Noneの場合は環境変数から生成）
+        report_path: まとめたレポート（JSON）の出力先（Noneの場合は出力しない）
+        resume_run_id: 中断した分散実行のID（すべてのシャードを --resume で実行）
+        incremental: 変更のない (ケース, メトリクス) の結果を再利用するか
+        selection: タグ式による絞り込みとタグごとのサンプリング
+
+    Returns:
+        すべてのシャードが成功した場合True
+    """
+    config = config or DistributedConfig.from_env()
+    run_id = (
+        resume_run_id
+        or os.getenv("EVAL_RUN_ID")
+        or datetime.now().strftime("eval-%Y%m%d-%H%M%S")
+    )
+    count = config.shard_count
+    report_dir = Path(config.shard_report_dir) / run_id
+    report_dir.mkdir(parents=True, exist_ok=True)
+
+    print("=" * 60)
+    print(f"Distributed evaluation: {count} shards, {config.processes} processes")
+    print("=" * 60)
+    print(f"🏷️  Run ID: {run_id}" + (" (resuming)" if resume_run_id else ""))
+    print(f"📁 Dataset: {dataset_path}")
+    if selection is not None and selection.active:
+        print(f"   Selecting cases ({selection.describe()})")
+
+    semaphore = asyncio.Semaphore(max(1, config.processes))
+
+    async def run(shard: ShardResult) -> ShardResult:
+        async with semaphore:
+            return await run_shard(
+                shard, dataset_path, run_id, config, bool(resume_run_id), incremental, selection
+            )
+
+    started = time.perf_counter()
+    shards = await asyncio.gather(
+        *(
+            run(ShardResult(index, count, str(report_dir / f"shard-{index}.json")))
+            for index in range(count)
+        )
+    )
+    wall_s = time.perf_counter() - started
+
+    report = merge_reports(shards)
+    failed = [shard for shard in shards if not shard.ok]
+    # シャードを1つずつ実行した場合の所要時間（全試行の合計）との比較
+    serial_s = sum(shard.total_s for shard in shards)
+    distributed = {
+        "processes": config.processes,
+        "wall_s": round(wall_s, 3),
+        "serial_s": round(serial_s, 3),
+        "speedup": round(serial_s / wall_s, 2) if wall_s > 0 else None,
+        "shards": [shard.to_dict() for shard in shards],
+    }
+    if report_path:
+        report.write(report_path, run_id=run_id, distributed=distributed)
+    summary = report.summary
+    metric_summaries = report.metrics()
+    report.close()
+
+    print("\n" + "=" * 60)
+    print("分散評価サマリー")
+    print("=" * 60)
+    for shard in shards:
+        status = "✅" if shard.ok else "❌"
+        print(
+            f"  {status} shard {shard.label}: {shard.wall_s:.1f}s"
+            + (f" ({shard.attempts} attempts, {shard.total_s:.1f}s in total)" if shard.attempts > 1 else "")
+            + (f" - {shard.error}" if shard.error else "")
+        )
+    print(
+        f"所要時間: {wall_s:.1f}s (シャードの合計 {serial_s:.1f}s, "
+        f"{distributed['speedup'] or 0:.1f}x, {config.processes} processes)"
+    )
+    print(f"テストケース数: {summary['cases'] - summary['failed']} (失敗 {summary['failed']})")
+    for name, metric_summary in metric_summaries.items():
+        mean = metric_summary["mean"]
+        pass_rate = metric_summary["pass_rate"]
+        print(
+            f"  - {name}: mean {mean:.3f}" if mean is not None else f"  - {name}: mean n/a",
+            f"pass {pass_rate:.0%}" if pass_rate is not None else "",
+            f"(n={metric_summary['count']})",
+        )
+    if report_path:
+        print(f"📄 Report saved to: {report_path}")
+    if failed:
+        print(
+            f"\n❌ {len(failed)}/{count} shards failed. Resume with: "
+            f"uv run python src/eval_distributed.py --resume {run_id} --shards {count}"
+        )
+        return False
+    print(f"\n✅ Distributed evaluation completed (Langfuse run: {run_id})")
+    return True
+
+
+def main():
+    """分散評価のコマンド."""
+    defaults = DistributedConfig.from_env()
+    parser = argparse.ArgumentParser(description="Run the evaluation across worker processes")
+    parser.add_argument(
+        "--dataset",
+        default=os.getenv("EVAL_DATASET", "datasets/evaluation_dataset.json"),
+        help="データセット（.json / .jsonl、.gz / .bz2 / .xz 圧縮可）",
+    )
+    parser.add_argument("--processes", type=int, default=defaults.processes, help="ワーカープロセス数")
+    parser.add_argument(
+        "--shards", type=int, default=defaults.shards, help="シャード数（省略時はプロセス数）"
+    )
+    parser.add_argument(
+        "--retries", type=int, default=defaults.max_shard_retries, help="失敗したシャードのリトライ回数"
+    )
+    add_selection_args(parser)
+    parser.add_argument("--resume", metavar="RUN_ID", default=None, help="中断した分散実行のID")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        default=os.getenv("EVAL_INCREMENTAL", "false").lower() in ("true", "1", "yes"),
+        help="変更のない (ケース, メトリクス) の結果を再利用",
+    )
+    parser.add_argument("--report", default="evaluation_report.json", help="まとめたレポートの出力先")
+    args = parser.parse_args()
+
+    config = DistributedConfig(
+        processes=args.processes,
+        shards=args.shards,
+        max_shard_retries=args.retries,
+    )
+    ok = asyncio.run(
+        run_distributed(
+            args.dataset,
+            config,
+            report_path=args.report,
+            resume_run_id=args.resume,
+            incremental=args.incremental,
+            selection=selection_from_args(args),
+        )
+    )
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,530 @@
+"""インクリメンタル評価のマニフェスト.
+
+データセットやメトリクスは `make eval` の実行ほど頻繁には変わらない。
+このモジュールはテストケースごとにエージェントの出力と各メトリクスのスコアを
+内容ハッシュとともに保存し、前回から変わった部分だけを再実行できるようにする。
+
+主な機能:
+1. 内容ハッシュ（フィンガープリント）
+   - 生成: テストケースの input + エージェント設定（モデル、システムプロンプト、温度、max_tokens）
+   - スコア: テストケース全体 + 出力 + メトリクス定義（名前、基準、閾値、評価用モデル）
+2. 実行計画（plan / plan_case）: 出力を再利用できるケースと、再評価が必要な (ケース, メトリクス) の組
+3. 再利用したスコアと新しいスコアを合わせた全体レポート（ReportBuilder はケースを一時ファイルに
+   書き出すため、ケース数に関係なくメモリ使用量は一定）
+4. SQLite への保存（ケースごとにコミットするため、中断した評価を run_id で再開できる）
+
+環境変数:
+    EVAL_INCREMENTAL=true: 変更のない (ケース, メトリクス) の結果を再利用
+    EVAL_MANIFEST_PATH=.eval_cache/manifest.sqlite: マニフェストファイル
+"""
+
+import hashlib
+import json
+import sqlite3
+import tempfile
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Iterable, Iterator, Optional
+
+MANIFEST_VERSION = 2
+
+# メトリクス定義としてフィンガープリントに含める属性
+_METRIC_ATTRIBUTES = (
+    "name",
+    "criteria",
+    "evaluation_steps",
+    "evaluation_params",
+    "threshold",
+    "strict_mode",
+    "include_reason",
+    "evaluation_model",
+)
+
+
+def stable_hash(value: Any) -> str:
+    """JSON に正規化した値の SHA-256（16進数の先頭16文字）."""
+    payload = json.dumps(value, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def agent_fingerprint(agent: Any) -> str:
+    """エージェント設定のフィンガープリント.
+
+    Args:
+        agent: BedrockAgentSDK
+
+    Returns:
+        ハッシュ
+    """
+    return stable_hash(
+        {
+            "model": getattr(agent, "model", None),
+            "system_prompt": getattr(agent, "system_prompt", None),
+            "temperature": getattr(agent, "temperature", None),
+            "max_tokens": getattr(agent, "max_tokens", None),
+        }
+    )
+
+
+def metric_name(metric: Any) -> str:
+    """メトリクス名（DeepEval の metrics_data.name と同じ値）."""
+    name = getattr(metric, "__name__", None)
+    if isinstance(name, str):
+        return name
+    return getattr(metric, "name", None) or type(metric).__name__
+
+
+def metric_fingerprint(metric: Any) -> str:
+    """メトリクス定義のフィンガープリント（評価用モデルを含む）.
+
+    Args:
+        metric: DeepEval のメトリクス
+
+    Returns:
+        ハッシュ
+    """
+    definition: dict[str, Any] = {"class": type(metric).__name__}
+    for attribute in _METRIC_ATTRIBUTES:
+        value = getattr(metric, attribute, None)
+        if value is not None:
+            definition[attribute] = value
+    model = getattr(metric, "model", None)
+    if model is not None and hasattr(model, "get_model_name"):
+        definition["model"] = model.get_model_name()
+    return stable_hash(definition)
+
+
+def case_key(test_item: dict) -> str:
+    """テストケースのキー（id があれば id、なければ input のハッシュ）."""
+    if test_item.get("id") is not None:
+        return str(test_item["id"])
+    return stable_hash(test_item.get("input"))
+
+
+@dataclass
+class ScoreEntry:
+    """1メトリクスのスコア."""
+
+    name: str
+    score: Optional[float]
+    reason: Optional[str] = None
+    success: Optional[bool] = None
+    threshold: Optional[float] = None
+    metric_hash: str = ""
+    # マニフェストから再利用した場合True（保存しない）
+    reused: bool = False
+
+    def to_dict(self) -> dict:
+        """保存用の辞書."""
+        data = asdict(self)
+        data.pop("reused")
+        return data
+
+
+@dataclass
+class CasePlan:
+    """1テストケースの実行計画と結果."""
+
+    index: int
+    key: str
+    item: dict
+    case_hash: str
+    generation_hash: str
+
+    # 再利用した、または今回生成した出力
+    actual_output: Optional[str] = None
+    trace_id: Optional[str] = None
+    usage: dict = field(default_factory=dict)
+    output_reused: bool = False
+
+    # メトリクス名 -> スコア（再利用分 + 今回の評価分）
+    scores: dict[str, ScoreEntry] = field(default_factory=dict)
+
+    # 評価が必要なメトリクス
+    pending_metrics: list = field(default_factory=list)
+
+    # 今回の実行で使う LLMTestCase（または辞書）
+    test_case: Any = None
+
+    # エージェントの実行に失敗した場合のエラー
+    error: Optional[str] = None
+
+    # 同じ run_id の中断前の実行で完了済み（再開時は生成・採点・送信をすべて省略）
+    resumed: bool = False
+
+    @property
+    def needs_generation(self) -> bool:
+        """エージェントの実行が必要か."""
+        return not self.output_reused
+
+
+class EvalManifest:
+    """テストケースごとの出力・スコアとハッシュを保存するマニフェスト（SQLite）."""
+
+    def __init__(self, path: str = ".eval_cache/manifest.sqlite"):
+        """初期化（ファイルがなければ作成）.
+
+        拡張子が .json の場合（バージョン1の JSON マニフェスト）は、同じ名前の .sqlite を使い、
+        JSON ファイルがあれば初回に取り込む。
+
+        Args:
+            path: マニフェストファイルのパス
+        """
+        legacy_path: Optional[Path] = None
+        self.path = Path(path)
+        if self.path.suffix == ".json":
+            legacy_path, self.path = self.path, self.path.with_suffix(".sqlite")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # シャードごとのプロセスが同じファイルに書き込めるよう WAL モードで開く
+        self._conn = sqlite3.connect(str(self.path), timeout=30.0, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cases ("
+            "key TEXT PRIMARY KEY, run_id TEXT, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)"
+        )
+        self._conn.execute(
+            "INSERT OR IGNORE INTO meta (name, value) VALUES ('version', ?)",
+            (str(MANIFEST_VERSION),),
+        )
+        self._conn.commit()
+        if legacy_path is not None and legacy_path.exists():
+            self._import_legacy(legacy_path)
+
+    def _import_legacy(self, legacy_path: Path):
+        """バージョン1の JSON マニフェストを取り込む（未取り込みのキーのみ）."""
+        data = json.loads(legacy_path.read_text(encoding="utf-8"))
+        if data.get("version") != 1:
+            print(f"⚠️ Ignoring manifest with unsupported version: {legacy_path}")
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO cases (key, run_id, data, updated_at) VALUES (?, NULL, ?, ?)",
+                (
+                    (key, json.dumps(entry, ensure_ascii=False), entry.get("updated_at", 0.0))
+                    for key, entry in data.get("cases", {}).items()
+                ),
+            )
+            self._conn.commit()
+
+    def get(self, key: str) -> Optional[dict]:
+        """ケースのエントリー（run_id を含む）."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT run_id, data FROM cases WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {**json.loads(row[1]), "run_id": row[0]}
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM cases").fetchone()[0]
+
+    def plan_case(
+        self,
+        index: int,
+        item: dict,
+        key: str,
+        agent_hash: str,
+        metric_hashes: dict[str, str],
+        metrics: list,
+        reuse: bool = True,
+        resume_run_id: Optional[str] = None,
+    ) -> CasePlan:
+        """1テストケースの実行計画を作成.
+
+        Args:
+            index: データセット内のインデックス
+            item: テストケースデータ
+            key: ケースのキー（case_key()、重複時は "#n" 付き）
+            agent_hash: agent_fingerprint() の戻り値
+            metric_hashes: メトリクス名 -> metric_fingerprint()
+            metrics: DeepEval のメトリクス
+            reuse: 別の実行の結果も再利用するか（インクリメンタル）
+            resume_run_id: 再開する実行のID（この実行で保存した結果は reuse に関係なく再利用）
+
+        Returns:
+            CasePlan
+        """
+        plan = CasePlan(
+            index=index,
+            key=key,
+            item=item,
+            case_hash=stable_hash(item),
+            generation_hash=stable_hash([item.get("input"), agent_hash]),
+        )
+        entry = self.get(key) if reuse or resume_run_id else None
+        same_run = entry is not None and resume_run_id is not None and entry["run_id"] == resume_run_id
+        if entry and not (reuse or same_run):
+            entry = None
+        if entry and entry.get("generation_hash") == plan.generation_hash:
+            plan.actual_output = entry.get("actual_output")
+            plan.trace_id = entry.get("trace_id")
+            plan.usage = entry.get("usage", {})
+            plan.output_reused = True
+            # 出力とテストケースが同じならスコアも再利用できる
+            if entry.get("case_hash") == plan.case_hash:
+                for name, stored in entry.get("scores", {}).items():
+                    if stored.get("metric_hash") == metric_hashes.get(name):
+                        plan.scores[name] = ScoreEntry(**stored, reused=True)
+        plan.pending_metrics = [m for m in metrics if metric_name(m) not in plan.scores]
+        # 同じ実行で送信まで完了したケース
+        plan.resumed = plan.output_reused and same_run and not plan.pending_metrics
+        return plan
+
+    def iter_plans(
+        self,
+        items: Iterable[tuple[int, dict]],
+        agent_hash: str,
+        metrics: list,
+        reuse: bool = True,
+        resume_run_id: Optional[str] = None,
+        score_hashes: Optional[dict[str, str]] = None,
+    ) -> Iterator[CasePlan]:
+        """(インデックス, テストケースデータ) のストリームから実行計画を順に作成.
+
+        Args:
+            items: eval_dataset.iter_dataset() などの (インデックス, テストケースデータ)
+            agent_hash: agent_fingerprint() の戻り値
+            metrics: DeepEval のメトリクス
+            reuse: マニフェストの結果を再利用するか（False の場合は再開分以外すべて再実行）
+            resume_run_id: 再開する実行のID
+            score_hashes: DeepEval のメトリクス以外で記録するスコアの名前 -> ハッシュ
+                （ツール使用の検証など。ハッシュが同じなら再利用する）
+
+        Yields:
+            CasePlan
+        """
+        metric_hashes = {metric_name(m): metric_fingerprint(m) for m in metrics}
+        metric_hashes.update(score_hashes or {})
+        seen: dict[str, int] = {}
+        for index, item in items:
+            key = case_key(item)
+            # 同じ input のケースが複数ある場合は出現順で区別
+            seen[key] = seen.get(key, 0) + 1
+            if seen[key] > 1:
+                key = f"{key}#{seen[key]}"
+            yield self.plan_case(
+                index, item, key, agent_hash, metric_hashes, metrics, reuse, resume_run_id
+            )
+
+    def plan(
+        self,
+        test_data: list[dict],
+        agent_hash: str,
+        metrics: list,
+        reuse: bool = True,
+    ) -> list[CasePlan]:
+        """実行計画を作成.
+
+        Args:
+            test_data: テストケースデータのリスト
+            agent_hash: agent_fingerprint() の戻り値
+            metrics: DeepEval のメトリクス
+            reuse: マニフェストの結果を再利用するか（False の場合はすべて再実行）
+
+        Returns:
+            test_data と同じ順序の CasePlan のリスト
+        """
+        return list(self.iter_plans(enumerate(test_data), agent_hash, metrics, reuse))
+
+    def record(self, plan: CasePlan, metrics: list, run_id: Optional[str] = None):
+        """ケースの出力とスコアをマニフェストに保存（ケースごとにコミット）.
+
+        スコアが None（評価エラー）のメトリクスは保存せず、次回再評価する。
+
+        Args:
+            plan: 実行済みの CasePlan
+            metrics: 今回のメトリクス（ハッシュの付与に使う）
+            run_id: 評価実行ID（再開時の判定に使う）
+        """
+        if plan.error is not None or plan.actual_output is None or plan.resumed:
+            return
+        metric_hashes = {metric_name(m): metric_fingerprint(m) for m in metrics}
+        scores = {}
+        for name, entry in plan.scores.items():
+            if entry.score is None:
+                continue
+            if not entry.metric_hash:
+                entry.metric_hash = metric_hashes.get(name, "")
+            scores[name] = entry.to_dict()
+        now = time.time()
+        data = {
+            "case_hash": plan.case_hash,
+            "generation_hash": plan.generation_hash,
+            "actual_output": plan.actual_output,
+            "trace_id": plan.trace_id,
+            "usage": plan.usage,
+            "scores": scores,
+            "updated_at": now,
+        }
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cases (key, run_id, data, updated_at) VALUES (?, ?, ?, ?)",
+                (plan.key, run_id, json.dumps(data, ensure_ascii=False), now),
+            )
+            self._conn.commit()
+
+    def save(self):
+        """保存（record() がケースごとにコミットするため互換性のために残す）."""
+        with self._lock:
+            self._conn.commit()
+
+    def close(self):
+        """接続を閉じる."""
+        with self._lock:
+            self._conn.close()
+
+
+class ReportBuilder:
+    """全体レポートをケースごとに積み上げる.
+
+    メトリクスの集計はケースを追加するたびに更新し、ケースごとの結果は一時ファイルに
+    書き出すため、メモリ使用量はケース数に比例しない（保持するのはケースごとの
+    index とファイル位置だけ）。ケースは完了順に追加されるが、レポートでは index 順に並べる。
+    """
+
+    def __init__(self):
+        self._cases = tempfile.TemporaryFile(mode="w+", encoding="utf-8")
+        # (index, 追加順, 一時ファイル内の位置)
+        self._offsets: list[tuple[int, int, int]] = []
+        self._metrics: dict[str, dict] = {}
+        self.summary = {
+            "cases": 0,
+            "failed": 0,
+            "outputs_reused": 0,
+            "scores_reused": 0,
+            "scores_evaluated": 0,
+        }
+
+    def add(self, plan: CasePlan):
+        """実行済みのケースを追加."""
+        self.add_case(
+            {
+                "index": plan.index,
+                "key": plan.key,
+                "input": plan.item.get("input"),
+                "tags": plan.item.get("tags", []),
+                "actual_output": plan.actual_output,
+                "trace_id": plan.trace_id,
+                "output_reused": plan.output_reused,
+                "usage": plan.usage,
+                "error": plan.error,
+                "scores": {
+                    name: {
+                        "score": entry.score,
+                        "success": entry.success,
+                        "reason": entry.reason,
+                        "reused": entry.reused,
+                    }
+                    for name, entry in plan.scores.items()
+                },
+            }
+        )
+
+    def add_case(self, case: dict):
+        """レポートのケース（add() の形式の辞書）を追加.
+
+        シャードごとのレポートを1つにまとめる場合にも使う。
+        """
+        self.summary["cases"] += 1
+        self.summary["failed"] += case.get("error") is not None
+        self.summary["outputs_reused"] += bool(case.get("output_reused"))
+        for name, score in case.get("scores", {}).items():
+            aggregate = self._metrics.setdefault(
+                name, {"count": 0, "sum": 0.0, "judged": 0, "passed": 0, "reused": 0, "errors": 0}
+            )
+            if score.get("score") is None:
+                aggregate["errors"] += 1
+            else:
+                aggregate["count"] += 1
+                aggregate["sum"] += score["score"]
+            if score.get("success") is not None:
+                aggregate["judged"] += 1
+                aggregate["passed"] += bool(score["success"])
+            if score.get("reused"):
+                aggregate["reused"] += 1
+                self.summary["scores_reused"] += 1
+            else:
+                self.summary["scores_evaluated"] += 1
+        position = len(self._offsets)
+        index = case.get("index")
+        self._offsets.append(
+            (index if isinstance(index, int) else position, position, self._cases.tell())
+        )
+        self._cases.write(json.dumps(case, ensure_ascii=False, default=str) + "\n")
+
+    def metrics(self) -> dict:
+        """メトリクスごとの集計（count, mean, pass_rate, reused, errors）."""
+        return {
+            name: {
+                "count": a["count"],
+                "mean": a["sum"] / a["count"] if a["count"] else None,
+                "pass_rate": a["passed"] / a["judged"] if a["judged"] else None,
+                "reused": a["reused"],
+                "errors": a["errors"],
+            }
+            for name, a in self._metrics.items()
+        }
+
+    def iter_cases(self) -> Iterator[dict]:
+        """追加したケースの結果を index 順に返す."""
+        self._cases.flush()
+        try:
+            for _, _, offset in sorted(self._offsets):
+                self._cases.seek(offset)
+                yield json.loads(self._cases.readline())
+        finally:
+            self._cases.seek(0, 2)
+
+    def build(self) -> dict:
+        """ケースを含むレポートの辞書（ケースをメモリに読み込む）."""
+        return {"summary": dict(self.summary), "metrics": self.metrics(), "cases": list(self.iter_cases())}
+
+    def write(self, path: str, **extra: Any):
+        """レポートを JSON で書き出す（ケースは一時ファイルから1件ずつコピー）.
+
+        Args:
+            path: 出力先
+            **extra: レポートに追加するキー（pipeline など）
+        """
+        header = {"summary": self.summary, "metrics": self.metrics(), **extra}
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("{\n")
+            for name, value in header.items():
+                body = json.dumps(value, ensure_ascii=False, indent=2, default=str)
+                f.write(f"  {json.dumps(name)}: " + body.replace("\n", "\n  ") + ",\n")
+            f.write('  "cases": [')
+            for position, case in enumerate(self.iter_cases()):
+                f.write(("," if position else "") + "\n    ")
+                f.write(json.dumps(case, ensure_ascii=False, default=str))
+            f.write("\n  ]\n}\n")
+
+    def close(self):
+        """一時ファイルを削除."""
+        self._cases.close()
+
+
+def build_report(plans: Iterable[CasePlan]) -> dict:
+    """再利用分を含む全体レポートを作成.
+
+    Args:
+        plans: 実行済みの CasePlan
+
+    Returns:
+        {"summary": ..., "metrics": {名前: 集計}, "cases": [...]}
+    """
+    builder = ReportBuilder()
+    try:
+        for plan in plans:
+            builder.add(plan)
+        return builder.build()
+    finally:
+        builder.close()
@@ -0,0 +1,515 @@
+"""評価のパイプライン実行（生成 → 採点 → アップロード）.
+
+全ケースの生成 → deepeval.evaluate → 全スコアのアップロードと段階ごとに待つと、
+各段階の間 Bedrock のスループットが遊ぶ。このモジュールは各テストケースを
+段階間の上限付きキューで流し、生成が終わったケースからすぐに採点し、
+採点が終わったケースからすぐにアップロードする。
+
+主な機能:
+1. Stage: 段階ごとの並行数（ワーカー数）とスキップ条件
+2. 段階間の上限付きキュー（asyncio.Queue）によるバックプレッシャー
+   （後段が詰まると前段のワーカーは put() で待つ。入力はイテレーターでもよく、
+   処理中のアイテム数はキューの上限とワーカー数で決まる）
+3. measure_metrics: メトリクスの a_measure() による1ケース単位の採点
+   （メトリクスは状態を持つため、ケースごとに浅いコピーを使う）
+4. 段階ごとの処理件数・稼働時間・最大キュー深さの統計
+5. MetricScheduler: メトリクス単位の並行数の制御（全体の上限と、メトリクス名または
+   ジャッジプロンプトの形によるグループごとの上限）と、メトリクスごとのレイテンシの内訳
+
+全体の所要時間は「各段階の合計」ではなく、おおよそ最も遅い段階の所要時間になる。
+
+環境変数:
+    EVAL_SCORE_WORKERS=8: 並行して採点するテストケース数
+    EVAL_UPLOAD_WORKERS=1: 並行してスコアを投入するワーカー数
+    EVAL_QUEUE_SIZE=16: 段階間のキューの上限
+    EVAL_METRIC_WORKERS=0: 全ケースで同時に実行するメトリクス評価数の上限（0 で無制限）
+    EVAL_METRIC_LIMITS: メトリクス名またはグループごとの上限
+        （例: "Faithfulness=4,GEval(actual_output,input)=6"）
+"""
+
+import asyncio
+import copy
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Iterable, Optional
+
+try:
+    from src.metrics_registry import HdrHistogram
+except ImportError:
+    from metrics_registry import HdrHistogram  # type: ignore
+
+# 段階の終了を後段に伝える番兵
+_DONE = object()
+
+
+@dataclass
+class PipelineConfig:
+    """パイプラインの設定（生成の並行数は EvalRunnerConfig.workers）."""
+
+    # 並行して採点するテストケース数
+    score_workers: int = 8
+
+    # 並行してスコアを投入するワーカー数
+    upload_workers: int = 1
+
+    # 段階間のキューの上限
+    queue_size: int = 16
+
+    # 全ケースで同時に実行するメトリクス評価数の上限（0 で無制限）
+    metric_workers: int = 0
+
+    # メトリクス名またはグループ（metric_group()）ごとの上限
+    metric_limits: dict[str, int] = field(default_factory=dict)
+
+    @classmethod
+    def from_env(cls) -> "PipelineConfig":
+        """環境変数から設定を生成."""
+        return cls(
+            score_workers=int(os.getenv("EVAL_SCORE_WORKERS", "8")),
+            upload_workers=int(os.getenv("EVAL_UPLOAD_WORKERS", "1")),
+            queue_size=int(os.getenv("EVAL_QUEUE_SIZE", "16")),
+            metric_workers=int(os.getenv("EVAL_METRIC_WORKERS", "0")),
+            metric_limits=parse_metric_limits(os.getenv("EVAL_METRIC_LIMITS", "")),
+        )
+
+
+def parse_metric_limits(value: str) -> dict[str, int]:
+    """"名前=上限,..." 形式の上限を解析.
+
+    Args:
+        value: 例 "Faithfulness=4,GEval(actual_output,input)=6"
+            （グループ名はカンマを含むため、"=数値" の直後のカンマで区切る）
+
+    Returns:
+        メトリクス名またはグループ -> 上限
+    """
+    limits: dict[str, int] = {}
+    rest = value.strip()
+    while rest:
+        name, sep, tail = rest.partition("=")
+        if not sep:
+            raise ValueError(f"Invalid metric limit (expected name=N): {rest!r}")
+        number, _, rest = tail.partition(",")
+        limits[name.strip()] = int(number)
+        rest = rest.strip()
+    return limits
+
+
+@dataclass
+class Stage:
+    """パイプラインの1段階."""
+
+    name: str
+    fn: Callable[[Any], Awaitable[None]]
+    workers: int = 1
+    # True を返すアイテムは処理せずに後段へ渡す
+    skip: Optional[Callable[[Any], bool]] = None
+
+
+@dataclass
+class StageStats:
+    """段階ごとの統計."""
+
+    name: str
+    workers: int
+    items: int = 0
+    processed: int = 0
+    errors: int = 0
+    busy_s: float = 0.0
+    max_queue_depth: int = 0
+    first_started: Optional[float] = None
+    last_finished: Optional[float] = None
+
+    @property
+    def active_s(self) -> float:
+        """最初の処理開始から最後の処理終了までの秒数."""
+        if self.first_started is None or self.last_finished is None:
+            return 0.0
+        return self.last_finished - self.first_started
+
+    def to_dict(self) -> dict:
+        """表示・レポート用の辞書."""
+        return {
+            "name": self.name,
+            "workers": self.workers,
+            "items": self.items,
+            "processed": self.processed,
+            "errors": self.errors,
+            "busy_s": round(self.busy_s, 3),
+            "active_s": round(self.active_s, 3),
+            "max_queue_depth": self.max_queue_depth,
+        }
+
+
+async def run_pipeline(
+    items: Iterable,
+    stages: list[Stage],
+    queue_size: int = 16,
+    on_complete: Optional[Callable[[Any], None]] = None,
+) -> list[StageStats]:
+    """アイテムを段階の順に流す.
+
+    各段階で例外が発生したアイテムも後段へ渡す（後段の skip で除外する）。
+
+    Args:
+        items: 処理するアイテム（CasePlan など。必要になった時点で1件ずつ取り出す）
+        stages: 段階のリスト（先頭から順に処理）
+        queue_size: 段階間のキューの上限
+        on_complete: 最後の段階を終えたアイテムごとに呼ぶ関数
+
+    Returns:
+        段階ごとの統計
+    """
+    queues: list[asyncio.Queue] = [asyncio.Queue(maxsize=queue_size) for _ in stages]
+    stats = [StageStats(stage.name, max(1, stage.workers)) for stage in stages]
+
+    async def feed():
+        for item in items:
+            await queues[0].put(item)
+        for _ in range(stats[0].workers):
+            await queues[0].put(_DONE)
+
+    async def worker(position: int):
+        stage, stage_stats, queue = stages[position], stats[position], queues[position]
+        while True:
+            stage_stats.max_queue_depth = max(stage_stats.max_queue_depth, queue.qsize())
+            item = await queue.get()
+            if item is _DONE:
+                return
+            stage_stats.items += 1
+            if stage.skip is None or not stage.skip(item):
+                started = time.perf_counter()
+                if stage_stats.first_started is None:
+                    stage_stats.first_started = started
+                try:
+                    await stage.fn(item)
+                except Exception as e:
+                    stage_stats.errors += 1
+                    print(f"   ⚠️ {stage.name} failed: {type(e).__name__}: {e}")
+                finished = time.perf_counter()
+                stage_stats.busy_s += finished - started
+                stage_stats.last_finished = finished
+                stage_stats.processed += 1
+            if position + 1 < len(stages):
+                await queues[position + 1].put(item)
+            elif on_complete is not None:
+                on_complete(item)
+
+    async def run_stage(position: int):
+        await asyncio.gather(*(worker(position) for _ in range(stats[position].workers)))
+        if position + 1 < len(stages):
+            for _ in range(stats[position + 1].workers):
+                await queues[position + 1].put(_DONE)
+
+    await asyncio.gather(feed(), *(run_stage(i) for i in range(len(stages))))
+    return stats
+
+
+@dataclass
+class MetricResult:
+    """1メトリクスの採点結果."""
+
+    name: str
+    score: Optional[float]
+    reason: Optional[str] = None
+    success: Optional[bool] = None
+    threshold: Optional[float] = None
+    error: Optional[str] = None
+    latency_s: float = 0.0
+    # 並行数の上限で待った秒数（latency_s には含まない）
+    wait_s: float = 0.0
+
+
+async def measure_metric(metric: Any, name: str, test_case: Any) -> MetricResult:
+    """1メトリクスで1ケースを採点.
+
+    メトリクスは score / reason を自身の属性に書き込むため、並行実行では
+    ケースごとの浅いコピーを使う（評価用モデルなどは共有）。
+
+    Args:
+        metric: DeepEval のメトリクス
+        name: メトリクス名
+        test_case: LLMTestCase
+
+    Returns:
+        MetricResult（失敗した場合は score=None, error 付き）
+    """
+    instance = copy.copy(metric)
+    started = time.perf_counter()
+    try:
+        await instance.a_measure(test_case)
+    except Exception as e:
+        return MetricResult(
+            name=name,
+            score=None,
+            threshold=getattr(metric, "threshold", None),
+            error=f"{type(e).__name__}: {e}",
+            latency_s=time.perf_counter() - started,
+        )
+    success = getattr(instance, "success", None)
+    if success is None and hasattr(instance, "is_successful"):
+        try:
+            success = instance.is_successful()
+        except Exception:
+            success = None
+    return MetricResult(
+        name=name,
+        score=getattr(instance, "score", None),
+        reason=getattr(instance, "reason", None),
+        success=success,
+        threshold=getattr(instance, "threshold", None),
+        latency_s=time.perf_counter() - started,
+    )
+
+
+async def measure_metrics(
+    metrics: list[Any],
+    names: list[str],
+    test_case: Any,
+    scheduler: Optional["MetricScheduler"] = None,
+) -> list[MetricResult]:
+    """1ケースを複数のメトリクスで並行して採点.
+
+    Args:
+        metrics: DeepEval のメトリクス
+        names: メトリクス名（metrics と同じ順序）
+        test_case: LLMTestCase
+        scheduler: 並行数の上限とレイテンシの記録（Noneの場合は制限しない）
+
+    Returns:
+        metrics と同じ順序の MetricResult のリスト
+    """
+    if scheduler is not None:
+        return await scheduler.measure(metrics, names, test_case)
+    return await asyncio.gather(
+        *(measure_metric(metric, name, test_case) for metric, name in zip(metrics, names))
+    )
+
+
+def metric_group(metric: Any) -> str:
+    """ジャッジプロンプトの形によるメトリクスのグループ.
+
+    同じクラスのメトリクスは同じプロンプトテンプレートを使う。GEval は基準ごとに
+    名前が異なるが、評価に使うフィールド（evaluation_params）が同じならプロンプトの
+    形と長さがそろうため、同じグループにまとめる。
+
+    Args:
+        metric: DeepEval のメトリクス
+
+    Returns:
+        例: "Faithfulness", "GEval(actual_output,input)"
+    """
+    group = type(metric).__name__
+    if group.endswith("Metric"):
+        group = group[: -len("Metric")]
+    params = getattr(metric, "evaluation_params", None)
+    if params:
+        fields = sorted(str(getattr(param, "value", param)) for param in params)
+        group += f"({','.join(fields)})"
+    return group
+
+
+class _MetricLatency:
+    """メトリクス（またはグループ）ごとのレイテンシの集計."""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_s = 0.0
+        self.wait_s = 0.0
+        # ケースの中で最も遅かった回数と、その時間の合計（ケースの採点時間を決めた時間）
+        self.slowest = 0
+        self.critical_s = 0.0
+
+
+class MetricScheduler:
+    """メトリクス単位の並行数の制御とレイテンシの内訳.
+
+    ケース単位の並行数（PipelineConfig.score_workers）とは別に、全ケースで同時に
+    実行するメトリクス評価数と、メトリクス名またはグループごとの同時実行数を制限する。
+    1ケースのメトリクスは並行して評価するため、ケースの採点時間は最も遅い
+    メトリクスで決まる。breakdown() はメトリクスごとに、その回数と時間を集計する。
+    """
+
+    def __init__(self, max_concurrent: int = 0, limits: Optional[dict[str, int]] = None):
+        """初期化.
+
+        Args:
+            max_concurrent: 全体の上限（0 で無制限）
+            limits: メトリクス名またはグループ -> 上限（名前の指定を優先）
+        """
+        self.max_concurrent = max_concurrent
+        self.limits = dict(limits or {})
+        self._global = asyncio.Semaphore(max_concurrent) if max_concurrent > 0 else None
+        self._semaphores: dict[str, asyncio.Semaphore] = {}
+        self._groups: dict[str, str] = {}
+        self._latency: dict[str, _MetricLatency] = {}
+        # p50 / p95 は HDR ヒストグラムで計算（ケース数によらずメモリは一定）
+        self._histogram = HdrHistogram("metric_latency_s", "Metric latency", ("metric",))
+
+    @classmethod
+    def from_config(cls, config: PipelineConfig) -> "MetricScheduler":
+        """パイプラインの設定から生成."""
+        return cls(config.metric_workers, config.metric_limits)
+
+    def _limit_key(self, name: str, group: str) -> Optional[str]:
+        """上限を適用するキー（メトリクス名 → グループの順に探す）."""
+        if name in self.limits:
+            return name
+        if group in self.limits:
+            return group
+        return None
+
+    def _semaphore(self, key: str) -> asyncio.Semaphore:
+        semaphore = self._semaphores.get(key)
+        if semaphore is None:
+            semaphore = self._semaphores[key] = asyncio.Semaphore(max(1, self.limits[key]))
+        return semaphore
+
+    async def _measure_one(self, metric: Any, name: str, test_case: Any) -> MetricResult:
+        group = self._groups.setdefault(name, metric_group(metric))
+        key = self._limit_key(name, group)
+        started = time.perf_counter()
+        # グループの上限 → 全体の上限の順に取得（全体の枠を待ち行列で占有しない）
+        if key is not None:
+            await self._semaphore(key).acquire()
+        try:
+            if self._global is not None:
+                await self._global.acquire()
+            try:
+                wait_s = time.perf_counter() - started
+                result = await measure_metric(metric, name, test_case)
+            finally:
+                if self._global is not None:
+                    self._global.release()
+        finally:
+            if key is not None:
+                self._semaphore(key).release()
+        result.wait_s = wait_s
+        return result
+
+    async def measure(self, metrics: list[Any], names: list[str], test_case: Any) -> list[MetricResult]:
+        """1ケースを複数のメトリクスで並行して採点し、レイテンシを記録.
+
+        Args:
+            metrics: DeepEval のメトリクス
+            names: メトリクス名（metrics と同じ順序）
+            test_case: LLMTestCase
+
+        Returns:
+            metrics と同じ順序の MetricResult のリスト
+        """
+        results = await asyncio.gather(
+            *(self._measure_one(metric, name, test_case) for metric, name in zip(metrics, names))
+        )
+        self._record(results)
+        return results
+
+    def _record(self, results: list[MetricResult]):
+        """1ケース分の結果を集計."""
+        if not results:
+            return
+        slowest = max(results, key=lambda r: r.wait_s + r.latency_s)
+        for result in results:
+            latency = self._latency.setdefault(result.name, _MetricLatency())
+            latency.count += 1
+            latency.errors += result.error is not None
+            latency.total_s += result.latency_s
+            latency.wait_s += result.wait_s
+            self._histogram.observe(result.latency_s, (result.name,))
+        latency = self._latency[slowest.name]
+        latency.slowest += 1
+        latency.critical_s += slowest.wait_s + slowest.latency_s
+
+    def breakdown(self) -> list[dict]:
+        """メトリクスごとのレイテンシの内訳（ケースの採点時間を決めた時間の長い順）.
+
+        Returns:
+            [{name, group, limit, count, errors, mean_s, p50_s, p95_s, wait_s,
+              total_s, slowest, critical_s, critical_share}, ...]
+        """
+        critical_total = sum(latency.critical_s for latency in self._latency.values())
+        rows = []
+        for name, latency in self._latency.items():
+            group = self._groups.get(name, name)
+            summary = self._histogram.summary((name,))
+            key = self._limit_key(name, group)
+            rows.append(
+                {
+                    "name": name,
+                    "group": group,
+                    "limit": self.limits[key] if key is not None else None,
+                    "count": latency.count,
+                    "errors": latency.errors,
+                    "mean_s": latency.total_s / latency.count if latency.count else 0.0,
+                    "p50_s": summary.get("p50", 0.0),
+                    "p95_s": summary.get("p95", 0.0),
+                    "wait_s": latency.wait_s,
+                    "total_s": latency.total_s,
+                    "slowest": latency.slowest,
+                    "critical_s": latency.critical_s,
+                    "critical_share": latency.critical_s / critical_total if critical_total else 0.0,
+                }
+            )
+        rows.sort(key=lambda row: (-row["critical_s"], -row["total_s"]))
+        return rows
+
+    def groups(self) -> dict[str, list[str]]:
+        """グループ -> メトリクス名."""
+        result: dict[str, list[str]] = {}
+        for name, group in self._groups.items():
+            result.setdefault(group, []).append(name)
+        return result
+
+
+def format_metric_breakdown(rows: list[dict]) -> list[str]:
+    """メトリクスごとのレイテンシの内訳の表示行.
+
+    Args:
+        rows: MetricScheduler.breakdown() の戻り値
+
+    Returns:
+        表示行のリスト
+    """
+    lines = []
+    for row in rows:
+        lines.append(
+            f"  - {row['name']:<28} "
+            + (f"[{row['group']}] " if row["group"] != row["name"] else "")
+            + f"p50 {row['p50_s']:5.1f}s p95 {row['p95_s']:5.1f}s "
+            f"total {row['total_s']:7.1f}s, slowest in {row['slowest']} cases "
+            f"({row['critical_share']:.0%} of scoring wall time)"
+            + (f", waited {row['wait_s']:.1f}s (limit {row['limit']})" if row["limit"] else "")
+            + (f", waited {row['wait_s']:.1f}s" if not row["limit"] and row["wait_s"] >= 0.05 else "")
+            + (f", errors {row['errors']}" if row["errors"] else "")
+        )
+    return lines
+
+
+def format_stage_stats(stats: list[StageStats], wall_s: float) -> list[str]:
+    """段階ごとの統計の表示行.
+
+    Args:
+        stats: run_pipeline() の戻り値
+        wall_s: パイプライン全体の所要時間（秒）
+
+    Returns:
+        表示行のリスト
+    """
+    lines = []
+    for stage in stats:
+        utilization = stage.busy_s / (wall_s * stage.workers) if wall_s > 0 else 0.0
+        lines.append(
+            f"  - {stage.name:<8} {stage.processed:>5} processed, busy {stage.busy_s:7.1f}s "
+            f"({stage.workers} workers, {utilization:.0%} utilized), "
+            f"max queue {stage.max_queue_depth}"
+            + (f", errors {stage.errors}" if stage.errors else "")
+        )
+    # 段階を順番に実行した場合は各段階の稼働期間の合計になる
+    serial = sum(stage.active_s for stage in stats)
+    lines.append(
+        f"  wall clock {wall_s:.1f}s (stages active {serial:.1f}s in total, "
+        f"overlap saved ≈{max(0.0, serial - wall_s):.1f}s)"
+    )
+    return lines
@@ -0,0 +1,224 @@
+"""評価テストケースの並行実行.
+
+テストケースを1件ずつ await すると、データセット全体の実行時間は
+各ケースのレイテンシの合計になる。run_evaluation_deepeval のパイプラインは
+generate 段階で EVAL_WORKERS 件ずつ並行してエージェントを実行し、
+1件ごとの実行と集計にこのモジュールを使う。
+
+主な機能:
+1. run_test_case: ケースごとのタイムアウトと指数バックオフ付きリトライ
+2. ケースごとのレイテンシ・TTFT・トークン使用量・キャッシュヒット率の記録
+   （metrics_registry.collect_request_metrics でそのケースのリクエストだけを集計）
+3. RunSummary: 実行結果を1件ずつ集計（件数、レイテンシの分位点、トークン合計）
+
+環境変数:
+    EVAL_WORKERS=4: 並行して実行するテストケース数
+    EVAL_CASE_TIMEOUT_S=300: 1回の実行のタイムアウト（秒、0 で無制限）
+    EVAL_CASE_RETRIES=1: タイムアウト・エラー時のリトライ回数
+
+使用例:
+    result = await run_test_case(run_case, test_item, index, EvalRunnerConfig(timeout_s=120))
+    summary = RunSummary()
+    summary.add(result)
+    summary.to_dict()
+"""
+
+import asyncio
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Optional
+
+try:
+    from src.metrics_registry import collect_request_metrics
+except ImportError:
+    from metrics_registry import collect_request_metrics  # type: ignore
+
+# run_case(test_item, index) -> (LLMTestCase または辞書, trace_id)
+RunCase = Callable[[dict, int], Awaitable[tuple[Any, str]]]
+
+
+@dataclass
+class EvalRunnerConfig:
+    """テストケース実行の設定."""
+
+    # 並行して実行するテストケース数
+    workers: int = 4
+
+    # 1回の実行のタイムアウト（秒、Noneの場合は無制限）
+    timeout_s: Optional[float] = 300.0
+
+    # タイムアウト・エラー時のリトライ回数と初回の待ち時間（以降は2倍ずつ）
+    max_retries: int = 1
+    backoff_s: float = 2.0
+
+    # 進捗を表示する間隔（完了件数、0 で表示しない）
+    progress_every: int = 1
+
+    @classmethod
+    def from_env(cls) -> "EvalRunnerConfig":
+        """環境変数から設定を生成."""
+        timeout = float(os.getenv("EVAL_CASE_TIMEOUT_S", "300"))
+        return cls(
+            workers=int(os.getenv("EVAL_WORKERS", "4")),
+            timeout_s=timeout if timeout > 0 else None,
+            max_retries=int(os.getenv("EVAL_CASE_RETRIES", "1")),
+        )
+
+
+@dataclass
+class CaseResult:
+    """1テストケースの実行結果."""
+
+    index: int
+    test_case: Any = None
+    trace_id: Optional[str] = None
+
+    # 成功した実行のレイテンシ（秒、リトライの待ち時間を含まない）
+    latency_s: float = 0.0
+    # 最初のリクエストの最初のテキストチャンクまでの時間（ミリ秒）
+    ttft_ms: Optional[float] = None
+    attempts: int = 0
+    error: Optional[str] = None
+
+    # 成功した実行のトークン使用量（AgentMetrics の合計）
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cache_read_tokens: int = 0
+    cache_write_tokens: int = 0
+    cost_usd: Optional[float] = None
+
+    # 失敗した試行のエラー（リトライで成功した場合も残す）
+    attempt_errors: list[str] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        """成功したか."""
+        return self.error is None and self.test_case is not None
+
+    @property
+    def cache_hit_ratio(self) -> Optional[float]:
+        """入力トークンのうちキャッシュから読み込んだ割合（入力がない場合None）."""
+        prompt_tokens = self.input_tokens + self.cache_read_tokens + self.cache_write_tokens
+        return self.cache_read_tokens / prompt_tokens if prompt_tokens else None
+
+    def usage(self) -> dict:
+        """レイテンシ・トークン使用量の辞書（LLMTestCase の additional_metadata 用）."""
+        cache_hit_ratio = self.cache_hit_ratio
+        return {
+            "latency_s": round(self.latency_s, 3),
+            "ttft_ms": round(self.ttft_ms, 1) if self.ttft_ms is not None else None,
+            "attempts": self.attempts,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "cache_read_tokens": self.cache_read_tokens,
+            "cache_write_tokens": self.cache_write_tokens,
+            "cache_hit_ratio": round(cache_hit_ratio, 4) if cache_hit_ratio is not None else None,
+            "cost_usd": self.cost_usd,
+        }
+
+
+def _attach_usage(result: CaseResult):
+    """レイテンシ・トークン使用量をテストケースに付ける."""
+    usage = result.usage()
+    test_case = result.test_case
+    if isinstance(test_case, dict):
+        test_case.update(usage)
+    elif test_case is not None:
+        metadata = getattr(test_case, "additional_metadata", None) or {}
+        test_case.additional_metadata = {**metadata, **usage}
+
+
+async def run_test_case(
+    run_case: RunCase,
+    test_item: dict,
+    index: int,
+    config: EvalRunnerConfig,
+) -> CaseResult:
+    """1テストケースをタイムアウト・リトライ付きで実行.
+
+    Args:
+        run_case: 1テストケースを実行するコルーチン関数（test_item, index）
+        test_item: テストケースデータ
+        index: データセット内のインデックス
+        config: 実行設定
+
+    Returns:
+        CaseResult（失敗した場合は error が設定される）
+    """
+    result = CaseResult(index=index)
+    for attempt in range(config.max_retries + 1):
+        result.attempts = attempt + 1
+        started = time.perf_counter()
+        try:
+            with collect_request_metrics() as collected:
+                result.test_case, result.trace_id = await asyncio.wait_for(
+                    run_case(test_item, index), timeout=config.timeout_s
+                )
+        except asyncio.TimeoutError:
+            error = f"timeout after {config.timeout_s:.0f}s"
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        else:
+            result.latency_s = time.perf_counter() - started
+            result.error = None
+            result.ttft_ms = collected.ttft_ms[0] if collected.ttft_ms else None
+            result.input_tokens = sum(m.input_tokens for m in collected)
+            result.output_tokens = sum(m.output_tokens for m in collected)
+            result.cache_read_tokens = sum(m.cache_read_input_tokens for m in collected)
+            result.cache_write_tokens = sum(
+                m.cache_creation_input_tokens for m in collected
+            )
+            costs = [m.total_cost_usd for m in collected if m.total_cost_usd is not None]
+            result.cost_usd = sum(costs) if costs else None
+            _attach_usage(result)
+            return result
+
+        result.error = error
+        result.attempt_errors.append(error)
+        if attempt < config.max_retries:
+            await asyncio.sleep(config.backoff_s * (2**attempt))
+    return result
+
+
+class RunSummary:
+    """実行結果を1件ずつ集計する（CaseResult を保持しない）."""
+
+    def __init__(self):
+        self.cases = 0
+        self.retried = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        # 分位点の計算のため成功したケースのレイテンシだけを保持する
+        self._latencies: list[float] = []
+
+    def add(self, result: CaseResult):
+        """1件の実行結果を追加."""
+        self.cases += 1
+        if result.attempts > 1:
+            self.retried += 1
+        if result.ok:
+            self._latencies.append(result.latency_s)
+            self.input_tokens += result.input_tokens
+            self.output_tokens += result.output_tokens
+
+    def to_dict(self) -> dict:
+        """集計の辞書."""
+        latencies = sorted(self._latencies)
+
+        def percentile(q: float) -> float:
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+        return {
+            "cases": self.cases,
+            "succeeded": len(latencies),
+            "failed": self.cases - len(latencies),
+            "retried": self.retried,
+            "latency_p50_s": percentile(0.5),
+            "latency_p95_s": percentile(0.95),
+            "latency_max_s": latencies[-1] if latencies else 0.0,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+        }
@@ -0,0 +1,381 @@
+"""評価実行の逐次検定による早期終了.
+
+プロンプトやモデルの2つのバリアントを比較するとき、データセットの一部で結論が
+出ていても全件を評価しがちである。このモジュールはケースをランダムな順序で評価し、
+メトリクスごとの信頼区間を逐次更新して、結論が統計的に確定した時点
+（または予算を使い切った時点）で評価を打ち切る。
+
+主な機能:
+1. 比較の対象
+   - ベースラインのレポートがある場合: 同じケースのスコアとの差（対応のある比較）の平均。
+     区間が 0 を含まなければ better / worse、±margin に収まれば equivalent
+   - ない場合: スコアの平均とメトリクスの閾値の比較（区間が閾値より上なら pass、下なら fail）
+2. 信頼区間: 正規近似（NumPy がある場合はブートストラップ）
+3. 群逐次検定: check_every 件ごとに判定し、有意水準を予定した判定回数で分割する
+   （Bonferroni。何度も途中で見ることによる第1種の過誤の増加を抑える）
+4. 予算: 最大ケース数・最大コスト（USD）
+5. 打ち切った時点のケース数・信頼水準・メトリクスごとの区間のレポート
+
+環境変数:
+    EVAL_SEQUENTIAL=false: 逐次検定による早期終了を有効にする
+    EVAL_SEQ_BASELINE: 比較するベースラインの評価レポート（JSON）
+    EVAL_SEQ_ALPHA=0.05: 有意水準（判定回数で分割する前）
+    EVAL_SEQ_CHECK_EVERY=10: 判定の間隔（完了ケース数）
+    EVAL_SEQ_MIN_CASES=20: 判定を始める最小ケース数
+    EVAL_SEQ_MAX_CASES: 最大ケース数（省略時はデータセット全体）
+    EVAL_SEQ_MAX_COST_USD: 最大コスト（USD）
+    EVAL_SEQ_MARGIN=0.02: 差がこの範囲に収まれば equivalent とみなす
+    EVAL_SEQ_SEED=0: 評価順序のシード
+"""
+
+import math
+import os
+import random
+import threading
+from dataclasses import dataclass
+from statistics import NormalDist
+from typing import Optional
+
+try:
+    import numpy as np
+
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+try:
+    from src.eval_dataset import iter_json_array
+except ImportError:
+    from eval_dataset import iter_json_array  # type: ignore
+
+# ブートストラップの反復回数
+_BOOTSTRAP_ITERATIONS = 2000
+
+# 小さいほど良いメトリクス（DeepEval ではスコアが閾値以下で成功）
+LOWER_IS_BETTER = frozenset({"Hallucination", "Bias", "Toxicity"})
+
+
+@dataclass
+class SequentialConfig:
+    """逐次検定の設定."""
+
+    enabled: bool = False
+
+    # 比較するベースラインの評価レポート（Noneの場合はメトリクスの閾値と比較）
+    baseline_report: Optional[str] = None
+
+    # 有意水準（予定した判定回数で分割する前）
+    alpha: float = 0.05
+
+    # 判定の間隔と、判定を始める最小ケース数
+    check_every: int = 10
+    min_cases: int = 20
+
+    # 予算（Noneの場合は制限しない）
+    max_cases: Optional[int] = None
+    max_cost_usd: Optional[float] = None
+
+    # 差がこの範囲に収まれば equivalent とみなす（ベースライン比較）
+    margin: float = 0.02
+
+    # 評価順序のシード
+    seed: int = 0
+
+    # 判定に使うメトリクス（Noneの場合はスコアのあるすべてのメトリクス）
+    metrics: Optional[list[str]] = None
+
+    # NumPy がある場合にブートストラップで区間を求めるか
+    bootstrap: bool = True
+
+    @classmethod
+    def from_env(cls) -> "SequentialConfig":
+        """環境変数から設定を生成."""
+        max_cases = os.getenv("EVAL_SEQ_MAX_CASES")
+        max_cost = os.getenv("EVAL_SEQ_MAX_COST_USD")
+        return cls(
+            enabled=os.getenv("EVAL_SEQUENTIAL", "false").lower() in ("true", "1", "yes"),
+            baseline_report=os.getenv("EVAL_SEQ_BASELINE") or None,
+            alpha=float(os.getenv("EVAL_SEQ_ALPHA", "0.05")),
+            check_every=int(os.getenv("EVAL_SEQ_CHECK_EVERY", "10")),
+            min_cases=int(os.getenv("EVAL_SEQ_MIN_CASES", "20")),
+            max_cases=int(max_cases) if max_cases else None,
+            max_cost_usd=float(max_cost) if max_cost else None,
+            margin=float(os.getenv("EVAL_SEQ_MARGIN", "0.02")),
+            seed=int(os.getenv("EVAL_SEQ_SEED", "0")),
+        )
+
+
+def load_baseline_scores(report_path: str) -> dict[str, dict[str, float]]:
+    """ベースラインのレポートからケースごとのスコアを読み込む.
+
+    Args:
+        report_path: 評価レポート（JSON）
+
+    Returns:
+        ケースのキー -> メトリクス名 -> スコア
+    """
+    scores: dict[str, dict[str, float]] = {}
+    for case in iter_json_array(report_path, "cases"):
+        if case.get("error") is not None:
+            continue
+        values = {
+            name: entry["score"]
+            for name, entry in (case.get("scores") or {}).items()
+            if entry.get("score") is not None
+        }
+        if values:
+            scores[case["key"]] = values
+    return scores
+
+
+def shuffled(items: list, seed: int) -> list:
+    """シード固定でシャッフルしたリスト."""
+    items = list(items)
+    random.Random(seed).shuffle(items)
+    return items
+
+
+def confidence_interval(
+    values: list[float], alpha: float, bootstrap: bool = True, seed: int = 0
+) -> tuple[float, float, float]:
+    """平均の両側 (1 - alpha) 信頼区間.
+
+    Args:
+        values: 観測値
+        alpha: 有意水準
+        bootstrap: NumPy がある場合にブートストラップ（パーセンタイル法）を使うか
+        seed: ブートストラップの乱数シード
+
+    Returns:
+        (平均, 下限, 上限)
+    """
+    n = len(values)
+    mean = sum(values) / n
+    if bootstrap and NUMPY_AVAILABLE and n >= 2:
+        rng = np.random.default_rng(seed)
+        samples = np.asarray(values, dtype=float)
+        means = samples[rng.integers(0, n, size=(_BOOTSTRAP_ITERATIONS, n))].mean(axis=1)
+        low, high = np.quantile(means, [alpha / 2, 1 - alpha / 2])
+        return mean, float(low), float(high)
+    if n < 2:
+        return mean, -math.inf, math.inf
+    variance = sum((v - mean) ** 2 for v in values) / (n - 1)
+    radius = NormalDist().inv_cdf(1 - alpha / 2) * math.sqrt(variance / n)
+    return mean, mean - radius, mean + radius
+
+
+class SequentialMonitor:
+    """完了したケースのスコアから逐次的に判定し、打ち切りを決める（スレッドセーフ）."""
+
+    def __init__(
+        self,
+        config: SequentialConfig,
+        total_cases: int,
+        baseline_scores: Optional[dict[str, dict[str, float]]] = None,
+        thresholds: Optional[dict[str, float]] = None,
+    ):
+        """初期化.
+
+        Args:
+            config: 逐次検定の設定
+            total_cases: 評価対象のケース数（予定した判定回数の計算に使う）
+            baseline_scores: load_baseline_scores() の戻り値（Noneの場合は閾値と比較）
+            thresholds: メトリクス名 -> 閾値（閾値との比較に使う）
+        """
+        self.config = config
+        self.baseline_scores = baseline_scores
+        self.thresholds = thresholds or {}
+        self.planned_cases = min(total_cases, config.max_cases or total_cases)
+        # 予定した判定回数で有意水準を分割（Bonferroni）
+        self.planned_looks = max(
+            1,
+            math.ceil(
+                max(0, self.planned_cases - config.min_cases) / max(1, config.check_every)
+            )
+            + 1,
+        )
+        self.alpha_per_look = config.alpha / self.planned_looks
+        self._lock = threading.Lock()
+        self._values: dict[str, list[float]] = {}
+        self.cases = 0
+        self.unpaired = 0
+        self.looks = 0
+        self.stopped = False
+        self.reason: Optional[str] = None
+        self.stopped_at: Optional[int] = None
+        # 打ち切った時点の区間と判定
+        self.at_stop: dict[str, dict] = {}
+
+    @property
+    def comparing(self) -> bool:
+        """ベースラインと比較しているか."""
+        return self.baseline_scores is not None
+
+    def observe(self, key: str, scores: dict[str, Optional[float]]):
+        """完了したケースのスコアを追加.
+
+        打ち切った後に完了した（投入済みだった）ケースも最終的な区間に含める。
+
+        Args:
+            key: ケースのキー
+            scores: メトリクス名 -> スコア
+        """
+        with self._lock:
+            self.cases += 1
+            baseline = None
+            if self.baseline_scores is not None:
+                baseline = self.baseline_scores.get(key)
+                if baseline is None:
+                    self.unpaired += 1
+                    return
+            for name, score in scores.items():
+                if score is None or (self.config.metrics and name not in self.config.metrics):
+                    continue
+                if baseline is not None:
+                    if name not in baseline:
+                        continue
+                    value = score - baseline[name]
+                elif name in self.thresholds:
+                    value = score
+                else:
+                    continue
+                self._values.setdefault(name, []).append(value)
+
+    def _decide(self, name: str, low: float, high: float) -> str:
+        """区間から判定."""
+        lower_is_better = name in LOWER_IS_BETTER
+        if self.comparing:
+            if -self.config.margin <= low and high <= self.config.margin:
+                return "equivalent"
+            if low > 0:
+                return "worse" if lower_is_better else "better"
+            if high < 0:
+                return "better" if lower_is_better else "worse"
+            return "undecided"
+        threshold = self.thresholds[name]
+        if lower_is_better:
+            if high <= threshold:
+                return "pass"
+            if low > threshold:
+                return "fail"
+        else:
+            if low >= threshold:
+                return "pass"
+            if high < threshold:
+                return "fail"
+        return "undecided"
+
+    def intervals(self, alpha: Optional[float] = None) -> dict[str, dict]:
+        """メトリクスごとの区間と判定.
+
+        Args:
+            alpha: 有意水準（Noneの場合は1回の判定あたりの有意水準）
+
+        Returns:
+            メトリクス名 -> {n, mean, low, high, decision}
+        """
+        alpha = self.alpha_per_look if alpha is None else alpha
+        with self._lock:
+            snapshot = {name: list(values) for name, values in self._values.items()}
+        result = {}
+        for name, values in snapshot.items():
+            mean, low, high = confidence_interval(
+                values, alpha, self.config.bootstrap, self.config.seed
+            )
+            result[name] = {
+                "n": len(values),
+                "mean": mean,
+                "low": low,
+                "high": high,
+                "decision": self._decide(name, low, high),
+            }
+        return result
+
+    def check(self, cost_usd: float = 0.0) -> bool:
+        """打ち切るかを判定（ケースが完了するたびに呼ぶ）.
+
+        Args:
+            cost_usd: ここまでのコスト（USD）
+
+        Returns:
+            打ち切る場合True
+        """
+        if self.stopped:
+            return True
+        config = self.config
+        reason = None
+        if config.max_cases is not None and self.cases >= config.max_cases:
+            reason = f"budget: {config.max_cases} cases"
+        elif config.max_cost_usd is not None and cost_usd >= config.max_cost_usd:
+            reason = f"budget: ${config.max_cost_usd:.2f}"
+        elif self.cases >= config.min_cases and (
+            (self.cases - config.min_cases) % max(1, config.check_every) == 0
+        ):
+            self.looks += 1
+            intervals = self.intervals()
+            if intervals and all(i["decision"] != "undecided" for i in intervals.values()):
+                reason = "settled"
+        if reason is not None:
+            self.stopped = True
+            self.reason = reason
+            self.stopped_at = self.cases
+            self.at_stop = self.intervals()
+        return self.stopped
+
+    def report(self) -> dict:
+        """打ち切った時点（または最後）の判定のレポート."""
+        intervals = self.intervals()
+        return {
+            "mode": "baseline" if self.comparing else "threshold",
+            "stopped": self.stopped,
+            "reason": self.reason or "completed",
+            "stopped_at_cases": self.stopped_at,
+            "evaluated_cases": self.cases,
+            "planned_cases": self.planned_cases,
+            "unpaired_cases": self.unpaired,
+            "looks": self.looks,
+            "planned_looks": self.planned_looks,
+            # 1回の判定あたりの信頼水準と、全判定を通した信頼水準（Bonferroni による下限）
+            "confidence_per_look": 1 - self.alpha_per_look,
+            "confidence_overall": 1 - self.config.alpha,
+            "method": "bootstrap" if self.config.bootstrap and NUMPY_AVAILABLE else "normal",
+            # 打ち切った時点の判定と、投入済みのケースを含めた最終的な区間
+            "at_stop": self.at_stop,
+            "metrics": intervals,
+        }
+
+
+def format_sequential(report: dict) -> list[str]:
+    """逐次検定のレポートの表示行.
+
+    Args:
+        report: SequentialMonitor.report() の戻り値
+
+    Returns:
+        表示行のリスト
+    """
+    if report["stopped"]:
+        head = (
+            f"  Stopped at {report['stopped_at_cases']}/{report['planned_cases']} cases "
+            f"({report['reason']})"
+        )
+    else:
+        head = f"  Completed all {report['evaluated_cases']} cases without a settled decision"
+    lines = [
+        head
+        + f", {report['evaluated_cases']} evaluated including in-flight cases, "
+        f"look {report['looks']}/{report['planned_looks']}, "
+        f"{report['confidence_per_look']:.2%} CI per look "
+        f"({report['confidence_overall']:.0%} overall, {report['method']})"
+    ]
+    if report["unpaired_cases"]:
+        lines.append(f"  ({report['unpaired_cases']} cases not in the baseline were ignored)")
+    label = "Δ vs baseline" if report["mode"] == "baseline" else "mean"
+    # 打ち切った場合は打ち切りの根拠になった時点の区間を表示
+    for name, interval in (report["at_stop"] or report["metrics"]).items():
+        lines.append(
+            f"  - {name}: {label} {interval['mean']:+.3f} "
+            f"[{interval['low']:+.3f}, {interval['high']:+.3f}] (n={interval['n']}) "
+            f"→ {interval['decision']}"
+        )
+    return lines
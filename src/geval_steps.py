@@ -0,0 +1,276 @@
+"""GEval の評価ステップの永続化.
+
+GEval メトリクスを criteria（評価基準の文章）だけで定義すると、DeepEval は
+採点の前に評価用LLMを1回呼び出して criteria を評価ステップに変換する。
+この呼び出しは実行ごと・プロセスごと（分散評価ではワーカーごと）に発生し、
+生成されるステップが実行ごとに揺れるため、スコアの再現性も下がる。
+このモジュールは生成した評価ステップを (criteria, evaluation_params, 評価用モデル) の
+ハッシュをキーにファイルへ保存し、以降の実行ではメトリクスに設定して生成を省略する。
+
+主な機能:
+1. GEvalStepsCache: 評価ステップの JSON ファイル（書き込みはアトミック、
+   複数プロセスが同時に保存しても他のエントリーを消さない）
+2. apply_cached_steps: GEval メトリクスに保存済みのステップを設定し、
+   ないものだけ生成して保存
+3. 明示的な再生成コマンド（make eval-geval-steps）
+
+評価ステップはメトリクスのフィンガープリント（eval_manifest）に含まれるため、
+再生成してステップが変わったメトリクスはインクリメンタル評価でも再採点される。
+
+環境変数:
+    GEVAL_STEPS_ENABLED=true: 保存済みのステップを使うか（false で毎回 DeepEval が生成）
+    GEVAL_STEPS_PATH=.eval_cache/geval_steps.json: 評価ステップのファイル
+        （リポジトリにコミットするとチーム・CI で同じステップを使える）
+
+使用例:
+    # 足りないステップだけ生成
+    uv run python src/geval_steps.py
+
+    # すべて再生成（criteria を変えずにステップを作り直す）
+    uv run python src/geval_steps.py --regenerate
+"""
+
+import argparse
+import inspect
+import json
+import os
+import tempfile
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Optional
+
+try:
+    from src.eval_manifest import metric_name, stable_hash
+except ImportError:
+    from eval_manifest import metric_name, stable_hash  # type: ignore
+
+# ファイル形式のバージョン
+GEVAL_STEPS_VERSION = 1
+
+DEFAULT_STEPS_PATH = ".eval_cache/geval_steps.json"
+
+
+def is_geval(metric: Any) -> bool:
+    """criteria から評価ステップを生成する GEval メトリクスか."""
+    return type(metric).__name__ == "GEval" and bool(getattr(metric, "criteria", None))
+
+
+def evaluator_name(metric: Any) -> str:
+    """メトリクスの評価用モデルの名前."""
+    model = getattr(metric, "model", None)
+    if model is not None and hasattr(model, "get_model_name"):
+        return model.get_model_name()
+    return str(getattr(metric, "evaluation_model", None) or model)
+
+
+def steps_key(metric: Any) -> str:
+    """評価ステップのキー（criteria・evaluation_params・評価用モデルのハッシュ）.
+
+    evaluation_params はステップ生成のプロンプトに含まれるため、キーにも含める。
+    """
+    params = [
+        str(getattr(param, "value", param)) for param in getattr(metric, "evaluation_params", None) or []
+    ]
+    return stable_hash(
+        {"criteria": metric.criteria, "evaluation_params": params, "model": evaluator_name(metric)}
+    )
+
+
+class GEvalStepsCache:
+    """評価ステップのファイル（キー -> ステップ）."""
+
+    def __init__(self, path: str = DEFAULT_STEPS_PATH):
+        """初期化.
+
+        Args:
+            path: JSON ファイルのパス（存在しない場合は保存時に作成）
+        """
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self.entries: dict[str, dict] = self._load()
+
+    def _load(self) -> dict[str, dict]:
+        """ファイルからエントリーを読み込む（ない場合・バージョンが違う場合は空）."""
+        if not self.path.exists():
+            return {}
+        data = json.loads(self.path.read_text(encoding="utf-8"))
+        if data.get("geval_steps_version") != GEVAL_STEPS_VERSION:
+            return {}
+        return data.get("entries", {})
+
+    def get(self, key: str) -> Optional[list[str]]:
+        """保存済みの評価ステップ（ない場合はNone）."""
+        entry = self.entries.get(key)
+        return list(entry["steps"]) if entry else None
+
+    def put(self, key: str, metric: Any, steps: list[str]):
+        """評価ステップを追加（save() で書き込む）.
+
+        Args:
+            key: steps_key() の戻り値
+            metric: GEval メトリクス
+            steps: 評価ステップ
+        """
+        with self._lock:
+            self.entries[key] = {
+                "name": metric_name(metric),
+                "model": evaluator_name(metric),
+                "criteria": metric.criteria,
+                "steps": list(steps),
+                "generated_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            }
+
+    def save(self):
+        """ファイルにアトミックに書き込む.
+
+        他のプロセスが先に保存したエントリーは残す（同じキーは自分の値で上書き）。
+        """
+        with self._lock:
+            entries = {**self._load(), **self.entries}
+            self.entries = entries
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            payload = json.dumps(
+                {"geval_steps_version": GEVAL_STEPS_VERSION, "entries": entries},
+                ensure_ascii=False,
+                indent=2,
+                sort_keys=True,
+            )
+            fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    f.write(payload)
+                os.replace(tmp_path, self.path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+
+
+def generate_steps(metric: Any, bypass_judge_cache: bool = False) -> list[str]:
+    """DeepEval に評価ステップを生成させる.
+
+    Args:
+        metric: GEval メトリクス（evaluation_steps は None にしておく）
+        bypass_judge_cache: 評価用モデルのジャッジキャッシュを使わずに生成するか
+            （再生成で前回と同じ応答が返らないようにする）
+
+    Returns:
+        評価ステップ
+    """
+    generate = getattr(metric, "_generate_evaluation_steps", None)
+    if generate is None:
+        raise RuntimeError(f"{type(metric).__name__} cannot generate evaluation steps")
+    model = getattr(metric, "model", None)
+    judge_cache = getattr(model, "judge_cache", None) if bypass_judge_cache else None
+    if judge_cache is not None:
+        model.judge_cache = None
+    # 新しい DeepEval は multimodal 引数が必須（古いバージョンは引数なし）
+    kwargs = {"multimodal": False} if "multimodal" in inspect.signature(generate).parameters else {}
+    try:
+        return list(generate(**kwargs))
+    finally:
+        if judge_cache is not None:
+            model.judge_cache = judge_cache
+
+
+def apply_cached_steps(
+    metrics: list[Any],
+    cache: GEvalStepsCache,
+    generate: bool = True,
+    regenerate: bool = False,
+) -> dict[str, int]:
+    """GEval メトリクスに保存済みの評価ステップを設定.
+
+    evaluation_steps を明示したメトリクスはそのまま使う。
+
+    Args:
+        metrics: DeepEval のメトリクス（GEval 以外は無視）
+        cache: 評価ステップのファイル
+        generate: 保存されていないステップを生成して保存するか
+            （False の場合は DeepEval が採点時に生成する）
+        regenerate: 保存済みのステップも生成し直すか
+
+    Returns:
+        {"reused": 件数, "generated": 件数, "failed": 件数}
+    """
+    stats = {"reused": 0, "generated": 0, "failed": 0}
+    for metric in metrics:
+        if not is_geval(metric) or getattr(metric, "evaluation_steps", None):
+            continue
+        key = steps_key(metric)
+        steps = None if regenerate else cache.get(key)
+        if steps is not None:
+            metric.evaluation_steps = steps
+            stats["reused"] += 1
+            continue
+        if not generate:
+            continue
+        try:
+            steps = generate_steps(metric, bypass_judge_cache=regenerate)
+        except Exception as e:
+            stats["failed"] += 1
+            print(f"   ⚠️ {metric_name(metric)}: failed to generate evaluation steps: {e}")
+            continue
+        metric.evaluation_steps = steps
+        cache.put(key, metric, steps)
+        stats["generated"] += 1
+    if stats["generated"]:
+        cache.save()
+    return stats
+
+
+_default_cache: Optional[GEvalStepsCache] = None
+
+
+def get_default_steps_cache() -> Optional[GEvalStepsCache]:
+    """既定の評価ステップのファイル（GEVAL_STEPS_ENABLED=false の場合はNone）."""
+    global _default_cache
+    if os.getenv("GEVAL_STEPS_ENABLED", "true").lower() in ("false", "0", "no"):
+        return None
+    if _default_cache is None:
+        _default_cache = GEvalStepsCache(os.getenv("GEVAL_STEPS_PATH", DEFAULT_STEPS_PATH))
+    return _default_cache
+
+
+def main():
+    """評価ステップを生成して保存（--regenerate ですべて生成し直す）."""
+    parser = argparse.ArgumentParser(description="GEval の評価ステップを生成して保存")
+    parser.add_argument(
+        "--path",
+        default=os.getenv("GEVAL_STEPS_PATH", DEFAULT_STEPS_PATH),
+        help="評価ステップのファイル",
+    )
+    parser.add_argument(
+        "--regenerate",
+        action="store_true",
+        help="保存済みのステップも生成し直す（ジャッジキャッシュを使わない）",
+    )
+    args = parser.parse_args()
+
+    try:
+        from src.run_evaluation_deepeval import create_custom_metrics
+    except ImportError:
+        from run_evaluation_deepeval import create_custom_metrics  # type: ignore
+
+    metrics = create_custom_metrics()
+    if not metrics:
+        print("❌ No GEval metrics (is DeepEval installed?)")
+        return
+    cache = GEvalStepsCache(args.path)
+    stats = apply_cached_steps(metrics, cache, regenerate=args.regenerate)
+    for metric in metrics:
+        if not is_geval(metric):
+            continue
+        print(f"\n📝 {metric_name(metric)} ({evaluator_name(metric)}, key {steps_key(metric)})")
+        for number, step in enumerate(metric.evaluation_steps or [], 1):
+            print(f"   {number}. {step}")
+    print(
+        f"\n✅ {stats['generated']} generated, {stats['reused']} reused, "
+        f"{stats['failed']} failed → {args.path}"
+    )
+    if stats["failed"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
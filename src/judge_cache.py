@@ -0,0 +1,253 @@
+"""評価用LLM（ジャッジ）のレスポンスキャッシュ.
+
+評価を再実行すると、変更のないテストケースでも同じジャッジプロンプトで
+Bedrock を呼び直す。このモジュールはレスポンスを内容アドレス（プロンプト等のハッシュ）で
+SQLite に保存し、同じ呼び出しにはキャッシュから応答する。
+
+主な機能:
+1. キャッシュキー: model_id / temperature / max_tokens / プロンプト / スキーマ（JSON Schema）の SHA-256
+2. SQLite バックエンド（プロセスをまたいで再利用、WAL モード）
+3. structured output は Pydantic モデルの辞書として保存し、取り出し時に検証して復元
+4. ヒット / ミス数と、ヒットで節約したトークン数の統計
+
+環境変数:
+    JUDGE_CACHE_ENABLED=true: キャッシュを使うか（false で無効）
+    JUDGE_CACHE_PATH=.judge_cache/judge.sqlite: キャッシュファイル
+
+使用例:
+    cache = JudgeCache(".judge_cache/judge.sqlite")
+    evaluator = BedrockEvaluator(judge_cache=cache)
+    ...
+    cache.stats()  # {"hits": 1320, "misses": 80, "hit_rate": 0.94, ...}
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS judge_responses (
+    key TEXT PRIMARY KEY,
+    model_id TEXT NOT NULL,
+    schema_name TEXT,
+    response TEXT NOT NULL,
+    input_tokens INTEGER NOT NULL DEFAULT 0,
+    output_tokens INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL
+);
+"""
+
+
+def _schema_fingerprint(schema: Optional[type]) -> Optional[dict]:
+    """スキーマの JSON Schema（フィールドが変わればキーも変わる）."""
+    if schema is None:
+        return None
+    if hasattr(schema, "model_json_schema"):
+        return schema.model_json_schema()
+    if hasattr(schema, "schema"):
+        # Pydantic v1
+        return schema.schema()
+    return {"name": f"{schema.__module__}.{schema.__qualname__}"}
+
+
+def cache_key(
+    model_id: str,
+    temperature: float,
+    max_tokens: int,
+    prompt: str,
+    schema: Optional[type] = None,
+) -> str:
+    """キャッシュキーを生成.
+
+    Args:
+        model_id: Bedrock モデルID
+        temperature: サンプリング温度
+        max_tokens: 最大トークン数（出力の打ち切りが変わるためキーに含める）
+        prompt: プロンプト
+        schema: Pydantic モデル（structured output の場合）
+
+    Returns:
+        SHA-256 の16進数文字列
+    """
+    payload = json.dumps(
+        {
+            "model_id": model_id,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "prompt": prompt,
+            "schema": _schema_fingerprint(schema),
+        },
+        ensure_ascii=False,
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _dump(value: Any) -> str:
+    """レスポンスを JSON 文字列に変換（Pydantic モデルは辞書にする）."""
+    if hasattr(value, "model_dump"):
+        value = value.model_dump(mode="json")
+    elif hasattr(value, "dict") and not isinstance(value, dict):
+        value = value.dict()
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _load(response: str, schema: Optional[type]) -> Any:
+    """JSON 文字列からレスポンスを復元."""
+    value = json.loads(response)
+    if schema is None:
+        return value
+    if hasattr(schema, "model_validate"):
+        return schema.model_validate(value)
+    return schema(**value)
+
+
+class JudgeCache:
+    """SQLite に保存するジャッジのレスポンスキャッシュ（スレッドセーフ）."""
+
+    def __init__(self, path: str = ".judge_cache/judge.sqlite"):
+        """初期化.
+
+        Args:
+            path: SQLite ファイルのパス
+        """
+        self.path = path
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30.0, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+
+        # 統計
+        self.hits = 0
+        self.misses = 0
+        self.saved_input_tokens = 0
+        self.saved_output_tokens = 0
+
+    def get(self, key: str, schema: Optional[type] = None) -> tuple[bool, Any]:
+        """キャッシュを参照.
+
+        Args:
+            key: cache_key() の戻り値
+            schema: 復元する Pydantic モデル
+
+        Returns:
+            (ヒットした場合True, レスポンス)
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, input_tokens, output_tokens FROM judge_responses WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return False, None
+        try:
+            value = _load(row[0], schema)
+        except Exception:
+            # スキーマの検証に失敗した（モデル定義が変わった等）場合はミスとして扱う
+            with self._lock:
+                self.misses += 1
+            return False, None
+        with self._lock:
+            self.hits += 1
+            self.saved_input_tokens += row[1]
+            self.saved_output_tokens += row[2]
+        return True, value
+
+    def put(
+        self,
+        key: str,
+        model_id: str,
+        value: Any,
+        schema: Optional[type] = None,
+        input_tokens: int = 0,
+        output_tokens: int = 0,
+    ):
+        """レスポンスを保存.
+
+        Args:
+            key: cache_key() の戻り値
+            model_id: Bedrock モデルID
+            value: レスポンス（テキストまたは Pydantic モデルインスタンス）
+            schema: Pydantic モデル
+            input_tokens: 元の呼び出しの入力トークン
+            output_tokens: 元の呼び出しの出力トークン
+        """
+        response = _dump(value)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO judge_responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    model_id,
+                    schema.__name__ if schema is not None else None,
+                    response,
+                    input_tokens,
+                    output_tokens,
+                    time.time(),
+                ),
+            )
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM judge_responses").fetchone()[0]
+
+    def clear(self):
+        """キャッシュを削除."""
+        with self._lock:
+            self._conn.execute("DELETE FROM judge_responses")
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        """ヒット / ミス数と節約したトークン数を返す."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "saved_input_tokens": self.saved_input_tokens,
+            "saved_output_tokens": self.saved_output_tokens,
+            "entries": len(self),
+        }
+
+    def close(self):
+        """接続を閉じる."""
+        with self._lock:
+            self._conn.close()
+
+
+_default_cache: Optional[JudgeCache] = None
+_default_cache_configured = False
+
+
+def configure_judge_cache(cache: Optional[JudgeCache] = None):
+    """既定のジャッジキャッシュを設定.
+
+    以降に作成される BedrockEvaluator（judge_cache 未指定）が使う。
+
+    Args:
+        cache: キャッシュ（Noneの場合はキャッシュを使わない）
+    """
+    global _default_cache, _default_cache_configured
+    _default_cache = cache
+    _default_cache_configured = True
+
+
+def get_default_judge_cache() -> Optional[JudgeCache]:
+    """既定のジャッジキャッシュを返す（未設定の場合は環境変数から作成）."""
+    global _default_cache, _default_cache_configured
+    if not _default_cache_configured:
+        _default_cache_configured = True
+        if os.getenv("JUDGE_CACHE_ENABLED", "true").lower() not in ("false", "0", "no"):
+            _default_cache = JudgeCache(
+                os.getenv("JUDGE_CACHE_PATH", ".judge_cache/judge.sqlite")
+            )
+    return _default_cache
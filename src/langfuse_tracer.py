@@ -10,8 +10,18 @@
 5. session_id / user_id のネイティブサポート
 6. ルートトレースによるスパン紐付け
 7. エラー時のスタックトレース記録
+8. 非同期バッチエクスポート（LANGFUSE_EXPORT_MODE=async）
+9. ヘッド/テールサンプリング（非同期モードで有効）
+10. ペイロードのサイズ制限・切り詰め・BlobStore への退避
+11. no-op モード（LANGFUSE_TRACING_ENABLED=false）: Langfuse SDK に一切触れない
+12. ローカルエクスポート（JSONL + SQLite、LANGFUSE_EXPORT_LOCAL_DIR）
+13. メトリクスレジストリ（metrics_registry）へのトレース数・エクスポート状況の記録
+14. contextvars による現在のスパンの伝播と、リクエストごとの未終了スパン管理（span_context）
+15. Langfuse が遅延・停止した場合のディスクスプールへの退避と復旧後の再送（LANGFUSE_SPOOL_DIR）
 """
 
+import atexit
+import os
 import traceback as tb
 from contextlib import contextmanager
 from dataclasses import dataclass, field
@@ -22,18 +32,123 @@ from claude_agent_sdk.types import ResultMessage
 # Load environment variables BEFORE initializing Langfuse
 load_dotenv()
 
-from langfuse import get_client
+try:
+    # When running from project root
+    from src.trace_export import (
+        BatchExportProcessor,
+        ExportConfig,
+        FanoutExportProcessor,
+        LangfuseExporter,
+        RecordingClient,
+        SpanExporter,
+    )
+    from src.trace_local_export import (
+        JsonlFileExporter,
+        SqliteExporter,
+    )
+    from src.metrics_registry import REGISTRY
+    from src.span_context import (
+        LEAK_ROOT_ENDED,
+        SpanRegistry,
+        start_leak_detector,
+        use_span,
+    )
+    from src.trace_spool import DiskSpool, SpoolConfig
+    from src.trace_sampling import (
+        GUARDRAIL_INTERVENED,
+        SamplingConfig,
+        TraceSampler,
+    )
+    from src.trace_payload import (
+        FIELD_GENERATION_INPUT,
+        FIELD_GENERATION_OUTPUT,
+        FIELD_INPUT,
+        FIELD_OUTPUT,
+        FIELD_TOOL_INPUT,
+        BlobStore,
+        PayloadLimiter,
+        PayloadPolicy,
+        create_blob_store,
+    )
+except ImportError:
+    # When running from src directory
+    from trace_export import (  # type: ignore
+        BatchExportProcessor,
+        ExportConfig,
+        FanoutExportProcessor,
+        LangfuseExporter,
+        RecordingClient,
+        SpanExporter,
+    )
+    from trace_local_export import (  # type: ignore
+        JsonlFileExporter,
+        SqliteExporter,
+    )
+    from metrics_registry import REGISTRY  # type: ignore
+    from span_context import (  # type: ignore
+        LEAK_ROOT_ENDED,
+        SpanRegistry,
+        start_leak_detector,
+        use_span,
+    )
+    from trace_spool import DiskSpool, SpoolConfig  # type: ignore
+    from trace_sampling import (  # type: ignore
+        GUARDRAIL_INTERVENED,
+        SamplingConfig,
+        TraceSampler,
+    )
+    from trace_payload import (  # type: ignore
+        FIELD_GENERATION_INPUT,
+        FIELD_GENERATION_OUTPUT,
+        FIELD_INPUT,
+        FIELD_OUTPUT,
+        FIELD_TOOL_INPUT,
+        BlobStore,
+        PayloadLimiter,
+        PayloadPolicy,
+        create_blob_store,
+    )
 
-# Initialize Langfuse client (after dotenv is loaded)
-_langfuse = get_client()
+# Langfuse client（初回使用時に初期化。no-op モードでは初期化しない）
+_langfuse: Any = None
+
+# トレーシングの有効/無効（LANGFUSE_TRACING_ENABLED=false で no-op モード）
+_tracing_enabled = os.getenv("LANGFUSE_TRACING_ENABLED", "true").lower() not in (
+    "false",
+    "0",
+    "no",
+)
+
+# 非同期エクスポート用プロセッサー（configure_export() で設定）
+_export_processor: Any = None  # BatchExportProcessor または FanoutExportProcessor
+_sampler: Optional[TraceSampler] = None
+
+# ペイロード制限（configure_payloads() で変更可能）
+_payload_policy = PayloadPolicy.from_env()
+_blob_store: Optional[BlobStore] = create_blob_store(_payload_policy)
+
+# トレーシングのメトリクス
+_TRACES = REGISTRY.counter(
+    "langfuse_traces_total", "Root traces started by LangfuseTracer", ("name",)
+)
+_TOOL_SPANS = REGISTRY.counter(
+    "langfuse_tool_spans_total", "Tool spans started by LangfuseTracer", ("tool",)
+)
+_TRACE_ERRORS = REGISTRY.counter(
+    "langfuse_trace_errors_total", "Root traces that ended with an error", ("name",)
+)
 
 # Application version
 APP_VERSION = "1.2.0"  # Langfuse分離版
 
 
-@dataclass
+@dataclass(slots=True)
 class AgentMetrics:
-    """Claude Agent SDKから取得したメトリクス."""
+    """Claude Agent SDKから取得したメトリクス.
+
+    リクエストごとに生成されるため __slots__ でインスタンスを小さくしている。
+    大量に保持して集計する場合は metrics_store.MetricsStore に追記する。
+    """
 
     # トークン使用量（ResultMessage.usageから取得）
     input_tokens: int = 0
@@ -182,6 +297,202 @@ class TracingConfig:
         return base_tags
 
 
+def _get_langfuse() -> Any:
+    """Langfuse クライアントを取得（初回呼び出し時に接続）."""
+    global _langfuse
+    if _langfuse is None:
+        from langfuse import get_client
+
+        _langfuse = get_client()
+    return _langfuse
+
+
+def is_tracing_enabled() -> bool:
+    """トレーシングが有効か."""
+    return _tracing_enabled
+
+
+def configure_tracing(enabled: bool):
+    """トレーシングの有効/無効を切り替え.
+
+    無効の場合、create_tracer() とエージェントは NOOP_TRACER を使う。
+
+    Args:
+        enabled: 有効にする場合True
+    """
+    global _tracing_enabled
+    _tracing_enabled = enabled
+
+
+def _build_exporters(config: ExportConfig) -> list[SpanExporter]:
+    """設定からエクスポーターを生成."""
+    exporters: list[SpanExporter] = []
+    if config.export_to_langfuse:
+        exporters.append(LangfuseExporter(_get_langfuse()))
+    if config.local_dir:
+        exporters.append(JsonlFileExporter(f"{config.local_dir}/jsonl"))
+        exporters.append(SqliteExporter(f"{config.local_dir}/spans.sqlite"))
+    return exporters
+
+
+def _warn_sampling_ignored(sampling: SamplingConfig):
+    """同期モードではサンプリングが無効であることを警告."""
+    if sampling.rate < 1.0:
+        print(
+            f"⚠️  Trace sampling (rate={sampling.rate}) is ignored in sync export mode; "
+            "set LANGFUSE_EXPORT_MODE=async to enable it"
+        )
+
+
+def _create_spool(directory: Optional[str]) -> Optional[DiskSpool]:
+    """ディスクスプールを生成（ディレクトリがない場合None）."""
+    return DiskSpool(SpoolConfig.from_env(directory)) if directory else None
+
+
+def configure_export(
+    config: Optional[ExportConfig] = None,
+    sampling: Optional[SamplingConfig] = None,
+    exporters: Optional[list[SpanExporter]] = None,
+) -> Optional[BatchExportProcessor]:
+    """トレースのエクスポート方式を設定.
+
+    mode="async" の場合、スパンはメモリ上のキューに積まれ、
+    バックグラウンドワーカーがバッチで送信する（Langfuse / ローカルファイル）。
+    リクエストごとの flush() は行わない。
+    config.spool_dir を指定した場合、送信が滞ったスパンはディスクスプールに退避される。
+    エクスポーターが複数の場合はエクスポーターごとにキュー・再送・スプール
+    （<spool_dir>/<エクスポーター名>）を持つ FanoutExportProcessor を使う。
+    サンプリングは非同期モードでのみ有効（同期モードでサンプリングを設定すると警告を表示）。
+    どちらのモードでも、処理が止まったリクエストの未終了スパンを最大保持時間で終了する
+    スイーパー（span_context.start_leak_detector）を開始する。
+
+    Args:
+        config: エクスポート設定（Noneの場合は環境変数から生成）
+        sampling: サンプリング設定（Noneの場合は環境変数から生成）
+        exporters: 送信先エクスポーター（Noneの場合は config から生成）
+
+    Returns:
+        非同期モードの場合は BatchExportProcessor（エクスポーターが複数の場合は
+        FanoutExportProcessor）、同期モードの場合はNone
+    """
+    global _export_processor, _sampler
+    config = config or ExportConfig.from_env()
+    sampling = sampling or SamplingConfig.from_env()
+
+    if _export_processor is not None:
+        _export_processor.shutdown()
+        _export_processor = None
+
+    if config.mode == "async":
+        exporters = exporters if exporters is not None else _build_exporters(config)
+        if not exporters:
+            raise ValueError("No trace exporter configured")
+        if len(exporters) == 1:
+            _export_processor = BatchExportProcessor(
+                exporters[0], config, _create_spool(config.spool_dir)
+            )
+        else:
+            # 再送・スプールはエクスポーターごと（Langfuse の失敗でローカルに再送しない）
+            processors: dict[str, BatchExportProcessor] = {}
+            for exporter in exporters:
+                name = exporter.name
+                if name in processors:
+                    name = f"{name}-{len(processors)}"
+                spool_dir = f"{config.spool_dir}/{name}" if config.spool_dir else None
+                processors[name] = BatchExportProcessor(
+                    exporter, config, _create_spool(spool_dir)
+                )
+            _export_processor = FanoutExportProcessor(processors)
+        # rate=1.0 ならすべて保持するためサンプラーは使わない
+        _sampler = TraceSampler(sampling) if sampling.rate < 1.0 else None
+    elif config.mode == "sync":
+        _sampler = None
+        _warn_sampling_ignored(sampling)
+    else:
+        raise ValueError(f"Unknown export mode: {config.mode}")
+
+    start_leak_detector()
+    return _export_processor
+
+
+def get_export_stats() -> dict:
+    """エクスポートのカウンター（キュー深さ、ドロップ数など）を返す.
+
+    Returns:
+        カウンター辞書（同期モードの場合は mode のみ）
+    """
+    if _export_processor is None:
+        return {"mode": "sync"}
+    stats = {"mode": "async", **_export_processor.stats()}
+    if _sampler is not None:
+        stats["sampling"] = _sampler.stats()
+    return stats
+
+
+def configure_payloads(policy: Optional[PayloadPolicy] = None):
+    """スパンのペイロード制限を設定.
+
+    以降に作成される LangfuseTracer に適用される。
+
+    Args:
+        policy: 制限設定（Noneの場合は環境変数から生成）
+    """
+    global _payload_policy, _blob_store
+    _payload_policy = policy or PayloadPolicy.from_env()
+    if _blob_store is not None:
+        _blob_store.flush()
+    _blob_store = create_blob_store(_payload_policy)
+
+
+def _shutdown_export():
+    """プロセス終了時に未送信のスパンと退避待ちのペイロードを書き出す."""
+    if _export_processor is not None:
+        _export_processor.shutdown()
+    if _blob_store is not None:
+        _blob_store.flush()
+
+
+atexit.register(_shutdown_export)
+
+
+def _export_metrics_lines() -> list[str]:
+    """エクスポートのカウンターを Prometheus のゲージとして出力."""
+    stats = get_export_stats()
+    lines = []
+    for key in ("queue_depth", "dropped_spans", "exported_spans", "failed_spans"):
+        if key in stats:
+            name = f"langfuse_export_{key}"
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {stats[key]}")
+    spool = stats.get("spool")
+    if spool:
+        for key, metric in (
+            ("bytes", "langfuse_spool_bytes"),
+            ("segments", "langfuse_spool_segments"),
+            ("lag_s", "langfuse_spool_lag_seconds"),
+            ("evicted_bytes", "langfuse_spool_evicted_bytes"),
+            ("corrupt_records", "langfuse_spool_corrupt_records"),
+        ):
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {spool[key]}")
+    sampling = stats.get("sampling")
+    if sampling:
+        lines.append("# TYPE langfuse_sampling_traces_dropped gauge")
+        lines.append(f"langfuse_sampling_traces_dropped {sampling['traces_dropped']}")
+    return lines
+
+
+REGISTRY.register_collector(_export_metrics_lines)
+
+# 環境変数で非同期モードが指定されている場合は自動で有効化
+if _tracing_enabled:
+    if os.getenv("LANGFUSE_EXPORT_MODE", "sync") == "async":
+        configure_export()
+    else:
+        _warn_sampling_ignored(SamplingConfig.from_env())
+        start_leak_detector()
+
+
 class LangfuseTracer:
     """Langfuse トレーシングマネージャー.
 
@@ -212,7 +523,97 @@ class LangfuseTracer:
             config: トレーシング設定（Noneの場合はデフォルト設定）
         """
         self.config = config or TracingConfig()
-        self._pending_spans: dict[str, Any] = {}
+        # 未終了のツールスパン（tool_use_id -> SpanWrapper）
+        self._spans = SpanRegistry()
+        self._payloads = PayloadLimiter(_payload_policy, _blob_store)
+
+        # 非同期モードではスパンを記録してバックグラウンド送信
+        if _export_processor is not None:
+            self._client: Any = RecordingClient(
+                _export_processor, _sampler, self.config.session_id
+            )
+        else:
+            self._client = _get_langfuse()
+
+    @contextmanager
+    def _root_span(
+        self,
+        name: str,
+        input: Any,
+        metadata: dict,
+        tags: list[str],
+    ):
+        """ルートスパンを作成（trace_agent / trace_span の共通処理）.
+
+        start_as_current_span は OpenTelemetry のコンテキストを使うため、
+        同じタスクで複数のリクエストのジェネレーターを交互に進めると
+        別リクエストのスパンの子になることがある。
+        新しいトレースIDを明示して作成し、現在のスパンは contextvars で伝播する。
+
+        Yields:
+            SpanWrapper: スパンラッパー
+        """
+        options: dict = {}
+        if isinstance(self._client, RecordingClient):
+            head_sampled = self._client.sample_trace()
+            if head_sampled is None:
+                # ヘッドで破棄: スパンの記録もペイロードの処理も行わない
+                with self._unrecorded_root(name) as wrapper:
+                    yield wrapper
+                return
+            options["head_sampled"] = head_sampled
+
+        span = self._client.start_span(
+            name=name,
+            input=self.limit_payload(input, FIELD_INPUT),
+            metadata=metadata,
+            trace_context={"trace_id": self._client.create_trace_id()},
+            **options,
+        )
+        # トレースレベルで session_id / user_id / tags を設定
+        span.update_trace(
+            session_id=self.config.session_id,
+            user_id=self.config.user_id,
+            tags=tags,
+        )
+
+        # auto_end=True: ルートスパンはこのメソッドが終了する
+        wrapper = SpanWrapper(span, self, auto_end=True)
+        _TRACES.inc(1, (name,))
+
+        try:
+            with use_span(wrapper):
+                yield wrapper
+        except Exception as e:
+            # スタックトレースを含めてエラーを記録
+            wrapper.set_error_with_traceback(e)
+            _TRACE_ERRORS.inc(1, (name,))
+            raise
+        finally:
+            # ルート終了時に残っている子スパンはリークとして終了
+            self._spans.close_all("root span ended", LEAK_ROOT_ENDED)
+            span.end()
+
+        # 終了後にフラッシュ（非同期モードではワーカーが送信）
+        if _export_processor is None:
+            self.flush()
+
+    @contextmanager
+    def _unrecorded_root(self, name: str):
+        """記録しないルートスパン（ヘッドサンプリングで破棄したトレース）.
+
+        子スパンも NOOP_SPAN になるため、リクエストあたりのコストは no-op モードと同程度。
+
+        Yields:
+            NOOP_SPAN
+        """
+        _TRACES.inc(1, (name,))
+        try:
+            with use_span(NOOP_SPAN):
+                yield NOOP_SPAN
+        except Exception:
+            _TRACE_ERRORS.inc(1, (name,))
+            raise
 
     @contextmanager
     def trace_agent(
@@ -224,7 +625,7 @@ class LangfuseTracer:
     ):
         """エージェント操作をトレース（コンテキストマネージャー）.
 
-        Langfuse の start_as_current_span を使用してルートトレースを作成。
+        新しいトレースIDでルートスパンを作成（グローバルなコンテキストには依存しない）。
         session_id / user_id はネイティブに設定。
         try/finally でスパンの確実終了を保証。
 
@@ -250,32 +651,8 @@ class LangfuseTracer:
         if tags:
             merged_tags.extend(tags)
 
-        # start_as_current_span でルートトレースを作成
-        with _langfuse.start_as_current_span(
-            name=name,
-            input=input,
-            metadata=merged_metadata,
-        ) as span:
-            # トレースレベルで session_id / user_id / tags を設定
-            span.update_trace(
-                session_id=self.config.session_id,
-                user_id=self.config.user_id,
-                tags=merged_tags,
-            )
-
-            # auto_end=True: コンテキストマネージャーが自動でend()を呼ぶ
-            wrapper = SpanWrapper(span, self, auto_end=True)
-
-            try:
-                yield wrapper
-            except Exception as e:
-                # スタックトレースを含めてエラーを記録
-                wrapper.set_error_with_traceback(e)
-                raise
-            # finally で end() を呼ばない（コンテキストマネージャーが処理）
-
-        # コンテキストマネージャー終了後にフラッシュ
-        self.flush()
+        with self._root_span(name, input, merged_metadata, merged_tags) as wrapper:
+            yield wrapper
 
     @contextmanager
     def trace_span(
@@ -287,7 +664,7 @@ class LangfuseTracer:
     ):
         """汎用スパンをトレース（コンテキストマネージャー）.
 
-        Langfuse の start_as_current_span を使用してルートトレースを作成。
+        新しいトレースIDでルートスパンを作成（グローバルなコンテキストには依存しない）。
         session_id / user_id はネイティブに設定。
         try/finally でスパンの確実終了を保証。
 
@@ -312,32 +689,8 @@ class LangfuseTracer:
         if tags:
             merged_tags.extend(tags)
 
-        # start_as_current_span でルートトレースを作成
-        with _langfuse.start_as_current_span(
-            name=name,
-            input=input,
-            metadata=merged_metadata,
-        ) as span:
-            # トレースレベルで session_id / user_id / tags を設定
-            span.update_trace(
-                session_id=self.config.session_id,
-                user_id=self.config.user_id,
-                tags=merged_tags,
-            )
-
-            # auto_end=True: コンテキストマネージャーが自動でend()を呼ぶ
-            wrapper = SpanWrapper(span, self, auto_end=True)
-
-            try:
-                yield wrapper
-            except Exception as e:
-                # スタックトレースを含めてエラーを記録
-                wrapper.set_error_with_traceback(e)
-                raise
-            # finally で end() を呼ばない（コンテキストマネージャーが処理）
-
-        # コンテキストマネージャー終了後にフラッシュ
-        self.flush()
+        with self._root_span(name, input, merged_metadata, merged_tags) as wrapper:
+            yield wrapper
 
     @contextmanager
     def trace_tool(
@@ -360,11 +713,16 @@ class LangfuseTracer:
         Yields:
             SpanWrapper: ツールスパンラッパー
         """
+        if isinstance(parent, NoopSpanWrapper):
+            # 記録していないトレース
+            yield NOOP_SPAN
+            return
+
         # start_observation で as_type="tool" を指定
         tool_span = parent._span.start_observation(
             name=f"tool:{tool_name}",
             as_type="tool",
-            input=input,
+            input=self.limit_payload(input, FIELD_TOOL_INPUT),
             metadata={
                 "tool_name": tool_name,
                 "tool_use_id": tool_use_id,
@@ -372,6 +730,7 @@ class LangfuseTracer:
         )
 
         wrapper = SpanWrapper(tool_span, self, is_tool=True)
+        _TOOL_SPANS.inc(1, (tool_name,))
 
         try:
             yield wrapper
@@ -405,11 +764,15 @@ class LangfuseTracer:
         Returns:
             SpanWrapper: ツールスパンラッパー
         """
+        if isinstance(parent, NoopSpanWrapper):
+            # 記録していないトレース
+            return NOOP_SPAN
+
         # start_observation で as_type="tool" を指定
         tool_span = parent._span.start_observation(
             name=f"tool:{tool_name}",
             as_type="tool",
-            input=input,
+            input=self.limit_payload(input, FIELD_TOOL_INPUT),
             metadata={
                 "tool_name": tool_name,
                 "tool_use_id": tool_use_id,
@@ -418,7 +781,8 @@ class LangfuseTracer:
         )
 
         wrapper = SpanWrapper(tool_span, self, is_tool=True)
-        self._pending_spans[tool_use_id] = wrapper
+        self._spans.open(tool_use_id, wrapper)
+        _TOOL_SPANS.inc(1, (tool_name,))
         return wrapper
 
     def end_tool_span(
@@ -437,7 +801,7 @@ class LangfuseTracer:
         Returns:
             終了したスパンラッパー（存在しない場合はNone）
         """
-        wrapper = self._pending_spans.pop(tool_use_id, None)
+        wrapper = self._spans.close(tool_use_id)
         if wrapper:
             if is_error:
                 wrapper.set_error(str(output) if output else "Tool execution failed")
@@ -454,11 +818,25 @@ class LangfuseTracer:
         Args:
             reason: 終了理由
         """
-        for tool_use_id, wrapper in list(self._pending_spans.items()):
-            wrapper.set_warning(f"Span ended due to: {reason}")
-            wrapper.set_output(f"(no result - {reason})")
+        self._spans.close_all(reason)
+
+    def end_open_tool_spans(self, output: Any = "(tool executed by SDK)") -> int:
+        """未終了のツールスパンをすべて正常終了.
+
+        SDK はツールを内部で実行し ToolResultBlock を受信ストリームに含めないため、
+        次のメッセージの到着をツール実行完了とみなして終了する。
+
+        Args:
+            output: ツール出力として記録する値
+
+        Returns:
+            終了したスパン数
+        """
+        spans = self._spans.pop_all()
+        for wrapper in spans:
+            wrapper.set_output(output)
             wrapper.end()
-        self._pending_spans.clear()
+        return len(spans)
 
     def create_generation(
         self,
@@ -483,13 +861,17 @@ class LangfuseTracer:
             metrics: メトリクス
             tool_call_count: ツール呼び出し数
         """
+        if isinstance(parent, NoopSpanWrapper):
+            # 記録していないトレース
+            return
+
         # start_observation で as_type="generation" を指定
         generation = parent._span.start_observation(
             name=name,
             as_type="generation",
             model=model or self.config.model,
-            input=input,
-            output=output,
+            input=self.limit_payload(input, FIELD_GENERATION_INPUT),
+            output=self.limit_payload(output, FIELD_GENERATION_OUTPUT),
             model_parameters={
                 "temperature": self.config.temperature,
                 "max_tokens": self.config.max_tokens,
@@ -516,13 +898,28 @@ class LangfuseTracer:
 
         generation.end()
 
+    def limit_payload(self, value: Any, field_name: str = FIELD_INPUT) -> Any:
+        """ペイロードにサイズ制限を適用.
+
+        Args:
+            value: ペイロード
+            field_name: フィールド名（trace_payload.FIELD_*）
+
+        Returns:
+            制限を適用したペイロード
+        """
+        return self._payloads.limit(value, field_name)
+
     def flush(self):
-        """トレースをフラッシュ."""
-        _langfuse.flush()
+        """トレースをフラッシュ.
+
+        非同期モードではキューをすべて送信するため、シャットダウン時やテストでのみ使う。
+        """
+        self._client.flush()
 
     def shutdown(self):
         """クライアントをシャットダウン."""
-        _langfuse.shutdown()
+        self._client.shutdown()
 
 
 class SpanWrapper:
@@ -560,7 +957,7 @@ class SpanWrapper:
         Args:
             output: 出力データ
         """
-        self._span.update(output=output)
+        self._span.update(output=self._tracer.limit_payload(output, FIELD_OUTPUT))
 
     def set_error(self, message: str):
         """エラーを設定.
@@ -603,6 +1000,22 @@ class SpanWrapper:
         self._status_message = message
         self._span.update(level="WARNING", status_message=message)
 
+    def set_guardrail_result(self, action: str, source: str = "OUTPUT"):
+        """ApplyGuardrail の結果を記録.
+
+        介入（GUARDRAIL_INTERVENED）時は WARNING レベルにし、
+        テールサンプリング（LANGFUSE_SAMPLE_KEEP_GUARDRAIL=true）で必ず保持されるようにする。
+
+        Args:
+            action: ApplyGuardrail のレスポンスの action
+            source: "INPUT" または "OUTPUT"
+        """
+        self._span.update(
+            metadata={"guardrail_action": action, "guardrail_source": source}
+        )
+        if action == GUARDRAIL_INTERVENED:
+            self.set_warning(f"Guardrail intervened ({source})")
+
     def update_metadata(self, metadata: dict):
         """メタデータを更新.
 
@@ -639,7 +1052,7 @@ class SpanWrapper:
         """
         child_span = self._span.start_span(
             name=name,
-            input=input,
+            input=self._tracer.limit_payload(input, FIELD_INPUT),
             metadata=metadata,
         )
         return SpanWrapper(child_span, self._tracer)
@@ -657,6 +1070,156 @@ class SpanWrapper:
             self._ended = True
 
 
+class NoopSpanWrapper(SpanWrapper):
+    """何もしないスパンラッパー.
+
+    SpanWrapper と同じ API を持ち、コンテキストマネージャーとしても使える。
+    状態を持たないため単一インスタンス（NOOP_SPAN）を共有する。
+    """
+
+    def __init__(self):
+        """初期化（Langfuse スパンは持たない）."""
+        self._span = None
+        self._tracer = None
+        self._is_tool = False
+        self._auto_end = True
+        self._ended = True
+        self._level = "DEFAULT"
+        self._status_message = None
+
+    def __enter__(self) -> "NoopSpanWrapper":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> bool:
+        return False
+
+    def set_output(self, output: Any):
+        pass
+
+    def set_error(self, message: str):
+        pass
+
+    def set_error_with_traceback(self, exception: Exception):
+        pass
+
+    def set_warning(self, message: str):
+        pass
+
+    def set_guardrail_result(self, action: str, source: str = "OUTPUT"):
+        pass
+
+    def update_metadata(self, metadata: dict):
+        pass
+
+    def score(self, name: str, value: float, comment: Optional[str] = None):
+        pass
+
+    def start_child_span(
+        self,
+        name: str,
+        input: Any = None,
+        metadata: Optional[dict] = None,
+    ) -> "NoopSpanWrapper":
+        return self
+
+    def end(self):
+        pass
+
+
+NOOP_SPAN = NoopSpanWrapper()
+
+
+class NoopTracer(LangfuseTracer):
+    """何もしないトレーサー.
+
+    LangfuseTracer と同じ API を持つが、Langfuse SDK には一切触れず、
+    呼び出しごとのオブジェクト生成も行わない（NOOP_SPAN を返すだけ）。
+    状態を持たないため単一インスタンス（NOOP_TRACER）を共有する。
+    """
+
+    def __init__(self, config: Optional[TracingConfig] = None):
+        """初期化（設定は保持しない）."""
+        self.config = config or TracingConfig()
+        self._spans = None
+        self._payloads = None
+        self._client = None
+
+    def trace_agent(
+        self,
+        name: str,
+        input: Any = None,
+        metadata: Optional[dict] = None,
+        tags: Optional[list[str]] = None,
+    ) -> NoopSpanWrapper:
+        return NOOP_SPAN
+
+    def trace_span(
+        self,
+        name: str,
+        input: Any = None,
+        metadata: Optional[dict] = None,
+        tags: Optional[list[str]] = None,
+    ) -> NoopSpanWrapper:
+        return NOOP_SPAN
+
+    def trace_tool(
+        self,
+        parent: SpanWrapper,
+        tool_name: str,
+        tool_use_id: str,
+        input: Any = None,
+    ) -> NoopSpanWrapper:
+        return NOOP_SPAN
+
+    def start_tool_span(
+        self,
+        parent: SpanWrapper,
+        tool_name: str,
+        tool_use_id: str,
+        tool_call_number: int,
+        input: Any = None,
+    ) -> NoopSpanWrapper:
+        return NOOP_SPAN
+
+    def end_tool_span(
+        self,
+        tool_use_id: str,
+        output: Any = None,
+        is_error: bool = False,
+    ) -> None:
+        return None
+
+    def end_all_pending_spans(self, reason: str = "interrupted"):
+        pass
+
+    def end_open_tool_spans(self, output: Any = "(tool executed by SDK)") -> int:
+        return 0
+
+    def create_generation(
+        self,
+        parent: SpanWrapper,
+        name: str = "llm_response",
+        input: Any = None,
+        output: Any = None,
+        model: Optional[str] = None,
+        metrics: Optional[AgentMetrics] = None,
+        tool_call_count: int = 0,
+    ):
+        pass
+
+    def limit_payload(self, value: Any, field_name: str = FIELD_INPUT) -> Any:
+        return value
+
+    def flush(self):
+        pass
+
+    def shutdown(self):
+        pass
+
+
+NOOP_TRACER = NoopTracer()
+
+
 # シンプルなファクトリー関数
 def create_tracer(
     session_id: Optional[str] = None,
@@ -666,6 +1229,7 @@ def create_tracer(
     aws_region: str = "us-east-1",
     model: str = "",
     tools: Optional[list[str]] = None,
+    enabled: Optional[bool] = None,
 ) -> LangfuseTracer:
     """トレーサーを作成.
 
@@ -677,10 +1241,14 @@ def create_tracer(
         aws_region: AWSリージョン
         model: モデル名
         tools: ツールリスト
+        enabled: トレーシングの有効/無効（Noneの場合は LANGFUSE_TRACING_ENABLED に従う）
 
     Returns:
-        LangfuseTracer: トレーサー
+        LangfuseTracer: トレーサー（無効の場合は NOOP_TRACER）
     """
+    if not (_tracing_enabled if enabled is None else enabled):
+        return NOOP_TRACER
+
     config = TracingConfig(
         session_id=session_id,
         user_id=user_id,
@@ -0,0 +1,620 @@
+"""プロセス内メトリクスレジストリ.
+
+Langfuse は個々のトレースの確認には向いているが、リアルタイムの SLO 監視には向かない。
+このモジュールはリクエストごとのメトリクスをプロセス内で集計し、
+Prometheus のテキスト形式で公開する。
+
+主な機能:
+1. Counter / HdrHistogram: スレッドごとのシャードに書き込むためホットパスでロック不要
+2. HDR 方式（対数-線形バケット）のヒストグラム: 相対誤差 約3% で分位点を計算
+3. ラベル（model / environment / tag）
+4. Prometheus テキスト形式の出力と /metrics エンドポイント
+5. RequestRecorder: エージェントのエントリーポイントから AgentMetrics を記録
+   （metrics_store.configure_store() / pricing.configure_ledger() を設定した場合は
+   列指向ストア・コスト台帳にも記録）
+6. collect_request_metrics: 現在のコンテキスト（タスク）で記録された AgentMetrics の収集
+
+環境変数:
+    METRICS_ENABLED=false: 記録を無効化
+    METRICS_PORT=9464: 指定した場合、インポート時に /metrics エンドポイントを起動
+"""
+
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Iterator, Optional
+
+try:
+    from src.metrics_store import get_default_store
+    from src.pricing import get_default_ledger
+except ImportError:
+    from metrics_store import get_default_store  # type: ignore
+    from pricing import get_default_ledger  # type: ignore
+
+LabelValues = tuple[str, ...]
+
+# collect_request_metrics() で設定される収集先
+_request_collector: ContextVar[Optional["CollectedRequests"]] = ContextVar(
+    "agent_request_collector", default=None
+)
+
+
+class CollectedRequests(list):
+    """collect_request_metrics() が集めた AgentMetrics のリスト（TTFT も保持）."""
+
+    def __init__(self):
+        super().__init__()
+        # リクエストごとの最初のテキストチャンクまでの時間（ミリ秒、受信した順）
+        self.ttft_ms: list[float] = []
+
+
+@contextmanager
+def collect_request_metrics() -> Iterator[CollectedRequests]:
+    """このコンテキストで記録されたリクエストの AgentMetrics を集める.
+
+    asyncio のタスクはコンテキストをコピーするため、並行実行しても
+    タスクごとに自分のリクエストのメトリクスだけが集まる。
+
+    使用例:
+        with collect_request_metrics() as collected:
+            await agent.chat(prompt)
+        input_tokens = sum(m.input_tokens for m in collected)
+        first_ttft_ms = collected.ttft_ms[0] if collected.ttft_ms else None
+
+    Yields:
+        AgentMetrics のリスト（リクエスト終了ごとに追加される。ttft_ms 属性に TTFT）
+    """
+    collected = CollectedRequests()
+    token = _request_collector.set(collected)
+    try:
+        yield collected
+    finally:
+        _request_collector.reset(token)
+
+
+def _escape(value: Any) -> str:
+    """Prometheus のラベル値をエスケープ."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    """Prometheus のラベル文字列を生成."""
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Sharded:
+    """スレッドごとのシャードを持つ基底クラス.
+
+    書き込みは自スレッドのシャード（dict）にのみ行うためロック不要。
+    読み出し時にすべてのシャードを合算する。
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards: list[dict] = []
+        self._shards_lock = threading.Lock()
+
+    def _shard(self) -> dict:
+        """自スレッドのシャードを取得（初回のみロック）."""
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard: dict = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+            return shard
+
+    def _snapshot_shards(self) -> list[dict]:
+        """すべてのシャードのコピーを返す."""
+        with self._shards_lock:
+            shards = list(self._shards)
+        # dict のコピーは GIL 下でアトミック
+        return [dict(shard) for shard in shards]
+
+
+class Counter(_Sharded):
+    """単調増加カウンター."""
+
+    def __init__(self, name: str, help: str, label_names: tuple[str, ...] = ()):
+        """初期化.
+
+        Args:
+            name: メトリクス名
+            help: 説明
+            label_names: ラベル名
+        """
+        super().__init__()
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+
+    def inc(self, value: float = 1.0, labels: LabelValues = ()):
+        """カウンターを増やす.
+
+        Args:
+            value: 増分
+            labels: ラベル値（label_names と同じ順序）
+        """
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + value
+
+    def values(self) -> dict[LabelValues, float]:
+        """ラベルごとの合計値を返す."""
+        totals: dict[LabelValues, float] = {}
+        for shard in self._snapshot_shards():
+            for labels, value in shard.items():
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    def render(self) -> list[str]:
+        """Prometheus テキスト形式の行を生成."""
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self.values().items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {value:g}")
+        return lines
+
+
+class _HistogramData:
+    """1ラベルセット分のヒストグラムデータ."""
+
+    __slots__ = ("buckets", "count", "total", "min", "max")
+
+    def __init__(self):
+        self.buckets: dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def merge(self, other: "_HistogramData"):
+        """別のデータを合算."""
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+
+class HdrHistogram(_Sharded):
+    """HDR 方式のヒストグラム.
+
+    値を 2 のべき乗ごとに sub_buckets 個の等幅バケットに分ける（対数-線形）。
+    sub_buckets=32 の場合、相対誤差は最大 約3%。
+    バケットは疎な dict で保持するため、値域の広さにかかわらずメモリは小さい。
+    """
+
+    DEFAULT_QUANTILES = (0.5, 0.9, 0.95, 0.99)
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        label_names: tuple[str, ...] = (),
+        sub_buckets: int = 32,
+        quantiles: tuple[float, ...] = DEFAULT_QUANTILES,
+    ):
+        """初期化.
+
+        Args:
+            name: メトリクス名
+            help: 説明
+            label_names: ラベル名
+            sub_buckets: 2 のべき乗あたりのバケット数（精度）
+            quantiles: Prometheus に出力する分位点
+        """
+        super().__init__()
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.sub_buckets = sub_buckets
+        self.quantiles = quantiles
+
+    def _index(self, value: float) -> int:
+        """値からバケット番号を計算."""
+        if value <= 0:
+            return -(2**31)
+        # value = mantissa * 2**exponent (0.5 <= mantissa < 1)
+        mantissa, exponent = math.frexp(value)
+        return exponent * self.sub_buckets + int((mantissa * 2 - 1) * self.sub_buckets)
+
+    def _bucket_value(self, index: int) -> float:
+        """バケットの代表値（中央値）を返す."""
+        if index == -(2**31):
+            return 0.0
+        exponent, sub = divmod(index, self.sub_buckets)
+        lower = (1 + sub / self.sub_buckets) * 2 ** (exponent - 1)
+        upper = (1 + (sub + 1) / self.sub_buckets) * 2 ** (exponent - 1)
+        return (lower + upper) / 2
+
+    def observe(self, value: float, labels: LabelValues = ()):
+        """値を記録.
+
+        Args:
+            value: 観測値
+            labels: ラベル値
+        """
+        shard = self._shard()
+        data = shard.get(labels)
+        if data is None:
+            data = shard[labels] = _HistogramData()
+        index = self._index(value)
+        data.buckets[index] = data.buckets.get(index, 0) + 1
+        data.count += 1
+        data.total += value
+        if value < data.min:
+            data.min = value
+        if value > data.max:
+            data.max = value
+
+    def _merged(self) -> dict[LabelValues, _HistogramData]:
+        """ラベルごとに全シャードを合算."""
+        with self._shards_lock:
+            shards = list(self._shards)
+        merged: dict[LabelValues, _HistogramData] = {}
+        for shard in shards:
+            for labels, data in list(shard.items()):
+                target = merged.setdefault(labels, _HistogramData())
+                # バケット dict は書き込み中の可能性があるためコピーしてから合算
+                snapshot = _HistogramData()
+                snapshot.buckets = dict(data.buckets)
+                snapshot.count = data.count
+                snapshot.total = data.total
+                snapshot.min = data.min
+                snapshot.max = data.max
+                target.merge(snapshot)
+        return merged
+
+    def _quantiles_of(
+        self,
+        data: _HistogramData,
+        quantiles: tuple[float, ...],
+    ) -> dict[float, float]:
+        """分位点を計算."""
+        result = {}
+        if data.count == 0:
+            return result
+        ordered = sorted(data.buckets.items())
+        for q in quantiles:
+            rank = max(1, math.ceil(q * data.count))
+            cumulative = 0
+            for index, count in ordered:
+                cumulative += count
+                if cumulative >= rank:
+                    # 代表値は実測の min/max の範囲に収める
+                    result[q] = min(max(self._bucket_value(index), data.min), data.max)
+                    break
+        return result
+
+    def summary(self, labels: LabelValues = ()) -> dict[str, float]:
+        """ラベルセットの要約（count / sum / 分位点）を返す."""
+        data = self._merged().get(labels)
+        if data is None:
+            return {"count": 0, "sum": 0.0}
+        result = {"count": data.count, "sum": data.total, "min": data.min, "max": data.max}
+        for q, value in self._quantiles_of(data, self.quantiles).items():
+            result[f"p{round(q * 100):g}"] = value
+        return result
+
+    def render(self) -> list[str]:
+        """Prometheus テキスト形式（summary 型）の行を生成."""
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} summary"]
+        for labels, data in sorted(self._merged().items()):
+            for q, value in self._quantiles_of(data, self.quantiles).items():
+                label_str = _format_labels(self.label_names, labels, f'quantile="{q:g}"')
+                lines.append(f"{self.name}{label_str} {value:g}")
+            label_str = _format_labels(self.label_names, labels)
+            lines.append(f"{self.name}_sum{label_str} {data.total:g}")
+            lines.append(f"{self.name}_count{label_str} {data.count}")
+        return lines
+
+
+class MetricsRegistry:
+    """メトリクスのレジストリ."""
+
+    def __init__(self):
+        self._metrics: dict[str, Any] = {}
+        self._collectors: list[Callable[[], list[str]]] = []
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help: str, label_names: tuple[str, ...] = ()) -> Counter:
+        """カウンターを取得（存在しない場合は作成）."""
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Counter(name, help, label_names)
+            return self._metrics[name]
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        label_names: tuple[str, ...] = (),
+        **kwargs,
+    ) -> HdrHistogram:
+        """ヒストグラムを取得（存在しない場合は作成）."""
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = HdrHistogram(name, help, label_names, **kwargs)
+            return self._metrics[name]
+
+    def register_collector(self, collector: Callable[[], list[str]]):
+        """出力時に呼ばれるコレクターを登録.
+
+        Args:
+            collector: Prometheus テキスト形式の行を返す関数（ゲージ用）
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render_prometheus(self) -> str:
+        """すべてのメトリクスを Prometheus テキスト形式で出力."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        lines: list[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for collector in collectors:
+            try:
+                lines.extend(collector())
+            except Exception as e:
+                lines.append(f"# collector error: {e}")
+        return "\n".join(lines) + "\n"
+
+
+# デフォルトのレジストリ
+REGISTRY = MetricsRegistry()
+
+_metrics_enabled = os.getenv("METRICS_ENABLED", "true").lower() not in ("false", "0", "no")
+
+# エージェントのリクエストメトリクス
+_LABELS = ("model", "environment", "tag")
+REQUESTS = REGISTRY.counter("agent_requests_total", "Agent requests", _LABELS)
+ERRORS = REGISTRY.counter(
+    "agent_errors_total", "Agent requests that raised an error", _LABELS
+)
+DURATION_MS = REGISTRY.histogram(
+    "agent_duration_ms", "Agent duration (ResultMessage.duration_ms)", _LABELS
+)
+DURATION_API_MS = REGISTRY.histogram(
+    "agent_duration_api_ms", "Agent API duration (ResultMessage.duration_api_ms)", _LABELS
+)
+TTFT_MS = REGISTRY.histogram("agent_ttft_ms", "Time to first text chunk", _LABELS)
+INPUT_TOKENS = REGISTRY.counter("agent_input_tokens_total", "Input tokens", _LABELS)
+OUTPUT_TOKENS = REGISTRY.counter("agent_output_tokens_total", "Output tokens", _LABELS)
+CACHE_READ_TOKENS = REGISTRY.counter(
+    "agent_cache_read_input_tokens_total", "Prompt cache read tokens", _LABELS
+)
+CACHE_WRITE_TOKENS = REGISTRY.counter(
+    "agent_cache_creation_input_tokens_total", "Prompt cache write tokens", _LABELS
+)
+TOOL_CALLS = REGISTRY.counter("agent_tool_calls_total", "Tool calls", _LABELS)
+COST_USD = REGISTRY.counter(
+    "agent_cost_usd_total", "Total cost in USD (ResultMessage.total_cost_usd)", _LABELS
+)
+
+
+def is_metrics_enabled() -> bool:
+    """メトリクスの記録が有効か."""
+    return _metrics_enabled
+
+
+def configure_metrics(enabled: bool):
+    """メトリクスの記録の有効/無効を切り替え."""
+    global _metrics_enabled
+    _metrics_enabled = enabled
+
+
+class RequestRecorder:
+    """1リクエスト分のメトリクスを記録するコンテキストマネージャー.
+
+    使用例:
+        with record_request(model, environment, tags) as request:
+            ...
+            request.first_token()          # 最初のテキストチャンク受信時
+            request.set_result(metrics, tool_calls=3)
+    """
+
+    __slots__ = (
+        "_label_sets",
+        "_model",
+        "_user_id",
+        "_tags",
+        "_started",
+        "_ttft_ms",
+        "_metrics",
+        "_tool_calls",
+    )
+
+    def __init__(
+        self,
+        label_sets: list[LabelValues],
+        model: Optional[str] = None,
+        user_id: Optional[str] = None,
+        tags: Optional[list[str]] = None,
+    ):
+        self._label_sets = label_sets
+        self._model = model
+        self._user_id = user_id
+        self._tags = tags
+        self._started = time.perf_counter()
+        self._ttft_ms: Optional[float] = None
+        self._metrics: Any = None
+        self._tool_calls = 0
+
+    def first_token(self):
+        """最初のテキストチャンクを受信した時刻を記録（2回目以降は無視）."""
+        if self._ttft_ms is None:
+            self._ttft_ms = (time.perf_counter() - self._started) * 1000
+
+    def set_result(self, metrics: Any, tool_calls: int = 0):
+        """リクエストの結果を設定.
+
+        Args:
+            metrics: AgentMetrics（ResultMessage がない場合None）
+            tool_calls: ツール呼び出し数
+        """
+        self._metrics = metrics
+        self._tool_calls = tool_calls
+
+    def __enter__(self) -> "RequestRecorder":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> bool:
+        # GeneratorExit（ストリーミングの途中終了）はエラーとして扱わない
+        error = exc_type is not None and issubclass(exc_type, Exception)
+        metrics = self._metrics
+        for labels in self._label_sets:
+            REQUESTS.inc(1, labels)
+            if error:
+                ERRORS.inc(1, labels)
+            if self._ttft_ms is not None:
+                TTFT_MS.observe(self._ttft_ms, labels)
+            if self._tool_calls:
+                TOOL_CALLS.inc(self._tool_calls, labels)
+            if metrics is None:
+                continue
+            if metrics.duration_ms is not None:
+                DURATION_MS.observe(metrics.duration_ms, labels)
+            if metrics.duration_api_ms is not None:
+                DURATION_API_MS.observe(metrics.duration_api_ms, labels)
+            INPUT_TOKENS.inc(metrics.input_tokens, labels)
+            OUTPUT_TOKENS.inc(metrics.output_tokens, labels)
+            CACHE_READ_TOKENS.inc(metrics.cache_read_input_tokens, labels)
+            CACHE_WRITE_TOKENS.inc(metrics.cache_creation_input_tokens, labels)
+            if metrics.total_cost_usd is not None:
+                COST_USD.inc(metrics.total_cost_usd, labels)
+        collected = _request_collector.get()
+        if collected is not None and self._ttft_ms is not None:
+            collected.ttft_ms.append(self._ttft_ms)
+        if metrics is not None:
+            if collected is not None:
+                collected.append(metrics)
+            # 記録先の失敗でリクエストを失敗させない
+            store = get_default_store()
+            if store is not None:
+                try:
+                    store.append(metrics, model=self._model, user_id=self._user_id)
+                except Exception as e:
+                    print(f"⚠️  Failed to record request metrics to the store: {e}")
+            ledger = get_default_ledger()
+            if ledger is not None:
+                try:
+                    ledger.record_metrics(metrics, self._model, self._user_id, self._tags)
+                except Exception as e:
+                    print(f"⚠️  Failed to record request cost to the ledger: {e}")
+        return False
+
+
+class _NoopRecorder:
+    """メトリクス無効時に使う何もしないレコーダー."""
+
+    __slots__ = ()
+
+    def first_token(self):
+        pass
+
+    def set_result(self, metrics: Any, tool_calls: int = 0):
+        pass
+
+    def __enter__(self) -> "_NoopRecorder":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> bool:
+        return False
+
+
+NOOP_RECORDER = _NoopRecorder()
+
+
+def record_request(
+    model: str,
+    environment: str,
+    tags: Optional[list[str]] = None,
+    user_id: Optional[str] = None,
+) -> Any:
+    """リクエストのメトリクス記録を開始.
+
+    タグごとに1つのラベルセットとして記録する（タグなしは tag="none"）。
+
+    Args:
+        model: モデルID
+        environment: 環境名
+        tags: ユーザー指定のタグ
+        user_id: ユーザーID（列指向ストア・コスト台帳への記録に使う）
+
+    Returns:
+        RequestRecorder（メトリクス無効かつストア・台帳・収集先が未設定の場合は NOOP_RECORDER）
+    """
+    if not _metrics_enabled:
+        if (
+            get_default_store() is None
+            and get_default_ledger() is None
+            and _request_collector.get() is None
+        ):
+            return NOOP_RECORDER
+        # ストア・台帳・収集先にだけ記録する
+        return RequestRecorder([], model, user_id, tags)
+    if tags:
+        label_sets = [(model, environment, tag) for tag in tags]
+    else:
+        label_sets = [(model, environment, "none")]
+    return RequestRecorder(label_sets, model, user_id, tags)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """/metrics を返す HTTP ハンドラー."""
+
+    registry: MetricsRegistry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.registry.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args):
+        # スクレイプごとのアクセスログは出さない
+        pass
+
+
+def start_metrics_server(
+    port: int = 9464,
+    host: str = "0.0.0.0",
+    registry: MetricsRegistry = REGISTRY,
+) -> ThreadingHTTPServer:
+    """Prometheus 用の /metrics エンドポイントをバックグラウンドで起動.
+
+    Args:
+        port: ポート番号
+        host: バインドするアドレス
+        registry: 公開するレジストリ
+
+    Returns:
+        起動した HTTP サーバー（shutdown() で停止）
+    """
+    handler = type("MetricsHandler", (_MetricsHandler,), {"registry": registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True)
+    thread.start()
+    return server
+
+
+if os.getenv("METRICS_PORT"):
+    try:
+        start_metrics_server(int(os.environ["METRICS_PORT"]))
+    except OSError as e:
+        print(f"⚠️  Failed to start metrics server: {e}")
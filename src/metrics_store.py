@@ -0,0 +1,513 @@
+"""AgentMetrics の列指向ストア.
+
+リクエストごとの AgentMetrics を Python オブジェクトとして保持せず、
+array モジュールの列（1レコードあたり約80バイト）に追記する。
+数百万件をメモリ上に保持したまま、ユーザー別コストやキャッシュ効果などを集計できる。
+
+主な機能:
+1. MetricsStore: 列指向の追記（model / user_id は辞書エンコード、
+   session_id は 64bit ハッシュで保持し、セッションごとの文字列を保持しない）
+2. 集計: 合計・平均・分位点（model / user / session / 時間バケットでグループ化）
+3. NumPy がインストールされていればベクトル化して集計（なければ純 Python）
+4. ディスクへのスナップショット保存と、メモリマップによる読み込み
+
+使用例:
+    store = MetricsStore()
+    store.append(metrics, model="claude-3-5-sonnet", user_id="user-1")
+    store.aggregate("total_cost_usd", "sum", group_by="user")
+    store.aggregate("duration_ms", "p95", group_by="time", bucket_s=3600)
+    store.aggregate("total_cost_usd", "sum", group_by="session")[session_key("sess-1")]
+    store.save("metrics_snapshot")
+    snapshot = MetricsStore.load("metrics_snapshot")  # メモリマップで読み込み
+"""
+
+import hashlib
+import json
+import math
+import mmap
+import threading
+import time
+from array import array
+from pathlib import Path
+from typing import Any, Iterator, Optional, Sequence
+
+try:
+    import numpy as np
+
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+# 数値列: 列名 -> array の型コード（q: int64, d: float64）
+NUMERIC_COLUMNS = {
+    "timestamp": "d",
+    "input_tokens": "q",
+    "output_tokens": "q",
+    "cache_creation_input_tokens": "q",
+    "cache_read_input_tokens": "q",
+    "total_cost_usd": "d",
+    "duration_ms": "d",
+    "duration_api_ms": "d",
+    "num_turns": "q",
+}
+
+# カテゴリ列（辞書エンコードして int32 コードで保持）
+# 値の種類が少ない列だけ。セッションのようにリクエストごとに増える列は辞書が際限なく育つ
+CATEGORY_COLUMNS = ("model", "user_id")
+
+# ハッシュ列（session_key() の int64 で保持し、元の文字列は保持しない）
+HASH_COLUMNS = ("session_id",)
+
+# group_by の指定 -> カテゴリ列またはハッシュ列
+GROUP_BY_COLUMNS = {"model": "model", "user": "user_id", "session": "session_id"}
+
+# 欠損値（None）は NaN で表現
+_MISSING = float("nan")
+
+
+def session_key(session_id: Optional[str]) -> int:
+    """セッションIDを MetricsStore のキー（符号付き int64 のハッシュ）に変換.
+
+    group_by="session" の集計結果はこのキーで引く。None は 0。
+    """
+    if session_id is None:
+        return 0
+    digest = hashlib.blake2b(session_id.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little", signed=True)
+
+
+def _column_type(name: str) -> str:
+    """列の array 型コード."""
+    if name in NUMERIC_COLUMNS:
+        return NUMERIC_COLUMNS[name]
+    return "q" if name in HASH_COLUMNS else "i"
+
+
+def _value(value: Optional[float]) -> float:
+    """None を NaN に変換."""
+    return _MISSING if value is None else value
+
+
+def _percentile(sorted_values: list[float], q: float) -> float:
+    """ソート済みリストの分位点（線形補間）."""
+    position = (len(sorted_values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    fraction = position - lower
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * fraction
+
+
+class MetricsStore:
+    """AgentMetrics の列指向ストア."""
+
+    def __init__(self):
+        self._columns: dict[str, Any] = {
+            name: array(code) for name, code in NUMERIC_COLUMNS.items()
+        }
+        for name in CATEGORY_COLUMNS + HASH_COLUMNS:
+            self._columns[name] = array(_column_type(name))
+        # カテゴリ列の辞書（コード -> 値、値 -> コード）
+        self._categories: dict[str, list[Optional[str]]] = {
+            name: [] for name in CATEGORY_COLUMNS
+        }
+        self._codes: dict[str, dict[Optional[str], int]] = {
+            name: {} for name in CATEGORY_COLUMNS
+        }
+        self._mapped: Optional[list[mmap.mmap]] = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._columns["timestamp"])
+
+    def _encode(self, column: str, value: Optional[str]) -> int:
+        """カテゴリ値をコードに変換（未登録なら追加）."""
+        codes = self._codes[column]
+        code = codes.get(value)
+        if code is None:
+            code = len(self._categories[column])
+            self._categories[column].append(value)
+            codes[value] = code
+        return code
+
+    def _ensure_writable(self):
+        """メモリマップで読み込んだ列を書き込み可能な array にコピー."""
+        if self._mapped is None:
+            return
+        for name, column in self._columns.items():
+            self._columns[name] = array(_column_type(name), column)
+            if isinstance(column, memoryview):
+                column.release()
+        for mapped in self._mapped:
+            mapped.close()
+        self._mapped = None
+
+    def append(
+        self,
+        metrics: Any,
+        model: Optional[str] = None,
+        user_id: Optional[str] = None,
+        timestamp: Optional[float] = None,
+    ):
+        """AgentMetrics を1件追記.
+
+        Args:
+            metrics: AgentMetrics
+            model: モデルID
+            user_id: ユーザーID
+            timestamp: 記録時刻（Noneの場合は現在時刻）
+        """
+        with self._lock:
+            self._ensure_writable()
+            columns = self._columns
+            columns["timestamp"].append(time.time() if timestamp is None else timestamp)
+            columns["input_tokens"].append(metrics.input_tokens)
+            columns["output_tokens"].append(metrics.output_tokens)
+            columns["cache_creation_input_tokens"].append(
+                metrics.cache_creation_input_tokens
+            )
+            columns["cache_read_input_tokens"].append(metrics.cache_read_input_tokens)
+            columns["total_cost_usd"].append(_value(metrics.total_cost_usd))
+            columns["duration_ms"].append(_value(metrics.duration_ms))
+            columns["duration_api_ms"].append(_value(metrics.duration_api_ms))
+            columns["num_turns"].append(metrics.num_turns)
+            columns["model"].append(self._encode("model", model))
+            columns["user_id"].append(self._encode("user_id", user_id))
+            columns["session_id"].append(session_key(metrics.session_id))
+
+    def column(self, name: str) -> Sequence:
+        """列を返す（array またはメモリマップの memoryview）."""
+        return self._columns[name]
+
+    def nbytes(self) -> int:
+        """列データのバイト数（カテゴリ辞書は除く）."""
+        return sum(len(column) * column.itemsize for column in self._columns.values())
+
+    def _snapshot(self, names: Sequence[str]) -> tuple[dict[str, array], dict[str, list]]:
+        """集計に使う列とカテゴリ辞書のコピー.
+
+        集計中もリクエスト処理のスレッドが append() するため、ロックを保持して
+        同じ長さでコピーする（np.frombuffer のビューを持ったままだと append() が
+        BufferError になり、列ごとに長さも揃わない）。
+        """
+        with self._lock:
+            length = len(self)
+            columns = {}
+            for name in dict.fromkeys(names):
+                column = self._columns[name]
+                if isinstance(column, memoryview):
+                    copied = array(_column_type(name))
+                    copied.frombytes(column[:length])
+                    columns[name] = copied
+                else:
+                    columns[name] = column[:length]
+            categories = {name: list(values) for name, values in self._categories.items()}
+        return columns, categories
+
+    @staticmethod
+    def _group_column(group_by: Optional[str]) -> Optional[str]:
+        """グループ化に使う列（none / time の場合None）."""
+        if group_by is None or group_by in ("none", "time"):
+            return None
+        if group_by not in GROUP_BY_COLUMNS:
+            raise ValueError(
+                f"group_by must be one of model / user / session / time / none: {group_by}"
+            )
+        return GROUP_BY_COLUMNS[group_by]
+
+    @staticmethod
+    def _group_keys(
+        columns: dict[str, array],
+        categories: dict[str, list],
+        group_by: Optional[str],
+        bucket_s: int,
+    ) -> tuple[Sequence, Any]:
+        """グループ化のキー列と、キーを表示値に変換する関数を返す."""
+        column = MetricsStore._group_column(group_by)
+        if group_by == "time":
+            return (
+                [int(t // bucket_s) * bucket_s for t in columns["timestamp"]],
+                lambda key: key,
+            )
+        if column is None:
+            return [0] * len(columns["timestamp"]), lambda key: "all"
+        if column in HASH_COLUMNS:
+            return columns[column], lambda key: key
+        values = categories[column]
+        return columns[column], lambda key: values[key]
+
+    def aggregate(
+        self,
+        column: str,
+        func: str = "sum",
+        group_by: Optional[str] = None,
+        bucket_s: int = 3600,
+        since: Optional[float] = None,
+    ) -> dict[Any, float]:
+        """列を集計.
+
+        Args:
+            column: 数値列名（NUMERIC_COLUMNS）
+            func: sum / mean / count / min / max / p50 / p95 / p99 など（pXX は分位点）
+            group_by: model / user / session / time / none
+            bucket_s: group_by="time" の場合のバケット幅（秒）
+            since: この時刻以降のレコードのみ対象（ローリング集計用）
+
+        Returns:
+            {グループ: 値}（欠損値 NaN は除外して集計。session のキーは session_key() の値）
+        """
+        if column not in NUMERIC_COLUMNS:
+            raise ValueError(f"Unknown numeric column: {column}")
+        group_column = self._group_column(group_by)
+        columns, categories = self._snapshot(
+            [column, "timestamp"] + ([group_column] if group_column else [])
+        )
+        if NUMPY_AVAILABLE:
+            return _aggregate_numpy(columns, categories, column, func, group_by, bucket_s, since)
+        return _aggregate_python(columns, categories, column, func, group_by, bucket_s, since)
+
+    def cache_hit_ratio(
+        self,
+        group_by: Optional[str] = None,
+        bucket_s: int = 3600,
+        since: Optional[float] = None,
+    ) -> dict[Any, Optional[float]]:
+        """プロンプトキャッシュのヒット率を集計.
+
+        ヒット率 = cache_read / (input + cache_read + cache_creation)
+        """
+        reads = self.aggregate("cache_read_input_tokens", "sum", group_by, bucket_s, since)
+        inputs = self.aggregate("input_tokens", "sum", group_by, bucket_s, since)
+        writes = self.aggregate(
+            "cache_creation_input_tokens", "sum", group_by, bucket_s, since
+        )
+        result = {}
+        for key, read in reads.items():
+            total = inputs.get(key, 0) + read + writes.get(key, 0)
+            result[key] = read / total if total else None
+        return result
+
+    def usage_rows(self, group_by: Optional[str] = None) -> Iterator[tuple]:
+        """トークン使用量を1レコードずつ返す（pricing.CostEngine 用）.
+
+        Args:
+            group_by: model / user / session / time / none（先頭要素のキー）
+
+        Yields:
+            (キー, model, input, output, cache_creation, cache_read)
+        """
+        group_column = self._group_column(group_by)
+        columns, categories = self._snapshot(
+            list(NUMERIC_COLUMNS) + ["model"] + ([group_column] if group_column else [])
+        )
+        keys, label = self._group_keys(columns, categories, group_by, 3600)
+        models = categories["model"]
+        model_codes = columns["model"]
+        inputs = columns["input_tokens"]
+        outputs = columns["output_tokens"]
+        cache_writes = columns["cache_creation_input_tokens"]
+        cache_reads = columns["cache_read_input_tokens"]
+        for i in range(len(model_codes)):
+            yield (
+                label(keys[i]),
+                models[model_codes[i]],
+                inputs[i],
+                outputs[i],
+                cache_writes[i],
+                cache_reads[i],
+            )
+
+    def save(self, directory: str):
+        """スナップショットをディレクトリに保存.
+
+        列ごとに生バイナリ（<列名>.bin）、カテゴリ辞書と型情報を meta.json に保存する。
+
+        Args:
+            directory: 保存先ディレクトリ
+        """
+        path = Path(directory)
+        path.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            for name, column in self._columns.items():
+                with open(path / f"{name}.bin", "wb") as f:
+                    f.write(column if isinstance(column, memoryview) else column.tobytes())
+            meta = {
+                "length": len(self),
+                "types": {name: _column_type(name) for name in self._columns},
+                "categories": self._categories,
+            }
+        (path / "meta.json").write_text(
+            json.dumps(meta, ensure_ascii=False), encoding="utf-8"
+        )
+
+    @classmethod
+    def load(cls, directory: str) -> "MetricsStore":
+        """スナップショットをメモリマップで読み込む.
+
+        列はファイルをメモリマップした memoryview として参照するため、
+        読み込み時にデータをコピーしない。追記すると書き込み可能な array にコピーされる。
+
+        Args:
+            directory: スナップショットのディレクトリ
+
+        Returns:
+            MetricsStore
+        """
+        path = Path(directory)
+        meta = json.loads((path / "meta.json").read_text(encoding="utf-8"))
+        store = cls()
+        store._mapped = []
+        for name, code in meta["types"].items():
+            with open(path / f"{name}.bin", "rb") as f:
+                if meta["length"] == 0:
+                    store._columns[name] = array(code)
+                    continue
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            store._mapped.append(mapped)
+            store._columns[name] = memoryview(mapped).cast(code)
+        for name, values in meta["categories"].items():
+            if name in HASH_COLUMNS:
+                # 辞書エンコードしていた頃のスナップショットはハッシュ列に変換
+                codes = store._columns[name]
+                store._columns[name] = array("q", (session_key(values[c]) for c in codes))
+                if isinstance(codes, memoryview):
+                    codes.release()
+                continue
+            store._categories[name] = values
+            store._codes[name] = {value: code for code, value in enumerate(values)}
+        if meta["length"] == 0:
+            store._mapped = None
+        return store
+
+
+def _aggregate_python(
+    columns: dict[str, array],
+    categories: dict[str, list],
+    column: str,
+    func: str,
+    group_by: Optional[str],
+    bucket_s: int,
+    since: Optional[float],
+) -> dict[Any, float]:
+    """純 Python での集計."""
+    values = columns[column]
+    timestamps = columns["timestamp"]
+    keys, label = MetricsStore._group_keys(columns, categories, group_by, bucket_s)
+
+    grouped: dict[Any, list[float]] = {}
+    for i in range(len(values)):
+        if since is not None and timestamps[i] < since:
+            continue
+        value = values[i]
+        if value != value:  # NaN
+            continue
+        grouped.setdefault(keys[i], []).append(value)
+
+    result = {}
+    for key, group_values in grouped.items():
+        result[label(key)] = _reduce_python(group_values, func)
+    return result
+
+def _aggregate_numpy(
+    columns: dict[str, array],
+    categories: dict[str, list],
+    column: str,
+    func: str,
+    group_by: Optional[str],
+    bucket_s: int,
+    since: Optional[float],
+) -> dict[Any, float]:
+    """NumPy でのベクトル化集計."""
+    dtype = np.float64 if NUMERIC_COLUMNS[column] == "d" else np.int64
+    values = np.frombuffer(columns[column], dtype=dtype).astype(np.float64)
+    timestamps = np.frombuffer(columns["timestamp"], dtype=np.float64)
+
+    if group_by is None or group_by == "none":
+        keys = np.zeros(len(values), dtype=np.int64)
+        label = lambda key: "all"  # noqa: E731
+    elif group_by == "time":
+        keys = (timestamps // bucket_s).astype(np.int64) * bucket_s
+        label = lambda key: int(key)  # noqa: E731
+    elif GROUP_BY_COLUMNS.get(group_by) in HASH_COLUMNS:
+        keys = np.frombuffer(columns[GROUP_BY_COLUMNS[group_by]], dtype=np.int64)
+        label = lambda key: int(key)  # noqa: E731
+    elif group_by in GROUP_BY_COLUMNS:
+        category_column = GROUP_BY_COLUMNS[group_by]
+        keys = np.frombuffer(columns[category_column], dtype=np.int32)
+        values_of = categories[category_column]
+        label = lambda key: values_of[key]  # noqa: E731
+    else:
+        raise ValueError(
+            f"group_by must be one of model / user / session / time / none: {group_by}"
+        )
+
+    mask = ~np.isnan(values)
+    if since is not None:
+        mask &= timestamps >= since
+    values = values[mask]
+    keys = keys[mask]
+    if len(values) == 0:
+        return {}
+
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    if func in ("sum", "mean", "count"):
+        sums = np.bincount(inverse, weights=values, minlength=len(unique_keys))
+        counts = np.bincount(inverse, minlength=len(unique_keys))
+        reduced = {"sum": sums, "count": counts, "mean": sums / counts}[func]
+        return {label(key): float(v) for key, v in zip(unique_keys, reduced)}
+
+    # 分位点・min・max はグループごとにソートして計算
+    order = np.argsort(inverse, kind="stable")
+    boundaries = np.searchsorted(inverse[order], np.arange(len(unique_keys) + 1))
+    sorted_values = values[order]
+    result = {}
+    for i, key in enumerate(unique_keys):
+        group_values = sorted_values[boundaries[i] : boundaries[i + 1]]
+        if func == "min":
+            result[label(key)] = float(group_values.min())
+        elif func == "max":
+            result[label(key)] = float(group_values.max())
+        else:
+            q = _parse_quantile(func)
+            result[label(key)] = float(np.quantile(group_values, q))
+    return result
+
+
+def _parse_quantile(func: str) -> float:
+    """"p95" 形式の指定を分位点（0.95）に変換."""
+    if not func.startswith("p"):
+        raise ValueError(f"Unknown aggregation: {func}")
+    return float(func[1:]) / 100
+
+
+def _reduce_python(values: list[float], func: str) -> float:
+    """純 Python での集計関数."""
+    if func == "sum":
+        return math.fsum(values)
+    if func == "count":
+        return float(len(values))
+    if func == "mean":
+        return math.fsum(values) / len(values)
+    if func == "min":
+        return min(values)
+    if func == "max":
+        return max(values)
+    return _percentile(sorted(values), _parse_quantile(func))
+
+
+# エージェントのリクエストを記録するデフォルトストア（configure_store() で設定）
+_default_store: Optional[MetricsStore] = None
+
+
+def configure_store(store: Optional[MetricsStore]):
+    """エージェントのリクエストを記録するストアを設定.
+
+    Args:
+        store: 記録先（Noneの場合は記録しない）
+    """
+    global _default_store
+    _default_store = store
+
+
+def get_default_store() -> Optional[MetricsStore]:
+    """デフォルトストアを返す."""
+    return _default_store
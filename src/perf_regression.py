@@ -0,0 +1,428 @@
+"""評価実行のパフォーマンス回帰レポート.
+
+評価実行の品質スコアだけでは、プロンプトやモデルの変更によるレイテンシ・トークン・
+コストの悪化に気づけない。このモジュールはケースごとのパフォーマンス
+（AgentMetrics から集計した値）をタグ別に集め、保存したベースラインと統計的に比較する。
+
+主な機能:
+1. ケースごとの指標: レイテンシ、TTFT、入出力トークン、キャッシュヒット率、コスト
+   （レポートの cases[].usage。出力を再利用したケース・失敗したケースは除外）
+2. タグ別（+ 全体 "all"）のサンプルの保存（ベースライン）と読み込み
+3. 統計的検定
+   - 中央値: Mann-Whitney の U 検定（正規近似、同順位補正あり）
+   - p95: ブートストラップによる p95 の比の信頼区間
+4. 回帰の判定: 悪化方向の変化が閾値を超え、かつ統計的に有意なもの
+   （例: "p95 latency_s +30% on tag tool-usage"）
+5. JSON レポートとコンソールのサマリー（回帰があれば終了コード 1）
+
+環境変数:
+    EVAL_PERF_BASELINE=.eval_cache/perf_baseline.json: 比較するベースライン（評価実行時に比較）
+    EVAL_PERF_THRESHOLD=0.1: 回帰とみなす変化率（+10%）
+    EVAL_PERF_ALPHA=0.05: 有意水準
+
+使用例:
+    # ベースラインを保存
+    python src/perf_regression.py --current evaluation_report.json --save-baseline .eval_cache/perf_baseline.json
+
+    # 比較（回帰があれば終了コード 1）
+    python src/perf_regression.py --current evaluation_report.json \
+        --baseline .eval_cache/perf_baseline.json --output perf_report.json
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Optional
+
+try:
+    from src.eval_dataset import iter_json_array
+except ImportError:
+    from eval_dataset import iter_json_array  # type: ignore
+
+BASELINE_VERSION = 1
+
+# 指標 -> 悪化の方向（"higher": 大きいほど悪い、"lower": 小さいほど悪い）
+PERF_FIELDS = {
+    "latency_s": "higher",
+    "ttft_ms": "higher",
+    "input_tokens": "higher",
+    "output_tokens": "higher",
+    "cost_usd": "higher",
+    "cache_hit_ratio": "lower",
+}
+
+# すべてのケースを集計するグループ
+ALL_TAG = "all"
+
+
+def percentile(values: list[float], q: float) -> float:
+    """分位点（ソート済みのリスト、RunSummary と同じ最近傍法）."""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+@dataclass
+class RegressionConfig:
+    """回帰判定の設定."""
+
+    # 回帰とみなす変化率（悪化方向）
+    threshold: float = 0.10
+
+    # 有意水準
+    alpha: float = 0.05
+
+    # グループごとの最小サンプル数（少ない場合は判定しない）
+    min_samples: int = 5
+
+    # p95 のブートストラップの反復回数と乱数シード
+    bootstrap_iterations: int = 1000
+    seed: int = 0
+
+    @classmethod
+    def from_env(cls) -> "RegressionConfig":
+        """環境変数から設定を生成."""
+        return cls(
+            threshold=float(os.getenv("EVAL_PERF_THRESHOLD", "0.1")),
+            alpha=float(os.getenv("EVAL_PERF_ALPHA", "0.05")),
+        )
+
+
+class PerfSamples:
+    """タグ別・指標別のケースごとの値."""
+
+    def __init__(self, groups: Optional[dict[str, dict[str, list[float]]]] = None):
+        # タグ -> 指標 -> 値のリスト
+        self.groups: dict[str, dict[str, list[float]]] = groups or {}
+
+    def add_case(self, case: dict):
+        """レポートのケース（ReportBuilder の形式）を追加.
+
+        出力を再利用したケースは前回のレイテンシを持つため除外する。
+        """
+        if case.get("error") is not None or case.get("output_reused"):
+            return
+        usage = case.get("usage") or {}
+        for tag in [ALL_TAG, *(case.get("tags") or [])]:
+            group = self.groups.setdefault(tag, {})
+            for name in PERF_FIELDS:
+                value = usage.get(name)
+                if value is not None:
+                    group.setdefault(name, []).append(float(value))
+
+    @classmethod
+    def from_cases(cls, cases: Iterable[dict]) -> "PerfSamples":
+        """ケースのイテラブルから作成."""
+        samples = cls()
+        for case in cases:
+            samples.add_case(case)
+        return samples
+
+    @classmethod
+    def from_report(cls, path: str) -> "PerfSamples":
+        """評価レポート（JSON）から作成（ケースは1件ずつ読み出す）."""
+        return cls.from_cases(iter_json_array(path, "cases"))
+
+    @classmethod
+    def load(cls, path: str) -> "PerfSamples":
+        """保存したベースライン、または評価レポートを読み込む."""
+        with open(path, "r", encoding="utf-8") as f:
+            head = f.read(256)
+        if '"perf_baseline_version"' not in head:
+            return cls.from_report(path)
+        data = json.loads(Path(path).read_text(encoding="utf-8"))
+        if data.get("perf_baseline_version") != BASELINE_VERSION:
+            raise ValueError(f"Unsupported baseline version: {path}")
+        return cls(data["groups"])
+
+    def save(self, path: str, run_id: Optional[str] = None):
+        """ベースラインとして保存."""
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        Path(path).write_text(
+            json.dumps(
+                {"perf_baseline_version": BASELINE_VERSION, "run_id": run_id, "groups": self.groups},
+                ensure_ascii=False,
+            ),
+            encoding="utf-8",
+        )
+
+
+def mann_whitney_u(a: list[float], b: list[float]) -> float:
+    """Mann-Whitney の U 検定の両側 p 値（正規近似、同順位補正あり）.
+
+    Args:
+        a: 標本1
+        b: 標本2
+
+    Returns:
+        p 値（差がない場合は 1.0）
+    """
+    n1, n2 = len(a), len(b)
+    combined = sorted([(value, 0) for value in a] + [(value, 1) for value in b])
+    # 同順位には平均順位を付ける
+    ranks = [0.0] * len(combined)
+    tie_term = 0.0
+    i = 0
+    while i < len(combined):
+        j = i
+        while j + 1 < len(combined) and combined[j + 1][0] == combined[i][0]:
+            j += 1
+        for k in range(i, j + 1):
+            ranks[k] = (i + j) / 2 + 1
+        ties = j - i + 1
+        tie_term += ties**3 - ties
+        i = j + 1
+    rank_sum = sum(rank for rank, (_, group) in zip(ranks, combined) if group == 0)
+    u = rank_sum - n1 * (n1 + 1) / 2
+    n = n1 + n2
+    variance = n1 * n2 / 12 * ((n + 1) - tie_term / (n * (n - 1)))
+    if variance <= 0:
+        return 1.0
+    # 連続性補正
+    z = (abs(u - n1 * n2 / 2) - 0.5) / math.sqrt(variance)
+    return min(1.0, math.erfc(max(z, 0.0) / math.sqrt(2)))
+
+
+def bootstrap_ratio_ci(
+    baseline: list[float],
+    current: list[float],
+    q: float = 0.95,
+    iterations: int = 1000,
+    seed: int = 0,
+    confidence: float = 0.95,
+) -> tuple[Optional[float], Optional[float]]:
+    """分位点の比（current / baseline）のブートストラップ信頼区間.
+
+    Args:
+        baseline: ベースラインの値
+        current: 今回の値
+        q: 分位点
+        iterations: 反復回数
+        seed: 乱数シード（同じ入力なら同じ結果）
+        confidence: 信頼水準
+
+    Returns:
+        (下限, 上限)（ベースラインの分位点が0になる場合は None）
+    """
+    rng = random.Random(seed)
+    ratios = []
+    for _ in range(iterations):
+        base = percentile(sorted(rng.choices(baseline, k=len(baseline))), q)
+        cur = percentile(sorted(rng.choices(current, k=len(current))), q)
+        if base > 0:
+            ratios.append(cur / base)
+    if len(ratios) < iterations / 2:
+        return None, None
+    ratios.sort()
+    tail = (1 - confidence) / 2
+    return percentile(ratios, tail), percentile(ratios, 1 - tail)
+
+
+def _relative_change(baseline: float, current: float) -> Optional[float]:
+    """変化率（ベースラインが0の場合None）."""
+    if baseline == 0:
+        return None
+    return (current - baseline) / baseline
+
+
+def compare_group(
+    tag: str,
+    name: str,
+    baseline: list[float],
+    current: list[float],
+    config: RegressionConfig,
+) -> dict:
+    """1つのタグ・指標を比較.
+
+    Returns:
+        比較結果の辞書（regression / improvement に判定）
+    """
+    baseline, current = sorted(baseline), sorted(current)
+    result: dict = {
+        "tag": tag,
+        "metric": name,
+        "n_baseline": len(baseline),
+        "n_current": len(current),
+        "status": "insufficient",
+    }
+    if len(baseline) < config.min_samples or len(current) < config.min_samples:
+        return result
+
+    worse_sign = 1 if PERF_FIELDS[name] == "higher" else -1
+    base_p50, cur_p50 = percentile(baseline, 0.5), percentile(current, 0.5)
+    base_p95, cur_p95 = percentile(baseline, 0.95), percentile(current, 0.95)
+    p_value = mann_whitney_u(baseline, current)
+    p95_low, p95_high = bootstrap_ratio_ci(
+        baseline, current, 0.95, config.bootstrap_iterations, config.seed
+    )
+    result.update(
+        {
+            "baseline_p50": base_p50,
+            "current_p50": cur_p50,
+            "p50_change": _relative_change(base_p50, cur_p50),
+            "baseline_p95": base_p95,
+            "current_p95": cur_p95,
+            "p95_change": _relative_change(base_p95, cur_p95),
+            "p95_ratio_ci": [p95_low, p95_high],
+            "p_value": p_value,
+        }
+    )
+
+    # 中央値: U 検定が有意で変化率が閾値を超える
+    # p95: 比の信頼区間が 1 をまたがず、変化率が閾値を超える
+    findings = []
+    for statistic, change, significant_worse, significant_better in (
+        (
+            "p50",
+            result["p50_change"],
+            p_value < config.alpha,
+            p_value < config.alpha,
+        ),
+        (
+            "p95",
+            result["p95_change"],
+            p95_low is not None and (p95_low > 1 if worse_sign > 0 else p95_high < 1),
+            p95_low is not None and (p95_high < 1 if worse_sign > 0 else p95_low > 1),
+        ),
+    ):
+        if change is None:
+            continue
+        if change * worse_sign > config.threshold and significant_worse:
+            findings.append(("regression", statistic, change))
+        elif change * worse_sign < -config.threshold and significant_better:
+            findings.append(("improvement", statistic, change))
+
+    if any(kind == "regression" for kind, _, _ in findings):
+        result["status"] = "regression"
+    elif findings:
+        result["status"] = "improvement"
+    else:
+        result["status"] = "unchanged"
+    result["findings"] = [
+        f"{statistic} {name} {change:+.0%} on tag {tag}"
+        for kind, statistic, change in findings
+        if kind == result["status"]
+    ]
+    return result
+
+
+def compare(
+    baseline: PerfSamples,
+    current: PerfSamples,
+    config: Optional[RegressionConfig] = None,
+) -> dict:
+    """ベースラインと今回のサンプルを比較.
+
+    Args:
+        baseline: ベースライン
+        current: 今回の評価実行
+        config: 判定の設定（Noneの場合は環境変数から生成）
+
+    Returns:
+        {"config", "comparisons", "regressions", "improvements"}
+    """
+    config = config or RegressionConfig.from_env()
+    comparisons = []
+    for tag in sorted(set(baseline.groups) | set(current.groups), key=lambda t: (t != ALL_TAG, t)):
+        for name in PERF_FIELDS:
+            base_values = baseline.groups.get(tag, {}).get(name, [])
+            cur_values = current.groups.get(tag, {}).get(name, [])
+            if base_values or cur_values:
+                comparisons.append(compare_group(tag, name, base_values, cur_values, config))
+    return {
+        "config": {
+            "threshold": config.threshold,
+            "alpha": config.alpha,
+            "min_samples": config.min_samples,
+            "bootstrap_iterations": config.bootstrap_iterations,
+        },
+        "comparisons": comparisons,
+        "regressions": [f for c in comparisons if c["status"] == "regression" for f in c["findings"]],
+        "improvements": [f for c in comparisons if c["status"] == "improvement" for f in c["findings"]],
+    }
+
+
+def format_comparison(result: dict) -> list[str]:
+    """比較結果の表示行.
+
+    Args:
+        result: compare() の戻り値
+
+    Returns:
+        表示行のリスト
+    """
+    lines = []
+    overall = [c for c in result["comparisons"] if c["tag"] == ALL_TAG and c["status"] != "insufficient"]
+    for comparison in overall:
+        p50_change = comparison["p50_change"]
+        p95_change = comparison["p95_change"]
+        lines.append(
+            f"  {comparison['metric']:<16} p50 {comparison['baseline_p50']:.4g} → {comparison['current_p50']:.4g}"
+            + (f" ({p50_change:+.0%})" if p50_change is not None else "")
+            + f", p95 {comparison['baseline_p95']:.4g} → {comparison['current_p95']:.4g}"
+            + (f" ({p95_change:+.0%})" if p95_change is not None else "")
+            + f", p={comparison['p_value']:.3f}"
+        )
+    insufficient = sum(1 for c in result["comparisons"] if c["status"] == "insufficient")
+    if insufficient:
+        lines.append(
+            f"  ({insufficient} tag/metric groups have fewer than "
+            f"{result['config']['min_samples']} samples and were not tested)"
+        )
+    for finding in result["regressions"]:
+        lines.append(f"  ⚠️ Regression: {finding}")
+    for finding in result["improvements"]:
+        lines.append(f"  ✅ Improvement: {finding}")
+    if not result["regressions"]:
+        lines.append("  ✅ No performance regression")
+    return lines
+
+
+def main():
+    """ベースラインの保存・比較のコマンド."""
+    defaults = RegressionConfig.from_env()
+    parser = argparse.ArgumentParser(description="Compare evaluation performance against a baseline")
+    parser.add_argument("--current", required=True, help="今回の評価レポート（JSON）")
+    parser.add_argument(
+        "--baseline",
+        default=os.getenv("EVAL_PERF_BASELINE"),
+        help="ベースライン（--save-baseline で保存したもの、または評価レポート）",
+    )
+    parser.add_argument("--save-baseline", default=None, help="今回の値をベースラインとして保存")
+    parser.add_argument("--output", default=None, help="比較結果（JSON）の出力先")
+    parser.add_argument("--threshold", type=float, default=defaults.threshold, help="回帰とみなす変化率")
+    parser.add_argument("--alpha", type=float, default=defaults.alpha, help="有意水準")
+    args = parser.parse_args()
+
+    current = PerfSamples.from_report(args.current)
+    if args.save_baseline:
+        current.save(args.save_baseline)
+        print(f"✅ Baseline saved to: {args.save_baseline}")
+    if not args.baseline:
+        if not args.save_baseline:
+            parser.error("--baseline or --save-baseline is required")
+        return
+
+    result = compare(
+        PerfSamples.load(args.baseline),
+        current,
+        RegressionConfig(threshold=args.threshold, alpha=args.alpha),
+    )
+    print(f"📈 Performance vs baseline ({args.baseline}):")
+    for line in format_comparison(result):
+        print(line)
+    if args.output:
+        Path(args.output).write_text(
+            json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8"
+        )
+        print(f"📄 Report saved to: {args.output}")
+    sys.exit(1 if result["regressions"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,725 @@
+"""トークンコストの計算・配賦・シミュレーション.
+
+AgentMetrics.total_cost_usd は ResultMessage に含まれる場合のみ取得できるが、
+評価用LLM（BedrockEvaluator）や ApplyGuardrail のテキストユニット、
+モデルの切り替えやキャッシュ改善の効果は計算できない。
+このモジュールはバージョン付きの料金表からコストを計算する。
+
+主な機能:
+1. バージョン付きのモデル別料金表（入力・出力・キャッシュ書き込み・キャッシュ読み込み）
+2. ApplyGuardrail のテキストユニット料金（フィルタータイプ別）
+3. CostLedger: リクエスト・セッション・ユーザー・タグ・モデル・発生元ごとのコスト配賦
+4. What-if シミュレーション（例: トラフィックの40%を Haiku に移した場合）
+
+環境変数:
+    PRICING_TABLE_PATH: 追加の料金表（JSON）のパス
+    PRICING_TABLE_VERSION: 使用する料金表のバージョン（未指定の場合は最新）
+
+使用例:
+    engine = CostEngine()
+    engine.token_cost("anthropic.claude-3-5-sonnet-20241022-v2:0", 1200, 350).total_usd
+    engine.guardrail_cost(len(text), filters=("content", "sensitive_information"))
+    engine.simulate(store, WhatIf(model_shift={"claude-3-5-haiku": 0.4}))
+"""
+
+import json
+import math
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Iterable, Optional
+
+# 1 テキストユニット = 1,000文字（1,000文字未満は1ユニットに切り上げ）
+TEXT_UNIT_CHARS = 1000
+
+# コストの発生元
+SOURCE_AGENT = "agent"
+SOURCE_EVALUATOR = "evaluator"
+SOURCE_GUARDRAIL = "guardrail"
+
+# ApplyGuardrail のデフォルトのフィルター（Content + Denied topics + PII）
+DEFAULT_GUARDRAIL_FILTERS = ("content", "denied_topics", "sensitive_information")
+
+# ApplyGuardrail のレスポンスの usage のキー -> フィルタータイプ
+# （sensitiveInformationPolicyFreeUnits は無料のため含めない）
+GUARDRAIL_USAGE_FILTERS = {
+    "contentPolicyUnits": "content",
+    "topicPolicyUnits": "denied_topics",
+    "sensitiveInformationPolicyUnits": "sensitive_information",
+    "contextualGroundingPolicyUnits": "contextual_grounding",
+    "wordPolicyUnits": "word",
+}
+
+# モデルIDのリージョンプレフィックス（クロスリージョン推論プロファイル）
+_REGION_PREFIXES = ("us.", "eu.", "apac.", "global.")
+
+
+@dataclass(frozen=True)
+class ModelPrice:
+    """モデルの料金（USD / 100万トークン）."""
+
+    input: float
+    output: float
+    cache_write: Optional[float] = None
+    cache_read: Optional[float] = None
+
+    def cache_write_rate(self) -> float:
+        """キャッシュ書き込み料金（未設定の場合は入力料金の1.25倍）."""
+        return self.input * 1.25 if self.cache_write is None else self.cache_write
+
+    def cache_read_rate(self) -> float:
+        """キャッシュ読み込み料金（未設定の場合は入力料金の0.1倍）."""
+        return self.input * 0.1 if self.cache_read is None else self.cache_read
+
+
+@dataclass
+class PriceTable:
+    """バージョン付きの料金表.
+
+    models のキーはモデルIDの一部（"claude-3-5-sonnet" など）。
+    モデルIDに含まれる最も長いキーの料金を使う。
+    """
+
+    version: str
+    effective_date: str
+    models: dict[str, ModelPrice]
+    # フィルタータイプ -> USD / 1,000 テキストユニット
+    guardrail_per_1000_units: dict[str, float] = field(default_factory=dict)
+    description: str = ""
+
+    def model_key(self, model: Optional[str]) -> str:
+        """モデルIDに対応する料金表のキーを返す（"claude-3-5-haiku" など）.
+
+        Args:
+            model: Bedrock モデルID（"us.anthropic.claude-3-5-haiku-20241022-v1:0" など）
+
+        Returns:
+            料金表のキー
+
+        Raises:
+            KeyError: 料金表にないモデルの場合
+        """
+        normalized = normalize_model_id(model or "")
+        matches = [key for key in self.models if key in normalized]
+        if not matches:
+            raise KeyError(f"No price for model {model!r} in table {self.version}")
+        return max(matches, key=len)
+
+    def model_price(self, model: Optional[str]) -> ModelPrice:
+        """モデルIDの料金を返す.
+
+        Args:
+            model: Bedrock モデルID（"us.anthropic.claude-3-5-haiku-20241022-v1:0" など）
+
+        Returns:
+            ModelPrice
+
+        Raises:
+            KeyError: 料金表にないモデルの場合
+        """
+        return self.models[self.model_key(model)]
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "PriceTable":
+        """辞書（JSON）から生成."""
+        return cls(
+            version=data["version"],
+            effective_date=data["effective_date"],
+            models={key: ModelPrice(**value) for key, value in data["models"].items()},
+            guardrail_per_1000_units=data.get("guardrail_per_1000_units", {}),
+            description=data.get("description", ""),
+        )
+
+
+def normalize_model_id(model: str) -> str:
+    """モデルIDからリージョンプレフィックスとプロバイダーを除く."""
+    for prefix in _REGION_PREFIXES:
+        if model.startswith(prefix):
+            model = model[len(prefix) :]
+            break
+    return model.removeprefix("anthropic.")
+
+
+# Bedrock オンデマンド料金（us-east-1、USD / 100万トークン）
+# 料金改定時は新しいバージョンを追加する（過去のバージョンは再計算のため残す）
+BEDROCK_2025_06 = PriceTable(
+    version="bedrock-2025-06",
+    effective_date="2025-06-01",
+    description="Amazon Bedrock on-demand, us-east-1",
+    models={
+        "claude-3-haiku": ModelPrice(0.25, 1.25, 0.30, 0.03),
+        "claude-3-5-haiku": ModelPrice(0.80, 4.00, 1.00, 0.08),
+        "claude-3-sonnet": ModelPrice(3.00, 15.00),
+        "claude-3-5-sonnet": ModelPrice(3.00, 15.00, 3.75, 0.30),
+        "claude-3-7-sonnet": ModelPrice(3.00, 15.00, 3.75, 0.30),
+        "claude-sonnet-4": ModelPrice(3.00, 15.00, 3.75, 0.30),
+        "claude-haiku-4-5": ModelPrice(1.00, 5.00, 1.25, 0.10),
+        "claude-3-opus": ModelPrice(15.00, 75.00),
+        "claude-opus-4": ModelPrice(15.00, 75.00, 18.75, 1.50),
+        "claude-opus-4-5": ModelPrice(5.00, 25.00, 6.25, 0.50),
+    },
+    guardrail_per_1000_units={
+        "content": 0.15,
+        "denied_topics": 0.15,
+        "sensitive_information": 0.10,
+        "contextual_grounding": 0.10,
+        "word": 0.0,
+    },
+)
+
+PRICE_TABLES: dict[str, PriceTable] = {BEDROCK_2025_06.version: BEDROCK_2025_06}
+
+
+def load_price_tables(path: str) -> list[PriceTable]:
+    """JSON ファイルから料金表を読み込んで登録.
+
+    ファイルは PriceTable の辞書、またはそのリスト。
+
+    Args:
+        path: JSON ファイルのパス
+
+    Returns:
+        読み込んだ料金表
+    """
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    tables = [PriceTable.from_dict(item) for item in (data if isinstance(data, list) else [data])]
+    for table in tables:
+        PRICE_TABLES[table.version] = table
+    return tables
+
+
+def get_price_table(version: Optional[str] = None) -> PriceTable:
+    """料金表を返す.
+
+    Args:
+        version: バージョン（Noneの場合は PRICING_TABLE_VERSION、未設定なら最新）
+
+    Returns:
+        PriceTable
+    """
+    version = version or os.getenv("PRICING_TABLE_VERSION")
+    if version:
+        return PRICE_TABLES[version]
+    return max(PRICE_TABLES.values(), key=lambda table: table.effective_date)
+
+
+if os.getenv("PRICING_TABLE_PATH"):
+    load_price_tables(os.environ["PRICING_TABLE_PATH"])
+
+
+def text_units(chars: int) -> int:
+    """ApplyGuardrail のテキストユニット数（切り上げ、空でも1ユニット）."""
+    return max(1, math.ceil(chars / TEXT_UNIT_CHARS))
+
+
+@dataclass
+class CostBreakdown:
+    """コストの内訳（USD）."""
+
+    input_usd: float = 0.0
+    output_usd: float = 0.0
+    cache_write_usd: float = 0.0
+    cache_read_usd: float = 0.0
+    guardrail_usd: float = 0.0
+    table_version: str = ""
+
+    @property
+    def total_usd(self) -> float:
+        """合計."""
+        return (
+            self.input_usd
+            + self.output_usd
+            + self.cache_write_usd
+            + self.cache_read_usd
+            + self.guardrail_usd
+        )
+
+    def to_dict(self) -> dict:
+        """辞書に変換（Langfuse メタデータ用）."""
+        return {
+            "input_usd": self.input_usd,
+            "output_usd": self.output_usd,
+            "cache_write_usd": self.cache_write_usd,
+            "cache_read_usd": self.cache_read_usd,
+            "guardrail_usd": self.guardrail_usd,
+            "total_usd": self.total_usd,
+            "price_table": self.table_version,
+        }
+
+
+@dataclass
+class WhatIf:
+    """What-if シミュレーションのシナリオ.
+
+    Attributes:
+        model_shift: 移行先モデル -> 移行するトラフィックの割合（他モデルの各リクエストから按分）
+        cache_read_ratio: 入力トークンのうちキャッシュから読む割合（Noneの場合は実績のまま）
+        price_table: 使用する料金表のバージョン（Noneの場合は CostEngine と同じ）
+    """
+
+    model_shift: dict[str, float] = field(default_factory=dict)
+    cache_read_ratio: Optional[float] = None
+    price_table: Optional[str] = None
+
+
+@dataclass
+class SimulationResult:
+    """What-if シミュレーションの結果."""
+
+    requests: int
+    baseline_usd: float
+    simulated_usd: float
+    baseline_by_model: dict[str, float]
+    simulated_by_model: dict[str, float]
+
+    @property
+    def delta_usd(self) -> float:
+        """差額（マイナスは削減）."""
+        return self.simulated_usd - self.baseline_usd
+
+    @property
+    def delta_ratio(self) -> Optional[float]:
+        """差額の割合."""
+        return self.delta_usd / self.baseline_usd if self.baseline_usd else None
+
+
+class CostEngine:
+    """料金表に基づくコスト計算エンジン."""
+
+    def __init__(self, table: Optional[PriceTable] = None):
+        """初期化.
+
+        Args:
+            table: 料金表（Noneの場合は get_price_table()）
+        """
+        self.table = table or get_price_table()
+
+    def token_cost(
+        self,
+        model: Optional[str],
+        input_tokens: int = 0,
+        output_tokens: int = 0,
+        cache_write_tokens: int = 0,
+        cache_read_tokens: int = 0,
+    ) -> CostBreakdown:
+        """トークン数からコストを計算.
+
+        input_tokens はキャッシュ対象外の入力トークン（Anthropic の usage と同じ定義）。
+
+        Args:
+            model: モデルID
+            input_tokens: 入力トークン
+            output_tokens: 出力トークン
+            cache_write_tokens: キャッシュ書き込みトークン
+            cache_read_tokens: キャッシュ読み込みトークン
+
+        Returns:
+            CostBreakdown
+        """
+        price = self.table.model_price(model)
+        return CostBreakdown(
+            input_usd=input_tokens * price.input / 1e6,
+            output_usd=output_tokens * price.output / 1e6,
+            cache_write_usd=cache_write_tokens * price.cache_write_rate() / 1e6,
+            cache_read_usd=cache_read_tokens * price.cache_read_rate() / 1e6,
+            table_version=self.table.version,
+        )
+
+    def metrics_cost(self, metrics: Any, model: Optional[str]) -> CostBreakdown:
+        """AgentMetrics のコストを計算.
+
+        Args:
+            metrics: AgentMetrics
+            model: モデルID
+
+        Returns:
+            CostBreakdown
+        """
+        return self.token_cost(
+            model,
+            metrics.input_tokens,
+            metrics.output_tokens,
+            metrics.cache_creation_input_tokens,
+            metrics.cache_read_input_tokens,
+        )
+
+    def guardrail_cost(
+        self,
+        chars: int,
+        filters: Iterable[str] = DEFAULT_GUARDRAIL_FILTERS,
+    ) -> CostBreakdown:
+        """ApplyGuardrail 1回分のコストを計算.
+
+        Args:
+            chars: チェック対象テキストの文字数
+            filters: 有効なフィルタータイプ（複数の場合は合算）
+
+        Returns:
+            CostBreakdown
+        """
+        rates = self.table.guardrail_per_1000_units
+        per_unit = sum(rates[name] for name in filters) / 1000
+        return CostBreakdown(
+            guardrail_usd=text_units(chars) * per_unit,
+            table_version=self.table.version,
+        )
+
+    def guardrail_usage_cost(self, usage: dict) -> CostBreakdown:
+        """ApplyGuardrail のレスポンスの usage（課金されたテキストユニット）からコストを計算.
+
+        Args:
+            usage: レスポンスの "usage"（contentPolicyUnits など）
+
+        Returns:
+            CostBreakdown
+        """
+        rates = self.table.guardrail_per_1000_units
+        usd = math.fsum(
+            usage.get(key, 0) * rates.get(name, 0.0) / 1000
+            for key, name in GUARDRAIL_USAGE_FILTERS.items()
+        )
+        return CostBreakdown(guardrail_usd=usd, table_version=self.table.version)
+
+    def simulate(self, source: Any, scenario: WhatIf) -> SimulationResult:
+        """記録済みのメトリクスで What-if シミュレーションを実行.
+
+        各リクエストのトークン数は変わらないものとし、移行割合で按分した期待値を計算する。
+        モデル別の内訳のキーは料金表のキー（"claude-3-5-haiku" など）。
+
+        Args:
+            source: usage_rows() を持つもの（MetricsStore / CostLedger）
+            scenario: シナリオ
+
+        Returns:
+            SimulationResult
+        """
+        if sum(scenario.model_shift.values()) > 1.0:
+            raise ValueError("model_shift fractions must sum to 1.0 or less")
+        target = (
+            CostEngine(get_price_table(scenario.price_table))
+            if scenario.price_table
+            else self
+        )
+        baseline_by_model: dict[str, float] = {}
+        simulated_by_model: dict[str, float] = {}
+        requests = 0
+
+        for _, model, input_tokens, output_tokens, cache_write, cache_read in source.usage_rows():
+            if model is None:
+                continue
+            requests += 1
+            baseline = self.token_cost(
+                model, input_tokens, output_tokens, cache_write, cache_read
+            ).total_usd
+            baseline_key = self.table.model_key(model)
+            baseline_by_model[baseline_key] = baseline_by_model.get(baseline_key, 0.0) + baseline
+            current_key = target.table.model_key(model)
+
+            if scenario.cache_read_ratio is not None:
+                # キャッシュ対象外 + キャッシュ読み込みの合計を再配分
+                prompt_tokens = input_tokens + cache_read
+                cache_read = round(prompt_tokens * scenario.cache_read_ratio)
+                input_tokens = prompt_tokens - cache_read
+
+            remaining = 1.0
+            for shifted_model, fraction in scenario.model_shift.items():
+                shifted_key = target.table.model_key(shifted_model)
+                if shifted_key == current_key:
+                    continue
+                cost = target.token_cost(
+                    shifted_model, input_tokens, output_tokens, cache_write, cache_read
+                ).total_usd
+                simulated_by_model[shifted_key] = (
+                    simulated_by_model.get(shifted_key, 0.0) + cost * fraction
+                )
+                remaining -= fraction
+            cost = target.token_cost(
+                model, input_tokens, output_tokens, cache_write, cache_read
+            ).total_usd
+            simulated_by_model[current_key] = (
+                simulated_by_model.get(current_key, 0.0) + cost * remaining
+            )
+
+        return SimulationResult(
+            requests=requests,
+            baseline_usd=math.fsum(baseline_by_model.values()),
+            simulated_usd=math.fsum(simulated_by_model.values()),
+            baseline_by_model=baseline_by_model,
+            simulated_by_model=simulated_by_model,
+        )
+
+
+@dataclass
+class CostEntry:
+    """コスト台帳の1エントリ."""
+
+    source: str
+    model: Optional[str]
+    cost: CostBreakdown
+    request_id: Optional[str] = None
+    session_id: Optional[str] = None
+    user_id: Optional[str] = None
+    tags: list[str] = field(default_factory=list)
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cache_write_tokens: int = 0
+    cache_read_tokens: int = 0
+    # ResultMessage などの実績値（ある場合）
+    reported_usd: Optional[float] = None
+    # 料金表にモデルがなくコストを計算できなかった場合 False
+    priced: bool = True
+
+
+# group_by の指定 -> CostEntry の属性
+_LEDGER_GROUPS = {
+    "request": "request_id",
+    "session": "session_id",
+    "user": "user_id",
+    "model": "model",
+    "source": "source",
+}
+
+
+class CostLedger:
+    """コストの台帳.
+
+    エージェント・評価用LLM・ApplyGuardrail のコストを記録し、
+    リクエスト・セッション・ユーザー・タグ・モデル・発生元ごとに集計する。
+    """
+
+    def __init__(self, engine: Optional[CostEngine] = None):
+        """初期化.
+
+        Args:
+            engine: コスト計算エンジン（Noneの場合はデフォルトの料金表）
+        """
+        self.engine = engine or CostEngine()
+        self.entries: list[CostEntry] = []
+        self.unpriced_models: set[str] = set()
+        self._lock = threading.Lock()
+
+    def _token_cost(self, model: Optional[str], *tokens: int) -> Optional[CostBreakdown]:
+        """コストを計算（料金表にないモデルは警告して None）."""
+        try:
+            return self.engine.token_cost(model, *tokens)
+        except KeyError:
+            if model not in self.unpriced_models:
+                self.unpriced_models.add(model)
+                print(f"⚠️ No price for model {model!r} in {self.engine.table.version}")
+            return None
+
+    def _add(self, entry: CostEntry) -> CostEntry:
+        with self._lock:
+            self.entries.append(entry)
+        return entry
+
+    def record_metrics(
+        self,
+        metrics: Any,
+        model: Optional[str],
+        user_id: Optional[str] = None,
+        tags: Optional[list[str]] = None,
+        request_id: Optional[str] = None,
+    ) -> CostEntry:
+        """エージェントのリクエストを記録.
+
+        Args:
+            metrics: AgentMetrics
+            model: モデルID
+            user_id: ユーザーID
+            tags: タグ
+            request_id: リクエストID
+
+        Returns:
+            CostEntry
+        """
+        cost = self._token_cost(
+            model,
+            metrics.input_tokens,
+            metrics.output_tokens,
+            metrics.cache_creation_input_tokens,
+            metrics.cache_read_input_tokens,
+        )
+        return self._add(
+            CostEntry(
+                source=SOURCE_AGENT,
+                model=model,
+                cost=cost or CostBreakdown(table_version=self.engine.table.version),
+                priced=cost is not None,
+                request_id=request_id,
+                session_id=metrics.session_id,
+                user_id=user_id,
+                tags=list(tags or []),
+                input_tokens=metrics.input_tokens,
+                output_tokens=metrics.output_tokens,
+                cache_write_tokens=metrics.cache_creation_input_tokens,
+                cache_read_tokens=metrics.cache_read_input_tokens,
+                reported_usd=metrics.total_cost_usd,
+            )
+        )
+
+    def record_tokens(
+        self,
+        source: str,
+        model: Optional[str],
+        input_tokens: int,
+        output_tokens: int,
+        cache_write_tokens: int = 0,
+        cache_read_tokens: int = 0,
+        **attribution: Any,
+    ) -> CostEntry:
+        """トークン数を記録（評価用LLMなど）.
+
+        Args:
+            source: 発生元（SOURCE_*）
+            model: モデルID
+            input_tokens: 入力トークン
+            output_tokens: 出力トークン
+            cache_write_tokens: キャッシュ書き込みトークン
+            cache_read_tokens: キャッシュ読み込みトークン
+            **attribution: request_id / session_id / user_id / tags
+
+        Returns:
+            CostEntry
+        """
+        cost = self._token_cost(
+            model, input_tokens, output_tokens, cache_write_tokens, cache_read_tokens
+        )
+        return self._add(
+            CostEntry(
+                source=source,
+                model=model,
+                cost=cost or CostBreakdown(table_version=self.engine.table.version),
+                priced=cost is not None,
+                input_tokens=input_tokens,
+                output_tokens=output_tokens,
+                cache_write_tokens=cache_write_tokens,
+                cache_read_tokens=cache_read_tokens,
+                **attribution,
+            )
+        )
+
+    def record_guardrail(
+        self,
+        chars: int,
+        filters: Iterable[str] = DEFAULT_GUARDRAIL_FILTERS,
+        usage: Optional[dict] = None,
+        **attribution: Any,
+    ) -> CostEntry:
+        """ApplyGuardrail の呼び出しを記録.
+
+        レスポンスの usage を渡した場合は課金されたテキストユニットから計算し、
+        ない場合は文字数と filters から見積もる。
+
+        Args:
+            chars: チェック対象テキストの文字数
+            filters: 有効なフィルタータイプ
+            usage: ApplyGuardrail のレスポンスの "usage"
+            **attribution: request_id / session_id / user_id / tags
+
+        Returns:
+            CostEntry
+        """
+        if usage:
+            cost = self.engine.guardrail_usage_cost(usage)
+        else:
+            cost = self.engine.guardrail_cost(chars, filters)
+        return self._add(
+            CostEntry(source=SOURCE_GUARDRAIL, model=None, cost=cost, **attribution)
+        )
+
+    def totals(self, group_by: str = "source") -> dict[Any, float]:
+        """グループごとの合計コスト（USD）.
+
+        tag の場合、複数のタグを持つエントリは各タグに計上する（合計は全体と一致しない）。
+
+        Args:
+            group_by: request / session / user / tag / model / source
+
+        Returns:
+            {グループ: USD}
+        """
+        result: dict[Any, float] = {}
+        with self._lock:
+            entries = list(self.entries)
+        for entry in entries:
+            if group_by == "tag":
+                keys = entry.tags or ["none"]
+            elif group_by in _LEDGER_GROUPS:
+                keys = [getattr(entry, _LEDGER_GROUPS[group_by])]
+            else:
+                raise ValueError(
+                    f"group_by must be one of {', '.join([*_LEDGER_GROUPS, 'tag'])}: {group_by}"
+                )
+            for key in keys:
+                result[key] = result.get(key, 0.0) + entry.cost.total_usd
+        return result
+
+    def total_usd(self) -> float:
+        """全体の合計コスト（USD）."""
+        with self._lock:
+            return math.fsum(entry.cost.total_usd for entry in self.entries)
+
+    def usage_rows(self) -> Iterable[tuple]:
+        """トークンを持つエントリを (request_id, model, input, output, cache_write, cache_read) で返す."""
+        with self._lock:
+            entries = list(self.entries)
+        for entry in entries:
+            if entry.model is None or not entry.priced:
+                continue
+            yield (
+                entry.request_id,
+                entry.model,
+                entry.input_tokens,
+                entry.output_tokens,
+                entry.cache_write_tokens,
+                entry.cache_read_tokens,
+            )
+
+
+def attribute_store_costs(
+    store: Any, group_by: str = "user", engine: Optional[CostEngine] = None
+) -> dict[Any, float]:
+    """MetricsStore の記録からグループごとのコストを計算.
+
+    total_cost_usd ではなくトークン数と料金表から計算するため、
+    料金改定後の再計算や Bedrock 料金での見積もりに使える。
+
+    Args:
+        store: MetricsStore
+        group_by: model / user / session
+        engine: コスト計算エンジン
+
+    Returns:
+        {グループ: USD}
+    """
+    engine = engine or CostEngine()
+    result: dict[Any, float] = {}
+    for key, model, input_tokens, output_tokens, cache_write, cache_read in store.usage_rows(
+        group_by
+    ):
+        if model is None:
+            continue
+        cost = engine.token_cost(model, input_tokens, output_tokens, cache_write, cache_read)
+        result[key] = result.get(key, 0.0) + cost.total_usd
+    return result
+
+
+# エージェントのリクエストを記録するデフォルトの台帳（configure_ledger() で設定）
+_default_ledger: Optional[CostLedger] = None
+
+
+def configure_ledger(ledger: Optional[CostLedger]):
+    """エージェントのリクエストを記録する台帳を設定.
+
+    Args:
+        ledger: 記録先（Noneの場合は記録しない）
+    """
+    global _default_ledger
+    _default_ledger = ledger
+
+
+def get_default_ledger() -> Optional[CostLedger]:
+    """デフォルトの台帳を返す."""
+    return _default_ledger
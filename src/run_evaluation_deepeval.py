@@ -2,15 +2,16 @@
 
 from __future__ import annotations
 
+import argparse
 import asyncio
-import json
 import os
+import time
+from datetime import datetime
 from typing import List, Dict, Any, Union
 from pathlib import Path
 
 # DeepEval imports (インストール後に有効化)
 try:
-    from deepeval import evaluate
     from deepeval.test_case import LLMTestCase, LLMTestCaseParams
     from deepeval.metrics import (
         AnswerRelevancyMetric,
@@ -25,11 +26,106 @@ except ImportError:
 
 try:
     from agent import BedrockAgentSDK
+    from eval_cascade import Cascade, CascadeConfig, format_calibration
+    from eval_dataset import (
+        DatasetSelection,
+        add_selection_args,
+        count_cases,
+        iter_dataset,
+        parse_shard,
+        selection_from_args,
+    )
+    from eval_manifest import (
+        EvalManifest,
+        ReportBuilder,
+        ScoreEntry,
+        agent_fingerprint,
+        metric_fingerprint,
+        metric_name,
+    )
+    from eval_pipeline import (
+        MetricScheduler,
+        PipelineConfig,
+        Stage,
+        format_metric_breakdown,
+        format_stage_stats,
+        measure_metrics,
+        run_pipeline,
+    )
+    from eval_runner import EvalRunnerConfig, RunSummary, run_test_case
+    from eval_sequential import (
+        SequentialConfig,
+        SequentialMonitor,
+        format_sequential,
+        load_baseline_scores,
+        shuffled,
+    )
+    from geval_steps import apply_cached_steps, get_default_steps_cache
+    from perf_regression import PerfSamples, compare, format_comparison
+    from pricing import CostLedger, configure_ledger
+    from score_upload import ScoreUploader
+    from tool_verifier import (
+        JUDGE_METRIC_NAME,
+        TOOL_SCORE_NAME,
+        ToolExpectations,
+        ToolVerifierConfig,
+        is_judge_metric,
+        run_and_verify,
+    )
 except ImportError:
     from src.agent import BedrockAgentSDK
+    from src.eval_cascade import Cascade, CascadeConfig, format_calibration
+    from src.eval_dataset import (
+        DatasetSelection,
+        add_selection_args,
+        count_cases,
+        iter_dataset,
+        parse_shard,
+        selection_from_args,
+    )
+    from src.eval_manifest import (
+        EvalManifest,
+        ReportBuilder,
+        ScoreEntry,
+        agent_fingerprint,
+        metric_fingerprint,
+        metric_name,
+    )
+    from src.eval_pipeline import (
+        MetricScheduler,
+        PipelineConfig,
+        Stage,
+        format_metric_breakdown,
+        format_stage_stats,
+        measure_metrics,
+        run_pipeline,
+    )
+    from src.eval_runner import EvalRunnerConfig, RunSummary, run_test_case
+    from src.eval_sequential import (
+        SequentialConfig,
+        SequentialMonitor,
+        format_sequential,
+        load_baseline_scores,
+        shuffled,
+    )
+    from src.geval_steps import apply_cached_steps, get_default_steps_cache
+    from src.perf_regression import PerfSamples, compare, format_comparison
+    from src.pricing import CostLedger, configure_ledger
+    from src.score_upload import ScoreUploader
+    from src.tool_verifier import (
+        JUDGE_METRIC_NAME,
+        TOOL_SCORE_NAME,
+        ToolExpectations,
+        ToolVerifierConfig,
+        is_judge_metric,
+        run_and_verify,
+    )
 
 from langfuse import get_client
 
+# 評価実行のコスト台帳（エージェント + 評価用LLM）
+COST_LEDGER = CostLedger()
+
 # Bedrock Evaluator (カスタム評価用LLM)
 EVALUATION_MODEL = None
 EVALUATION_MODEL_NAME = "unknown"
@@ -44,6 +140,7 @@ try:
         # DeepEvalBaseLLM 経由で Bedrock Haiku を使用
         EVALUATION_MODEL = create_bedrock_evaluator(
             model_id="anthropic.claude-3-haiku-20240307-v1:0",
+            cost_ledger=COST_LEDGER,
         )
         EVALUATION_MODEL_NAME = "Bedrock Claude 3 Haiku (via DeepEvalBaseLLM)"
     else:
@@ -62,16 +159,15 @@ langfuse = get_client()
 def load_evaluation_dataset(dataset_path: str) -> List[Dict[str, Any]]:
     """評価用データセットを読み込む.
 
+    大きなデータセットは iter_dataset() で1件ずつ読み出す（run_evaluation_simple はこちらを使う）。
+
     Args:
-        dataset_path: データセットファイルのパス
+        dataset_path: データセットファイルのパス（.json / .jsonl、.gz / .bz2 / .xz 圧縮可）
 
     Returns:
         テストケースのリスト
     """
-    with open(dataset_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-
-    return data.get("test_cases", [])
+    return [item for _, item in iter_dataset(dataset_path)]
 
 
 def create_custom_metrics():
@@ -191,8 +287,6 @@ async def run_agent_on_test_case(
     Returns:
         (LLMTestCase オブジェクト, trace_id)
     """
-    print(f"  Running test case {index + 1}: {test_case['input'][:50]}...")
-
     # 手動でトレースを作成して trace_id を取得
     trace = langfuse.start_span(
         name=f"Evaluation Test Case {index + 1}",
@@ -203,46 +297,151 @@ async def run_agent_on_test_case(
         }
     )
 
-    # エージェント実行
-    actual_output = await agent.chat(
-        prompt=test_case["input"],
-        session_id=f"eval-{index}",
-        user_id="evaluator",
-    )
+    # エージェント実行（タイムアウトによるキャンセルでもトレースは終了する）
+    try:
+        actual_output = await agent.chat(
+            prompt=test_case["input"],
+            session_id=f"eval-{index}",
+            user_id="evaluator",
+        )
+    except BaseException as e:
+        trace.update(level="ERROR", status_message=f"{type(e).__name__}: {e}")
+        trace.end()
+        raise
 
     # トレースを更新して終了
     trace.update(output=actual_output)
     trace.end()
 
+    return build_test_case(test_case, actual_output), trace.id
+
+
+async def run_verified_test_case(
+    test_case: Dict[str, Any],
+    index: int,
+    expectations: ToolExpectations,
+    verifier_config: ToolVerifierConfig,
+):
+    """ツール使用の期待値を持つテストケースを作業ディレクトリで実行して検証.
+
+    Args:
+        test_case: テストケースデータ
+        index: テストケースのインデックス
+        expectations: ケースのツール使用の期待値
+        verifier_config: 検証の設定
+
+    Returns:
+        (LLMTestCase オブジェクト, trace_id, ToolVerdict)
+    """
+    trace = langfuse.start_span(
+        name=f"Evaluation Test Case {index + 1}",
+        input=test_case["input"],
+        metadata={
+            "test_case_index": index,
+            "expected_output": test_case.get("expected_output"),
+            "verification": "tool",
+        }
+    )
+
+    try:
+        actual_output, verdict = await run_and_verify(
+            test_case["input"],
+            expectations,
+            verifier_config,
+            session_id=f"eval-{index}",
+            user_id="evaluator",
+        )
+    except BaseException as e:
+        trace.update(level="ERROR", status_message=f"{type(e).__name__}: {e}")
+        trace.end()
+        raise
+
+    trace.update(output=actual_output, metadata={"tool_verification": verdict.reason})
+    trace.end()
+
+    return build_test_case(test_case, actual_output), trace.id, verdict
+
+
+def build_test_case(
+    test_case: Dict[str, Any],
+    actual_output: str,
+    usage: Dict[str, Any] | None = None,
+) -> Union[LLMTestCase, Dict[str, Any]]:
+    """テストケースデータとエージェントの出力から LLMTestCase を作成.
+
+    Args:
+        test_case: テストケースデータ
+        actual_output: エージェントの出力
+        usage: レイテンシ・トークン使用量（additional_metadata に記録）
+
+    Returns:
+        LLMTestCase オブジェクト（DeepEval が利用不可の場合は辞書）
+    """
     if not DEEPEVAL_AVAILABLE:
         # DeepEval が利用不可の場合はダミーオブジェクトを返す
         return {
             "input": test_case["input"],
             "actual_output": actual_output,
             "expected_output": test_case.get("expected_output"),
-        }, trace.id
+            **(usage or {}),
+        }
 
     # LLMTestCase 作成
-    test_case_obj = LLMTestCase(
+    return LLMTestCase(
         input=test_case["input"],
         actual_output=actual_output,
         expected_output=test_case.get("expected_output"),
         context=test_case.get("context", []),
         retrieval_context=test_case.get("retrieval_context", []),
+        additional_metadata=usage or None,
     )
 
-    return test_case_obj, trace.id
+
+def _actual_output(test_case: Union[LLMTestCase, Dict[str, Any]]) -> str:
+    """LLMTestCase（または辞書）からエージェントの出力を取り出す."""
+    if isinstance(test_case, dict):
+        return test_case["actual_output"]
+    return test_case.actual_output
 
 
 async def run_evaluation_simple(
     dataset_path: str = "datasets/evaluation_dataset.json",
     use_custom_metrics: bool = True,
+    runner_config: EvalRunnerConfig | None = None,
+    pipeline_config: PipelineConfig | None = None,
+    incremental: bool | None = None,
+    manifest_path: str | None = None,
+    report_path: str | None = None,
+    shard: tuple[int, int] | None = None,
+    resume_run_id: str | None = None,
+    cascade_config: CascadeConfig | None = None,
+    selection: DatasetSelection | None = None,
+    sequential_config: SequentialConfig | None = None,
+    verifier_config: ToolVerifierConfig | None = None,
 ):
     """シンプルな評価を実行.
 
+    データセットは1件ずつ読み出してパイプラインに流し、完了したケースから
+    マニフェストにコミットするため、メモリ使用量はデータセットのサイズに比例しない。
+
     Args:
         dataset_path: 評価データセットのパス
         use_custom_metrics: カスタムメトリクスを使用するか
+        runner_config: テストケースの並行実行の設定（Noneの場合は環境変数から生成）
+        pipeline_config: 採点・アップロードの並行数とキューの設定（Noneの場合は環境変数から生成）
+        incremental: 変更のない (ケース, メトリクス) の結果を再利用するか
+            （Noneの場合は EVAL_INCREMENTAL）
+        manifest_path: マニフェストのパス（Noneの場合は EVAL_MANIFEST_PATH）
+        report_path: 全体レポート（JSON）の出力先（Noneの場合は出力しない）
+        shard: (i, n) を指定した場合、シャード i に割り当てられたケースのみを評価
+        resume_run_id: 中断した実行のID（完了済みのケースを省略し、同じIDで続きを実行）
+        cascade_config: ローカル指標によるジャッジの選別の設定（Noneの場合は環境変数から生成）
+        selection: タグ式による絞り込みとタグごとのサンプリング（Noneの場合は環境変数から生成）
+        sequential_config: 逐次検定による早期終了の設定（Noneの場合は環境変数から生成）。
+            有効な場合はケースをランダムな順序で評価するため、選択したケースをメモリに読み込む
+        verifier_config: ツール使用の検証の設定（Noneの場合は環境変数から生成）。
+            context などにツール・ファイルの期待値を持つケースは作業ディレクトリで実行して
+            決定的に検証し、Tool Usage Correctness（GEval）のジャッジを省略する
     """
     if not DEEPEVAL_AVAILABLE:
         print("\n" + "=" * 60)
@@ -260,24 +459,62 @@ async def run_evaluation_simple(
     print("=" * 60)
     print(f"\n🤖 評価用LLM: {EVALUATION_MODEL_NAME}")
 
-    # データセット読み込み
-    print(f"\n📁 Loading dataset: {dataset_path}")
-    test_data = load_evaluation_dataset(dataset_path)
-    print(f"   Loaded {len(test_data)} test cases")
+    # 評価実行ID（スコアの冪等キーに使う。同じIDで再実行するとスコアは上書きされる）
+    run_id = (
+        resume_run_id
+        or os.getenv("EVAL_RUN_ID")
+        or datetime.now().strftime("eval-%Y%m%d-%H%M%S")
+    )
+    print(f"🏷️  Run ID: {run_id}" + (" (resuming)" if resume_run_id else ""))
+
+    # データセットは件数だけ先に数え、テストケースはパイプラインが1件ずつ読み出す
+    print(f"\n📁 Streaming dataset: {dataset_path}" + (f" (shard {shard[0]}/{shard[1]})" if shard else ""))
+    selection = selection or DatasetSelection.from_env()
+    if selection.active:
+        print(f"   Selecting cases ({selection.describe()})")
+    total = count_cases(dataset_path, shard, selection)
+    print(f"   Found {total} test cases")
+    if not total:
+        # 分散実行でシャードにケースが割り当てられなかった場合も成功として空のレポートを書く
+        print("\n✅ No test cases to evaluate" + (f" in shard {shard[0]}/{shard[1]}" if shard else ""))
+        if report_path:
+            empty = ReportBuilder()
+            empty.write(
+                report_path,
+                run_id=run_id,
+                shard=list(shard) if shard else None,
+                selection=selection.describe() if selection.active else None,
+            )
+            empty.close()
+        return
+
+    # 逐次検定: ランダムな順序で評価し、結論が確定した時点で打ち切る
+    sequential_config = sequential_config or SequentialConfig.from_env()
+    items = iter_dataset(dataset_path, shard, selection)
+    monitor = None
+    if sequential_config.enabled:
+        items = shuffled(items, sequential_config.seed)
+        baseline_scores = None
+        if sequential_config.baseline_report:
+            baseline_scores = load_baseline_scores(sequential_config.baseline_report)
+        monitor = SequentialMonitor(sequential_config, total, baseline_scores)
+        print(
+            f"\n🎲 Sequential: random order (seed {sequential_config.seed}), "
+            f"look every {sequential_config.check_every} cases after {sequential_config.min_cases}, "
+            f"alpha {sequential_config.alpha} over {monitor.planned_looks} looks"
+            + (
+                f", vs baseline {sequential_config.baseline_report} ({len(baseline_scores)} cases)"
+                if baseline_scores is not None
+                else ", vs metric thresholds"
+            )
+        )
+        total = monitor.planned_cases
 
     # エージェント初期化
     print("\n🤖 Initializing agent...")
     agent = BedrockAgentSDK()
-
-    # テストケース実行
-    print("\n🚀 Running test cases...")
-    test_cases = []
-    trace_ids = []
-    for i, test_item in enumerate(test_data):
-        test_case, trace_id = await run_agent_on_test_case(agent, test_item, i)
-        test_cases.append(test_case)
-        trace_ids.append(trace_id)
-        break  # デバッグ用に1ケースのみ実行
+    # エージェントのリクエストのコストも台帳に記録
+    configure_ledger(COST_LEDGER)
 
     # メトリクス準備
     print("\n📊 Preparing metrics...")
@@ -285,59 +522,359 @@ async def run_evaluation_simple(
 
     if use_custom_metrics:
         custom_metrics = create_custom_metrics()
+        # GEval の評価ステップは保存済みのものを使う（criteria からの生成を省略）
+        steps_cache = get_default_steps_cache()
+        if steps_cache is not None:
+            steps_stats = apply_cached_steps(custom_metrics, steps_cache)
+            print(
+                f"   GEval steps: {steps_stats['reused']} reused, "
+                f"{steps_stats['generated']} generated ({steps_cache.path})"
+            )
         metrics.extend(custom_metrics)
         print(f"   Using {len(metrics)} metrics ({len(custom_metrics)} custom)")
     else:
         print(f"   Using {len(metrics)} standard metrics")
+    if monitor is not None:
+        monitor.thresholds = {
+            metric_name(m): m.threshold
+            for m in metrics
+            if getattr(m, "threshold", None) is not None
+        }
 
-    # 評価実行
-    print("\n⚙️  Evaluating...")
-    results = evaluate(test_cases=test_cases, metrics=metrics)
-
-    # 結果を Langfuse に送信
-    print("\n📤 Sending evaluation scores to Langfuse...")
-    test_results = getattr(results, 'test_results', [])
-
-    scores_sent = 0
-    for idx, test_result in enumerate(test_results):
-        if idx >= len(trace_ids):
-            break
-
-        trace_id = trace_ids[idx]
-
-        # 各メトリクスのスコアを送信
-        if hasattr(test_result, 'metrics_data'):
-            for metric_data in test_result.metrics_data:
-                langfuse.create_score(
-                    name=metric_data.name,
-                    value=metric_data.score,
-                    trace_id=trace_id,
-                    comment=metric_data.reason if hasattr(metric_data, 'reason') else None,
+    # 実行計画（インクリメンタルモードでは変更のない出力・スコアを再利用）
+    if incremental is None:
+        incremental = os.getenv("EVAL_INCREMENTAL", "false").lower() in ("true", "1", "yes")
+    manifest = EvalManifest(
+        manifest_path or os.getenv("EVAL_MANIFEST_PATH", ".eval_cache/manifest.sqlite")
+    )
+    # ツール使用の期待値を持つケースは LLM ジャッジの代わりに決定的に検証
+    verifier_config = verifier_config or ToolVerifierConfig.from_env()
+    verifier_hash = verifier_config.fingerprint()
+    plans = manifest.iter_plans(
+        items,
+        agent_fingerprint(agent),
+        metrics,
+        reuse=incremental,
+        resume_run_id=resume_run_id,
+        score_hashes={TOOL_SCORE_NAME: verifier_hash} if verifier_config.enabled else None,
+    )
+    if monitor is not None:
+        plans = _until_stopped(plans, monitor)
+
+    # 生成 → 採点 → アップロードをパイプラインで実行
+    # （生成が終わったケースからすぐに採点し、採点が終わったケースからすぐに送信する）
+    runner_config = runner_config or EvalRunnerConfig.from_env()
+    pipeline_config = pipeline_config or PipelineConfig.from_env()
+    metric_hashes = {metric_name(m): metric_fingerprint(m) for m in metrics}
+    # メトリクス単位の並行数の上限とレイテンシの内訳
+    metric_scheduler = MetricScheduler.from_config(pipeline_config)
+    # ローカル指標で結論が出るケースはジャッジを省略
+    cascade_config = cascade_config or CascadeConfig.from_env()
+    cascade = Cascade(cascade_config) if cascade_config.enabled else None
+    if cascade is not None:
+        print(
+            f"\n🪜 Cascade: judges only for local scores in "
+            f"[{cascade_config.low}, {cascade_config.high}) "
+            f"(+{cascade_config.calibration_rate:.0%} of decided cases for calibration)"
+        )
+        gated_names = [metric_name(m) for m in metrics if cascade.gates(m)]
+        print(f"   Gated metrics: {', '.join(gated_names) or 'none'} (other metrics always run)")
+    uploader = ScoreUploader(langfuse, run_id=run_id)
+    run_summary = RunSummary()
+    report = ReportBuilder()
+    # ケースごとのレイテンシ・TTFT・トークン・キャッシュヒット率・コスト（タグ別）
+    perf_samples = PerfSamples()
+
+    verified = 0
+
+    async def generate(plan):
+        nonlocal verified
+        expectations = ToolExpectations.from_case(plan.item) if verifier_config.enabled else None
+
+        async def run_case(test_item, index):
+            if expectations is None:
+                return await run_agent_on_test_case(agent, test_item, index)
+            test_case, trace_id, verdict = await run_verified_test_case(
+                test_item, index, expectations, verifier_config
+            )
+            plan.scores[TOOL_SCORE_NAME] = ScoreEntry(**verdict.score_entry_fields(verifier_hash))
+            return test_case, trace_id
+
+        result = await run_test_case(run_case, plan.item, plan.index, runner_config)
+        verified += result.ok and expectations is not None
+        run_summary.add(result)
+        if result.ok:
+            plan.test_case = result.test_case
+            plan.trace_id = result.trace_id
+            plan.actual_output = _actual_output(result.test_case)
+            plan.usage = result.usage()
+        else:
+            # 失敗したケースは評価から除外
+            plan.error = result.error
+            print(f"   ❌ case {plan.index + 1} failed after {result.attempts} attempts: {result.error}")
+
+    async def score(plan):
+        if plan.test_case is None:
+            plan.test_case = build_test_case(plan.item, plan.actual_output, plan.usage)
+        pending = plan.pending_metrics
+        if TOOL_SCORE_NAME in plan.scores:
+            # ツール使用を検証したケースは LLM ジャッジで採点しない
+            pending = [m for m in pending if not is_judge_metric(m)]
+        verdict = None
+        gated: set[str] = set()
+        skipped = 0
+        if cascade is not None:
+            # ROUGE-L は出力の長さの2乗に比例するためスレッドで計算
+            verdict = await asyncio.to_thread(
+                cascade.assess, plan.key, plan.actual_output, plan.item.get("expected_output")
+            )
+            local_entry = cascade.score_entry_fields(verdict)
+            if local_entry is not None:
+                plan.scores[local_entry["name"]] = ScoreEntry(**local_entry)
+            # 省略するのは expected_output と比較できるメトリクスだけ（参照を使わないメトリクスは評価する）
+            gated = {metric_name(m) for m in pending if cascade.gates(m)}
+            if not verdict.run_judges:
+                skipped = len(gated)
+                pending = [m for m in pending if metric_name(m) not in gated]
+        names = [metric_name(m) for m in pending]
+        results = await measure_metrics(pending, names, plan.test_case, metric_scheduler)
+        if verdict is not None:
+            cascade.observe(verdict, [r for r in results if r.name in gated], skipped=skipped)
+        for result in results:
+            if result.error:
+                print(f"   ⚠️ case {plan.index + 1} {result.name}: {result.error}")
+            plan.scores[result.name] = ScoreEntry(
+                name=result.name,
+                score=result.score,
+                reason=result.reason,
+                success=result.success,
+                threshold=result.threshold,
+                metric_hash=metric_hashes.get(result.name, ""),
+            )
+
+    async def upload(plan):
+        # 再利用したスコアも含めて送信（submit() は並行送信数の上限で待つためスレッドで実行）
+        def submit_all():
+            for entry in plan.scores.values():
+                uploader.submit(
+                    trace_id=plan.trace_id,
+                    name=entry.name,
+                    value=entry.score,
+                    comment=entry.reason,
                 )
-                scores_sent += 1
 
+        await asyncio.to_thread(submit_all)
+
+    completed = 0
+    resumed = 0
+
+    def on_complete(plan):
+        # 完了したケースはすぐにマニフェストへコミット（中断しても --resume で続きから再開できる）
+        nonlocal completed, resumed
+        completed += 1
+        resumed += plan.resumed
+        manifest.record(plan, metrics, run_id=run_id)
+        report.add(plan)
+        perf_samples.add_case(
+            {
+                "tags": plan.item.get("tags"),
+                "usage": plan.usage,
+                "error": plan.error,
+                "output_reused": plan.output_reused,
+            }
+        )
+        if monitor is not None and plan.error is None:
+            monitor.observe(plan.key, {name: entry.score for name, entry in plan.scores.items()})
+            if not monitor.stopped and monitor.check(COST_LEDGER.total_usd()):
+                print(
+                    f"  🛑 Sequential stop after {completed} cases ({monitor.reason}); "
+                    f"finishing in-flight cases"
+                )
+        every = runner_config.progress_every
+        if plan.error is None and every and (completed % every == 0 or completed == total):
+            elapsed = time.perf_counter() - pipeline_started
+            eta = elapsed / completed * (total - completed)
+            print(
+                f"  [{completed}/{total}] case {plan.index + 1}: "
+                f"{len(plan.scores)} scores"
+                + (" (resumed)" if plan.resumed else " (output reused)" if plan.output_reused else "")
+                + f" | elapsed {elapsed:.0f}s, ETA {eta:.0f}s"
+            )
+
+    print(
+        f"\n🚀 Running pipeline: generate ({runner_config.workers} workers, "
+        f"timeout {runner_config.timeout_s}s, retries {runner_config.max_retries}) → "
+        f"score ({pipeline_config.score_workers} workers, "
+        f"{pipeline_config.metric_workers or 'unlimited'} concurrent metrics"
+        + (
+            f", limits {', '.join(f'{k}={v}' for k, v in pipeline_config.metric_limits.items())}"
+            if pipeline_config.metric_limits
+            else ""
+        )
+        + ") → "
+        f"upload ({pipeline_config.upload_workers} workers), queue {pipeline_config.queue_size}"
+    )
+    pipeline_started = time.perf_counter()
+    stage_stats = await run_pipeline(
+        plans,
+        [
+            Stage("generate", generate, runner_config.workers, skip=lambda p: not p.needs_generation),
+            Stage("score", score, pipeline_config.score_workers, skip=lambda p: p.error is not None or p.resumed or (not p.pending_metrics and cascade is None)),
+            Stage("upload", upload, pipeline_config.upload_workers, skip=lambda p: p.error is not None or p.resumed),
+        ],
+        queue_size=pipeline_config.queue_size,
+        on_complete=on_complete,
+    )
+    upload_stats = await asyncio.to_thread(uploader.close)
     langfuse.flush()
-    print(f"   Sent {scores_sent} scores to Langfuse across {len(test_results)} test cases")
+    pipeline_wall_s = time.perf_counter() - pipeline_started
+
+    manifest.close()
+    run_summary = run_summary.to_dict()
+    print(
+        f"\n   Generated {run_summary['succeeded']}/{run_summary['cases']} cases "
+        f"(p50 {run_summary['latency_p50_s']:.1f}s, p95 {run_summary['latency_p95_s']:.1f}s, "
+        f"{run_summary['input_tokens']}/{run_summary['output_tokens']} tokens)"
+    )
+    for line in format_stage_stats(stage_stats, pipeline_wall_s):
+        print(line)
+    metric_breakdown = metric_scheduler.breakdown()
+    if metric_breakdown:
+        print("   Metric latency (by share of scoring wall time):")
+        for line in format_metric_breakdown(metric_breakdown):
+            print(line)
+
+    evaluable = report.summary["cases"] - report.summary["failed"]
+    if not evaluable:
+        report.close()
+        print("\n❌ No test case succeeded")
+        return
+    if resumed:
+        print(f"   ♻️  Skipped {resumed} cases completed before the run was interrupted")
+    if verified:
+        print(
+            f"   🔧 Verified tool usage deterministically for {verified} cases "
+            f"(skipped {JUDGE_METRIC_NAME})"
+        )
+
+    scores_sent = upload_stats["uploaded"]
+    print(f"   Sent {scores_sent} scores to Langfuse across {evaluable - resumed} test cases")
+    if upload_stats["spooled"]:
+        print(
+            f"   ⚠️ {upload_stats['spooled']} scores failed and were spooled to "
+            f"{uploader.config.spool_path} (resubmit: make eval-resubmit-scores)"
+        )
+
+    # ベースラインとのパフォーマンス比較（ベースラインがなければ今回の値を保存）
+    performance = None
+    perf_baseline = os.getenv("EVAL_PERF_BASELINE")
+    if perf_baseline and Path(perf_baseline).exists():
+        performance = compare(PerfSamples.load(perf_baseline), perf_samples)
+        performance["baseline"] = perf_baseline
+    elif perf_baseline and not shard:
+        perf_samples.save(perf_baseline, run_id=run_id)
+        print(f"   📈 Saved performance baseline to {perf_baseline}")
+
+    if report_path:
+        report.write(
+            report_path,
+            run_id=run_id,
+            shard=list(shard) if shard else None,
+            selection=selection.describe() if selection.active else None,
+            cascade=cascade.report() if cascade is not None else None,
+            performance=performance,
+            sequential=monitor.report() if monitor is not None else None,
+            pipeline={
+                "wall_s": round(pipeline_wall_s, 3),
+                "stages": [stage.to_dict() for stage in stage_stats],
+                "metrics": metric_breakdown,
+                "metric_groups": metric_scheduler.groups(),
+            },
+        )
+    report_summary = report.summary
+    metric_summaries = report.metrics()
+    report.close()
 
     # 結果サマリー
     print("\n" + "=" * 60)
     print("評価結果サマリー")
     print("=" * 60)
 
-    print(f"テストケース数: {len(test_cases)}")
+    print(f"テストケース数: {evaluable} (失敗 {report_summary['failed']})")
     print(f"メトリクス数: {len(metrics)}")
+    print(
+        f"再利用: 出力 {report_summary['outputs_reused']} 件, "
+        f"スコア {report_summary['scores_reused']} 件 "
+        f"(新規評価 {report_summary['scores_evaluated']} 件)"
+    )
+    for name, metric_summary in metric_summaries.items():
+        mean = metric_summary["mean"]
+        pass_rate = metric_summary["pass_rate"]
+        print(
+            f"  - {name}: mean {mean:.3f}" if mean is not None else f"  - {name}: mean n/a",
+            f"pass {pass_rate:.0%}" if pass_rate is not None else "",
+            f"(n={metric_summary['count']}, reused {metric_summary['reused']})",
+        )
     print(f"評価モデル: {EVALUATION_MODEL_NAME}")
     print(f"Langfuse スコア: {scores_sent} 件")
+    cost_by_source = COST_LEDGER.totals("source")
+    print(
+        f"推定コスト: ${COST_LEDGER.total_usd():.4f} "
+        f"(agent ${cost_by_source.get('agent', 0.0):.4f}, "
+        f"evaluator ${cost_by_source.get('evaluator', 0.0):.4f}, "
+        f"{COST_LEDGER.engine.table.version})"
+    )
+    if performance is not None:
+        print(f"パフォーマンス（ベースライン {perf_baseline} との比較）:")
+        for line in format_comparison(performance):
+            print(line)
+    if monitor is not None:
+        print("逐次検定:")
+        for line in format_sequential(monitor.report()):
+            print(line)
+    if cascade is not None:
+        print("カスケード:")
+        for line in format_calibration(cascade.report()):
+            print(line)
+    judge_cache = getattr(EVALUATION_MODEL, "judge_cache", None)
+    if judge_cache is not None:
+        cache_stats = judge_cache.stats()
+        print(
+            f"ジャッジキャッシュ: {cache_stats['hits']} hits / {cache_stats['misses']} misses "
+            f"(hit rate {cache_stats['hit_rate']:.0%}, "
+            f"saved {cache_stats['saved_input_tokens']}/{cache_stats['saved_output_tokens']} tokens)"
+        )
+    client_pool = getattr(EVALUATION_MODEL, "client_pool", None)
+    if client_pool is not None:
+        pool_stats = client_pool.stats()
+        print(
+            f"Bedrock クライアントプール: {pool_stats['size']} connections, "
+            f"{pool_stats['waited']}/{pool_stats['acquired']} calls waited for a slot "
+            f"(mean {pool_stats['wait_mean_ms']:.0f}ms, p95 {pool_stats['wait_p95_ms']:.0f}ms, "
+            f"max {pool_stats['wait_max_ms']:.0f}ms)"
+        )
 
     # 詳細な結果は DeepEval のコンソール出力に表示されています
     print("\n✅ Evaluation completed!")
-    print(f"📊 詳細な結果は上記の DeepEval 出力を参照してください")
+    if report_path:
+        print(f"📄 Report saved to: {report_path}")
     print(f"\n💡 結果の確認方法:")
-    print(f"  - DeepEval ダッシュボード: deepeval view")
+    print(f"  - ケースごとの結果: --report でレポート（JSON）を出力")
     print(f"  - Langfuse ダッシュボード: https://cloud.langfuse.com")
     print(f"\n✨ 評価スコアは Langfuse のトレースに記録されました！")
 
 
+def _until_stopped(plans, monitor: SequentialMonitor):
+    """逐次検定で打ち切るまで実行計画を流す（投入済みのケースは最後まで実行される）.
+
+    最大ケース数を超えて投入しないため、予算の上限は投入済みのケースがあっても守られる。
+    """
+    for fed, plan in enumerate(plans):
+        if monitor.stopped or fed >= monitor.planned_cases:
+            return
+        yield plan
+
+
 async def run_evaluation_with_report(
     dataset_path: str = "datasets/evaluation_dataset.json",
     output_path: str = "evaluation_report.json",
@@ -348,14 +885,61 @@ async def run_evaluation_with_report(
         dataset_path: 評価データセットのパス
         output_path: レポート出力パス
     """
-    await run_evaluation_simple(dataset_path)
+    await run_evaluation_simple(dataset_path, report_path=output_path)
+
 
-    # レポート作成（実装は省略）
-    print(f"\n📄 Report saved to: {output_path}")
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    """コマンドライン引数を解析."""
+    parser = argparse.ArgumentParser(description="DeepEval による Claude Agent SDK 評価")
+    parser.add_argument(
+        "--dataset",
+        default=os.getenv("EVAL_DATASET", "datasets/evaluation_dataset.json"),
+        help="データセット（.json / .jsonl、.gz / .bz2 / .xz 圧縮可）",
+    )
+    parser.add_argument(
+        "--shard",
+        type=parse_shard,
+        default=None,
+        help="i/n: ケースのキーのハッシュでシャード i（0 始まり）に割り当てられたケースのみを評価",
+    )
+    add_selection_args(parser)
+    parser.add_argument(
+        "--resume",
+        metavar="RUN_ID",
+        default=None,
+        help="中断した実行のIDを指定して、完了済みのケースを省略して再開",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        default=None,
+        help="変更のない (ケース, メトリクス) の結果を再利用（EVAL_INCREMENTAL と同じ）",
+    )
+    parser.add_argument(
+        "--cascade",
+        action="store_true",
+        help="ローカル指標で結論が出ないケースだけをジャッジで評価（EVAL_CASCADE と同じ）",
+    )
+    parser.add_argument(
+        "--sequential",
+        action="store_true",
+        help="ランダムな順序で評価し、信頼区間で結論が確定した時点で打ち切る（EVAL_SEQUENTIAL と同じ）",
+    )
+    parser.add_argument(
+        "--baseline-report",
+        default=None,
+        help="逐次検定で比較するベースラインの評価レポート（EVAL_SEQ_BASELINE と同じ）",
+    )
+    parser.add_argument("--max-cases", type=int, default=None, help="逐次検定の最大ケース数")
+    parser.add_argument("--max-cost", type=float, default=None, help="逐次検定の最大コスト（USD）")
+    parser.add_argument("--report", default=None, help="全体レポート（JSON）の出力先")
+    return parser.parse_args(argv)
 
 
 async def main():
     """メイン関数."""
+    args = parse_args()
+
     # 環境変数チェック
     required_vars = [
         "LANGFUSE_SECRET_KEY",
@@ -370,10 +954,30 @@ async def main():
         print("   Please set them in .env file")
         return
 
+    cascade_config = CascadeConfig.from_env()
+    if args.cascade:
+        cascade_config.enabled = True
+    sequential_config = SequentialConfig.from_env()
+    if args.sequential or args.baseline_report:
+        sequential_config.enabled = True
+    if args.baseline_report:
+        sequential_config.baseline_report = args.baseline_report
+    if args.max_cases is not None:
+        sequential_config.max_cases = args.max_cases
+    if args.max_cost is not None:
+        sequential_config.max_cost_usd = args.max_cost
+
     # 評価実行
     await run_evaluation_simple(
-        dataset_path="datasets/evaluation_dataset.json",
+        dataset_path=args.dataset,
         use_custom_metrics=True,
+        incremental=args.incremental,
+        report_path=args.report,
+        shard=args.shard,
+        resume_run_id=args.resume,
+        cascade_config=cascade_config,
+        selection=selection_from_args(args),
+        sequential_config=sequential_config,
     )
 
 
@@ -0,0 +1,434 @@
+"""評価スコアのバッチアップロード.
+
+評価実行ではテストケース数 × メトリクス数のスコアが発生する。
+1件ずつ create_score を呼ぶと実行の最後に長い直列処理が残るため、
+スコアをバッチにまとめて Langfuse Ingestion API で並行して送信する。
+
+主な機能:
+1. バッチ化（件数 / 間隔）と並行送信数の上限（上限に達すると submit() が待つ）
+2. 冪等キー: スコアIDを (run_id, trace_id, メトリクス名) から決定的に生成し、
+   再送しても重複スコアを作らない（Langfuse は同じIDのスコアを上書きする）
+3. 一時的なエラー（ネットワーク、429、5xx）の指数バックオフ付きリトライ
+4. 送信できなかったスコアのスプールファイル（JSONL）への退避と再送
+
+環境変数:
+    LANGFUSE_SCORE_BATCH_SIZE=100: 1回の送信でまとめるスコア数
+    LANGFUSE_SCORE_MAX_CONCURRENCY=4: 並行して送信するバッチ数
+    LANGFUSE_SCORE_MAX_RETRIES=3: リトライ回数
+    LANGFUSE_SCORE_SPOOL_PATH=.langfuse_spool/scores.jsonl: スプールファイル
+
+使用例:
+    uploader = ScoreUploader(get_client(), run_id="eval-2025-06-01")
+    uploader.submit(trace_id, "Answer Relevancy", 0.92, comment="...")
+    stats = uploader.close()  # 残りを送信して完了を待つ
+
+    # スプールの再送
+    python src/score_upload.py --resubmit .langfuse_spool/scores.jsonl
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Optional
+
+# リトライするHTTPステータス
+_RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+@dataclass
+class ScoreRecord:
+    """送信するスコア."""
+
+    id: str
+    trace_id: str
+    name: str
+    value: float
+    comment: Optional[str] = None
+    observation_id: Optional[str] = None
+    data_type: Optional[str] = None
+
+    def to_event(self) -> dict:
+        """Ingestion API の score-create イベントに変換."""
+        body = {
+            "id": self.id,
+            "traceId": self.trace_id,
+            "name": self.name,
+            "value": self.value,
+            "comment": self.comment,
+        }
+        if self.observation_id:
+            body["observationId"] = self.observation_id
+        if self.data_type:
+            body["dataType"] = self.data_type
+        return {
+            "id": uuid.uuid4().hex,
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "type": "score-create",
+            "body": body,
+        }
+
+
+def score_id(run_id: str, trace_id: str, name: str) -> str:
+    """冪等キー（スコアID）を生成.
+
+    同じ評価実行・トレース・メトリクスのスコアは常に同じIDになる。
+
+    Args:
+        run_id: 評価実行ID
+        trace_id: トレースID
+        name: スコア名
+
+    Returns:
+        UUID 形式のスコアID
+    """
+    digest = hashlib.sha256(f"{run_id}\0{trace_id}\0{name}".encode("utf-8")).digest()
+    return str(uuid.UUID(bytes=digest[:16]))
+
+
+@dataclass
+class ScoreUploaderConfig:
+    """スコアアップロードの設定."""
+
+    # 1回の送信でまとめるスコア数
+    batch_size: int = 100
+
+    # 並行して送信するバッチ数
+    max_concurrency: int = 4
+
+    # バッチが満杯にならなくても送信する間隔（秒）
+    flush_interval_s: float = 1.0
+
+    # リトライ回数と初回の待ち時間（以降は2倍ずつ）
+    max_retries: int = 3
+    backoff_s: float = 0.5
+
+    # 送信できなかったスコアの退避先（Noneの場合は退避しない）
+    spool_path: Optional[str] = ".langfuse_spool/scores.jsonl"
+
+    @classmethod
+    def from_env(cls) -> "ScoreUploaderConfig":
+        """環境変数から設定を生成."""
+        return cls(
+            batch_size=int(os.getenv("LANGFUSE_SCORE_BATCH_SIZE", "100")),
+            max_concurrency=int(os.getenv("LANGFUSE_SCORE_MAX_CONCURRENCY", "4")),
+            max_retries=int(os.getenv("LANGFUSE_SCORE_MAX_RETRIES", "3")),
+            spool_path=os.getenv(
+                "LANGFUSE_SCORE_SPOOL_PATH", ".langfuse_spool/scores.jsonl"
+            )
+            or None,
+        )
+
+
+class ScoreUploader:
+    """スコアをバッチにまとめて並行送信するアップローダー.
+
+    submit() は呼び出し元をほとんど待たせずに戻り、送信は評価の実行中に
+    バックグラウンドで行われる。close() で残りを送信して完了を待つ。
+    """
+
+    def __init__(
+        self,
+        client: Any,
+        run_id: Optional[str] = None,
+        config: Optional[ScoreUploaderConfig] = None,
+    ):
+        """初期化.
+
+        Args:
+            client: Langfuse クライアント（get_client() の戻り値）
+            run_id: 評価実行ID（冪等キーの生成に使う。Noneの場合はランダム）
+            config: 設定（Noneの場合は環境変数から生成）
+        """
+        self._client = client
+        self.run_id = run_id or uuid.uuid4().hex
+        self.config = config or ScoreUploaderConfig.from_env()
+
+        self._pending: list[ScoreRecord] = []
+        self._lock = threading.Lock()
+        self._spool_lock = threading.Lock()
+        # 送信中のバッチ数の上限（上限に達すると submit() が待つ）
+        self._slots = threading.BoundedSemaphore(self.config.max_concurrency)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.config.max_concurrency,
+            thread_name_prefix="score-upload",
+        )
+        self._futures: list[Future] = []
+
+        self.submitted = 0
+        self.uploaded = 0
+        self.retried = 0
+        self.spooled = 0
+        self.skipped = 0
+        self.batches = 0
+
+        self._closed = threading.Event()
+        self._timer = threading.Thread(
+            target=self._run_timer, name="score-upload-timer", daemon=True
+        )
+        self._timer.start()
+
+    def submit(
+        self,
+        trace_id: str,
+        name: str,
+        value: Optional[float],
+        comment: Optional[str] = None,
+        observation_id: Optional[str] = None,
+    ) -> Optional[str]:
+        """スコアを送信キューに追加.
+
+        Args:
+            trace_id: トレースID
+            name: スコア名
+            value: スコア値（Noneの場合は送信しない）
+            comment: コメント
+            observation_id: オブザベーションID
+
+        Returns:
+            スコアID（送信しない場合None）
+        """
+        if value is None:
+            self._count("skipped", 1)
+            return None
+        record = ScoreRecord(
+            id=score_id(self.run_id, trace_id, name),
+            trace_id=trace_id,
+            name=name,
+            value=float(value),
+            comment=comment,
+            observation_id=observation_id,
+        )
+        self.submit_record(record)
+        return record.id
+
+    def submit_record(self, record: ScoreRecord):
+        """ScoreRecord を送信キューに追加（スプールの再送用）.
+
+        Args:
+            record: スコア
+        """
+        with self._lock:
+            self._pending.append(record)
+            self.submitted += 1
+            batch = self._take_batch(full_only=True)
+        if batch:
+            self._dispatch(batch)
+
+    def _take_batch(self, full_only: bool) -> list[ScoreRecord]:
+        """送信するバッチを取り出す（ロック取得中に呼ぶ）."""
+        if not self._pending or (full_only and len(self._pending) < self.config.batch_size):
+            return []
+        batch = self._pending[: self.config.batch_size]
+        del self._pending[: self.config.batch_size]
+        return batch
+
+    def _dispatch(self, batch: list[ScoreRecord]):
+        """バッチを送信スレッドに渡す（並行数の上限に達している場合は待つ）."""
+        self._slots.acquire()
+        future = self._executor.submit(self._upload, batch)
+        future.add_done_callback(lambda _: self._slots.release())
+        with self._lock:
+            self._futures = [f for f in self._futures if not f.done()]
+            self._futures.append(future)
+
+    def _run_timer(self):
+        """一定間隔で満杯でないバッチも送信."""
+        while not self._closed.wait(self.config.flush_interval_s):
+            self.flush(wait=False)
+
+    def _count(self, name: str, value: int):
+        """カウンターを加算（送信スレッドから呼ばれる）."""
+        with self._lock:
+            setattr(self, name, getattr(self, name) + value)
+
+    def _upload(self, batch: list[ScoreRecord]):
+        """バッチを送信（失敗したスコアはリトライ後にスプールへ）."""
+        self._count("batches", 1)
+        remaining = batch
+        error = ""
+        for attempt in range(self.config.max_retries + 1):
+            if attempt > 0:
+                self._count("retried", len(remaining))
+                time.sleep(self.config.backoff_s * 2 ** (attempt - 1))
+            # イベントID -> (イベント, スコア)
+            events = {}
+            for record in remaining:
+                event = record.to_event()
+                events[event["id"]] = (event, record)
+            try:
+                response = self._client.api.ingestion.batch(
+                    batch=[event for event, _ in events.values()]
+                )
+            except Exception as e:
+                # ネットワークエラーなどはバッチ全体をリトライ
+                error = f"{type(e).__name__}: {e}"
+                continue
+
+            retry = []
+            for item in getattr(response, "errors", None) or []:
+                entry = events.pop(item.id, None)
+                if entry is None:
+                    continue
+                if item.status in _RETRYABLE_STATUS:
+                    retry.append(entry[1])
+                else:
+                    # リトライしても成功しない（バリデーションエラーなど）
+                    self._spool([entry[1]], f"{item.status}: {item.message}")
+            # events にはエラーにならなかったスコアだけが残っている
+            self._count("uploaded", len(events))
+            if not retry:
+                return
+            remaining = retry
+            error = "retryable errors from ingestion API"
+
+        self._spool(remaining, error)
+
+    def _spool(self, records: list[ScoreRecord], error: str):
+        """送信できなかったスコアをスプールファイルに追記."""
+        self._count("spooled", len(records))
+        if not self.config.spool_path:
+            print(f"⚠️ Dropped {len(records)} score(s): {error}")
+            return
+        path = Path(self.config.spool_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        failed_at = datetime.now(timezone.utc).isoformat()
+        with self._spool_lock, open(path, "a", encoding="utf-8") as f:
+            for record in records:
+                entry = {**asdict(record), "error": error, "failed_at": failed_at}
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        print(f"⚠️ Spooled {len(records)} score(s) to {path}: {error}")
+
+    def flush(self, wait: bool = True):
+        """キューに残っているスコアを送信.
+
+        Args:
+            wait: 送信中のバッチの完了を待つ場合True
+        """
+        while True:
+            with self._lock:
+                batch = self._take_batch(full_only=False)
+            if not batch:
+                break
+            self._dispatch(batch)
+        if wait:
+            with self._lock:
+                futures = list(self._futures)
+            for future in futures:
+                future.result()
+
+    def stats(self) -> dict:
+        """カウンターを返す."""
+        return {
+            "submitted": self.submitted,
+            "uploaded": self.uploaded,
+            "retried": self.retried,
+            "spooled": self.spooled,
+            "skipped": self.skipped,
+            "batches": self.batches,
+        }
+
+    def close(self) -> dict:
+        """残りのスコアを送信して停止.
+
+        Returns:
+            カウンター（stats()）
+        """
+        self._closed.set()
+        self._timer.join()
+        self.flush(wait=True)
+        self._executor.shutdown(wait=True)
+        return self.stats()
+
+
+def resubmit_spool(
+    client: Any,
+    spool_path: str,
+    config: Optional[ScoreUploaderConfig] = None,
+) -> dict:
+    """スプールファイルのスコアを再送.
+
+    スコアIDは元のまま送るため、前回一部が届いていても重複しない。
+    再送でも失敗したスコアは同じスプールファイルに戻る。
+    前回の再送が中断されて <spool_path>.resubmitting が残っている場合は、
+    上書きせずに現在のスプールを追記してまとめて再送する。
+
+    Args:
+        client: Langfuse クライアント
+        spool_path: スプールファイルのパス
+        config: 設定（spool_path は引数の値で上書き）
+
+    Returns:
+        カウンター（ScoreUploader.stats()）
+    """
+    path = Path(spool_path)
+    resubmitting = path.with_suffix(path.suffix + ".resubmitting")
+    if not path.exists() and not resubmitting.exists():
+        return {"submitted": 0}
+    # 再送中に失敗したスコアが追記されるため、先に退避してから読む
+    if not resubmitting.exists():
+        os.replace(path, resubmitting)
+    elif path.exists():
+        # 中断された前回の再送の残りを失わないように追記
+        pending = path.with_suffix(path.suffix + f".{os.getpid()}.pending")
+        os.replace(path, pending)
+        with open(resubmitting, "ab") as out, open(pending, "rb") as src:
+            if out.tell() and not _ends_with_newline(resubmitting):
+                out.write(b"\n")
+            shutil.copyfileobj(src, out)
+        pending.unlink()
+
+    config = config or ScoreUploaderConfig.from_env()
+    config.spool_path = spool_path
+    uploader = ScoreUploader(client, config=config)
+    try:
+        with open(resubmitting, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                entry.pop("error", None)
+                entry.pop("failed_at", None)
+                uploader.submit_record(ScoreRecord(**entry))
+    finally:
+        # 途中で失敗しても投入済みのスコアは送る（.resubmitting は残して次回に再送）
+        stats = uploader.close()
+    resubmitting.unlink()
+    return stats
+
+
+def _ends_with_newline(path: Path) -> bool:
+    """ファイルが改行で終わっているか."""
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+def main():
+    """スプールファイルを再送するコマンド."""
+    parser = argparse.ArgumentParser(description="Resubmit spooled Langfuse scores")
+    parser.add_argument(
+        "--resubmit",
+        default=ScoreUploaderConfig.from_env().spool_path,
+        help="スプールファイルのパス",
+    )
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    from langfuse import get_client
+
+    load_dotenv()
+    stats = resubmit_spool(get_client(), args.resubmit)
+    print(f"✅ Resubmitted scores: {stats}")
+
+
+if __name__ == "__main__":
+    main()
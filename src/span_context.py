@@ -0,0 +1,368 @@
+"""スパンのコンテキスト伝播と未終了スパンの管理.
+
+1つのイベントループで数百のセッションを同時に処理しても、
+スパンがリクエスト間で紐付かないようにするための仕組み。
+
+主な機能:
+1. contextvars による現在のスパンの伝播（current_span / use_span）
+2. SpanRegistry: リクエストごとの未終了スパン（tool_use_id -> スパン）の管理
+3. 最大保持時間・最大数を超えた未終了スパンの強制終了
+4. リーク検出: 未終了スパンを残したまま破棄されたレジストリのスパンを終了して記録
+   （処理が止まったリクエストのスパンはバックグラウンドのスイーパーが最大保持時間で終了。
+   langfuse_tracer.configure_export() が start_leak_detector() で開始する）
+5. 未終了スパン数・リーク数のメトリクス
+
+スパンの親子関係は常に親スパンから明示的に作成するため、current_span() の値に依存しない。
+current_span() は親スパンを受け取れないコード（ガードレール呼び出しなど）のための参照用。
+各セッションを別タスク（asyncio.gather / TaskGroup）で実行すればタスクごとに独立するが、
+1つのタスクで複数の非同期ジェネレーターを交互に進める場合は値が共有される点に注意。
+
+環境変数:
+    LANGFUSE_SPAN_MAX_AGE_S=600: 未終了スパンの最大保持時間（秒）
+    LANGFUSE_MAX_OPEN_SPANS=256: 1リクエストあたりの未終了スパンの最大数
+    LANGFUSE_SPAN_SWEEP_INTERVAL_S=30: スイーパーの実行間隔（秒、0 で無効）
+"""
+
+import os
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Iterator, Optional
+
+try:
+    from src.metrics_registry import REGISTRY
+except ImportError:
+    from metrics_registry import REGISTRY  # type: ignore
+
+# リーク理由
+LEAK_MAX_AGE = "max_age"
+LEAK_MAX_OPEN = "max_open"
+LEAK_ROOT_ENDED = "root_ended"
+LEAK_GC = "gc"
+
+_LEAKED_SPANS = REGISTRY.counter(
+    "langfuse_leaked_spans_total",
+    "Pending spans force-ended by the span registry",
+    ("reason",),
+)
+
+# 現在のスパン（SpanWrapper）
+_current_span: ContextVar[Any] = ContextVar("langfuse_current_span", default=None)
+
+
+def current_span() -> Any:
+    """現在のコンテキストのスパンを返す（ない場合None）."""
+    return _current_span.get()
+
+
+@contextmanager
+def use_span(span: Any) -> Iterator[Any]:
+    """スパンを現在のコンテキストのスパンに設定（コンテキストマネージャー）.
+
+    Args:
+        span: スパン（SpanWrapper）
+
+    Yields:
+        span
+    """
+    token = _current_span.set(span)
+    try:
+        yield span
+    finally:
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            # 別のコンテキストで再開・終了されたジェネレーターでは元に戻せない
+            # （そのコンテキストは破棄されるため問題ない）
+            pass
+
+
+@dataclass
+class SpanRegistryConfig:
+    """未終了スパンの管理設定."""
+
+    # 未終了スパンの最大保持時間（秒、None で無制限）
+    max_age_s: Optional[float] = 600.0
+
+    # 1リクエストあたりの未終了スパンの最大数（超えた場合は最も古いものを終了）
+    max_open_spans: int = 256
+
+    # 最大保持時間を超えたスパンを終了するスイーパーの実行間隔（秒、None で無効）
+    sweep_interval_s: Optional[float] = 30.0
+
+    @classmethod
+    def from_env(cls) -> "SpanRegistryConfig":
+        """環境変数から設定を生成."""
+        max_age = float(os.getenv("LANGFUSE_SPAN_MAX_AGE_S", "600"))
+        interval = float(os.getenv("LANGFUSE_SPAN_SWEEP_INTERVAL_S", "30"))
+        return cls(
+            max_age_s=max_age if max_age > 0 else None,
+            max_open_spans=int(os.getenv("LANGFUSE_MAX_OPEN_SPANS", "256")),
+            sweep_interval_s=interval if interval > 0 else None,
+        )
+
+
+_config = SpanRegistryConfig.from_env()
+
+# 生存中のレジストリ（未終了スパン数の集計とリーク検出用）
+_live_registries: "weakref.WeakSet[SpanRegistry]" = weakref.WeakSet()
+
+# スイーパーのスレッドと停止イベント（start_leak_detector() で開始）
+_leak_detector: Optional[threading.Thread] = None
+_leak_detector_stop = threading.Event()
+_leak_detector_lock = threading.Lock()
+
+
+def configure_span_registry(config: Optional[SpanRegistryConfig] = None):
+    """未終了スパンの管理設定を変更.
+
+    以降に作成される SpanRegistry に適用される。
+
+    Args:
+        config: 設定（Noneの場合は環境変数から生成）
+    """
+    global _config
+    _config = config or SpanRegistryConfig.from_env()
+
+
+def _force_end(span: Any, reason: str):
+    """未終了スパンを WARNING で終了."""
+    span.set_warning(f"Span ended due to: {reason}")
+    span.set_output(f"(no result - {reason})")
+    span.end()
+
+
+class SpanRegistry:
+    """リクエストごとの未終了スパンのレジストリ.
+
+    LangfuseTracer が1リクエストに1つ持ち、start_tool_span で開始した
+    ツールスパンを tool_use_id で管理する。
+    """
+
+    def __init__(self, config: Optional[SpanRegistryConfig] = None):
+        """初期化.
+
+        Args:
+            config: 設定（Noneの場合は configure_span_registry() の設定）
+        """
+        self.config = config or _config
+        # key -> (開始時刻, スパン)。挿入順 = 開始順
+        self._spans: dict[str, tuple[float, Any]] = {}
+        self._lock = threading.Lock()
+        _live_registries.add(self)
+
+    def __len__(self) -> int:
+        return len(self._spans)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._spans
+
+    def open(self, key: str, span: Any):
+        """スパンを登録.
+
+        登録前に最大保持時間を超えたスパンを終了し、最大数を超える場合は
+        最も古いスパンを終了する。
+
+        Args:
+            key: キー（tool_use_id）
+            span: スパン（SpanWrapper）
+        """
+        now = time.monotonic()
+        self.reap(now)
+        evicted = 0
+        with self._lock:
+            while len(self._spans) >= self.config.max_open_spans:
+                oldest = next(iter(self._spans))
+                _force_end(self._spans.pop(oldest)[1], "too many open spans")
+                evicted += 1
+            self._spans[key] = (now, span)
+        if evicted:
+            _LEAKED_SPANS.inc(evicted, (LEAK_MAX_OPEN,))
+
+    def close(self, key: str) -> Any:
+        """スパンの登録を解除して返す（終了は呼び出し側で行う）.
+
+        強制終了はレジストリのロックを保持したまま行うため、スイーパーが終了中のスパンは
+        終了を待ってからNoneを返す（同じスパンを二重に終了しない）。
+
+        Args:
+            key: キー（tool_use_id）
+
+        Returns:
+            スパン（登録されていない場合None）
+        """
+        with self._lock:
+            entry = self._spans.pop(key, None)
+        return entry[1] if entry else None
+
+    def pop_all(self) -> list[Any]:
+        """すべてのスパンの登録を解除して返す（開始順）."""
+        with self._lock:
+            spans = [span for _, span in self._spans.values()]
+            self._spans.clear()
+        return spans
+
+    def close_all(self, reason: str, leak_reason: Optional[str] = None) -> int:
+        """すべての未終了スパンを WARNING で終了.
+
+        Args:
+            reason: 終了理由（スパンのステータスメッセージに記録）
+            leak_reason: リークとして記録する場合の理由（LEAK_*）
+
+        Returns:
+            終了したスパン数
+        """
+        with self._lock:
+            spans = [span for _, span in self._spans.values()]
+            self._spans.clear()
+            for span in spans:
+                _force_end(span, reason)
+        if spans and leak_reason:
+            _LEAKED_SPANS.inc(len(spans), (leak_reason,))
+        return len(spans)
+
+    def reap(self, now: Optional[float] = None) -> int:
+        """最大保持時間を超えたスパンを終了.
+
+        Args:
+            now: 現在時刻（time.monotonic()）
+
+        Returns:
+            終了したスパン数
+        """
+        max_age = self.config.max_age_s
+        if max_age is None or not self._spans:
+            return 0
+        deadline = (time.monotonic() if now is None else now) - max_age
+        expired = 0
+        # スイーパーのスレッドから呼ばれるため、終了までロックを保持する
+        with self._lock:
+            for key, (started, span) in list(self._spans.items()):
+                if started > deadline:
+                    # 挿入順 = 開始順のため以降はすべて新しい
+                    break
+                del self._spans[key]
+                _force_end(span, f"exceeded max age ({max_age:.0f}s)")
+                expired += 1
+        if expired:
+            _LEAKED_SPANS.inc(expired, (LEAK_MAX_AGE,))
+        return expired
+
+    def snapshot(self) -> list[dict]:
+        """未終了スパンの一覧（キーと経過秒数）."""
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {"key": key, "age_s": now - started}
+                for key, (started, _) in self._spans.items()
+            ]
+
+    def __del__(self):
+        # 未終了スパンを残したまま破棄された（ジェネレーターが閉じられなかった等）
+        spans = self._spans
+        if not spans:
+            return
+        count = len(spans)
+        for _, span in list(spans.values()):
+            try:
+                _force_end(span, "leaked (request abandoned)")
+            except Exception:
+                pass
+        spans.clear()
+        _LEAKED_SPANS.inc(count, (LEAK_GC,))
+
+
+def open_span_count() -> int:
+    """生存中のレジストリの未終了スパン数の合計."""
+    return sum(len(registry) for registry in list(_live_registries))
+
+
+def sweep_expired_spans() -> int:
+    """生存中のすべてのレジストリで最大保持時間を超えたスパンを終了.
+
+    処理が止まったリクエストのスパンは次の open() まで終了されないため、
+    定期的に呼ぶ（start_leak_detector()）。
+
+    Returns:
+        終了したスパン数
+    """
+    now = time.monotonic()
+    return sum(registry.reap(now) for registry in list(_live_registries))
+
+
+def leak_report(min_age_s: float = 0.0) -> list[dict]:
+    """経過時間が min_age_s 以上の未終了スパンの一覧（古い順）.
+
+    Args:
+        min_age_s: 最小経過時間（秒）
+
+    Returns:
+        [{"key": ..., "age_s": ...}, ...]
+    """
+    entries = [
+        entry
+        for registry in list(_live_registries)
+        for entry in registry.snapshot()
+        if entry["age_s"] >= min_age_s
+    ]
+    return sorted(entries, key=lambda entry: entry["age_s"], reverse=True)
+
+
+def start_leak_detector(interval_s: Optional[float] = None) -> Optional[threading.Thread]:
+    """sweep_expired_spans() を定期実行するデーモンスレッドを開始.
+
+    プロセスに1つだけ開始する（実行中の場合は既存のスレッドを返す）。
+    langfuse_tracer.configure_export() から呼ばれるため、通常は直接呼ぶ必要はない。
+
+    Args:
+        interval_s: 実行間隔（秒、Noneの場合は configure_span_registry() の設定）
+
+    Returns:
+        スレッド（間隔または最大保持時間が無効の場合None）
+    """
+    global _leak_detector
+    interval = interval_s if interval_s is not None else _config.sweep_interval_s
+    if not interval or _config.max_age_s is None:
+        return None
+    with _leak_detector_lock:
+        if _leak_detector is not None and _leak_detector.is_alive():
+            return _leak_detector
+        _leak_detector_stop.clear()
+
+        def run():
+            while not _leak_detector_stop.wait(interval):
+                expired = sweep_expired_spans()
+                if expired:
+                    print(f"⚠️  Ended {expired} span(s) exceeding max age")
+
+        _leak_detector = threading.Thread(target=run, name="span-leak-detector", daemon=True)
+        _leak_detector.start()
+        return _leak_detector
+
+
+def stop_leak_detector(timeout: Optional[float] = None):
+    """start_leak_detector() で開始したスレッドを停止.
+
+    Args:
+        timeout: 停止を待つ最大秒数
+    """
+    global _leak_detector
+    with _leak_detector_lock:
+        thread, _leak_detector = _leak_detector, None
+        _leak_detector_stop.set()
+    if thread is not None:
+        thread.join(timeout)
+
+
+def _span_metrics_lines() -> list[str]:
+    """未終了スパン数を Prometheus のゲージとして出力."""
+    return [
+        "# TYPE langfuse_open_spans gauge",
+        f"langfuse_open_spans {open_span_count()}",
+    ]
+
+
+REGISTRY.register_collector(_span_metrics_lines)
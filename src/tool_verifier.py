@@ -0,0 +1,336 @@
+"""ツール使用の決定的な検証（LLM ジャッジを使わない）.
+
+「hello.py を作成」のようなケースは、context に "tool: Write", "file: hello.py" のような
+構造化された期待値を持つ。これまでは LLM の GEval（Tool Usage Correctness）で採点していたが、
+採点のたびに Bedrock を呼び出し、結果も揺れる。このモジュールはケースを
+BedrockAgentSDKWithClient で使い捨ての作業ディレクトリで実行し、実際のツール呼び出し
+（ToolUseBlock）と実行後のファイルシステムの状態を期待値と突き合わせる。
+構造化された期待値がないケースだけが LLM ジャッジで採点される。
+
+主な機能:
+1. 期待値の読み取り
+   - context の "tool: 名前" / "file: パス"
+   - ケースの "expect" フィールド:
+     {"tools": [...], "forbidden_tools": [...], "files": [...], "file_contains": {パス: 文字列}}
+2. ケースごとの作業ディレクトリ（一時ディレクトリ）での実行と、実行前後のファイルのスナップショット
+3. 検査: 期待したツールの呼び出し、禁止したツールの不使用、ファイルの作成・変更と内容、
+   ツールの入力のパスが作業ディレクトリの外を指していないこと
+4. 合格した検査の割合をスコアとして記録（すべて合格で success）
+
+環境変数:
+    EVAL_TOOL_VERIFY=true: 構造化された期待値を持つケースを検証する（false で常に LLM ジャッジ）
+    EVAL_VERIFY_TOOLS=Read,Write,Edit,Bash,Glob,Grep: 検証の実行で許可するツール
+        （期待したツールは常に許可する）
+    EVAL_VERIFY_WORKSPACE: 作業ディレクトリを作る場所（省略時はシステムの一時ディレクトリ）
+    EVAL_VERIFY_KEEP=false: 実行後に作業ディレクトリを残す（デバッグ用）
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+try:
+    from src.eval_manifest import stable_hash
+except ImportError:
+    from eval_manifest import stable_hash  # type: ignore
+
+# 検証結果をスコアとして記録するときの名前
+TOOL_SCORE_NAME = "Tool Usage Verified"
+
+# 検証したケースで省略する LLM ジャッジのメトリクス（GEval の name。
+# DeepEval の metrics_data.name は "Tool Usage Correctness [GEval]" になる）
+JUDGE_METRIC_NAME = "Tool Usage Correctness"
+
+# 検査の内容を変えたら上げる（マニフェストの再利用の判定に使う）
+VERIFIER_VERSION = 1
+
+# ツールの入力でパスを表すキー
+_PATH_KEYS = ("file_path", "path", "notebook_path")
+
+
+@dataclass
+class ToolVerifierConfig:
+    """ツール使用の検証の設定."""
+
+    enabled: bool = True
+
+    # 検証の実行で許可するツール（期待したツールは常に追加する）
+    tools: list[str] = field(
+        default_factory=lambda: ["Read", "Write", "Edit", "Bash", "Glob", "Grep"]
+    )
+
+    # 作業ディレクトリを作る場所（Noneの場合はシステムの一時ディレクトリ）
+    workspace_root: Optional[str] = None
+
+    # 実行後に作業ディレクトリを残すか
+    keep_workspaces: bool = False
+
+    @classmethod
+    def from_env(cls) -> "ToolVerifierConfig":
+        """環境変数から設定を生成."""
+        config = cls(
+            enabled=os.getenv("EVAL_TOOL_VERIFY", "true").lower() not in ("false", "0", "no"),
+            workspace_root=os.getenv("EVAL_VERIFY_WORKSPACE") or None,
+            keep_workspaces=os.getenv("EVAL_VERIFY_KEEP", "false").lower() in ("true", "1", "yes"),
+        )
+        tools = os.getenv("EVAL_VERIFY_TOOLS")
+        if tools:
+            config.tools = [tool.strip() for tool in tools.split(",") if tool.strip()]
+        return config
+
+    def fingerprint(self) -> str:
+        """検証のフィンガープリント（スコアの metric_hash）."""
+        return stable_hash({"verifier": VERIFIER_VERSION, "tools": sorted(self.tools)})
+
+
+@dataclass
+class ToolExpectations:
+    """ケースに宣言されたツール使用の期待値."""
+
+    tools: list[str] = field(default_factory=list)
+    forbidden_tools: list[str] = field(default_factory=list)
+    files: list[str] = field(default_factory=list)
+    file_contains: dict[str, str] = field(default_factory=dict)
+
+    @property
+    def empty(self) -> bool:
+        """検査する期待値がないか."""
+        return not (self.tools or self.forbidden_tools or self.files or self.file_contains)
+
+    @classmethod
+    def from_case(cls, item: dict) -> Optional["ToolExpectations"]:
+        """テストケースから期待値を読み取る.
+
+        Args:
+            item: テストケースデータ
+
+        Returns:
+            ToolExpectations（期待値がない場合None）
+        """
+        expectations = cls()
+        for line in item.get("context") or []:
+            if not isinstance(line, str):
+                continue
+            key, sep, value = line.partition(":")
+            key, value = key.strip().lower(), value.strip()
+            if not sep or not value:
+                continue
+            if key == "tool":
+                expectations.tools.append(value)
+            elif key == "file":
+                expectations.files.append(value)
+        expect = item.get("expect") or {}
+        expectations.tools.extend(t for t in expect.get("tools", []) if t not in expectations.tools)
+        expectations.forbidden_tools.extend(expect.get("forbidden_tools", []))
+        expectations.files.extend(f for f in expect.get("files", []) if f not in expectations.files)
+        expectations.file_contains.update(expect.get("file_contains", {}))
+        return None if expectations.empty else expectations
+
+
+@dataclass
+class ToolVerdict:
+    """検証の結果."""
+
+    # (検査の説明, 合格したか)
+    checks: list[tuple[str, bool]]
+    tool_calls: list[dict] = field(default_factory=list)
+    # 実行で作成・変更・削除されたファイル（作業ディレクトリからの相対パス）
+    created: list[str] = field(default_factory=list)
+    modified: list[str] = field(default_factory=list)
+    deleted: list[str] = field(default_factory=list)
+
+    @property
+    def score(self) -> float:
+        """合格した検査の割合."""
+        if not self.checks:
+            return 1.0
+        return sum(passed for _, passed in self.checks) / len(self.checks)
+
+    @property
+    def success(self) -> bool:
+        """すべての検査に合格したか."""
+        return all(passed for _, passed in self.checks)
+
+    @property
+    def reason(self) -> str:
+        """検査結果の説明."""
+        failed = [description for description, passed in self.checks if not passed]
+        called = ", ".join(call["name"] for call in self.tool_calls) or "none"
+        head = (
+            f"{len(self.checks) - len(failed)}/{len(self.checks)} checks passed "
+            f"(tools called: {called}; files created: {', '.join(self.created) or 'none'}, "
+            f"modified: {', '.join(self.modified) or 'none'})"
+        )
+        if failed:
+            return head + ". Failed: " + "; ".join(failed)
+        return head
+
+    def score_entry_fields(self, metric_hash: str = "") -> dict:
+        """検証結果を記録するスコアの値（ScoreEntry の引数）."""
+        return {
+            "name": TOOL_SCORE_NAME,
+            "score": self.score,
+            "success": self.success,
+            "threshold": 1.0,
+            "reason": self.reason,
+            "metric_hash": metric_hash,
+        }
+
+
+def is_judge_metric(metric: Any) -> bool:
+    """検証したケースで省略する LLM ジャッジのメトリクスか."""
+    return getattr(metric, "name", None) == JUDGE_METRIC_NAME
+
+
+def snapshot_files(root: str) -> dict[str, str]:
+    """作業ディレクトリ内のファイルのスナップショット.
+
+    Args:
+        root: 作業ディレクトリ
+
+    Returns:
+        相対パス（"/" 区切り） -> 内容の SHA-256
+    """
+    snapshot = {}
+    root_path = Path(root)
+    for path in root_path.rglob("*"):
+        if path.is_file():
+            relative = path.relative_to(root_path).as_posix()
+            snapshot[relative] = hashlib.sha256(path.read_bytes()).hexdigest()
+    return snapshot
+
+
+def _normalize_path(path: str, workspace: str) -> Optional[str]:
+    """ツールの入力のパスを作業ディレクトリからの相対パスに変換（外を指す場合None）."""
+    root = Path(workspace).resolve()
+    resolved = (root / path).resolve() if not os.path.isabs(path) else Path(path).resolve()
+    try:
+        return resolved.relative_to(root).as_posix()
+    except ValueError:
+        return None
+
+
+def verify(
+    expectations: ToolExpectations,
+    tool_calls: list[dict],
+    before: dict[str, str],
+    after: dict[str, str],
+    workspace: str,
+) -> ToolVerdict:
+    """ツール呼び出しとファイルの状態を期待値と突き合わせる.
+
+    Args:
+        expectations: ケースの期待値
+        tool_calls: 実際のツール呼び出し（BedrockAgentSDKWithClient.tool_calls）
+        before: 実行前の snapshot_files()
+        after: 実行後の snapshot_files()
+        workspace: 作業ディレクトリ
+
+    Returns:
+        ToolVerdict
+    """
+    created = sorted(set(after) - set(before))
+    modified = sorted(path for path in set(after) & set(before) if after[path] != before[path])
+    deleted = sorted(set(before) - set(after))
+    called = [call["name"] for call in tool_calls]
+    checks: list[tuple[str, bool]] = []
+
+    for tool in expectations.tools:
+        checks.append((f"tool {tool} was called", tool in called))
+    for tool in expectations.forbidden_tools:
+        checks.append((f"tool {tool} was not called", tool not in called))
+    for path in expectations.files:
+        relative = _normalize_path(path, workspace)
+        checks.append(
+            (f"file {path} was created or modified", relative in created or relative in modified)
+        )
+    for path, text in expectations.file_contains.items():
+        relative = _normalize_path(path, workspace)
+        file_path = Path(workspace) / relative if relative is not None else None
+        contains = (
+            file_path is not None
+            and file_path.is_file()
+            and text in file_path.read_text(encoding="utf-8", errors="replace")
+        )
+        checks.append((f"file {path} contains {text!r}", contains))
+
+    # ファイルを扱うツールが作業ディレクトリの外を指していないか
+    outside = sorted(
+        {
+            str(call["input"][key])
+            for call in tool_calls
+            for key in _PATH_KEYS
+            if isinstance(call.get("input"), dict)
+            and call["input"].get(key)
+            and _normalize_path(str(call["input"][key]), workspace) is None
+        }
+    )
+    checks.append(
+        (
+            "tool paths stay in the workspace"
+            + (f" (outside: {', '.join(outside)})" if outside else ""),
+            not outside,
+        )
+    )
+
+    return ToolVerdict(
+        checks=checks,
+        tool_calls=tool_calls,
+        created=created,
+        modified=modified,
+        deleted=deleted,
+    )
+
+
+def _default_agent_factory(**kwargs):
+    try:
+        from src.agent import BedrockAgentSDKWithClient
+    except ImportError:
+        from agent import BedrockAgentSDKWithClient  # type: ignore
+    return BedrockAgentSDKWithClient(**kwargs)
+
+
+async def run_and_verify(
+    prompt: str,
+    expectations: ToolExpectations,
+    config: ToolVerifierConfig,
+    session_id: Optional[str] = None,
+    user_id: Optional[str] = None,
+    agent_factory: Callable[..., Any] = _default_agent_factory,
+) -> tuple[str, ToolVerdict]:
+    """ケースを使い捨ての作業ディレクトリで実行して検証.
+
+    Args:
+        prompt: ケースの入力
+        expectations: ケースの期待値
+        config: 検証の設定
+        session_id: セッションID
+        user_id: ユーザーID
+        agent_factory: BedrockAgentSDKWithClient を生成する関数（cwd, tools を受け取る）
+
+    Returns:
+        (エージェントの出力, ToolVerdict)
+    """
+    if config.workspace_root:
+        Path(config.workspace_root).mkdir(parents=True, exist_ok=True)
+    workspace = tempfile.mkdtemp(prefix="eval-verify-", dir=config.workspace_root)
+    tools = list(config.tools) + [t for t in expectations.tools if t not in config.tools]
+    try:
+        before = snapshot_files(workspace)
+        async with agent_factory(cwd=workspace, tools=tools) as agent:
+            chunks = [
+                chunk
+                async for chunk in agent.chat_with_client(
+                    prompt, session_id=session_id, user_id=user_id
+                )
+            ]
+            tool_calls = list(agent.tool_calls)
+        after = snapshot_files(workspace)
+        return "".join(chunks), verify(expectations, tool_calls, before, after, workspace)
+    finally:
+        if not config.keep_workspaces:
+            shutil.rmtree(workspace, ignore_errors=True)
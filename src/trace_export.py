@@ -0,0 +1,904 @@
+"""トレースのバッチエクスポート.
+
+LangfuseTracer の非同期エクスポートモード用の実装。
+リクエスト処理中は Langfuse SDK を呼ばずにスパンをメモリ上に記録し、
+バックグラウンドワーカーがまとめて送信する。
+
+主な機能:
+1. RecordingClient / RecordingSpan: Langfuse クライアント/スパンと同じ API でスパンを記録
+2. BatchExportProcessor: 上限付きキュー + バックグラウンドワーカーによるバッチ送信
+3. キュー満杯時のポリシー（drop_oldest / block）
+4. キュー深さ・ドロップ数などのカウンター
+5. サンプリング（trace_sampling.TraceSampler）によるトレース単位の保持/破棄
+6. LangfuseExporter: 記録したスパンを Langfuse Ingestion API で送信
+7. ディスクスプール（trace_spool.DiskSpool）: キュー満杯時・送信失敗時に退避し、復旧後に順番に再送
+"""
+
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Optional
+
+# キュー満杯時のポリシー
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_BLOCK = "block"
+
+
+@dataclass
+class SpanRecord:
+    """記録されたスパン（trace / span / tool / generation / score）."""
+
+    kind: str
+    trace_id: str
+    id: str
+    name: str = ""
+    parent_id: Optional[str] = None
+    start_time: float = 0.0
+    end_time: Optional[float] = None
+
+    input: Any = None
+    output: Any = None
+    metadata: dict = field(default_factory=dict)
+    level: str = "DEFAULT"
+    status_message: Optional[str] = None
+
+    # generation 用
+    model: Optional[str] = None
+    model_parameters: Optional[dict] = None
+    usage_details: Optional[dict] = None
+
+    # trace 用
+    session_id: Optional[str] = None
+    user_id: Optional[str] = None
+    tags: list[str] = field(default_factory=list)
+
+    # score 用
+    value: Optional[float] = None
+    comment: Optional[str] = None
+
+
+@dataclass
+class ExportConfig:
+    """エクスポート設定."""
+
+    # "sync": リクエストごとに flush（従来動作）, "async": バックグラウンド送信
+    mode: str = "sync"
+
+    # キューに保持する最大スパン数
+    max_queue_size: int = 10000
+
+    # 1回の送信でまとめるスパン数（この数に達したら即送信）
+    max_batch_size: int = 200
+
+    # キューにスパンがあれば最大この間隔で送信
+    schedule_delay_s: float = 2.0
+
+    # キュー満杯時のポリシー（drop_oldest / block）
+    overflow_policy: str = OVERFLOW_DROP_OLDEST
+
+    # block ポリシーで待つ最大秒数（超えたら新しいスパンをドロップ）
+    block_timeout_s: float = 1.0
+
+    # Langfuse へ送信するか（エアギャップ環境では False）
+    export_to_langfuse: bool = True
+
+    # ローカル出力先（JSONL + SQLite、Noneの場合は出力しない）
+    local_dir: Optional[str] = None
+
+    # ディスクスプールのディレクトリ（Noneの場合はスプールせずドロップ）
+    spool_dir: Optional[str] = None
+
+    # 送信失敗後にスプールの再送を再試行する間隔（秒）
+    spool_retry_interval_s: float = 5.0
+
+    @classmethod
+    def from_env(cls) -> "ExportConfig":
+        """環境変数から設定を生成."""
+        return cls(
+            mode=os.getenv("LANGFUSE_EXPORT_MODE", "sync"),
+            max_queue_size=int(os.getenv("LANGFUSE_EXPORT_MAX_QUEUE_SIZE", "10000")),
+            max_batch_size=int(os.getenv("LANGFUSE_EXPORT_MAX_BATCH_SIZE", "200")),
+            schedule_delay_s=float(os.getenv("LANGFUSE_EXPORT_SCHEDULE_DELAY", "2.0")),
+            overflow_policy=os.getenv(
+                "LANGFUSE_EXPORT_OVERFLOW_POLICY", OVERFLOW_DROP_OLDEST
+            ),
+            block_timeout_s=float(os.getenv("LANGFUSE_EXPORT_BLOCK_TIMEOUT", "1.0")),
+            export_to_langfuse=os.getenv("LANGFUSE_EXPORT_TO_LANGFUSE", "true").lower()
+            not in ("false", "0", "no"),
+            local_dir=os.getenv("LANGFUSE_EXPORT_LOCAL_DIR") or None,
+            spool_dir=os.getenv("LANGFUSE_SPOOL_DIR") or None,
+            spool_retry_interval_s=float(
+                os.getenv("LANGFUSE_SPOOL_RETRY_INTERVAL", "5.0")
+            ),
+        )
+
+
+def new_trace_id() -> str:
+    """トレースIDを生成（32桁の16進数）."""
+    return uuid.uuid4().hex
+
+
+def new_observation_id() -> str:
+    """オブザベーションIDを生成（16桁の16進数）."""
+    return os.urandom(8).hex()
+
+
+class SpanExporter:
+    """エクスポーターの基底クラス.
+
+    export() はバックグラウンドワーカーから呼ばれる。
+    """
+
+    # スプールのサブディレクトリ名・統計のキー（FanoutExportProcessor）
+    name = "exporter"
+
+    def export(self, records: list[SpanRecord]):
+        """スパンを送信.
+
+        Args:
+            records: 送信するスパンのリスト
+        """
+        raise NotImplementedError
+
+    def flush(self):
+        """バッファを送信（必要な場合のみ実装）."""
+
+    def shutdown(self):
+        """終了処理（必要な場合のみ実装）."""
+
+
+def _iso(timestamp: Optional[float]) -> Optional[str]:
+    """UNIX 時刻を ISO 8601 文字列に変換."""
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).isoformat()
+
+
+class LangfuseExporter(SpanExporter):
+    """Langfuse Ingestion API でスパンを送信するエクスポーター.
+
+    記録時刻をそのまま送るため、送信が遅れてもレイテンシは正しく表示される。
+    """
+
+    name = "langfuse"
+
+    def __init__(self, client: Any):
+        """初期化.
+
+        Args:
+            client: Langfuse クライアント（get_client() の戻り値）
+        """
+        self._client = client
+
+    def export(self, records: list[SpanRecord]):
+        """スパンを Ingestion イベントに変換して送信."""
+        events = [self._to_event(record) for record in records]
+        if events:
+            self._client.api.ingestion.batch(batch=events)
+
+    def _to_event(self, record: SpanRecord) -> dict:
+        """SpanRecord を Ingestion イベントに変換."""
+        if record.kind == "trace":
+            event_type = "trace-create"
+            body = {
+                "id": record.trace_id,
+                "name": record.name,
+                "timestamp": _iso(record.start_time),
+                "input": record.input,
+                "output": record.output,
+                "metadata": record.metadata,
+                "sessionId": record.session_id,
+                "userId": record.user_id,
+                "tags": record.tags,
+            }
+        elif record.kind == "score":
+            event_type = "score-create"
+            body = {
+                "id": record.id,
+                "traceId": record.trace_id,
+                "observationId": record.parent_id,
+                "name": record.name,
+                "value": record.value,
+                "comment": record.comment,
+            }
+        else:
+            body = {
+                "id": record.id,
+                "traceId": record.trace_id,
+                "parentObservationId": record.parent_id,
+                "name": record.name,
+                "startTime": _iso(record.start_time),
+                "endTime": _iso(record.end_time),
+                "input": record.input,
+                "output": record.output,
+                "metadata": record.metadata,
+                "level": record.level,
+                "statusMessage": record.status_message,
+            }
+            if record.kind == "generation":
+                event_type = "generation-create"
+                body["model"] = record.model
+                body["modelParameters"] = record.model_parameters
+                body["usageDetails"] = record.usage_details
+            else:
+                # tool は span として送信し、種別はメタデータに残す
+                event_type = "span-create"
+                if record.kind != "span":
+                    body["metadata"] = {**record.metadata, "observation_type": record.kind}
+
+        return {
+            "id": uuid.uuid4().hex,
+            "timestamp": _iso(time.time()),
+            "type": event_type,
+            "body": body,
+        }
+
+    def flush(self):
+        """Langfuse クライアントをフラッシュ."""
+        self._client.flush()
+
+    def shutdown(self):
+        """Langfuse クライアントをシャットダウン."""
+        self._client.shutdown()
+
+
+class BatchExportProcessor:
+    """上限付きキューとバックグラウンドワーカーによるバッチ送信.
+
+    submit() はキューに積むだけで、ネットワーク送信はワーカースレッドが行う。
+    max_batch_size に達するか schedule_delay_s が経過すると送信する。
+
+    スプールを指定した場合、キュー満杯時と送信失敗時はドロップせずにディスクへ書き込む。
+    スプールに未送信のバッチがある間は、順序を保つため新しいスパンもスプールに書き込み、
+    ワーカーがスプールを古い順に再送する（少なくとも1回の配送。
+    Langfuse はオブザベーションIDで upsert するため再送の重複は上書きになる）。
+    ディスクへの書き込みと再送はワーカースレッドが行い、submit() はメモリ上の
+    書き込み待ち（最大 max_queue_size スパン）に積むだけでディスクに触れない。
+    """
+
+    def __init__(
+        self,
+        exporter: SpanExporter,
+        config: Optional[ExportConfig] = None,
+        spool: Any = None,
+    ):
+        """初期化.
+
+        Args:
+            exporter: 送信先エクスポーター
+            config: エクスポート設定
+            spool: ディスクスプール（trace_spool.DiskSpool、Noneの場合はスプールしない）
+        """
+        self.exporter = exporter
+        self.spool = spool
+        self.config = config or ExportConfig(mode="async")
+        if self.config.overflow_policy not in (OVERFLOW_DROP_OLDEST, OVERFLOW_BLOCK):
+            raise ValueError(
+                f"Unknown overflow policy: {self.config.overflow_policy}"
+            )
+
+        self._queue: deque[SpanRecord] = deque()
+        # スプールへの書き込み待ち（ワーカーが書き込む）
+        self._spill_queue: deque[list[SpanRecord]] = deque()
+        self._spill_pending = 0
+        self._cond = threading.Condition()
+        # エクスポーターはスレッドセーフとは限らないため送信は直列化
+        self._export_lock = threading.Lock()
+        self._shutdown = False
+
+        # カウンター
+        self.dropped_spans = 0
+        self.exported_spans = 0
+        self.failed_spans = 0
+        self.exported_batches = 0
+        self.spooled_spans = 0
+
+        # スプールの再送を再開する時刻（送信失敗後は spool_retry_interval_s 待つ）
+        self._replay_after = 0.0
+        # 再送途中のセグメント -> 送信済みバッチ数
+        self._replay_progress: dict[Any, int] = {}
+
+        self._worker = threading.Thread(
+            target=self._run, name="langfuse-export", daemon=True
+        )
+        self._worker.start()
+
+    @property
+    def queue_depth(self) -> int:
+        """キューに残っているスパン数."""
+        return len(self._queue)
+
+    def stats(self) -> dict:
+        """カウンターのスナップショットを返す."""
+        return {
+            "queue_depth": self.queue_depth,
+            "max_queue_size": self.config.max_queue_size,
+            "dropped_spans": self.dropped_spans,
+            "exported_spans": self.exported_spans,
+            "failed_spans": self.failed_spans,
+            "exported_batches": self.exported_batches,
+            **(
+                {
+                    "spooled_spans": self.spooled_spans,
+                    "spill_pending": self._spill_pending,
+                    "spool": self.spool.stats(),
+                }
+                if self.spool is not None
+                else {}
+            ),
+        }
+
+    def submit(self, records: list[SpanRecord]):
+        """スパンをキューに追加.
+
+        Args:
+            records: 追加するスパン
+        """
+        with self._cond:
+            if self._shutdown:
+                self.dropped_spans += len(records)
+                return
+            spill = self.spool is not None and (
+                self._spill_queue
+                or self.spool.has_pending()
+                or len(self._queue) + len(records) > self.config.max_queue_size
+            )
+            if not spill:
+                self._enqueue(records)
+            elif self._spill_pending + len(records) > self.config.max_queue_size:
+                # ワーカーの書き込みが追いつかない（ディスクの遅延）
+                self.dropped_spans += len(records)
+            else:
+                # ディスクへの書き込みはワーカーが行う（リクエスト処理のスレッドで I/O しない）
+                self._spill_queue.append(records)
+                self._spill_pending += len(records)
+                self._cond.notify_all()
+
+    def _enqueue(self, records: list[SpanRecord]):
+        """スパンをキューに追加（_cond を保持した状態で呼ぶ）."""
+        for record in records:
+            if len(self._queue) >= self.config.max_queue_size:
+                if not self._make_room():
+                    self.dropped_spans += 1
+                    continue
+            self._queue.append(record)
+        if len(self._queue) >= self.config.max_batch_size:
+            self._cond.notify_all()
+
+    def _spill(self, records: list[SpanRecord]) -> bool:
+        """スパンをディスクスプールに書き込む.
+
+        Returns:
+            書き込んだ場合True（スプールが拒否した場合はドロップ）
+        """
+        try:
+            written = self.spool.append(records)
+        except OSError as e:
+            print(f"⚠️  Trace spool write failed ({len(records)} spans): {e}")
+            written = False
+        with self._cond:
+            if written:
+                self.spooled_spans += len(records)
+                self._cond.notify_all()
+            else:
+                self.dropped_spans += len(records)
+        return written
+
+    def _write_spills(self):
+        """書き込み待ちのスパンをスプールに書き込む（ワーカーまたは _export_lock を保持して呼ぶ）."""
+        while True:
+            with self._cond:
+                if not self._spill_queue:
+                    return
+                records = self._spill_queue.popleft()
+                self._spill_pending -= len(records)
+            self._spill(records)
+
+    def _make_room(self) -> bool:
+        """キューに空きを作る（_cond を保持した状態で呼ぶ）.
+
+        Returns:
+            空きができた場合True（False の場合は新しいスパンをドロップ）
+        """
+        if self.config.overflow_policy == OVERFLOW_DROP_OLDEST:
+            self._queue.popleft()
+            self.dropped_spans += 1
+            return True
+
+        # block: ワーカーが送信して空きができるまで待つ
+        self._cond.notify_all()
+        deadline = time.monotonic() + self.config.block_timeout_s
+        while len(self._queue) >= self.config.max_queue_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._shutdown:
+                return False
+            self._cond.wait(remaining)
+        return True
+
+    def _take_batch(self) -> list[SpanRecord]:
+        """キューから1バッチ分を取り出す（_cond を保持した状態で呼ぶ）."""
+        size = min(len(self._queue), self.config.max_batch_size)
+        batch = [self._queue.popleft() for _ in range(size)]
+        if batch:
+            # block ポリシーで待っている submit() を起こす
+            self._cond.notify_all()
+        return batch
+
+    def _export(self, batch: list[SpanRecord]):
+        """バッチを送信（_export_lock を保持した状態で呼ぶ）."""
+        try:
+            self.exporter.export(batch)
+            self.exported_spans += len(batch)
+            self.exported_batches += 1
+        except Exception as e:
+            # トレース送信の失敗でアプリケーションを止めない
+            print(f"⚠️  Trace export failed ({len(batch)} spans): {e}")
+            if self.spool is not None:
+                self._replay_after = time.monotonic() + self.config.spool_retry_interval_s
+                if self._spill(batch):
+                    return
+            self.failed_spans += len(batch)
+
+    def _replay_due(self) -> bool:
+        """スプールの再送を行うか."""
+        return (
+            self.spool is not None
+            and self.spool.has_pending()
+            and time.monotonic() >= self._replay_after
+        )
+
+    def _replay_segment(self) -> bool:
+        """スプールの最も古いセグメントを再送（_export_lock を保持した状態で呼ぶ）.
+
+        送信に失敗した場合はセグメントを残し、spool_retry_interval_s 後に
+        送信済みのバッチの次から再開する。
+
+        Returns:
+            セグメントをすべて送信した場合True
+        """
+        path = self.spool.oldest_segment()
+        if path is None:
+            return False
+        batches = self.spool.read_segment(path)
+        done = self._replay_progress.get(path, 0)
+        for batch in batches[done:]:
+            records = [SpanRecord(**record) for record in batch]
+            try:
+                self.exporter.export(records)
+            except Exception as e:
+                self._replay_progress[path] = done
+                self._replay_after = time.monotonic() + self.config.spool_retry_interval_s
+                print(f"⚠️  Trace spool replay failed, retrying in {self.config.spool_retry_interval_s:.1f}s: {e}")
+                return False
+            done += 1
+            self.exported_spans += len(records)
+            self.exported_batches += 1
+        self._replay_progress.pop(path, None)
+        self.spool.ack(path, len(batches))
+        return True
+
+    def _run(self):
+        """ワーカースレッドのメインループ."""
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self.config.schedule_delay_s
+                while (
+                    not self._shutdown
+                    and not self._spill_queue
+                    and len(self._queue) < self.config.max_batch_size
+                    and not self._replay_due()
+                ):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    if self.spool is not None and self.spool.has_pending():
+                        # 再送の再開時刻に起きる
+                        remaining = min(
+                            remaining, max(0.01, self._replay_after - time.monotonic())
+                        )
+                    self._cond.wait(remaining)
+                if self._shutdown:
+                    return
+                batch = self._take_batch()
+
+            with self._export_lock:
+                self._write_spills()
+            if batch:
+                with self._export_lock:
+                    self._export(batch)
+            # キューを先に送り、空いている間にスプールを古い順に再送
+            if not self.queue_depth and self._replay_due():
+                with self._export_lock:
+                    self._replay_segment()
+
+    def force_flush(self):
+        """キューをすべて送信（シャットダウン時やテスト用）.
+
+        スプールに未送信のバッチがある場合は、順序を保つため先にスプールを再送する。
+        再送できなかった場合、キューのスパンは送信せずにスプールの後ろに書き込む
+        （次回起動時に古い順に再送される）。
+        呼び出し元スレッドで送信するため、リクエスト処理中には呼ばないこと。
+        """
+        with self._export_lock:
+            drained = True
+            if self.spool is not None:
+                self._write_spills()
+                self._replay_after = 0.0
+                while drained and self.spool.has_pending():
+                    drained = self._replay_segment()
+            while True:
+                with self._cond:
+                    batch = self._take_batch()
+                if not batch:
+                    break
+                if drained:
+                    self._export(batch)
+                    # 送信に失敗したバッチはスプールに入るため、以降もその後ろに書き込む
+                    drained = self.spool is None or not self.spool.has_pending()
+                else:
+                    self._spill(batch)
+            self.exporter.flush()
+
+    def drain_spool(self) -> bool:
+        """スプールをすべて再送（復旧確認後の手動実行やテスト用）.
+
+        Returns:
+            スプールが空になった場合True
+        """
+        if self.spool is None:
+            return True
+        with self._export_lock:
+            self._write_spills()
+            self._replay_after = 0.0
+            while self.spool.has_pending():
+                if not self._replay_segment():
+                    return False
+            self.exporter.flush()
+        return True
+
+    def shutdown(self):
+        """ワーカーを停止し、残りのスパンを送信."""
+        with self._cond:
+            if self._shutdown:
+                return
+            self._shutdown = True
+            self._cond.notify_all()
+        self._worker.join(timeout=self.config.schedule_delay_s + 5.0)
+        self.force_flush()
+        if self.spool is not None:
+            # 未送信のバッチはディスクに残し、次回起動時に再送する
+            self.spool.close()
+        self.exporter.shutdown()
+
+
+class FanoutExportProcessor:
+    """エクスポーターごとの BatchExportProcessor に同じスパンを配る.
+
+    キュー・再送・スプールはエクスポーターごとに独立しているため、
+    Langfuse だけが失敗してもローカルのエクスポーターには再送されない。
+    BatchExportProcessor と同じ submit / force_flush / drain_spool / shutdown / stats を持つ。
+    """
+
+    def __init__(self, processors: dict[str, BatchExportProcessor]):
+        """初期化.
+
+        Args:
+            processors: エクスポーター名 -> プロセッサー
+        """
+        self.processors = processors
+
+    def submit(self, records: list[SpanRecord]):
+        """すべてのプロセッサーのキューに追加."""
+        for processor in self.processors.values():
+            processor.submit(records)
+
+    def force_flush(self):
+        """すべてのプロセッサーのキューを送信."""
+        for processor in self.processors.values():
+            processor.force_flush()
+
+    def drain_spool(self) -> bool:
+        """すべてのプロセッサーのスプールを再送.
+
+        Returns:
+            すべてのスプールが空になった場合True
+        """
+        results = [processor.drain_spool() for processor in self.processors.values()]
+        return all(results)
+
+    def shutdown(self):
+        """すべてのプロセッサーを停止."""
+        for processor in self.processors.values():
+            processor.shutdown()
+
+    def stats(self) -> dict:
+        """カウンターの合計とエクスポーターごとの内訳.
+
+        キュー深さ・ドロップ数などはエクスポーターごとの合計、
+        スプールの遅れ（lag_s）は最大値。
+        """
+        per_exporter = {name: p.stats() for name, p in self.processors.items()}
+        totals: dict[str, Any] = {}
+        for stats in per_exporter.values():
+            for key, value in stats.items():
+                if key == "spool":
+                    spool = totals.setdefault("spool", {})
+                    for spool_key, spool_value in value.items():
+                        if spool_key == "lag_s":
+                            spool[spool_key] = max(spool.get(spool_key, 0.0), spool_value)
+                        else:
+                            spool[spool_key] = spool.get(spool_key, 0) + spool_value
+                else:
+                    totals[key] = totals.get(key, 0) + value
+        totals["exporters"] = per_exporter
+        return totals
+
+
+class _TraceBuffer:
+    """1トレース分のスパンを集めるバッファ.
+
+    ルートスパン終了時にサンプリングを判定し、保持する場合のみ
+    まとめて BatchExportProcessor に渡す。
+    """
+
+    def __init__(
+        self,
+        processor: BatchExportProcessor,
+        name: str,
+        sampler: Any = None,
+        session_id: Optional[str] = None,
+        trace_id: Optional[str] = None,
+        head_sampled: Optional[bool] = None,
+    ):
+        self.processor = processor
+        self.sampler = sampler
+        self.trace = SpanRecord(
+            kind="trace",
+            trace_id=trace_id or new_trace_id(),
+            id="",
+            name=name,
+            start_time=time.time(),
+        )
+        self.trace.id = self.trace.trace_id
+        self.records: list[SpanRecord] = []
+        self.closed = False
+        self.kept = True
+
+        # ヘッドで破棄され、テールルールもない場合は何も記録しない
+        if head_sampled is None:
+            head_sampled = sampler is None or sampler.head_sample(session_id)
+        self.head_sampled = head_sampled
+        self.recording = self.head_sampled or sampler.needs_recording
+
+    def add(self, record: SpanRecord):
+        """スパンを追加（ルート終了後に開始したスパンは終了時に単独で送信）."""
+        if self.recording and not self.closed:
+            self.records.append(record)
+
+    def on_end(self, record: SpanRecord):
+        """スパン終了時の処理."""
+        if self.closed and self.kept and self.recording:
+            # ルート終了後に終わったスパンは単独で送信（ルート終了時には送信していない）
+            self.processor.submit([record])
+
+    def close(self, root: SpanRecord):
+        """ルートスパン終了時にトレースを送信."""
+        if self.closed:
+            return
+        self.closed = True
+
+        if self.sampler is not None:
+            if not self.recording:
+                self.kept = False
+                self.sampler.record_unrecorded_drop()
+                return
+            self.kept, sampling_info = self.sampler.decide(
+                self.head_sampled, self.records
+            )
+            if not self.kept:
+                self.records = []
+                return
+            self.trace.metadata.update(sampling_info)
+
+        if self.trace.input is None:
+            self.trace.input = root.input
+        if self.trace.output is None:
+            self.trace.output = root.output
+        self.trace.end_time = root.end_time
+        # 未終了の子スパンは終了時に on_end() で送信する（同じスパンを2回送らない）
+        ended = [record for record in self.records if record.end_time is not None]
+        self.processor.submit([self.trace, *ended])
+        self.records = []
+
+
+class RecordingSpan:
+    """Langfuse スパンと同じ API でスパンを記録するクラス.
+
+    SpanWrapper から使われる update / start_observation / start_span /
+    score / end / update_trace をサポートする。
+    """
+
+    def __init__(self, buffer: _TraceBuffer, record: SpanRecord, is_root: bool = False):
+        self._buffer = buffer
+        self._record = record
+        self._is_root = is_root
+
+    @property
+    def id(self) -> str:
+        """オブザベーションID."""
+        return self._record.id
+
+    @property
+    def trace_id(self) -> str:
+        """トレースID."""
+        return self._record.trace_id
+
+    def update(self, **kwargs):
+        """スパンの属性を更新（metadata はキーごとにマージ）."""
+        record = self._record
+        for key, value in kwargs.items():
+            if key == "metadata":
+                if value:
+                    record.metadata.update(value)
+            elif hasattr(record, key):
+                setattr(record, key, value)
+        return self
+
+    def update_trace(self, **kwargs):
+        """トレースの属性を更新."""
+        trace = self._buffer.trace
+        for key, value in kwargs.items():
+            if key == "metadata":
+                if value:
+                    trace.metadata.update(value)
+            elif key == "tags":
+                if value:
+                    trace.tags.extend(value)
+            elif hasattr(trace, key):
+                setattr(trace, key, value)
+        return self
+
+    def start_observation(self, *, name: str, as_type: str = "span", **kwargs) -> "RecordingSpan":
+        """子オブザベーションを開始."""
+        record = SpanRecord(
+            kind=as_type,
+            trace_id=self._record.trace_id,
+            id=new_observation_id(),
+            name=name,
+            parent_id=self._record.id,
+            start_time=time.time(),
+        )
+        self._buffer.add(record)
+        child = RecordingSpan(self._buffer, record)
+        child.update(**kwargs)
+        return child
+
+    def start_span(self, *, name: str, input: Any = None, metadata: Optional[dict] = None) -> "RecordingSpan":
+        """子スパンを開始."""
+        return self.start_observation(
+            name=name, as_type="span", input=input, metadata=metadata
+        )
+
+    def score(self, *, name: str, value: float, comment: Optional[str] = None, **kwargs):
+        """スコアを記録."""
+        record = SpanRecord(
+            kind="score",
+            trace_id=self._record.trace_id,
+            id=uuid.uuid4().hex,
+            name=name,
+            parent_id=self._record.id,
+            start_time=time.time(),
+            end_time=time.time(),
+            value=value,
+            comment=comment,
+        )
+        self._buffer.add(record)
+        self._buffer.on_end(record)
+
+    def end(self):
+        """スパンを終了."""
+        if self._record.end_time is not None:
+            return
+        self._record.end_time = time.time()
+        if self._is_root:
+            self._buffer.close(self._record)
+        else:
+            self._buffer.on_end(self._record)
+
+
+class RecordingClient:
+    """Langfuse クライアントの代わりに使う記録用クライアント.
+
+    LangfuseTracer が使う start_span / create_trace_id / flush / shutdown を提供する。
+    """
+
+    def __init__(
+        self,
+        processor: BatchExportProcessor,
+        sampler: Any = None,
+        session_id: Optional[str] = None,
+    ):
+        """初期化.
+
+        Args:
+            processor: 記録したトレースの送信先
+            sampler: トレースサンプラー（Noneの場合はすべて保持）
+            session_id: ヘッドサンプリングに使うセッションID
+        """
+        self.processor = processor
+        self.sampler = sampler
+        self.session_id = session_id
+
+    @staticmethod
+    def create_trace_id() -> str:
+        """新しいトレースIDを生成."""
+        return new_trace_id()
+
+    def sample_trace(self) -> Optional[bool]:
+        """次のトレースのヘッドサンプリングの判定（TraceSampler.sample_trace）.
+
+        None の場合、呼び出し元はトレースを開始せず、ペイロードの処理も行わない。
+
+        Returns:
+            True: 保持, False: ヘッドで破棄（テール判定のために記録）, None: 記録しない
+        """
+        if self.sampler is None:
+            return True
+        return self.sampler.sample_trace(self.session_id)
+
+    def start_span(
+        self,
+        *,
+        name: str,
+        input: Any = None,
+        metadata: Optional[dict] = None,
+        trace_context: Optional[dict] = None,
+        head_sampled: Optional[bool] = None,
+    ) -> RecordingSpan:
+        """ルートスパンを開始（end() で終了するとトレースを送信）.
+
+        head_sampled を省略した場合はここでヘッドサンプリングを判定する。
+        """
+        trace_id = trace_context.get("trace_id") if trace_context else None
+        buffer = _TraceBuffer(
+            self.processor, name, self.sampler, self.session_id, trace_id, head_sampled
+        )
+        record = SpanRecord(
+            kind="span",
+            trace_id=buffer.trace.trace_id,
+            id=new_observation_id(),
+            name=name,
+            start_time=buffer.trace.start_time,
+            input=input,
+            metadata=dict(metadata) if metadata else {},
+        )
+        buffer.add(record)
+        return RecordingSpan(buffer, record, is_root=True)
+
+    @contextmanager
+    def start_as_current_span(
+        self,
+        *,
+        name: str,
+        input: Any = None,
+        metadata: Optional[dict] = None,
+    ):
+        """ルートスパンを開始（コンテキストマネージャー）."""
+        span = self.start_span(name=name, input=input, metadata=metadata)
+        try:
+            yield span
+        finally:
+            span.end()
+
+    def flush(self):
+        """キューをすべて送信."""
+        self.processor.force_flush()
+
+    def shutdown(self):
+        """プロセッサーを停止."""
+        self.processor.shutdown()
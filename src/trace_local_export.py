@@ -0,0 +1,443 @@
+"""ローカルファイルへのスパンエクスポート.
+
+エアギャップ環境やオフラインの性能分析用に、記録したスパンを
+ローカルファイルへ書き出すエクスポーターとクエリヘルパー。
+
+主な機能:
+1. JsonlFileExporter: ローテーション付き gzip 圧縮 JSONL
+2. SqliteExporter: 分析用の列指向テーブル（SQLite）
+3. MultiExporter: 複数のエクスポーターへ同時に送信
+   （configure_export は再送・スプールをエクスポーターごとに行うため
+   trace_export.FanoutExportProcessor を使う）
+4. TraceQuery: レイテンシ分位点・トークン使用量・キャッシュヒット率の集計
+   （model / tag / session / 時間バケットでグループ化）
+"""
+
+import gzip
+import json
+import sqlite3
+import threading
+import time
+from dataclasses import asdict
+from pathlib import Path
+from typing import Any, Optional
+
+try:
+    # When running from project root
+    from src.trace_export import SpanExporter, SpanRecord
+except ImportError:
+    # When running from src directory
+    from trace_export import SpanExporter, SpanRecord  # type: ignore
+
+
+def _to_json(value: Any) -> str:
+    """JSON 文字列に変換（シリアライズできない値は str() で変換）."""
+    return json.dumps(value, ensure_ascii=False, default=str)
+
+
+class MultiExporter(SpanExporter):
+    """複数のエクスポーターへ同じスパンを送信.
+
+    1つのエクスポーターが失敗しても他のエクスポーターには送信するが、失敗は例外として
+    伝わるため、BatchExportProcessor はバッチ全体をすべてのエクスポーターに再送する。
+    再送するエクスポーターでは重複しても問題ない場合（SqliteExporter は span ID で上書き）
+    にだけ使い、通常は trace_export.FanoutExportProcessor を使う。
+    """
+
+    def __init__(self, exporters: list[SpanExporter]):
+        """初期化.
+
+        Args:
+            exporters: 送信先エクスポーターのリスト
+        """
+        self.exporters = exporters
+
+    def export(self, records: list[SpanRecord]):
+        """すべてのエクスポーターに送信."""
+        errors = []
+        for exporter in self.exporters:
+            try:
+                exporter.export(records)
+            except Exception as e:
+                errors.append(f"{type(exporter).__name__}: {e}")
+        if errors:
+            raise RuntimeError("; ".join(errors))
+
+    def flush(self):
+        """すべてのエクスポーターをフラッシュ."""
+        for exporter in self.exporters:
+            exporter.flush()
+
+    def shutdown(self):
+        """すべてのエクスポーターを終了."""
+        for exporter in self.exporters:
+            exporter.shutdown()
+
+
+class JsonlFileExporter(SpanExporter):
+    """gzip 圧縮 JSONL へのエクスポーター.
+
+    1行に1スパン（SpanRecord を辞書化したもの）を書き込む。
+    書き込んだバイト数（非圧縮）が max_bytes を超えると新しいファイルに切り替える。
+
+    ファイル名: <directory>/spans-<YYYYmmdd-HHMMSS>-<連番>.jsonl.gz
+    """
+
+    name = "jsonl"
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int = 64 * 1024 * 1024,
+        max_files: Optional[int] = None,
+    ):
+        """初期化.
+
+        Args:
+            directory: 出力ディレクトリ
+            max_bytes: 1ファイルあたりの最大バイト数（非圧縮）
+            max_files: 保持する最大ファイル数（超えたら古い順に削除、Noneで無制限）
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self._file: Any = None
+        self._bytes_written = 0
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def _open_new_file(self):
+        """新しいファイルを開く."""
+        if self._file is not None:
+            self._file.close()
+        self._sequence += 1
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        path = self.directory / f"spans-{stamp}-{self._sequence:04d}.jsonl.gz"
+        self._file = gzip.open(path, "at", encoding="utf-8")
+        self._bytes_written = 0
+        self._enforce_retention()
+
+    def _enforce_retention(self):
+        """max_files を超えた古いファイルを削除."""
+        if self.max_files is None:
+            return
+        files = sorted(self.directory.glob("spans-*.jsonl.gz"))
+        for path in files[: max(0, len(files) - self.max_files)]:
+            path.unlink(missing_ok=True)
+
+    def export(self, records: list[SpanRecord]):
+        """スパンを JSONL として書き込む."""
+        with self._lock:
+            for record in records:
+                if self._file is None or self._bytes_written >= self.max_bytes:
+                    self._open_new_file()
+                line = _to_json(asdict(record)) + "\n"
+                self._file.write(line)
+                self._bytes_written += len(line.encode("utf-8"))
+
+    def flush(self):
+        """バッファをファイルに書き込む."""
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def shutdown(self):
+        """ファイルを閉じる."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS spans (
+    id TEXT PRIMARY KEY,
+    trace_id TEXT,
+    parent_id TEXT,
+    kind TEXT,
+    name TEXT,
+    start_time REAL,
+    end_time REAL,
+    duration_ms REAL,
+    level TEXT,
+    status_message TEXT,
+    model TEXT,
+    session_id TEXT,
+    user_id TEXT,
+    input_tokens INTEGER,
+    output_tokens INTEGER,
+    cache_creation_input_tokens INTEGER,
+    cache_read_input_tokens INTEGER,
+    total_cost_usd REAL,
+    agent_duration_ms REAL,
+    agent_duration_api_ms REAL,
+    num_turns INTEGER,
+    tool_calls INTEGER,
+    value REAL,
+    metadata TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_spans_trace ON spans (trace_id);
+CREATE INDEX IF NOT EXISTS idx_spans_kind_start ON spans (kind, start_time);
+CREATE TABLE IF NOT EXISTS trace_tags (
+    trace_id TEXT,
+    tag TEXT,
+    PRIMARY KEY (trace_id, tag)
+);
+CREATE INDEX IF NOT EXISTS idx_trace_tags_tag ON trace_tags (tag);
+"""
+
+
+class SqliteExporter(SpanExporter):
+    """SQLite への列指向エクスポーター.
+
+    入出力ペイロードは保存せず、分析に使う列（時間・トークン・コストなど）のみ保存する。
+    generation の列には AgentMetrics（usage_details / metadata）を展開する。
+    span ID が主キーのため、再送された同じスパンは上書きされ集計が重複しない。
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        """初期化.
+
+        Args:
+            path: SQLite ファイルのパス
+        """
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        # ワーカースレッドから使うため check_same_thread=False（書き込みは _lock で直列化）
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(_SCHEMA)
+        self._migrate()
+        self._lock = threading.Lock()
+
+    def _migrate(self):
+        """主キーのない旧スキーマのテーブルを重複排除し、一意インデックスを作る."""
+        for table, columns, index in (
+            ("spans", "id", "idx_spans_id"),
+            ("trace_tags", "trace_id, tag", "idx_trace_tags_unique"),
+        ):
+            info = self._conn.execute(f"PRAGMA table_info({table})").fetchall()
+            migrated = self._conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (index,)
+            ).fetchone()
+            if migrated or any(column[5] for column in info):
+                continue
+            with self._conn:
+                self._conn.execute(
+                    f"DELETE FROM {table} WHERE rowid NOT IN "
+                    f"(SELECT MAX(rowid) FROM {table} GROUP BY {columns})"
+                )
+                self._conn.execute(
+                    f"CREATE UNIQUE INDEX IF NOT EXISTS {index} ON {table} ({columns})"
+                )
+
+    @staticmethod
+    def _to_row(record: SpanRecord) -> tuple:
+        """SpanRecord を spans テーブルの行に変換."""
+        usage = record.usage_details or {}
+        metadata = record.metadata or {}
+        duration_ms = (
+            (record.end_time - record.start_time) * 1000
+            if record.end_time is not None
+            else None
+        )
+        return (
+            record.id,
+            record.trace_id,
+            record.parent_id,
+            record.kind,
+            record.name,
+            record.start_time,
+            record.end_time,
+            duration_ms,
+            record.level,
+            record.status_message,
+            record.model,
+            record.session_id,
+            record.user_id,
+            usage.get("input"),
+            usage.get("output"),
+            usage.get("cache_creation_input_tokens"),
+            usage.get("cache_read_input_tokens"),
+            metadata.get("total_cost_usd"),
+            metadata.get("duration_ms"),
+            metadata.get("duration_api_ms"),
+            metadata.get("num_turns"),
+            metadata.get("tool_calls"),
+            record.value,
+            _to_json(metadata),
+        )
+
+    def export(self, records: list[SpanRecord]):
+        """スパンを書き込む."""
+        rows = [self._to_row(record) for record in records]
+        tags = [
+            (record.trace_id, tag)
+            for record in records
+            if record.kind == "trace"
+            for tag in record.tags
+        ]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO spans VALUES ({', '.join('?' * 24)})", rows
+            )
+            if tags:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO trace_tags VALUES (?, ?)", tags
+                )
+
+    def shutdown(self):
+        """接続を閉じる."""
+        with self._lock:
+            self._conn.close()
+
+
+def _percentile(sorted_values: list[float], q: float) -> Optional[float]:
+    """ソート済みリストの分位点（線形補間）."""
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    fraction = position - lower
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * fraction
+
+
+class TraceQuery:
+    """SqliteExporter の出力を集計するクエリヘルパー.
+
+    使用例:
+        query = TraceQuery("traces/spans.sqlite")
+        query.latency_percentiles(group_by="model")
+        query.token_usage(group_by="tag")
+        query.cache_hit_ratio(group_by="time", bucket_s=3600)
+    """
+
+    GROUP_BY = ("model", "tag", "session", "time", "none")
+
+    def __init__(self, path: str):
+        """初期化.
+
+        Args:
+            path: SQLite ファイルのパス
+        """
+        self._conn = sqlite3.connect(path)
+
+    def _group_expr(self, group_by: str, bucket_s: int) -> tuple[str, str]:
+        """グループ化の SELECT 式と JOIN 句を返す."""
+        if group_by not in self.GROUP_BY:
+            raise ValueError(f"group_by must be one of {self.GROUP_BY}: {group_by}")
+        if group_by == "model":
+            return "s.model", ""
+        if group_by == "tag":
+            return "t.tag", "JOIN trace_tags t ON t.trace_id = s.trace_id"
+        if group_by == "session":
+            return "tr.session_id", (
+                "JOIN spans tr ON tr.trace_id = s.trace_id AND tr.kind = 'trace'"
+            )
+        if group_by == "time":
+            return f"CAST(s.start_time / {int(bucket_s)} AS INTEGER) * {int(bucket_s)}", ""
+        return "'all'", ""
+
+    def latency_percentiles(
+        self,
+        group_by: str = "model",
+        kind: str = "generation",
+        quantiles: tuple[float, ...] = (0.5, 0.9, 0.95, 0.99),
+        bucket_s: int = 3600,
+        metric: str = "duration_ms",
+    ) -> dict[Any, dict[str, float]]:
+        """レイテンシの分位点を集計.
+
+        Args:
+            group_by: グループ化キー（model / tag / session / time / none）
+            kind: 対象のスパン種別（generation / tool / span / trace）
+            quantiles: 計算する分位点
+            bucket_s: group_by="time" の場合のバケット幅（秒）
+            metric: 対象の列（duration_ms / agent_duration_ms / agent_duration_api_ms）
+
+        Returns:
+            {グループ: {"count": n, "p50": ..., "p95": ...}}
+        """
+        if metric not in ("duration_ms", "agent_duration_ms", "agent_duration_api_ms"):
+            raise ValueError(f"Unsupported latency metric: {metric}")
+        group, join = self._group_expr(group_by, bucket_s)
+        rows = self._conn.execute(
+            f"SELECT {group}, s.{metric} FROM spans s {join} "
+            f"WHERE s.kind = ? AND s.{metric} IS NOT NULL",
+            (kind,),
+        ).fetchall()
+
+        grouped: dict[Any, list[float]] = {}
+        for key, value in rows:
+            grouped.setdefault(key, []).append(value)
+
+        result = {}
+        for key, values in grouped.items():
+            values.sort()
+            summary = {"count": len(values)}
+            for q in quantiles:
+                summary[f"p{round(q * 100):g}"] = _percentile(values, q)
+            result[key] = summary
+        return result
+
+    def token_usage(self, group_by: str = "model", bucket_s: int = 3600) -> dict[Any, dict[str, float]]:
+        """トークン使用量とコストを集計（generation のみ）.
+
+        Args:
+            group_by: グループ化キー
+            bucket_s: group_by="time" の場合のバケット幅（秒）
+
+        Returns:
+            {グループ: {"requests", "input_tokens", "output_tokens", ...}}
+        """
+        group, join = self._group_expr(group_by, bucket_s)
+        rows = self._conn.execute(
+            f"SELECT {group}, COUNT(*), "
+            "SUM(COALESCE(s.input_tokens, 0)), SUM(COALESCE(s.output_tokens, 0)), "
+            "SUM(COALESCE(s.cache_creation_input_tokens, 0)), "
+            "SUM(COALESCE(s.cache_read_input_tokens, 0)), "
+            "SUM(COALESCE(s.total_cost_usd, 0)) "
+            f"FROM spans s {join} WHERE s.kind = 'generation' GROUP BY 1"
+        ).fetchall()
+        return {
+            key: {
+                "requests": count,
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "cache_creation_input_tokens": cache_creation,
+                "cache_read_input_tokens": cache_read,
+                "total_cost_usd": cost,
+            }
+            for key, count, input_tokens, output_tokens, cache_creation, cache_read, cost in rows
+        }
+
+    def cache_hit_ratio(self, group_by: str = "model", bucket_s: int = 3600) -> dict[Any, Optional[float]]:
+        """プロンプトキャッシュのヒット率を集計.
+
+        ヒット率 = cache_read / (input + cache_read + cache_creation)
+
+        Args:
+            group_by: グループ化キー
+            bucket_s: group_by="time" の場合のバケット幅（秒）
+
+        Returns:
+            {グループ: ヒット率（入力トークンがない場合None）}
+        """
+        result = {}
+        for key, usage in self.token_usage(group_by, bucket_s).items():
+            total_input = (
+                usage["input_tokens"]
+                + usage["cache_read_input_tokens"]
+                + usage["cache_creation_input_tokens"]
+            )
+            result[key] = (
+                usage["cache_read_input_tokens"] / total_input if total_input else None
+            )
+        return result
+
+    def close(self):
+        """接続を閉じる."""
+        self._conn.close()
@@ -0,0 +1,459 @@
+"""スパンのペイロードサイズ制限.
+
+プロンプト・レスポンス・ツール入力（Write に渡されるファイル全体など）を
+そのまま Langfuse に送るとシリアライズ CPU と送信帯域が際限なく増えるため、
+フィールドごとのサイズ上限で制限する。
+
+主な機能:
+1. フィールドごとの上限（文字数）と先頭/末尾を残す切り詰め
+2. 切り詰めたペイロードの SHA-256 ハッシュ
+3. 上限超過ペイロードのローカルのコンテンツアドレス型 BlobStore への退避（ダイジェストで参照）。
+   圧縮と書き込みはバックグラウンドスレッドで行い、容量と保持期間を超えた古いものから削除する
+4. 繰り返される同一ペイロードの重複排除（同一リクエスト内 / 退避済みのものはリクエスト間）
+
+環境変数:
+    LANGFUSE_PAYLOAD_MAX_CHARS=50000: フィールドの上限（文字数、0 で無制限）
+    LANGFUSE_PAYLOAD_MAX_TOOL_INPUT_CHARS=10000: ツール入力の上限
+    LANGFUSE_PAYLOAD_DEDUPE_MIN_CHARS=1000: この文字数以上の同一ペイロードを参照に置き換える
+    LANGFUSE_PAYLOAD_BLOB_DIR: 上限超過ペイロードの退避先（省略時は退避しない）
+    LANGFUSE_PAYLOAD_BLOB_MAX_MB=1024: 退避先の最大容量（0 で無制限）
+    LANGFUSE_PAYLOAD_BLOB_MAX_AGE_DAYS=7: 退避したペイロードの保持日数（0 で無期限）
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import queue
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Optional
+
+# フィールド名
+FIELD_INPUT = "input"
+FIELD_OUTPUT = "output"
+FIELD_TOOL_INPUT = "tool_input"
+FIELD_GENERATION_INPUT = "generation_input"
+FIELD_GENERATION_OUTPUT = "generation_output"
+
+
+def _env_int(name: str, default: Optional[int]) -> Optional[int]:
+    """環境変数を int で取得（"0" や未設定はデフォルト/None 扱い）."""
+    value = os.getenv(name)
+    if value is None or value == "":
+        return default
+    parsed = int(value)
+    return parsed if parsed > 0 else None
+
+
+def _env_float(name: str, default: Optional[float]) -> Optional[float]:
+    """環境変数を float で取得（"0" や未設定はデフォルト/None 扱い）."""
+    value = os.getenv(name)
+    if value is None or value == "":
+        return default
+    parsed = float(value)
+    return parsed if parsed > 0 else None
+
+
+@dataclass
+class PayloadPolicy:
+    """ペイロード制限の設定.
+
+    上限は文字数（None で無制限）。
+    """
+
+    max_input_chars: Optional[int] = 50_000
+    max_output_chars: Optional[int] = 50_000
+    max_tool_input_chars: Optional[int] = 10_000
+    max_generation_input_chars: Optional[int] = 50_000
+    max_generation_output_chars: Optional[int] = 50_000
+
+    # 切り詰め時に残す先頭/末尾の文字数（合計はフィールドの上限までに抑える）
+    head_chars: int = 2_000
+    tail_chars: int = 500
+
+    # 上限超過ペイロードの退避先（None の場合は退避しない）
+    blob_dir: Optional[str] = None
+
+    # 退避先の最大容量（バイト）と保持期間（秒）。None で無制限
+    blob_max_bytes: Optional[int] = 1024 * 1024 * 1024
+    blob_max_age_s: Optional[float] = 7 * 86400.0
+
+    # この文字数以上の同一ペイロードは2回目以降を参照に置き換える（None で無効）
+    dedupe_min_chars: Optional[int] = 1_000
+
+    @classmethod
+    def from_env(cls) -> "PayloadPolicy":
+        """環境変数から設定を生成."""
+        default = _env_int("LANGFUSE_PAYLOAD_MAX_CHARS", 50_000)
+        blob_max_mb = _env_float("LANGFUSE_PAYLOAD_BLOB_MAX_MB", 1024)
+        blob_max_days = _env_float("LANGFUSE_PAYLOAD_BLOB_MAX_AGE_DAYS", 7)
+        return cls(
+            max_input_chars=default,
+            max_output_chars=default,
+            max_tool_input_chars=_env_int(
+                "LANGFUSE_PAYLOAD_MAX_TOOL_INPUT_CHARS", 10_000
+            ),
+            max_generation_input_chars=default,
+            max_generation_output_chars=default,
+            blob_dir=os.getenv("LANGFUSE_PAYLOAD_BLOB_DIR") or None,
+            blob_max_bytes=(
+                None if blob_max_mb is None else int(blob_max_mb * 1024 * 1024)
+            ),
+            blob_max_age_s=None if blob_max_days is None else blob_max_days * 86400,
+            dedupe_min_chars=_env_int("LANGFUSE_PAYLOAD_DEDUPE_MIN_CHARS", 1_000),
+        )
+
+    def limit_for(self, field_name: str) -> Optional[int]:
+        """フィールドの上限を返す."""
+        return {
+            FIELD_INPUT: self.max_input_chars,
+            FIELD_OUTPUT: self.max_output_chars,
+            FIELD_TOOL_INPUT: self.max_tool_input_chars,
+            FIELD_GENERATION_INPUT: self.max_generation_input_chars,
+            FIELD_GENERATION_OUTPUT: self.max_generation_output_chars,
+        }.get(field_name, self.max_input_chars)
+
+    def excerpt_chars(self, limit: int) -> tuple[int, int]:
+        """切り詰め時に残す先頭/末尾の文字数（合計が limit を超えないように抑える）."""
+        head = min(self.head_chars, limit)
+        tail = min(self.tail_chars, limit - head)
+        return head, tail
+
+
+def create_blob_store(policy: PayloadPolicy) -> Optional["BlobStore"]:
+    """設定から BlobStore を生成（blob_dir がない場合None）."""
+    if not policy.blob_dir:
+        return None
+    return BlobStore(
+        policy.blob_dir, max_bytes=policy.blob_max_bytes, max_age_s=policy.blob_max_age_s
+    )
+
+
+class BlobStore:
+    """ローカルのコンテンツアドレス型ストア.
+
+    SHA-256 ダイジェストをキーに gzip 圧縮して保存する。
+    同じ内容は1回だけ書き込まれる。
+    put_async() はキューに積むだけで、圧縮と書き込みはバックグラウンドスレッドが行う
+    （キューが満杯の場合は書き込まない）。
+    容量（max_bytes）を超えると古いものから、保持期間（max_age_s）を過ぎたものは削除する。
+
+    レイアウト: <root>/<digest[:2]>/<digest>.gz
+    """
+
+    # 保持期間を確認する間隔（秒）
+    AGE_CHECK_INTERVAL_S = 60.0
+
+    def __init__(
+        self,
+        root: str,
+        max_bytes: Optional[int] = None,
+        max_age_s: Optional[float] = None,
+        max_pending: int = 64,
+    ):
+        """初期化.
+
+        Args:
+            root: 保存先ディレクトリ
+            max_bytes: 最大容量（バイト、Noneの場合は無制限）
+            max_age_s: 保持期間（秒、Noneの場合は無期限）
+            max_pending: 書き込み待ちの最大数
+        """
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_age_s = max_age_s
+        # _lock: _known / _pending（リクエスト処理から短時間だけ取る）
+        # _index_lock: ファイルの一覧と削除（書き込みスレッドが取る）
+        self._lock = threading.Lock()
+        self._index_lock = threading.Lock()
+        # 存在確認済みのダイジェスト（stat を減らすため）
+        self._known: set[str] = set()
+        # 書き込み待ちのダイジェスト
+        self._pending: set[str] = set()
+        self._queue: queue.Queue = queue.Queue(maxsize=max(1, max_pending))
+        self._worker: Optional[threading.Thread] = None
+        # ダイジェスト -> (更新時刻, サイズ)。最初の書き込み時にディレクトリを走査して作る
+        self._index: Optional[dict[str, tuple[float, int]]] = None
+        self.total_bytes = 0
+        self._age_checked_at = 0.0
+
+        # カウンター
+        self.dropped_writes = 0
+        self.evicted_blobs = 0
+
+    def path_for(self, digest: str) -> Path:
+        """ダイジェストに対応するファイルパス."""
+        return self.root / digest[:2] / f"{digest}.gz"
+
+    def put(self, digest: str, data: bytes) -> Path:
+        """内容を呼び出し元スレッドで保存（既に存在する場合は何もしない）.
+
+        Args:
+            digest: data の SHA-256 ダイジェスト
+            data: 保存する内容
+
+        Returns:
+            保存先パス
+        """
+        if not self.contains(digest):
+            self._write(digest, data)
+        return self.path_for(digest)
+
+    def put_async(self, digest: str, data: bytes) -> bool:
+        """内容をバックグラウンドで保存する.
+
+        Args:
+            digest: data の SHA-256 ダイジェスト
+            data: 保存する内容
+
+        Returns:
+            保存済み・保存予定の場合True（書き込み待ちが満杯の場合False）
+        """
+        with self._lock:
+            if digest in self._known or digest in self._pending:
+                return True
+            try:
+                self._queue.put_nowait((digest, data))
+            except queue.Full:
+                self.dropped_writes += 1
+                return False
+            self._pending.add(digest)
+            if self._worker is None:
+                self._worker = threading.Thread(
+                    target=self._run, name="langfuse-blob-store", daemon=True
+                )
+                self._worker.start()
+        return True
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """書き込み待ちがなくなるまで待つ.
+
+        Returns:
+            すべて書き込んだ場合True
+        """
+        deadline = time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def _run(self):
+        """書き込みスレッドのメインループ."""
+        while True:
+            digest, data = self._queue.get()
+            try:
+                if self.path_for(digest).exists():
+                    with self._lock:
+                        self._known.add(digest)
+                else:
+                    self._write(digest, data)
+            except OSError as e:
+                print(f"⚠️  Payload blob write failed ({digest[:12]}): {e}")
+            finally:
+                with self._lock:
+                    self._pending.discard(digest)
+                self._queue.task_done()
+
+    def _write(self, digest: str, data: bytes):
+        """圧縮して書き込み、容量と保持期間を適用."""
+        path = self.path_for(digest)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        compressed = gzip.compress(data)
+        # 一時ファイルに書いてから rename（書き込み途中のファイルを残さない）
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(compressed)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        with self._lock:
+            self._known.add(digest)
+        with self._index_lock:
+            index = self._load_index()
+            previous = index.get(digest)
+            if previous is not None:
+                self.total_bytes -= previous[1]
+            index[digest] = (time.time(), len(compressed))
+            self.total_bytes += len(compressed)
+            self._evict(index)
+
+    def _load_index(self) -> dict[str, tuple[float, int]]:
+        """保存済みのファイルの一覧（初回のみディレクトリを走査、_index_lock を保持して呼ぶ）."""
+        if self._index is None:
+            index = {}
+            for path in self.root.glob("*/*.gz"):
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                index[path.name.removesuffix(".gz")] = (stat.st_mtime, stat.st_size)
+            self._index = index
+            self.total_bytes = sum(size for _, size in index.values())
+        return self._index
+
+    def _evict(self, index: dict[str, tuple[float, int]]):
+        """容量・保持期間を超えたファイルを古い順に削除（_index_lock を保持した状態で呼ぶ）."""
+        now = time.time()
+        check_age = (
+            self.max_age_s is not None
+            and now - self._age_checked_at >= self.AGE_CHECK_INTERVAL_S
+        )
+        over_size = self.max_bytes is not None and self.total_bytes > self.max_bytes
+        if not check_age and not over_size:
+            return
+        if check_age:
+            self._age_checked_at = now
+        # 容量超過時は上限の 90% まで削除して、書き込みのたびに削除しないようにする
+        target = int(self.max_bytes * 0.9) if over_size else None
+        for digest, (mtime, size) in sorted(index.items(), key=lambda item: item[1][0]):
+            expired = self.max_age_s is not None and now - mtime > self.max_age_s
+            if not expired and (target is None or self.total_bytes <= target):
+                break
+            try:
+                self.path_for(digest).unlink()
+            except FileNotFoundError:
+                pass
+            except OSError:
+                continue
+            del index[digest]
+            with self._lock:
+                self._known.discard(digest)
+            self.total_bytes -= size
+            self.evicted_blobs += 1
+
+    def contains(self, digest: str) -> bool:
+        """内容が保存済み（または書き込み待ち）か."""
+        if digest in self._known or digest in self._pending:
+            return True
+        if self.path_for(digest).exists():
+            self._known.add(digest)
+            return True
+        return False
+
+    def get(self, digest: str) -> Optional[bytes]:
+        """内容を取得.
+
+        Args:
+            digest: SHA-256 ダイジェスト（"sha256:" 接頭辞付きも可）
+
+        Returns:
+            内容（存在しない場合None）
+        """
+        digest = digest.removeprefix("sha256:")
+        path = self.path_for(digest)
+        if not path.exists():
+            return None
+        return gzip.decompress(path.read_bytes())
+
+    def stats(self) -> dict:
+        """容量・書き込み待ち・削除数のスナップショット."""
+        with self._lock:
+            return {
+                "bytes": self.total_bytes,
+                "pending": len(self._pending),
+                "dropped_writes": self.dropped_writes,
+                "evicted_blobs": self.evicted_blobs,
+            }
+
+
+def _serialize(value: Any) -> str:
+    """ペイロードを文字列に変換."""
+    if isinstance(value, str):
+        return value
+    return json.dumps(value, ensure_ascii=False, default=str)
+
+
+class PayloadLimiter:
+    """ペイロードにサイズ制限を適用.
+
+    重複排除はインスタンス単位（LangfuseTracer はリクエストごとに作成されるため、
+    同一リクエスト内の重複）で行う。BlobStore がある場合は上限超過のペイロードだけを退避し、
+    退避済みのものはリクエストをまたいでダイジェストで参照する。
+    """
+
+    def __init__(self, policy: PayloadPolicy, store: Optional[BlobStore] = None):
+        """初期化.
+
+        Args:
+            policy: 制限設定
+            store: 上限超過ペイロードの退避先
+        """
+        self.policy = policy
+        self.store = store
+        self._seen: dict[str, str] = {}
+
+    def limit(self, value: Any, field_name: str = FIELD_INPUT) -> Any:
+        """ペイロードに制限を適用.
+
+        Args:
+            value: ペイロード
+            field_name: フィールド名（上限の選択と重複排除の参照先に使う）
+
+        Returns:
+            そのままのペイロード、または切り詰め/参照に置き換えた辞書
+        """
+        if value is None or isinstance(value, (bool, int, float)):
+            return value
+
+        limit = self.policy.limit_for(field_name)
+        dedupe_min = self.policy.dedupe_min_chars
+        # 短い文字列はシリアライズもハッシュもしない
+        if isinstance(value, str) and (limit is None or len(value) <= limit) and (
+            dedupe_min is None or len(value) < dedupe_min
+        ):
+            return value
+
+        text = _serialize(value)
+        size = len(text)
+        over_limit = limit is not None and size > limit
+        dedupe = dedupe_min is not None and size >= dedupe_min
+        if not over_limit and not dedupe:
+            return value
+
+        data = text.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+
+        if dedupe:
+            first_field = self._seen.get(digest)
+            if first_field is not None:
+                return {
+                    "_ref": f"sha256:{digest}",
+                    "same_as": first_field,
+                    "original_chars": size,
+                }
+            self._seen[digest] = field_name
+
+        if not over_limit:
+            return value
+
+        if self.store is not None and self.store.contains(digest):
+            # 以前のリクエストで退避済み
+            return {
+                "_ref": f"sha256:{digest}",
+                "blob": f"sha256:{digest}",
+                "original_chars": size,
+            }
+
+        head_chars, tail_chars = self.policy.excerpt_chars(limit)
+        truncated = {
+            "_truncated": True,
+            "original_chars": size,
+            "sha256": digest,
+            "head": text[:head_chars],
+            "tail": text[-tail_chars:] if tail_chars else "",
+        }
+        # 書き込みはバックグラウンド（リクエスト処理をディスク I/O で止めない）
+        if self.store is not None and self.store.put_async(digest, data):
+            truncated["blob"] = f"sha256:{digest}"
+        return truncated
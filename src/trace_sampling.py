@@ -0,0 +1,239 @@
+"""トレースのサンプリング.
+
+非同期エクスポートモード（RecordingClient）で使うヘッド/テールサンプリング。
+
+- ヘッドサンプリング: session_id のハッシュで確率的に判定（セッション単位で保持/破棄）
+- テールサンプリング: トレース終了時に判定し、有効にしたルールに該当するものは必ず保持
+  - エラー（level=ERROR のスパン）
+  - 遅いリクエスト（slow_threshold_ms 以上）
+  - Guardrail の介入（metadata の guardrail_action=GUARDRAIL_INTERVENED）
+  - 低いスコア（low_score_threshold 未満）。対象はトレース中に span.score() で
+    記録したスコアのみ。評価（DeepEval）のスコアはトレース終了後に Score API で
+    送信されるため、判定には使えない
+
+テールルールはすべて既定で無効。テールルールがない場合、ヘッドで破棄したトレースは
+スパンの記録もペイロードの処理も行わない（破棄したリクエストのコストはほぼゼロ）。
+テールルールを1つでも有効にすると、判定のためにすべてのトレースを記録する。
+
+保持したトレースには判定結果と重み（逆確率）をメタデータとして記録するため、
+集計時に重み付けして全体の値を推定できる。
+
+環境変数:
+    LANGFUSE_SAMPLE_RATE=1.0: ヘッドサンプリング率
+    LANGFUSE_SAMPLE_KEEP_ERRORS=false: エラーのトレースを必ず保持
+    LANGFUSE_SAMPLE_KEEP_GUARDRAIL=false: Guardrail が介入したトレースを必ず保持
+    LANGFUSE_SAMPLE_SLOW_MS: この時間以上のスパンを含むトレースを必ず保持
+    LANGFUSE_SAMPLE_LOW_SCORE: この値未満のスコア（span.score()）を含むトレースを必ず保持
+"""
+
+import hashlib
+import os
+import random
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
+GUARDRAIL_INTERVENED = "GUARDRAIL_INTERVENED"
+
+
+@dataclass
+class SamplingConfig:
+    """サンプリング設定."""
+
+    # ヘッドサンプリング率（1.0 = すべて保持）
+    rate: float = 1.0
+
+    # テールルール（有効にするとヘッドで破棄するトレースも判定のために記録する）
+    keep_errors: bool = False
+    slow_threshold_ms: Optional[float] = None
+    keep_guardrail_interventions: bool = False
+    low_score_threshold: Optional[float] = None
+
+    @classmethod
+    def from_env(cls) -> "SamplingConfig":
+        """環境変数から設定を生成."""
+        slow = os.getenv("LANGFUSE_SAMPLE_SLOW_MS")
+        low_score = os.getenv("LANGFUSE_SAMPLE_LOW_SCORE")
+        return cls(
+            rate=float(os.getenv("LANGFUSE_SAMPLE_RATE", "1.0")),
+            keep_errors=os.getenv("LANGFUSE_SAMPLE_KEEP_ERRORS", "false").lower()
+            in ("true", "1", "yes"),
+            keep_guardrail_interventions=os.getenv(
+                "LANGFUSE_SAMPLE_KEEP_GUARDRAIL", "false"
+            ).lower()
+            in ("true", "1", "yes"),
+            slow_threshold_ms=float(slow) if slow else None,
+            low_score_threshold=float(low_score) if low_score else None,
+        )
+
+    @property
+    def has_tail_rules(self) -> bool:
+        """テールルールが1つでも有効か."""
+        return (
+            self.keep_errors
+            or self.slow_threshold_ms is not None
+            or self.keep_guardrail_interventions
+            or self.low_score_threshold is not None
+        )
+
+
+def session_sample_value(session_id: str) -> float:
+    """session_id から [0, 1) の値を決定論的に生成.
+
+    同じ session_id は常に同じ値になるため、セッション全体がまとめて保持/破棄される。
+
+    Args:
+        session_id: セッションID
+
+    Returns:
+        0以上1未満の値
+    """
+    digest = hashlib.blake2b(session_id.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") / 2**64
+
+
+class TraceSampler:
+    """ヘッド/テールサンプラー.
+
+    判定結果のカウンターを保持し、stats() で取得できる。
+    """
+
+    def __init__(self, config: Optional[SamplingConfig] = None):
+        """初期化.
+
+        Args:
+            config: サンプリング設定
+        """
+        self.config = config or SamplingConfig()
+        if not 0.0 <= self.config.rate <= 1.0:
+            raise ValueError(f"Sampling rate must be in [0, 1]: {self.config.rate}")
+
+        self._lock = threading.Lock()
+        self.traces_seen = 0
+        self.traces_dropped = 0
+        self.spans_dropped = 0
+        self.kept_by_reason: dict[str, int] = {}
+
+    def head_sample(self, session_id: Optional[str]) -> bool:
+        """ヘッドサンプリングの判定.
+
+        Args:
+            session_id: セッションID（Noneの場合はリクエスト単位で判定）
+
+        Returns:
+            保持する場合True
+        """
+        rate = self.config.rate
+        if rate >= 1.0:
+            return True
+        if rate <= 0.0:
+            return False
+        if session_id:
+            return session_sample_value(session_id) < rate
+        return random.random() < rate
+
+    @property
+    def needs_recording(self) -> bool:
+        """ヘッドで破棄されたトレースも記録が必要か（テール判定用）."""
+        return self.config.has_tail_rules
+
+    def sample_trace(self, session_id: Optional[str]) -> Optional[bool]:
+        """新しいトレースのヘッドサンプリングの判定.
+
+        Args:
+            session_id: セッションID
+
+        Returns:
+            True: 保持, False: ヘッドで破棄（テール判定のために記録する）,
+            None: 破棄して記録もしない（破棄としてカウント済み）
+        """
+        if self.head_sample(session_id):
+            return True
+        if self.needs_recording:
+            return False
+        self.record_unrecorded_drop()
+        return None
+
+    def tail_reason(self, records: list) -> Optional[str]:
+        """テールルールに該当するかを判定.
+
+        Args:
+            records: トレースのスパン（SpanRecord）のリスト
+
+        Returns:
+            該当したルール名（該当しない場合None）
+        """
+        config = self.config
+        for record in records:
+            if config.keep_errors and record.level == "ERROR":
+                return "error"
+            if (
+                config.keep_guardrail_interventions
+                and record.metadata.get("guardrail_action") == GUARDRAIL_INTERVENED
+            ):
+                return "guardrail"
+            if (
+                config.low_score_threshold is not None
+                and record.kind == "score"
+                and record.value is not None
+                and record.value < config.low_score_threshold
+            ):
+                return "low_score"
+            if (
+                config.slow_threshold_ms is not None
+                and record.kind != "score"
+                and record.end_time is not None
+                and (record.end_time - record.start_time) * 1000
+                >= config.slow_threshold_ms
+            ):
+                return "slow"
+        return None
+
+    def decide(self, head_sampled: bool, records: list) -> tuple[bool, dict]:
+        """トレースを保持するかを判定.
+
+        Args:
+            head_sampled: ヘッドサンプリングの結果
+            records: トレースのスパンのリスト
+
+        Returns:
+            (保持するか, トレースに記録するサンプリング情報)
+        """
+        reason = self.tail_reason(records) if self.config.has_tail_rules else None
+        keep = head_sampled or reason is not None
+
+        with self._lock:
+            self.traces_seen += 1
+            if keep:
+                key = reason or "head"
+                self.kept_by_reason[key] = self.kept_by_reason.get(key, 0) + 1
+            else:
+                self.traces_dropped += 1
+                self.spans_dropped += len(records)
+
+        # テールルールに該当するトレースは必ず保持されるため重み1、
+        # それ以外はヘッドサンプリング率の逆数で重み付けする
+        weight = 1.0 if reason is not None or self.config.rate <= 0 else 1.0 / self.config.rate
+        return keep, {
+            "sampling_rate": self.config.rate,
+            "sampling_head": head_sampled,
+            "sampling_reason": reason or "head",
+            "sampling_weight": weight,
+        }
+
+    def record_unrecorded_drop(self):
+        """記録せずに破棄したトレースをカウント（テールルールなしの場合）."""
+        with self._lock:
+            self.traces_seen += 1
+            self.traces_dropped += 1
+
+    def stats(self) -> dict:
+        """カウンターのスナップショットを返す."""
+        with self._lock:
+            return {
+                "rate": self.config.rate,
+                "traces_seen": self.traces_seen,
+                "traces_dropped": self.traces_dropped,
+                "spans_dropped": self.spans_dropped,
+                "kept_by_reason": dict(self.kept_by_reason),
+            }
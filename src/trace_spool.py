@@ -0,0 +1,338 @@
+"""トレースのディスクスプール.
+
+Langfuse の障害やレイテンシ増加でエクスポートが滞ったときに、
+スパンを失わずにリクエスト処理を続けるための追記型のディスクバッファ。
+BatchExportProcessor がキュー満杯時と送信失敗時にバッチを書き込み、
+Langfuse の復旧後に書き込み順で再送する。
+
+主な機能:
+1. セグメントファイルへの追記（レコードごとに長さ・CRC32・書き込み時刻のヘッダー）
+2. fsync ポリシー（always / interval / never）
+3. ディスク使用量の上限と退避ポリシー（drop_oldest: 最も古いセグメントを削除 / reject_new: 新しいバッチを拒否）
+4. 破損・書き込み途中のレコードの検出（CRC 不一致以降は読み飛ばす）
+5. サイズ・セグメント数・ラグ（最も古い未送信レコードの経過秒数）のメトリクス
+
+ファイルレイアウト: <dir>/segment-<連番12桁>.spool
+レコード形式: <長さ u32><CRC32 u32><書き込み時刻 f64><JSON（SpanRecord の辞書のリスト）>
+
+環境変数:
+    LANGFUSE_SPOOL_DIR: スプールのディレクトリ（指定した場合に有効）
+    LANGFUSE_SPOOL_MAX_BYTES=536870912: ディスク使用量の上限（バイト）
+    LANGFUSE_SPOOL_SEGMENT_BYTES=16777216: セグメントファイルの最大サイズ（バイト）
+    LANGFUSE_SPOOL_FSYNC=interval: fsync ポリシー（always / interval / never）
+    LANGFUSE_SPOOL_EVICTION=drop_oldest: 上限到達時の退避ポリシー（drop_oldest / reject_new）
+"""
+
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Optional
+
+# fsync ポリシー
+FSYNC_ALWAYS = "always"
+FSYNC_INTERVAL = "interval"
+FSYNC_NEVER = "never"
+
+# 退避ポリシー
+EVICT_DROP_OLDEST = "drop_oldest"
+EVICT_REJECT_NEW = "reject_new"
+
+# レコードヘッダー: 長さ, CRC32, 書き込み時刻
+_HEADER = struct.Struct("<IId")
+
+_SEGMENT_PREFIX = "segment-"
+_SEGMENT_SUFFIX = ".spool"
+
+
+@dataclass
+class SpoolConfig:
+    """ディスクスプールの設定."""
+
+    directory: str
+
+    # ディスク使用量の上限（バイト）
+    max_bytes: int = 512 * 1024 * 1024
+
+    # セグメントファイルの最大サイズ（バイト）
+    segment_bytes: int = 16 * 1024 * 1024
+
+    # fsync ポリシー（always / interval / never）と interval の間隔（秒）
+    fsync: str = FSYNC_INTERVAL
+    fsync_interval_s: float = 1.0
+
+    # 上限到達時の退避ポリシー（drop_oldest / reject_new）
+    eviction: str = EVICT_DROP_OLDEST
+
+    @classmethod
+    def from_env(cls, directory: Optional[str] = None) -> "SpoolConfig":
+        """環境変数から設定を生成.
+
+        Args:
+            directory: ディレクトリ（Noneの場合は LANGFUSE_SPOOL_DIR）
+        """
+        return cls(
+            directory=directory or os.environ["LANGFUSE_SPOOL_DIR"],
+            max_bytes=int(os.getenv("LANGFUSE_SPOOL_MAX_BYTES", str(512 * 1024 * 1024))),
+            segment_bytes=int(
+                os.getenv("LANGFUSE_SPOOL_SEGMENT_BYTES", str(16 * 1024 * 1024))
+            ),
+            fsync=os.getenv("LANGFUSE_SPOOL_FSYNC", FSYNC_INTERVAL),
+            eviction=os.getenv("LANGFUSE_SPOOL_EVICTION", EVICT_DROP_OLDEST),
+        )
+
+
+class DiskSpool:
+    """追記型のディスクスプール.
+
+    書き込みはアクティブセグメントに追記し、読み出しは閉じたセグメントを古い順に行う。
+    送信が完了したセグメントは ack() で削除する（少なくとも1回の配送）。
+    """
+
+    def __init__(self, config: SpoolConfig):
+        """初期化（前回のプロセスが残したセグメントも再送対象にする）.
+
+        Args:
+            config: 設定
+        """
+        if config.fsync not in (FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_NEVER):
+            raise ValueError(f"Unknown fsync policy: {config.fsync}")
+        if config.eviction not in (EVICT_DROP_OLDEST, EVICT_REJECT_NEW):
+            raise ValueError(f"Unknown eviction policy: {config.eviction}")
+        self.config = config
+        self.directory = Path(config.directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        # 閉じたセグメント（古い順）と各セグメントの最初のレコードの書き込み時刻
+        self._segments: deque[Path] = deque()
+        self._first_written: dict[Path, float] = {}
+        self._sizes: dict[Path, int] = {}
+        self._bytes = 0
+
+        self._active: Any = None
+        self._active_path: Optional[Path] = None
+        self._active_bytes = 0
+        self._last_fsync = time.monotonic()
+
+        # カウンター
+        self.spooled_batches = 0
+        self.replayed_batches = 0
+        self.evicted_segments = 0
+        self.evicted_bytes = 0
+        self.rejected_batches = 0
+        self.corrupt_records = 0
+
+        self._next_seq = 0
+        for path in sorted(self.directory.glob(f"{_SEGMENT_PREFIX}*{_SEGMENT_SUFFIX}")):
+            size = path.stat().st_size
+            if size == 0:
+                path.unlink()
+                continue
+            self._segments.append(path)
+            self._sizes[path] = size
+            self._bytes += size
+            self._first_written[path] = self._read_first_timestamp(path)
+            self._next_seq = max(self._next_seq, self._sequence(path) + 1)
+
+    @staticmethod
+    def _sequence(path: Path) -> int:
+        """セグメントファイル名の連番."""
+        return int(path.name[len(_SEGMENT_PREFIX) : -len(_SEGMENT_SUFFIX)])
+
+    @staticmethod
+    def _read_first_timestamp(path: Path) -> float:
+        """セグメントの最初のレコードの書き込み時刻（読めない場合はファイルの更新時刻）."""
+        with open(path, "rb") as f:
+            header = f.read(_HEADER.size)
+        if len(header) == _HEADER.size:
+            return _HEADER.unpack(header)[2]
+        return path.stat().st_mtime
+
+    @property
+    def size_bytes(self) -> int:
+        """スプールの合計サイズ（バイト）."""
+        return self._bytes
+
+    def has_pending(self) -> bool:
+        """未送信のレコードがあるか."""
+        return self._bytes > 0
+
+    def append(self, records: list) -> bool:
+        """バッチを追記.
+
+        Args:
+            records: SpanRecord のリスト
+
+        Returns:
+            書き込んだ場合True（reject_new で上限に達している場合False）
+        """
+        payload = json.dumps(
+            [asdict(record) for record in records], ensure_ascii=False, default=str
+        ).encode("utf-8")
+        written_at = time.time()
+        data = _HEADER.pack(len(payload), zlib.crc32(payload), written_at) + payload
+
+        with self._lock:
+            if not self._ensure_capacity(len(data)):
+                self.rejected_batches += 1
+                return False
+            if self._active is None or (
+                self._active_bytes > 0
+                and self._active_bytes + len(data) > self.config.segment_bytes
+            ):
+                self._roll()
+            if self._active_bytes == 0:
+                self._first_written[self._active_path] = written_at
+            self._active.write(data)
+            self._active_bytes += len(data)
+            self._bytes += len(data)
+            self.spooled_batches += 1
+            self._sync(force=self.config.fsync == FSYNC_ALWAYS)
+        return True
+
+    def _ensure_capacity(self, size: int) -> bool:
+        """上限を超える場合に退避ポリシーを適用（_lock を保持した状態で呼ぶ）."""
+        if self._bytes + size <= self.config.max_bytes:
+            return True
+        if self.config.eviction == EVICT_REJECT_NEW:
+            return False
+        # drop_oldest: 閉じたセグメントを古い順に削除
+        if not self._segments:
+            self._close_active()
+        while self._segments and self._bytes + size > self.config.max_bytes:
+            path = self._segments.popleft()
+            self._remove(path)
+            self.evicted_segments += 1
+            self.evicted_bytes += self._sizes.pop(path, 0)
+        return self._bytes + size <= self.config.max_bytes or self._active_bytes == 0
+
+    def _remove(self, path: Path):
+        """セグメントファイルを削除してサイズを減らす（_lock を保持した状態で呼ぶ）."""
+        self._bytes -= self._sizes.get(path, 0)
+        self._first_written.pop(path, None)
+        path.unlink(missing_ok=True)
+
+    def _sync(self, force: bool = False):
+        """fsync ポリシーに従ってディスクに書き出す（_lock を保持した状態で呼ぶ）."""
+        self._active.flush()
+        if self.config.fsync == FSYNC_NEVER:
+            return
+        now = time.monotonic()
+        if force or now - self._last_fsync >= self.config.fsync_interval_s:
+            os.fsync(self._active.fileno())
+            self._last_fsync = now
+
+    def _roll(self):
+        """アクティブセグメントを閉じて新しいセグメントを開く（_lock を保持した状態で呼ぶ）."""
+        self._close_active()
+        self._active_path = self.directory / f"{_SEGMENT_PREFIX}{self._next_seq:012d}{_SEGMENT_SUFFIX}"
+        self._next_seq += 1
+        self._active = open(self._active_path, "ab")
+        self._active_bytes = 0
+
+    def _close_active(self):
+        """アクティブセグメントを閉じて読み出し対象にする（_lock を保持した状態で呼ぶ）."""
+        if self._active is None:
+            return
+        self._sync(force=self.config.fsync != FSYNC_NEVER)
+        self._active.close()
+        if self._active_bytes > 0:
+            self._segments.append(self._active_path)
+            self._sizes[self._active_path] = self._active_bytes
+        else:
+            self._active_path.unlink(missing_ok=True)
+        self._active = None
+        self._active_path = None
+        self._active_bytes = 0
+
+    def oldest_segment(self) -> Optional[Path]:
+        """最も古いセグメントを返す（閉じたセグメントがなければアクティブセグメントを閉じる）."""
+        with self._lock:
+            if not self._segments and self._active_bytes > 0:
+                self._close_active()
+            return self._segments[0] if self._segments else None
+
+    def read_segment(self, path: Path) -> list[list[dict]]:
+        """セグメントのバッチを書き込み順に読む.
+
+        CRC が一致しないレコードや書き込み途中のレコード以降は読み飛ばす。
+
+        Args:
+            path: セグメントファイル
+
+        Returns:
+            バッチ（SpanRecord の辞書のリスト）のリスト
+        """
+        batches = []
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            # 退避ポリシーで削除された
+            return batches
+        offset = 0
+        while offset + _HEADER.size <= len(data):
+            length, crc, _ = _HEADER.unpack_from(data, offset)
+            start = offset + _HEADER.size
+            payload = data[start : start + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                self.corrupt_records += 1
+                print(f"⚠️ Corrupt spool record in {path.name} at offset {offset}, skipping rest")
+                break
+            batches.append(json.loads(payload))
+            offset = start + length
+        else:
+            if offset < len(data):
+                # ヘッダーの途中で途切れている（書き込み中のクラッシュ）
+                self.corrupt_records += 1
+                print(f"⚠️ Truncated spool record in {path.name} at offset {offset}, skipping")
+        return batches
+
+    def ack(self, path: Path, batches: int = 0):
+        """送信が完了したセグメントを削除.
+
+        Args:
+            path: セグメントファイル
+            batches: 送信したバッチ数
+        """
+        with self._lock:
+            if self._segments and self._segments[0] == path:
+                self._segments.popleft()
+                self._remove(path)
+                self._sizes.pop(path, None)
+            self.replayed_batches += batches
+
+    def lag_s(self) -> float:
+        """最も古い未送信レコードの経過秒数."""
+        with self._lock:
+            if self._segments:
+                oldest = self._first_written.get(self._segments[0])
+            elif self._active_bytes > 0:
+                oldest = self._first_written.get(self._active_path)
+            else:
+                return 0.0
+        return max(0.0, time.time() - oldest) if oldest else 0.0
+
+    def stats(self) -> dict:
+        """カウンターのスナップショットを返す."""
+        return {
+            "bytes": self._bytes,
+            "segments": len(self._segments) + (1 if self._active_bytes > 0 else 0),
+            "lag_s": self.lag_s(),
+            "spooled_batches": self.spooled_batches,
+            "replayed_batches": self.replayed_batches,
+            "evicted_segments": self.evicted_segments,
+            "evicted_bytes": self.evicted_bytes,
+            "rejected_batches": self.rejected_batches,
+            "corrupt_records": self.corrupt_records,
+        }
+
+    def close(self):
+        """アクティブセグメントを閉じる（未送信のセグメントは次回起動時に再送）."""
+        with self._lock:
+            self._close_active()
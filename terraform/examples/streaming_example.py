@@ -10,14 +10,20 @@ Claude Agent SDK + Bedrock Guardrails ストリーミング処理の実装例
 """
 
 import os
+import sys
 import asyncio
 import json
+from pathlib import Path
 from typing import Dict, Any
 from dotenv import load_dotenv
 from claude_agent_sdk import ClaudeSDKClient, ClaudeAgentOptions
 from claude_agent_sdk.types import AssistantMessage, TextBlock, ResultMessage
 import boto3
 
+# プロジェクトルートをパスに追加（ApplyGuardrail のコストを src/pricing の台帳に記録）
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from src.pricing import CostLedger, configure_ledger, get_default_ledger  # noqa: E402
+
 # 環境変数を読み込み
 load_dotenv()
 
@@ -56,7 +62,8 @@ class AgentSDKWithApplyGuardrail:
         model: str = "sonnet",
         allowed_tools: list = None,
         enable_input_filtering: bool = True,
-        enable_output_filtering: bool = True
+        enable_output_filtering: bool = True,
+        cost_ledger: CostLedger = None
     ):
         """
         Args:
@@ -67,6 +74,8 @@ class AgentSDKWithApplyGuardrail:
             allowed_tools: 許可するツールのリスト
             enable_input_filtering: 入力フィルタリングを有効化
             enable_output_filtering: 出力フィルタリングを有効化
+            cost_ledger: ApplyGuardrail のコストを記録する台帳
+                （デフォルト: pricing.configure_ledger() で設定した台帳、未設定なら記録しない）
         """
         self.guardrail_id = guardrail_id or os.getenv("BEDROCK_GUARDRAIL_ID")
         self.guardrail_version = guardrail_version
@@ -75,6 +84,7 @@ class AgentSDKWithApplyGuardrail:
         self.allowed_tools = allowed_tools or ["Read", "Write"]
         self.enable_input_filtering = enable_input_filtering
         self.enable_output_filtering = enable_output_filtering
+        self.cost_ledger = cost_ledger if cost_ledger is not None else get_default_ledger()
         
         # Bedrock Runtimeクライアント（ApplyGuardrail API用）
         self.bedrock_runtime = boto3.client(
@@ -114,6 +124,12 @@ class AgentSDKWithApplyGuardrail:
             content=[{"text": {"text": text}}]
         )
         
+        # 課金されたテキストユニット（usage）からコストを記録
+        if self.cost_ledger is not None:
+            self.cost_ledger.record_guardrail(
+                len(text), usage=response.get("usage"), tags=[f"guardrail:{source.lower()}"]
+            )
+        
         # 結果を処理
         action = response.get("action", "NONE")
         is_blocked = action == "GUARDRAIL_INTERVENED"
@@ -303,6 +319,10 @@ BEDROCK_GUARDRAIL_ID=your_guardrail_id_here
 ╚══════════════════════════════════════════════════════════════════════════════╝
     """)
     
+    # ApplyGuardrail のコスト（テキストユニット）を記録する台帳
+    ledger = CostLedger()
+    configure_ledger(ledger)
+    
     # 1. INPUT フィルタリングのテスト
     print("\n" + "="*80)
     print("【パート1】INPUT フィルタリングのテスト")
@@ -458,6 +478,9 @@ BEDROCK_GUARDRAIL_ID=your_guardrail_id_here
                 source="OUTPUT",
                 content=[{"text": {"text": test_case["text"]}}]
             )
+            ledger.record_guardrail(
+                len(test_case["text"]), usage=response.get("usage"), tags=["guardrail:output"]
+            )
             
             action = response.get("action", "NONE")
             print(f"\nアクション: {action}")
@@ -480,6 +503,13 @@ BEDROCK_GUARDRAIL_ID=your_guardrail_id_here
                 
         except Exception as e:
             print(f"\n⚠️  エラー: {e}")
+    
+    # ApplyGuardrail のコスト（INPUT / OUTPUT 別）
+    print(f"\n\n{'='*80}")
+    print("ApplyGuardrail のコスト")
+    print(f"{'='*80}")
+    for tag, usd in ledger.totals("tag").items():
+        print(f"  {tag}: ${usd:.6f}")
 
 
 async def main():
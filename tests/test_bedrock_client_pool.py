@@ -0,0 +1,116 @@
+"""bedrock_client_pool（ClientSlots, BedrockClientPool.run_async）のテスト."""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from src.bedrock_client_pool import BedrockClientConfig, BedrockClientPool, ClientSlots
+
+
+class _Concurrency:
+    """同時実行数の最大値を記録する."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.active = 0
+        self.peak = 0
+
+    def __enter__(self):
+        with self._lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+
+    def __exit__(self, *exc):
+        with self._lock:
+            self.active -= 1
+
+
+def test_slots_limit_threads():
+    slots = ClientSlots(3, name="test-threads")
+    concurrency = _Concurrency()
+
+    def call():
+        with slots.slot(), concurrency:
+            time.sleep(0.02)
+
+    threads = [threading.Thread(target=call) for _ in range(12)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = slots.stats()
+    assert concurrency.peak == 3
+    assert stats["acquired"] == 12
+    assert stats["waited"] > 0
+    assert stats["in_use"] == 0 and stats["waiting"] == 0
+
+
+def test_slots_shared_between_threads_and_event_loop():
+    slots = ClientSlots(2, name="test-mixed")
+    concurrency = _Concurrency()
+
+    def sync_call():
+        with slots.slot(), concurrency:
+            time.sleep(0.02)
+
+    async def async_call():
+        async with slots.slot_async():
+            with concurrency:
+                await asyncio.sleep(0.02)
+
+    async def main():
+        threads = [threading.Thread(target=sync_call) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        await asyncio.gather(*(async_call() for _ in range(6)))
+        await asyncio.to_thread(lambda: [thread.join() for thread in threads])
+
+    asyncio.run(main())
+    assert concurrency.peak <= 2
+    assert slots.stats()["acquired"] == 10
+    assert slots.in_use == 0
+
+
+def test_cancelled_waiter_passes_the_slot_on():
+    slots = ClientSlots(1, name="test-cancel")
+
+    async def main():
+        await slots.acquire_async()
+        waiter = asyncio.create_task(slots.acquire_async())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        slots.release()
+        # キャンセルされた待機者がスロットを持ったままにならない
+        await asyncio.wait_for(slots.acquire_async(), timeout=1.0)
+        slots.release()
+
+    asyncio.run(main())
+    assert slots.in_use == 0 and slots.waiting == 0
+
+
+def test_run_async_uses_one_thread_per_slot():
+    # イベントループの既定のエグゼキューター（最大32スレッド）より多いスロットでも全部使う
+    pool = BedrockClientPool(
+        BedrockClientConfig(max_pool_connections=40, name="test-executor"), client=object()
+    )
+    concurrency = _Concurrency()
+
+    def call(value):
+        with concurrency:
+            time.sleep(0.05)
+        return value * 2
+
+    async def main():
+        return await asyncio.gather(*(pool.run_async(call, i) for i in range(80)))
+
+    try:
+        assert asyncio.run(main()) == [i * 2 for i in range(80)]
+    finally:
+        pool.shutdown()
+    assert concurrency.peak == 40
+    assert pool.stats()["waited"] == 40
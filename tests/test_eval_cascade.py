@@ -0,0 +1,41 @@
+"""eval_cascade のテスト."""
+
+import pytest
+
+from src.eval_cascade import Cascade, CascadeConfig
+
+
+def test_cascade_gates_only_reference_comparable_metrics():
+    pytest.importorskip("deepeval")
+    pytest.importorskip("langchain_aws")
+    from deepeval.metrics import GEval
+    from deepeval.test_case import LLMTestCaseParams
+
+    from src.eval_manifest import metric_name
+    from src.run_evaluation_deepeval import (
+        EVALUATION_MODEL,
+        create_custom_metrics,
+        create_standard_metrics,
+    )
+
+    reference = GEval(
+        name="Reference Match",
+        criteria="期待される出力と一致するか",
+        evaluation_params=[LLMTestCaseParams.ACTUAL_OUTPUT, LLMTestCaseParams.EXPECTED_OUTPUT],
+        model=EVALUATION_MODEL,
+    )
+    metrics = create_custom_metrics() + create_standard_metrics() + [reference]
+    cascade = Cascade(CascadeConfig(enabled=True))
+
+    assert sorted(metric_name(m) for m in metrics if cascade.gates(m)) == [
+        "Answer Relevancy",
+        "Reference Match [GEval]",
+        "Response Quality [GEval]",
+    ]
+
+
+def test_assess_decides_by_local_scores():
+    cascade = Cascade(CascadeConfig(enabled=True, calibration_rate=0.0))
+    assert cascade.assess("a", "東京は日本の首都です", "東京は日本の首都です").decision == "pass"
+    assert cascade.assess("b", "不明", "東京は日本の首都です。人口は約1400万人です").decision == "fail"
+    assert cascade.assess("c", "回答", None).run_judges
@@ -0,0 +1,113 @@
+"""eval_dataset のテスト."""
+
+import io
+import json
+
+import pytest
+
+from src import eval_dataset
+from src.eval_dataset import iter_dataset
+
+DATASET = {
+    "version": 1234567,
+    "description": "チャンク境界のテスト",
+    "ratio": -12.5e-3,
+    "enabled": True,
+    "nested": {"values": [1, 22, 333], "flag": None},
+    "test_cases": [
+        {"input": "a", "score": 123456, "tags": ["knowledge"]},
+        {"input": "b", "score": 0.000125, "tags": ["git"]},
+        {"input": "c", "score": -98765.4321, "limits": [10, 200, 3000]},
+    ],
+}
+
+
+def _read_all(text: str, chunk_size: int, monkeypatch) -> list:
+    monkeypatch.setattr(eval_dataset, "_CHUNK_SIZE", chunk_size)
+    return list(eval_dataset._iter_json_array(io.StringIO(text)))
+
+
+@pytest.mark.parametrize("chunk_size", range(1, 48))
+def test_json_object_at_every_chunk_boundary(chunk_size, monkeypatch):
+    # 数値・キー・リテラルがチャンクの境界で切れても値が変わらない
+    text = json.dumps(DATASET, ensure_ascii=False)
+    assert _read_all(text, chunk_size, monkeypatch) == DATASET["test_cases"]
+
+
+@pytest.mark.parametrize("chunk_size", range(1, 24))
+def test_top_level_array_of_numbers(chunk_size, monkeypatch):
+    values = [1234567, -8.5e10, 42, 0, 3.14159]
+    text = json.dumps(values)
+    assert _read_all(text, chunk_size, monkeypatch) == values
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5, 8])
+def test_top_level_array_with_whitespace(chunk_size, monkeypatch):
+    text = '[\n  {"input": "x"},\n  {"input": "y"}\n]\n'
+    assert _read_all(text, chunk_size, monkeypatch) == [{"input": "x"}, {"input": "y"}]
+
+
+def test_missing_key_raises(monkeypatch):
+    text = json.dumps({"version": 123, "cases": []})
+    with pytest.raises(ValueError, match="test_cases"):
+        _read_all(text, 4, monkeypatch)
+
+
+def test_truncated_array_raises(monkeypatch):
+    with pytest.raises(ValueError):
+        _read_all('{"test_cases": [{"input": "a"}', 4, monkeypatch)
+
+
+def test_iter_dataset_json_and_jsonl(tmp_path):
+    json_path = tmp_path / "dataset.json"
+    json_path.write_text(json.dumps(DATASET), encoding="utf-8")
+    jsonl_path = tmp_path / "dataset.jsonl"
+    jsonl_path.write_text(
+        "# comment\n\n" + "\n".join(json.dumps(case) for case in DATASET["test_cases"]),
+        encoding="utf-8",
+    )
+
+    expected = list(enumerate(DATASET["test_cases"]))
+    assert list(iter_dataset(str(json_path))) == expected
+    assert list(iter_dataset(str(jsonl_path))) == expected
+
+
+def test_iter_dataset_gzip(tmp_path):
+    import gzip
+
+    path = tmp_path / "dataset.json.gz"
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        json.dump(DATASET, f)
+    assert [item for _, item in iter_dataset(str(path))] == DATASET["test_cases"]
+
+
+def _sampled_tags(tmp_path, cases: list[dict], **selection) -> list[list[str]]:
+    path = tmp_path / "dataset.jsonl"
+    path.write_text("\n".join(json.dumps(case) for case in cases), encoding="utf-8")
+    sample = iter_dataset(str(path), selection=eval_dataset.DatasetSelection(**selection))
+    return [item["tags"] for _, item in sample]
+
+
+def test_sample_covers_each_tag_quota(tmp_path):
+    # 細かいタグごとに1件しかないケースでも、全件ではなく各タグの件数を満たす分だけ選ぶ
+    cases = [
+        {"input": f"q{i}", "tags": ["knowledge", f"topic-{i}"] + (["python"] if i % 2 else [])}
+        for i in range(20)
+    ]
+    for seed in range(5):
+        tags = _sampled_tags(tmp_path, cases, per_tag=2, seed=seed, strata=["knowledge", "python"])
+        assert len(tags) <= 4
+        assert sum("knowledge" in t for t in tags) >= 2
+        assert sum("python" in t for t in tags) >= 2
+
+
+def test_sample_counts_multi_tag_cases_for_every_tag(tmp_path):
+    cases = [{"input": f"q{i}", "tags": ["a", "b", "c"]} for i in range(10)]
+    assert len(_sampled_tags(tmp_path, cases, per_tag=3, seed=0)) == 3
+
+
+def test_sample_keeps_small_tags(tmp_path):
+    cases = [{"input": f"q{i}", "tags": ["common"]} for i in range(10)]
+    cases.append({"input": "rare", "tags": ["rare"]})
+    tags = _sampled_tags(tmp_path, cases, per_tag=2, seed=0)
+    assert tags.count(["rare"]) == 1 and tags.count(["common"]) == 2
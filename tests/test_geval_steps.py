@@ -0,0 +1,83 @@
+"""geval_steps のテスト."""
+
+import pytest
+
+from src.geval_steps import GEvalStepsCache, apply_cached_steps, steps_key
+
+
+def _stub_judge():
+    """評価ステップを返す評価用モデル（Bedrock を呼ばない）."""
+    from deepeval.models.base_model import DeepEvalBaseLLM
+
+    class StubJudge(DeepEvalBaseLLM):
+        def __init__(self):
+            self.calls = 0
+            super().__init__(model="stub-judge")
+
+        def load_model(self):
+            return self
+
+        def generate(self, prompt, schema=None):
+            self.calls += 1
+            steps = ["入力を読む", f"出力を評価する ({self.calls})"]
+            return schema(steps=steps) if schema is not None else '{"steps": %s}' % steps
+
+        async def a_generate(self, prompt, schema=None):
+            return self.generate(prompt, schema)
+
+        def get_model_name(self):
+            return "stub-judge"
+
+    return StubJudge()
+
+
+def _geval(judge, criteria="回答の品質を評価します"):
+    from deepeval.metrics import GEval
+    from deepeval.test_case import LLMTestCaseParams
+
+    return GEval(
+        name="Response Quality",
+        criteria=criteria,
+        evaluation_params=[LLMTestCaseParams.INPUT, LLMTestCaseParams.ACTUAL_OUTPUT],
+        model=judge,
+    )
+
+
+def test_generates_persists_and_reuses_steps(tmp_path):
+    pytest.importorskip("deepeval")
+    judge = _stub_judge()
+    path = tmp_path / "geval_steps.json"
+
+    metric = _geval(judge)
+    stats = apply_cached_steps([metric], GEvalStepsCache(str(path)))
+    assert stats == {"reused": 0, "generated": 1, "failed": 0}
+    assert metric.evaluation_steps == ["入力を読む", "出力を評価する (1)"]
+    assert path.exists()
+
+    # 別のプロセスでは保存済みのステップを使い、評価用モデルを呼ばない
+    again = _geval(judge)
+    stats = apply_cached_steps([again], GEvalStepsCache(str(path)))
+    assert stats == {"reused": 1, "generated": 0, "failed": 0}
+    assert again.evaluation_steps == metric.evaluation_steps
+    assert judge.calls == 1
+
+
+def test_regenerate_and_key_changes_with_criteria(tmp_path):
+    pytest.importorskip("deepeval")
+    judge = _stub_judge()
+    cache = GEvalStepsCache(str(tmp_path / "geval_steps.json"))
+    apply_cached_steps([_geval(judge)], cache)
+
+    regenerated = _geval(judge)
+    assert apply_cached_steps([regenerated], cache, regenerate=True)["generated"] == 1
+    assert regenerated.evaluation_steps[-1] == "出力を評価する (2)"
+    assert steps_key(_geval(judge)) != steps_key(_geval(judge, criteria="別の基準"))
+
+
+def test_missing_steps_are_left_to_deepeval_without_generate(tmp_path):
+    pytest.importorskip("deepeval")
+    judge = _stub_judge()
+    metric = _geval(judge)
+    stats = apply_cached_steps([metric], GEvalStepsCache(str(tmp_path / "s.json")), generate=False)
+    assert stats == {"reused": 0, "generated": 0, "failed": 0}
+    assert metric.evaluation_steps is None and judge.calls == 0
@@ -0,0 +1,111 @@
+"""metrics_store のテスト."""
+
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from src import metrics_store
+from src.metrics_registry import record_request
+from src.metrics_store import MetricsStore, configure_store, session_key
+
+
+def _metrics(cost=0.01, duration_ms=100.0, session_id="s", input_tokens=10, cache_read=0):
+    return SimpleNamespace(
+        input_tokens=input_tokens,
+        output_tokens=5,
+        cache_creation_input_tokens=0,
+        cache_read_input_tokens=cache_read,
+        total_cost_usd=cost,
+        duration_ms=duration_ms,
+        duration_api_ms=None,
+        num_turns=1,
+        session_id=session_id,
+    )
+
+
+@pytest.fixture(params=["numpy", "python"])
+def backend(request, monkeypatch):
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(metrics_store, "NUMPY_AVAILABLE", False)
+    return request.param
+
+
+def _store() -> MetricsStore:
+    store = MetricsStore()
+    store.append(_metrics(cost=0.01, duration_ms=100.0, session_id="a"), model="m1", user_id="u1", timestamp=0)
+    store.append(_metrics(cost=0.03, duration_ms=300.0, session_id="a"), model="m2", user_id="u1", timestamp=10)
+    store.append(_metrics(cost=None, duration_ms=200.0, session_id="b"), model="m1", user_id="u2", timestamp=3600)
+    return store
+
+
+def test_aggregate_by_group(backend):
+    store = _store()
+    assert store.aggregate("total_cost_usd", "sum", group_by="user") == pytest.approx(
+        {"u1": 0.04}
+    )
+    assert store.aggregate("duration_ms", "max", group_by="model") == {"m1": 200.0, "m2": 300.0}
+    assert store.aggregate("duration_ms", "p50") == {"all": 200.0}
+    assert store.aggregate("duration_ms", "count", group_by="time", bucket_s=3600) == {
+        0: 2.0,
+        3600: 1.0,
+    }
+    by_session = store.aggregate("duration_ms", "mean", group_by="session")
+    assert by_session[session_key("a")] == 200.0 and by_session[session_key("b")] == 200.0
+    assert store.aggregate("duration_ms", "sum", since=5) == {"all": 500.0}
+    with pytest.raises(ValueError):
+        store.aggregate("duration_ms", "sum", group_by="region")
+
+
+def test_save_and_load_then_append(tmp_path, backend):
+    store = _store()
+    store.save(str(tmp_path / "snapshot"))
+    loaded = MetricsStore.load(str(tmp_path / "snapshot"))
+    assert len(loaded) == 3
+    assert loaded.aggregate("duration_ms", "sum", group_by="model") == {"m1": 300.0, "m2": 300.0}
+    loaded.append(_metrics(duration_ms=50.0), model="m3")
+    assert loaded.aggregate("duration_ms", "sum", group_by="model")["m3"] == 50.0
+    assert len(list(loaded.usage_rows(group_by="model"))) == 4
+
+
+def test_aggregate_while_appending(backend):
+    # 集計中に別スレッドが追記しても集計も追記も失敗しない
+    store = MetricsStore()
+    errors = []
+    stop = threading.Event()
+
+    def writer():
+        try:
+            while not stop.is_set():
+                store.append(_metrics(), model="m", user_id="u")
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=writer) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    try:
+        for _ in range(200):
+            store.aggregate("duration_ms", "p95", group_by="user", since=0)
+            store.aggregate("total_cost_usd", "sum", group_by="session")
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    assert not errors
+    assert store.aggregate("duration_ms", "count") == {"all": float(len(store))}
+
+
+def test_store_failure_does_not_fail_the_request():
+    class BrokenStore(MetricsStore):
+        def append(self, *args, **kwargs):
+            raise BufferError("cannot resize an array that is exporting buffers")
+
+    configure_store(BrokenStore())
+    try:
+        with record_request("model", "test", user_id="u") as recorder:
+            recorder.set_result(_metrics())
+    finally:
+        configure_store(None)
@@ -0,0 +1,132 @@
+"""score_upload のテスト."""
+
+import json
+import threading
+from types import SimpleNamespace
+
+from src.score_upload import ScoreUploader, ScoreUploaderConfig, resubmit_spool, score_id
+
+
+class _FakeClient:
+    """Langfuse の api.ingestion.batch を記録する（errors で失敗させるステータスを指定）."""
+
+    def __init__(self, errors=None, raises: int = 0):
+        # スコア名 -> 返すエラーのステータスのリスト（呼び出しごとに先頭から使う）
+        self.errors = {name: list(statuses) for name, statuses in (errors or {}).items()}
+        # 最初の N 回は例外
+        self.raises = raises
+        self.batches: list[list[dict]] = []
+        self._lock = threading.Lock()
+        self.api = SimpleNamespace(ingestion=SimpleNamespace(batch=self._batch))
+
+    def _batch(self, batch):
+        with self._lock:
+            if self.raises:
+                self.raises -= 1
+                raise ConnectionError("langfuse is down")
+            self.batches.append(batch)
+            errors = []
+            for event in batch:
+                statuses = self.errors.get(event["body"]["name"])
+                if statuses:
+                    errors.append(
+                        SimpleNamespace(id=event["id"], status=statuses.pop(0), message="error")
+                    )
+            return SimpleNamespace(errors=errors)
+
+    def uploaded(self) -> list[str]:
+        """送信したスコア名（エラーを返したものも含む）."""
+        return [event["body"]["name"] for batch in self.batches for event in batch]
+
+
+def _config(tmp_path, **overrides) -> ScoreUploaderConfig:
+    values = {
+        "batch_size": 2,
+        "max_concurrency": 2,
+        "backoff_s": 0.0,
+        "spool_path": str(tmp_path / "scores.jsonl"),
+    }
+    values.update(overrides)
+    return ScoreUploaderConfig(**values)
+
+
+def _spooled(tmp_path) -> list[dict]:
+    path = tmp_path / "scores.jsonl"
+    if not path.exists():
+        return []
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+
+def test_score_id_is_idempotent():
+    assert score_id("run", "trace", "Faithfulness") == score_id("run", "trace", "Faithfulness")
+    assert score_id("run", "trace", "Faithfulness") != score_id("run-2", "trace", "Faithfulness")
+
+
+def test_batches_and_skips_missing_values(tmp_path):
+    client = _FakeClient()
+    uploader = ScoreUploader(client, run_id="run", config=_config(tmp_path))
+    for i in range(5):
+        uploader.submit(f"trace-{i}", f"metric-{i}", 0.5)
+    assert uploader.submit("trace-x", "metric-x", None) is None
+    stats = uploader.close()
+
+    assert sorted(client.uploaded()) == [f"metric-{i}" for i in range(5)]
+    assert all(len(batch) <= 2 for batch in client.batches)
+    assert stats["uploaded"] == 5 and stats["skipped"] == 1 and stats["spooled"] == 0
+
+
+def test_retryable_errors_are_retried_and_others_spooled(tmp_path):
+    client = _FakeClient(errors={"throttled": [429], "invalid": [400]})
+    uploader = ScoreUploader(client, run_id="run", config=_config(tmp_path, batch_size=10))
+    uploader.submit("trace", "ok", 1.0)
+    uploader.submit("trace", "throttled", 0.5)
+    uploader.submit("trace", "invalid", 0.0)
+    stats = uploader.close()
+
+    assert stats["uploaded"] == 2
+    assert stats["retried"] == 1
+    assert [entry["name"] for entry in _spooled(tmp_path)] == ["invalid"]
+
+
+def test_network_errors_spool_after_retries(tmp_path):
+    client = _FakeClient(raises=10)
+    uploader = ScoreUploader(client, run_id="run", config=_config(tmp_path, max_retries=2))
+    expected_id = uploader.submit("trace", "metric", 0.7, comment="reason")
+    stats = uploader.close()
+
+    assert stats["spooled"] == 1
+    (entry,) = _spooled(tmp_path)
+    assert entry["id"] == expected_id and entry["comment"] == "reason"
+    assert entry["error"].startswith("ConnectionError")
+
+
+def test_resubmit_spool_keeps_ids(tmp_path):
+    config = _config(tmp_path, max_retries=0)
+    uploader = ScoreUploader(_FakeClient(raises=10), run_id="run", config=config)
+    expected_id = uploader.submit("trace", "metric", 0.7)
+    uploader.close()
+
+    client = _FakeClient()
+    stats = resubmit_spool(client, str(tmp_path / "scores.jsonl"), config=_config(tmp_path))
+    assert stats["uploaded"] == 1
+    assert client.batches[0][0]["body"]["id"] == expected_id
+    assert not (tmp_path / "scores.jsonl").exists()
+    assert not (tmp_path / "scores.jsonl.resubmitting").exists()
+
+
+def test_resubmit_spool_includes_interrupted_run(tmp_path):
+    # 前回の再送が中断されて残った .resubmitting も、現在のスプールと一緒に再送する
+    leftover = {"id": "a", "trace_id": "t", "name": "leftover", "value": 1.0, "error": "x"}
+    current = {"id": "b", "trace_id": "t", "name": "current", "value": 0.0, "error": "y"}
+    (tmp_path / "scores.jsonl.resubmitting").write_text(json.dumps(leftover), encoding="utf-8")
+    (tmp_path / "scores.jsonl").write_text(json.dumps(current) + "\n", encoding="utf-8")
+
+    client = _FakeClient()
+    stats = resubmit_spool(client, str(tmp_path / "scores.jsonl"), config=_config(tmp_path))
+    assert stats["uploaded"] == 2
+    assert sorted(client.uploaded()) == ["current", "leftover"]
+    assert not (tmp_path / "scores.jsonl.resubmitting").exists()
+
+
+def test_resubmit_spool_without_spool(tmp_path):
+    assert resubmit_spool(_FakeClient(), str(tmp_path / "scores.jsonl")) == {"submitted": 0}
@@ -0,0 +1,105 @@
+"""tool_verifier のテスト."""
+
+import asyncio
+import os
+
+import pytest
+
+from src.tool_verifier import (
+    JUDGE_METRIC_NAME,
+    ToolExpectations,
+    ToolVerifierConfig,
+    is_judge_metric,
+    run_and_verify,
+    snapshot_files,
+    verify,
+)
+
+
+def test_verified_cases_skip_the_tool_usage_judge():
+    # 実際のメトリクス一覧で、ツール使用の GEval だけが省略される
+    pytest.importorskip("deepeval")
+    pytest.importorskip("langchain_aws")
+    from src.eval_manifest import metric_name
+    from src.run_evaluation_deepeval import create_custom_metrics, create_standard_metrics
+
+    metrics = create_custom_metrics() + create_standard_metrics()
+    names = [metric_name(m) for m in metrics]
+    kept = [metric_name(m) for m in metrics if not is_judge_metric(m)]
+
+    assert f"{JUDGE_METRIC_NAME} [GEval]" in names
+    assert kept == [name for name in names if name != f"{JUDGE_METRIC_NAME} [GEval]"]
+
+
+def test_expectations_from_context_and_expect_field():
+    item = {
+        "input": "hello.py を作成",
+        "context": ["tool: Write", "file: hello.py", "no structure here"],
+        "expect": {"tools": ["Write", "Bash"], "forbidden_tools": ["WebFetch"]},
+    }
+    expectations = ToolExpectations.from_case(item)
+    assert expectations.tools == ["Write", "Bash"]
+    assert expectations.files == ["hello.py"]
+    assert expectations.forbidden_tools == ["WebFetch"]
+    assert ToolExpectations.from_case({"input": "質問", "context": ["背景の説明"]}) is None
+
+
+def test_verify_checks_tools_files_and_workspace(tmp_path):
+    (tmp_path / "hello.py").write_text('print("hello")\n', encoding="utf-8")
+    expectations = ToolExpectations(
+        tools=["Write"],
+        forbidden_tools=["Bash"],
+        files=["hello.py"],
+        file_contains={"hello.py": "hello"},
+    )
+    calls = [{"name": "Write", "input": {"file_path": str(tmp_path / "hello.py")}}]
+    verdict = verify(expectations, calls, {}, snapshot_files(str(tmp_path)), str(tmp_path))
+    assert verdict.success and verdict.score == 1.0
+    assert verdict.created == ["hello.py"]
+
+    outside = calls + [{"name": "Bash", "input": {"path": "/etc/passwd"}}]
+    verdict = verify(expectations, outside, {}, snapshot_files(str(tmp_path)), str(tmp_path))
+    assert not verdict.success
+    assert verdict.score == pytest.approx(3 / 5)
+    assert "outside: /etc/passwd" in verdict.reason
+
+
+class _FakeAgent:
+    """作業ディレクトリに hello.py を書き込むエージェント."""
+
+    def __init__(self, cwd, tools):
+        self.cwd = cwd
+        self.tools = tools
+        self.tool_calls = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def chat_with_client(self, prompt, session_id=None, user_id=None):
+        path = os.path.join(self.cwd, "hello.py")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write('print("こんにちは")\n')
+        self.tool_calls.append({"name": "Write", "input": {"file_path": path}})
+        yield "作成しました"
+
+
+def test_run_and_verify_uses_a_throwaway_workspace(tmp_path):
+    agents = []
+
+    def factory(**kwargs):
+        agents.append(_FakeAgent(**kwargs))
+        return agents[-1]
+
+    config = ToolVerifierConfig(tools=["Read"], workspace_root=str(tmp_path))
+    expectations = ToolExpectations(tools=["Write"], files=["hello.py"])
+    output, verdict = asyncio.run(
+        run_and_verify("hello.py を作成", expectations, config, agent_factory=factory)
+    )
+
+    assert output == "作成しました"
+    assert verdict.success
+    assert agents[0].tools == ["Read", "Write"]
+    assert not os.path.exists(agents[0].cwd)
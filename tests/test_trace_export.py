@@ -0,0 +1,165 @@
+"""trace_export（BatchExportProcessor）と trace_spool のテスト."""
+
+import threading
+import time
+
+import pytest
+
+from src.trace_export import BatchExportProcessor, ExportConfig, SpanExporter, SpanRecord
+from src.trace_spool import EVICT_REJECT_NEW, FSYNC_NEVER, DiskSpool, SpoolConfig
+
+
+def _records(start: int, count: int) -> list[SpanRecord]:
+    return [
+        SpanRecord(kind="span", trace_id="t", id=f"span-{i}", name=f"span {i}")
+        for i in range(start, start + count)
+    ]
+
+
+class _ListExporter(SpanExporter):
+    """送信したスパンを記録する（failing の間は失敗する）."""
+
+    def __init__(self):
+        self.exported: list[str] = []
+        self.failing = False
+
+    def export(self, records):
+        if self.failing:
+            raise ConnectionError("langfuse is down")
+        self.exported.extend(record.id for record in records)
+
+
+class _ThreadRecordingSpool(DiskSpool):
+    """append() を呼んだスレッドを記録する."""
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.append_threads: list[str] = []
+
+    def append(self, records):
+        self.append_threads.append(threading.current_thread().name)
+        return super().append(records)
+
+
+def _spool(tmp_path, **overrides) -> DiskSpool:
+    return DiskSpool(SpoolConfig(directory=str(tmp_path / "spool"), fsync=FSYNC_NEVER, **overrides))
+
+
+def _config(**overrides) -> ExportConfig:
+    values = {"mode": "async", "schedule_delay_s": 60.0, "spool_retry_interval_s": 60.0}
+    values.update(overrides)
+    return ExportConfig(**values)
+
+
+def test_spool_round_trip_survives_restart(tmp_path):
+    spool = _spool(tmp_path)
+    assert spool.append(_records(0, 2))
+    assert spool.append(_records(2, 1))
+    spool.close()
+
+    reopened = _spool(tmp_path)
+    assert reopened.has_pending()
+    path = reopened.oldest_segment()
+    batches = reopened.read_segment(path)
+    assert [[r["id"] for r in batch] for batch in batches] == [["span-0", "span-1"], ["span-2"]]
+    reopened.ack(path, len(batches))
+    assert not reopened.has_pending()
+    assert reopened.stats()["replayed_batches"] == 2
+
+
+def test_spool_skips_truncated_record(tmp_path):
+    spool = _spool(tmp_path)
+    spool.append(_records(0, 1))
+    spool.append(_records(1, 1))
+    spool.close()
+    path = next((tmp_path / "spool").glob("segment-*.spool"))
+    path.write_bytes(path.read_bytes()[:-5])
+
+    reopened = _spool(tmp_path)
+    batches = reopened.read_segment(reopened.oldest_segment())
+    assert [[r["id"] for r in batch] for batch in batches] == [["span-0"]]
+    assert reopened.stats()["corrupt_records"] == 1
+
+
+def test_spool_reject_new_at_capacity(tmp_path):
+    # 1バッチ（1スパン）は400バイト弱
+    spool = _spool(tmp_path, max_bytes=600, eviction=EVICT_REJECT_NEW)
+    assert spool.append(_records(0, 1))
+    assert not spool.append(_records(1, 1))
+    assert spool.stats()["rejected_batches"] == 1
+
+
+def test_export_preserves_order_without_spool():
+    exporter = _ListExporter()
+    processor = BatchExportProcessor(exporter, _config(max_batch_size=3))
+    for i in range(10):
+        processor.submit(_records(i, 1))
+    processor.shutdown()
+    assert exporter.exported == [f"span-{i}" for i in range(10)]
+    assert processor.stats()["exported_spans"] == 10
+
+
+def test_drop_oldest_when_queue_is_full():
+    exporter = _ListExporter()
+    processor = BatchExportProcessor(exporter, _config(max_queue_size=3, max_batch_size=100))
+    processor.submit(_records(0, 5))
+    processor.shutdown()
+    assert exporter.exported == ["span-2", "span-3", "span-4"]
+    assert processor.stats()["dropped_spans"] == 2
+
+
+def test_failed_export_is_spooled_and_replayed_in_order(tmp_path):
+    exporter = _ListExporter()
+    exporter.failing = True
+    processor = BatchExportProcessor(exporter, _config(), spool=_spool(tmp_path))
+    processor.submit(_records(0, 3))
+    processor.force_flush()
+    assert exporter.exported == []
+    assert processor.stats()["spooled_spans"] == 3
+
+    # 未送信のスプールがある間の新しいスパンはスプールの後ろに積む
+    processor.submit(_records(3, 2))
+    exporter.failing = False
+    assert processor.drain_spool()
+    processor.shutdown()
+    assert exporter.exported == [f"span-{i}" for i in range(5)]
+    assert processor.stats()["failed_spans"] == 0
+
+
+def test_spill_happens_on_worker_thread(tmp_path):
+    # キュー満杯時のディスクへの書き込みは submit() を呼んだスレッドで行わない
+    spool = _ThreadRecordingSpool(
+        SpoolConfig(directory=str(tmp_path / "spool"), fsync=FSYNC_NEVER)
+    )
+    exporter = _ListExporter()
+    processor = BatchExportProcessor(
+        exporter, _config(max_queue_size=3, max_batch_size=100), spool=spool
+    )
+    # 3件はキュー、残りの3件は書き込み待ち（上限は max_queue_size）
+    for i in range(6):
+        processor.submit(_records(i, 1))
+    deadline = time.monotonic() + 5.0
+    while processor.stats()["spooled_spans"] < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert spool.append_threads == ["langfuse-export"] * 3
+    processor.shutdown()
+    assert sorted(exporter.exported) == sorted(f"span-{i}" for i in range(6))
+
+
+def test_leftover_spool_is_replayed_before_new_spans(tmp_path):
+    spool = _spool(tmp_path)
+    spool.append(_records(0, 2))
+    spool.close()
+
+    exporter = _ListExporter()
+    processor = BatchExportProcessor(exporter, _config(), spool=_spool(tmp_path))
+    processor.submit(_records(2, 2))
+    processor.force_flush()
+    processor.shutdown()
+    assert exporter.exported == [f"span-{i}" for i in range(4)]
+
+
+def test_unknown_overflow_policy():
+    with pytest.raises(ValueError):
+        BatchExportProcessor(_ListExporter(), _config(overflow_policy="spill"))